@@ -6,7 +6,12 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import functools
+import json
+
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.variants as variants
 import ga4gh.exceptions as exceptions
 import ga4gh.protocol as protocol
 
@@ -173,12 +178,7 @@ class ReadsIntervalIterator(IntervalIterator):
 
     @classmethod
     def _getStart(cls, readAlignment):
-        if readAlignment.alignment.position.position == 0:
-            # unmapped read with mapped mate; see SAM standard 2.4.1
-            return readAlignment.next_mate_position.position
-        else:
-            # usual case
-            return readAlignment.alignment.position.position
+        return reads.getReadAlignmentStart(readAlignment)
 
     @classmethod
     def _getEnd(cls, readAlignment):
@@ -187,15 +187,79 @@ class ReadsIntervalIterator(IntervalIterator):
             len(readAlignment.aligned_sequence))
 
 
+class PysamReadsIntervalIterator(ReadsIntervalIterator):
+    """
+    An interval iterator over the unconverted pysam reads, used to build
+    ReadAlignmentBatches. The objects returned are (read, readGroupId,
+    referenceNames) tuples.
+    """
+    def _search(self, start, end):
+        return self._parentContainer.getPysamReadAlignments(
+            self._reference, start, end)
+
+    @classmethod
+    def _getStart(cls, pysamReadAlignment):
+        return reads.getPysamReadAlignmentStart(pysamReadAlignment)
+
+    @classmethod
+    def _getEnd(cls, pysamReadAlignment):
+        return pysamReadAlignment[0].reference_end
+
+
+class UnmappedReadsIterator(object):
+    """
+    Implements generator logic for unmapped reads. Unmapped reads have
+    no position, so they cannot be paged using an IntervalIterator.
+    Instead, the page token consists of the index of the ReadGroupSet
+    being read and the virtual file offset of the next read within it,
+    allowing us to seek directly to the start of each page.
+    """
+    def __init__(self, request, readAlignmentMerger):
+        sourceIndex, virtualOffset = 0, None
+        if request.page_token:
+            sourceIndex, virtualOffset = _parsePageToken(
+                request.page_token, 2)
+            numSources = len(readAlignmentMerger.getReadGroupSets())
+            if not 0 <= sourceIndex < numSources or virtualOffset < 0:
+                raise exceptions.BadPageTokenException(
+                    "Page token out of range")
+        self._searchIterator = readAlignmentMerger.getUnmappedReadAlignments(
+            sourceIndex, virtualOffset)
+        self._currentObject = next(self._searchIterator, None)
+
+    def next(self):
+        """
+        Returns the next (object, nextPageToken) pair.
+        """
+        if self._currentObject is None:
+            raise StopIteration()
+        readAlignment, sourceIndex, virtualOffset = self._currentObject
+        self._currentObject = next(self._searchIterator, None)
+        nextPageToken = None
+        if self._currentObject is not None:
+            nextPageToken = "{}:{}".format(sourceIndex, virtualOffset)
+        return readAlignment, nextPageToken
+
+    def __iter__(self):
+        return self
+
+
 class VariantsIntervalIterator(IntervalIterator):
     """
-    An interval iterator for variants
+    An interval iterator for variants. If a variantFilter is specified,
+    it is applied to the variant records in the VariantSet before they
+    are converted, and so must also be used for every subsequent page of
+    the same search.
     """
+    def __init__(self, request, parentContainer, variantFilter=None):
+        self._variantFilter = variantFilter
+        super(VariantsIntervalIterator, self).__init__(
+            request, parentContainer)
 
     def _search(self, start, end):
         return self._parentContainer.getVariants(
             self._request.reference_name, start, end,
-            self._request.call_set_ids)
+            self._request.call_set_ids, self._variantFilter)
 
     @classmethod
     def _getStart(cls, variant):
@@ -206,23 +270,76 @@ class VariantsIntervalIterator(IntervalIterator):
         return variant.end
 
 
+class GenotypeRecordsIntervalIterator(VariantsIntervalIterator):
+    """
+    An interval iterator over the raw variant records used to build
+    GenotypeMatrices. The objects returned are (record, variantId,
+    callSetLookups) tuples. If no callSetIds are specified in the
+    request, all CallSets in the VariantSet are included.
+    """
+
+    def _search(self, start, end):
+        return self._parentContainer.getGenotypeRecords(
+            self._request.reference_name, start, end,
+            list(self._request.call_set_ids) or None, self._variantFilter)
+
+    @classmethod
+    def _getStart(cls, genotypeRecord):
+        return genotypeRecord[0].start
+
+    @classmethod
+    def _getEnd(cls, genotypeRecord):
+        return genotypeRecord[0].stop
+
+
 class VariantAnnotationsIntervalIterator(IntervalIterator):
     """
-    An interval iterator for annotations
+    An interval iterator for annotations. If any of geneName, featureId
+    or impact are specified, only the annotations of records with a
+    transcript annotation matching all of them are returned, and these
+    must also be used for every subsequent page of the same search.
     """
 
-    def __init__(self, request, parentContainer):
-        super(VariantAnnotationsIntervalIterator, self).__init__(
-            request, parentContainer)
+    def __init__(
+            self, request, parentContainer, geneName=None, featureId=None,
+            impact=None):
+        self._geneName = geneName
+        self._featureId = featureId
+        self._impact = impact
         # TODO do input validation somewhere more sensible
-        if self._request.effects is None:
+        if request.effects is None:
             self._effects = []
         else:
-            self._effects = self._request.effects
+            self._effects = request.effects
+        # The effect IDs are used in _search, which is first called when
+        # the superclass initialises the iteration.
+        self._effectIds = None
+        if len(self._effects) != 0:
+            self._effectIds = self._getEffectIds(parentContainer)
+        super(VariantAnnotationsIntervalIterator, self).__init__(
+            request, parentContainer)
+
+    def _getEffectIds(self, variantAnnotationSet):
+        """
+        Returns the set of SO term IDs matched by the requested effects,
+        which includes the IDs of all the terms descended from each
+        requested term in the annotation set's ontology.
+        """
+        ontology = variantAnnotationSet.getOntology()
+        effectIds = set()
+        for requestedEffect in self._effects:
+            if requestedEffect.id != "":
+                if ontology is None:
+                    effectIds.add(requestedEffect.id)
+                else:
+                    effectIds.update(
+                        ontology.getDescendantIds(requestedEffect.id))
+        return effectIds
 
     def _search(self, start, end):
         return self._parentContainer.getVariantAnnotations(
-            self._request.reference_name, start, end)
+            self._request.reference_name, start, end, self._effectIds,
+            self._geneName, self._featureId, self._impact)
 
     def _extractProtocolObject(self, pair):
         variant, annotation = pair
@@ -271,22 +388,8 @@ class VariantAnnotationsIntervalIterator(IntervalIterator):
             ret = self._matchAnyEffects(effect) or ret
         return ret
 
-    def _checkIdEquality(self, requestedEffect, effect):
-        """
-        Tests whether a requested effect and an effect
-        present in an annotation are equal.
-        """
-        return self._idPresent(requestedEffect) and (
-            effect.id == requestedEffect.id)
-
-    def _idPresent(self, requestedEffect):
-        return requestedEffect.id != ""
-
     def _matchAnyEffects(self, effect):
-        ret = False
-        for requestedEffect in self._effects:
-            ret = self._checkIdEquality(requestedEffect, effect) or ret
-        return ret
+        return effect.id in self._effectIds
 
     def _removeNonMatchingTranscriptEffects(self, ann):
         newTxE = []
@@ -300,9 +403,13 @@ class VariantAnnotationsIntervalIterator(IntervalIterator):
                     add = True
             if add:
                 newTxE.append(txe)
-        ann.ClearField('transcript_effects')
-        ann.transcript_effects.extend(newTxE)
-        return ann
+        # The annotation may be shared through the regionCache, so the
+        # matching effects are returned in a copy.
+        newAnn = protocol.VariantAnnotation()
+        newAnn.CopyFrom(ann)
+        newAnn.ClearField('transcript_effects')
+        newAnn.transcript_effects.extend(newTxE)
+        return newAnn
 
 
 class Backend(object):
@@ -593,11 +700,11 @@ class Backend(object):
         Returns a generator over the (read, nextPageToken) pairs defined
         by the specified request
         """
-        if not request.reference_id:
-            raise exceptions.UnmappedReadsNotSupported()
         if len(request.read_group_ids) < 1:
             raise exceptions.BadRequestException(
                 "At least one readGroupId must be specified")
+        elif not request.reference_id:
+            return self._unmappedReadsGenerator(request)
         elif len(request.read_group_ids) == 1:
             return self._readsGeneratorSingle(request)
         else:
@@ -619,40 +726,105 @@ class Backend(object):
         return intervalIterator
 
     def _readsGeneratorMultiple(self, request):
-        compoundId = datamodel.ReadGroupCompoundId.parse(
-            request.read_group_ids[0])
-        dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
-        readGroupSet = dataset.getReadGroupSet(compoundId.read_group_set_id)
-        referenceSet = readGroupSet.getReferenceSet()
-        if referenceSet is None:
-            raise exceptions.ReadGroupSetNotMappedToReferenceSetException(
-                    readGroupSet.getId())
-        reference = referenceSet.getReference(request.reference_id)
-        readGroupIds = readGroupSet.getReadGroupIds()
-        if set(readGroupIds) != set(request.read_group_ids):
-            raise exceptions.BadRequestException(
-                "If multiple readGroupIds are specified, "
-                "they must be all of the readGroupIds in a ReadGroupSet")
+        """
+        Returns a generator over the reads in the specified ReadGroups,
+        which may be drawn from any number of ReadGroupSets as long as
+        these are all aligned to the same ReferenceSet. Each underlying
+        alignment file is read in a single pass, and the per-file streams
+        are merged in coordinate order.
+        """
+        readGroups = self._getRequestReadGroups(request)
+        reference = self._getReadGroupsReference(request, readGroups)
         intervalIterator = ReadsIntervalIterator(
-            request, readGroupSet, reference)
+            request, reads.ReadAlignmentMerger(readGroups), reference)
         return intervalIterator
 
-    def variantsGenerator(self, request):
+    def _getReadGroupsReference(self, request, readGroups):
+        """
+        Returns the reference with the requested referenceId in the
+        ReferenceSet to which all of the specified ReadGroups are aligned.
+        """
+        referenceSet = None
+        for readGroup in readGroups:
+            readGroupSet = readGroup.getParentContainer()
+            if readGroupSet.getReferenceSet() is None:
+                raise exceptions.ReadGroupSetNotMappedToReferenceSetException(
+                    readGroupSet.getId())
+            if referenceSet is None:
+                referenceSet = readGroupSet.getReferenceSet()
+            elif readGroupSet.getReferenceSet().getId() != \
+                    referenceSet.getId():
+                raise exceptions.BadRequestException(
+                    "If multiple readGroupIds are specified, they must "
+                    "all be aligned to the same ReferenceSet")
+        return referenceSet.getReference(request.reference_id)
+
+    def readsBatchGenerator(self, request):
+        """
+        Returns a generator over the ((read, readGroupId, referenceNames),
+        nextPageToken) pairs for the unconverted pysam reads defined by
+        the specified request.
+        """
+        if len(request.read_group_ids) < 1:
+            raise exceptions.BadRequestException(
+                "At least one readGroupId must be specified")
+        if not request.reference_id:
+            raise exceptions.BadRequestException(
+                "A referenceId must be specified when requesting reads "
+                "in batch format")
+        readGroups = self._getRequestReadGroups(request)
+        reference = self._getReadGroupsReference(request, readGroups)
+        return PysamReadsIntervalIterator(
+            request, reads.ReadAlignmentMerger(readGroups), reference)
+
+    def _unmappedReadsGenerator(self, request):
+        """
+        Returns a generator over the unmapped reads in the specified
+        ReadGroups.
+        """
+        readGroups = self._getRequestReadGroups(request)
+        return UnmappedReadsIterator(
+            request, reads.ReadAlignmentMerger(readGroups))
+
+    def _getRequestReadGroups(self, request):
+        """
+        Returns the list of ReadGroups corresponding to the readGroupIds
+        in the specified request.
+        """
+        if len(set(request.read_group_ids)) != len(request.read_group_ids):
+            raise exceptions.BadRequestException(
+                "The same readGroupId may not be specified more than once")
+        readGroups = []
+        for readGroupId in request.read_group_ids:
+            compoundId = datamodel.ReadGroupCompoundId.parse(readGroupId)
+            dataset = self.getDataRepository().getDataset(
+                compoundId.dataset_id)
+            readGroupSet = dataset.getReadGroupSet(
+                compoundId.read_group_set_id)
+            readGroups.append(
+                readGroupSet.getReadGroup(compoundId.read_group_id))
+        return readGroups
+
+    def variantsGenerator(self, request, variantFilter=None):
         """
         Returns a generator over the (variant, nextPageToken) pairs defined
-        by the specified request.
+        by the specified request, restricted to the records satisfying
+        the specified compiled variantFilter.
         """
         compoundId = datamodel.VariantSetCompoundId \
             .parse(request.variant_set_id)
         dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
         variantSet = dataset.getVariantSet(compoundId.variant_set_id)
-        intervalIterator = VariantsIntervalIterator(request, variantSet)
+        intervalIterator = VariantsIntervalIterator(
+            request, variantSet, variantFilter)
         return intervalIterator
 
-    def variantAnnotationsGenerator(self, request):
+    def variantAnnotationsGenerator(
+            self, request, geneName=None, featureId=None, impact=None):
         """
         Returns a generator over the (variantAnnotaitons, nextPageToken) pairs
-        defined by the specified request.
+        defined by the specified request, restricted to the records with an
+        annotation matching the specified geneName, featureId and impact.
         """
         compoundId = datamodel.VariantAnnotationSetCompoundId.parse(
             request.variant_annotation_set_id)
@@ -661,7 +833,7 @@ class Backend(object):
         variantAnnotationSet = variantSet.getVariantAnnotationSet(
             request.variant_annotation_set_id)
         intervalIterator = VariantAnnotationsIntervalIterator(
-            request, variantAnnotationSet)
+            request, variantAnnotationSet, geneName, featureId, impact)
         return intervalIterator
 
     def featuresGenerator(self, request):
@@ -877,15 +1049,20 @@ class Backend(object):
         any point using the nextPageToken attribute of the request object.
         """
         self.startProfile()
-        try:
-            request = protocol.fromJson(requestStr, requestClass)
-        except protocol.json_format.ParseError:
-            raise exceptions.InvalidJsonException(requestStr)
-        # TODO How do we detect when the page size is not set?
-        if not request.page_size:
-            request.page_size = self._defaultPageSize
-        if request.page_size < 0:
-            raise exceptions.BadPageSizeException(request.page_size)
+        request = self._parseSearchRequest(requestStr, requestClass)
+        response = self.searchRequest(request, responseClass, objectGenerator)
+        responseString = protocol.toJson(response)
+        self.endProfile()
+        return responseString
+
+    def searchRequest(self, request, responseClass, objectGenerator):
+        """
+        Runs the specified request object, and returns the resulting page
+        as an instance of the specified responseClass, without any JSON
+        serialisation. This is used directly by in-process clients;
+        objectGenerator is as for runSearchRequest.
+        """
+        request = self._checkPageSize(request)
         responseBuilder = protocol.SearchResponseBuilder(
             responseClass, request.page_size, self._maxResponseLength)
         nextPageToken = None
@@ -894,27 +1071,118 @@ class Backend(object):
             if responseBuilder.isFull():
                 break
         responseBuilder.setNextPageToken(nextPageToken)
-        responseString = responseBuilder.getSerializedResponse()
-        self.endProfile()
-        return responseString
+        return responseBuilder.getResponse()
+
+    def _parseSearchRequest(self, requestStr, requestClass):
+        """
+        Returns an instance of the specified requestClass parsed from the
+        specified JSON string.
+        """
+        try:
+            return protocol.fromJson(requestStr, requestClass)
+        except protocol.json_format.ParseError:
+            raise exceptions.InvalidJsonException(requestStr)
+
+    def _checkPageSize(self, request):
+        """
+        Checks that the page size of the specified request is valid, and
+        returns the request to run. If the page size is not set, this is
+        a copy of the request with the default page size, so that the
+        caller's request object is left unchanged.
+        """
+        if request.page_size < 0:
+            raise exceptions.BadPageSizeException(request.page_size)
+        # TODO How do we detect when the page size is not set?
+        if not request.page_size:
+            defaultedRequest = type(request)()
+            defaultedRequest.CopyFrom(request)
+            defaultedRequest.page_size = self._defaultPageSize
+            request = defaultedRequest
+        return request
+
+    def searchReadsBatch(self, request):
+        """
+        Runs the specified SearchReadsRequest, and returns the resulting
+        page of reads as a ReadAlignmentBatch. The page size and maximum
+        response length are applied in the same way as for
+        runSearchRequest, and the batch's nextPageToken may be used to
+        retrieve the following page.
+        """
+        request = self._checkPageSize(request)
+        batch = reads.ReadAlignmentBatch()
+        nextPageToken = None
+        for (read, readGroupId, referenceNames), nextPageToken in \
+                self.readsBatchGenerator(request):
+            batch.append(read, readGroupId, referenceNames)
+            if len(batch) >= request.page_size or \
+                    batch.getNumBytes() >= self._maxResponseLength:
+                break
+        batch.nextPageToken = nextPageToken
+        return batch
+
+    def searchGenotypeMatrix(
+            self, request, includePhasing=False,
+            includeGenotypeLikelihoods=False, variantFilter=None):
+        """
+        Runs the specified SearchVariantsRequest, and returns the
+        genotypes for the resulting page of variants as a GenotypeMatrix.
+        If no callSetIds are specified in the request, the matrix includes
+        all CallSets in the VariantSet. Paging and the variantFilter
+        expression are the same as for runSearchVariants.
+        """
+        request = self._checkPageSize(request)
+        compiledFilter = None
+        if variantFilter is not None:
+            compiledFilter = variants.compileVariantFilter(variantFilter)
+        compoundId = datamodel.VariantSetCompoundId.parse(
+            request.variant_set_id)
+        dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
+        variantSet = dataset.getVariantSet(compoundId.variant_set_id)
+        callSetIds = list(request.call_set_ids)
+        if len(callSetIds) == 0:
+            callSetIds = [
+                callSet.getId() for callSet in variantSet.getCallSets()]
+        matrix = variants.GenotypeMatrix(
+            callSetIds, includePhasing, includeGenotypeLikelihoods)
+        nextPageToken = None
+        for (record, variantId, callSetLookups), nextPageToken in \
+                GenotypeRecordsIntervalIterator(
+                    request, variantSet, compiledFilter):
+            matrix.append(record, variantId, callSetLookups)
+            if len(matrix) >= request.page_size or \
+                    matrix.getNumBytes() >= self._maxResponseLength:
+                break
+        matrix.nextPageToken = nextPageToken
+        return matrix
 
     def runListReferenceBases(self, id_, requestArgs):
         """
         Runs a listReferenceBases request for the specified ID and
         request arguments.
         """
+        request = protocol.ListReferenceBasesRequest()
+        request.start = _parseIntegerArgument(requestArgs, 'start', 0)
+        request.end = _parseIntegerArgument(requestArgs, 'end', 0)
+        request.page_token = requestArgs.get('pageToken', "")
+        return protocol.toJson(self.listReferenceBases(id_, request))
+
+    def listReferenceBases(self, id_, request):
+        """
+        Runs the specified ListReferenceBasesRequest object for the
+        reference with the specified ID, and returns the resulting
+        ListReferenceBasesResponse object. An end of 0 denotes the end
+        of the reference.
+        """
         compoundId = datamodel.ReferenceCompoundId.parse(id_)
         referenceSet = self.getDataRepository().getReferenceSet(
             compoundId.reference_set_id)
         reference = referenceSet.getReference(id_)
-        start = _parseIntegerArgument(requestArgs, 'start', 0)
-        end = _parseIntegerArgument(requestArgs, 'end', reference.getLength())
+        start = request.start
+        end = request.end
         if end == 0:  # assume meant "get all"
             end = reference.getLength()
-        if 'pageToken' in requestArgs:
-            pageTokenStr = requestArgs['pageToken']
-            if pageTokenStr != "":
-                start = _parsePageToken(pageTokenStr, 1)[0]
+        if request.page_token != "":
+            start = _parsePageToken(request.page_token, 1)[0]
 
         chunkSize = self._maxResponseLength
         nextPageToken = None
@@ -929,7 +1197,7 @@ class Backend(object):
         response.sequence = sequence
         if nextPageToken is not None:
             response.next_page_token = nextPageToken
-        return protocol.toJson(response)
+        return response
 
     # Get requests.
 
@@ -1032,6 +1300,22 @@ class Backend(object):
         variantSet = dataset.getVariantSet(id_)
         return self.runGetRequest(variantSet)
 
+    def runGetVariantSetStatistics(self, id_):
+        """
+        Runs a getVariantSetStatistics request for the specified ID,
+        returning the summary statistics computed when the VariantSet was
+        added to the repository.
+        """
+        compoundId = datamodel.VariantSetCompoundId.parse(id_)
+        dataset = self.getDataRepository().getDataset(compoundId.dataset_id)
+        variantSet = dataset.getVariantSet(id_)
+        statistics = variantSet.getStatistics()
+        if statistics is None:
+            raise exceptions.VariantSetStatisticsNotFoundException(id_)
+        jsonDict = statistics.toJsonDict()
+        jsonDict["variantSetId"] = variantSet.getId()
+        return json.dumps(jsonDict)
+
     def runGetFeatureSet(self, id_):
         """
         Runs a getFeatureSet request for the specified ID.
@@ -1129,6 +1413,15 @@ class Backend(object):
             protocol.SearchReadsResponse,
             self.readsGenerator)
 
+    def runSearchReadsBatch(self, request):
+        """
+        Runs the specified SearchReadsRequest, returning the serialised
+        ReadAlignmentBatch for the resulting page of reads.
+        """
+        requestObject = self._parseSearchRequest(
+            request, protocol.SearchReadsRequest)
+        return self.searchReadsBatch(requestObject).toBytes()
+
     def runSearchReferenceSets(self, request):
         """
         Runs the specified SearchReferenceSetsRequest.
@@ -1165,23 +1458,89 @@ class Backend(object):
             protocol.SearchVariantAnnotationSetsResponse,
             self.variantAnnotationSetsGenerator)
 
-    def runSearchVariants(self, request):
+    def runSearchVariants(self, request, variantFilter=None):
         """
-        Runs the specified SearchVariantRequest.
+        Runs the specified SearchVariantRequest. If variantFilter is
+        specified, only the variants satisfying this filter expression
+        (see variants.compileVariantFilter) are returned. The expression is
+        compiled once for the request and evaluated on the variant records
+        before they are converted, and must be specified again for each
+        page of the search.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantsRequest,
             protocol.SearchVariantsResponse,
-            self.variantsGenerator)
+            self._getVariantsGenerator(variantFilter))
+
+    def searchVariants(self, request, variantFilter=None):
+        """
+        Runs the specified SearchVariantsRequest object, and returns the
+        resulting SearchVariantsResponse object. The variantFilter is as
+        for runSearchVariants.
+        """
+        return self.searchRequest(
+            request, protocol.SearchVariantsResponse,
+            self._getVariantsGenerator(variantFilter))
+
+    def _getVariantsGenerator(self, variantFilter):
+        """
+        Returns the object generator for a variants search using the
+        specified filter expression, which may be None.
+        """
+        if variantFilter is None:
+            return self.variantsGenerator
+        return functools.partial(
+            self.variantsGenerator,
+            variantFilter=variants.compileVariantFilter(variantFilter))
 
-    def runSearchVariantAnnotations(self, request):
+    def runSearchGenotypeMatrix(
+            self, request, includePhasing=False,
+            includeGenotypeLikelihoods=False, variantFilter=None):
         """
-        Runs the specified SearchVariantAnnotationsRequest.
+        Runs the specified SearchVariantsRequest, returning the serialised
+        GenotypeMatrix for the resulting page of variants.
+        """
+        requestObject = self._parseSearchRequest(
+            request, protocol.SearchVariantsRequest)
+        return self.searchGenotypeMatrix(
+            requestObject, includePhasing, includeGenotypeLikelihoods,
+            variantFilter).toBytes()
+
+    def runSearchVariantAnnotations(
+            self, request, geneName=None, featureId=None, impact=None):
+        """
+        Runs the specified SearchVariantAnnotationsRequest. If any of
+        geneName, featureId or impact are specified, only the annotations
+        of variants with a transcript annotation matching all of them are
+        returned. These must be specified again for each page of the
+        search.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantAnnotationsRequest,
             protocol.SearchVariantAnnotationsResponse,
-            self.variantAnnotationsGenerator)
+            self._getVariantAnnotationsGenerator(geneName, featureId, impact))
+
+    def searchVariantAnnotations(
+            self, request, geneName=None, featureId=None, impact=None):
+        """
+        Runs the specified SearchVariantAnnotationsRequest object, and
+        returns the resulting SearchVariantAnnotationsResponse object. The
+        filters are as for runSearchVariantAnnotations.
+        """
+        return self.searchRequest(
+            request, protocol.SearchVariantAnnotationsResponse,
+            self._getVariantAnnotationsGenerator(geneName, featureId, impact))
+
+    def _getVariantAnnotationsGenerator(self, geneName, featureId, impact):
+        """
+        Returns the object generator for a variant annotations search
+        using the specified filters, any of which may be None.
+        """
+        if geneName is None and featureId is None and impact is None:
+            return self.variantAnnotationsGenerator
+        return functools.partial(
+            self.variantAnnotationsGenerator, geneName=geneName,
+            featureId=featureId, impact=impact)
 
     def runSearchCallSets(self, request):
         """
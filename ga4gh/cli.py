@@ -8,13 +8,13 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-import glob
 import json
 import logging
 import operator
 import os
 import sys
 import textwrap
+import time
 import traceback
 import unittest
 import unittest.loader
@@ -192,7 +192,8 @@ class AbstractQueryRunner(object):
             self._client = client.LocalClient(theBackend)
         else:
             self._client = client.HttpClient(
-                args.baseUrl, verbosityToLogLevel(args.verbose), self._key)
+                args.baseUrl, verbosityToLogLevel(args.verbose), self._key,
+                args.prefetchPages, args.parallelism)
 
 
 class FormattedOutputRunner(AbstractQueryRunner):
@@ -672,13 +673,15 @@ class SearchVariantsRunner(VariantFormatterMixin, AbstractSearchRunner):
             self._callSetIds = None
         else:
             self._callSetIds = args.callSetIds.split(",")
+        self._variantFilter = args.filter
 
     def _run(self, variantSetId):
         iterator = self._client.search_variants(
             start=self._start, end=self._end,
             reference_name=self._referenceName,
             variant_set_id=variantSetId,
-            call_set_ids=self._callSetIds)
+            call_set_ids=self._callSetIds,
+            variant_filter=self._variantFilter)
         self._output(iterator)
 
     def run(self):
@@ -710,6 +713,9 @@ class SearchVariantAnnotationsRunner(
                 term = protocol.OntologyTerm()
                 term.id = eff
                 self._effects.append(term)
+        self._gene = args.gene
+        self._featureId = args.featureId
+        self._impact = args.impact
 
     def _run(self, variantAnnotationSetId):
         iterator = self._client.search_variant_annotations(
@@ -717,7 +723,8 @@ class SearchVariantAnnotationsRunner(
             reference_name=self._referenceName,
             reference_id=self._referenceId,
             start=self._start, end=self._end,
-            effects=self._effects)
+            effects=self._effects, gene=self._gene,
+            feature_id=self._featureId, impact=self._impact)
         self._output(iterator)
 
     def getAllAnnotationSets(self):
@@ -1087,6 +1094,13 @@ def addVersionArgument(parser):
         "--version", version=versionString, action="version")
 
 
+def addVariantFilterArgument(parser):
+    parser.add_argument(
+        "--filter", default=None,
+        help="Only return the variants satisfying this filter expression, "
+        "for example 'FILTER == PASS && QUAL >= 30 && INFO.AF > 0.01'")
+
+
 def addVariantSearchOptions(parser):
     """
     Adds common options to a variant searches command line parser.
@@ -1112,6 +1126,20 @@ def addAnnotationsSearchOptions(parser):
     addPageSizeArgument(parser)
 
 
+def addAnnotationFilterArguments(parser):
+    parser.add_argument(
+        "--gene", default=None,
+        help="Only return annotations of variants affecting the gene with "
+        "this symbol")
+    parser.add_argument(
+        "--featureId", default=None,
+        help="Only return annotations of variants affecting this feature")
+    parser.add_argument(
+        "--impact", default=None,
+        help="Only return annotations of variants having a transcript "
+        "effect of this impact, for example HIGH")
+
+
 def addFeaturesSearchOptions(parser):
     """
     Adds common options to a features search command line parser.
@@ -1341,6 +1369,18 @@ def addClientGlobalOptions(parser):
     parser.add_argument(
         "--key", "-k", default='invalid',
         help="Auth Key. Found on server index page.")
+    parser.add_argument(
+        "--prefetchPages", default=0, type=int,
+        help=(
+            "The number of pages of search results to request from the "
+            "server ahead of those being output, using a background "
+            "thread. The default is 0, which disables prefetching."))
+    parser.add_argument(
+        "--parallelism", default=1, type=int,
+        help=(
+            "The number of shards of the region in a reads or variants "
+            "search to request from the server concurrently. The default "
+            "is 1, which requests the whole region as a single search."))
     addDisableUrllibWarningsArgument(parser)
     addVersionArgument(parser)
 
@@ -1359,6 +1399,7 @@ def addVariantsSearchParser(subparsers):
     addUrlArgument(parser)
     addOutputFormatArgument(parser)
     addVariantSearchOptions(parser)
+    addVariantFilterArgument(parser)
     return parser
 
 
@@ -1382,6 +1423,7 @@ def addVariantAnnotationSearchParser(subparsers):
     addUrlArgument(parser)
     addOutputFormatArgument(parser)
     addAnnotationsSearchOptions(parser)
+    addAnnotationFilterArguments(parser)
     return parser
 
 
@@ -1822,20 +1864,53 @@ class Ga2VcfRunner(SearchVariantsRunner):
     def __init__(self, args):
         super(Ga2VcfRunner, self).__init__(args)
         self._outputFile = args.outputFile
-        self._binaryOutput = False
-        if args.outputFormat == "bcf":
-            self._binaryOutput = True
+        self._binaryOutput = args.outputFormat == "bcf"
+        self._compressedOutput = args.outputFormat == "vcf.gz"
+
+    def _getCallSets(self):
+        """
+        Returns the CallSets whose calls are output, in order.
+        """
+        if self._callSetIds == []:
+            return []
+        callSets = list(self._client.search_call_sets(self._variantSetId))
+        if self._callSetIds is None:
+            return callSets
+        callSetMap = dict((callSet.id, callSet) for callSet in callSets)
+        return [callSetMap[callSetId] for callSetId in self._callSetIds]
+
+    def _getReferences(self, variantSet):
+        """
+        Returns the References declared as contigs in the output.
+        """
+        references = []
+        if variantSet.reference_set_id:
+            references = list(self._client.search_references(
+                variantSet.reference_set_id))
+        if self._referenceName is not None and self._referenceName not in [
+                reference.name for reference in references]:
+            reference = protocol.Reference()
+            reference.name = self._referenceName
+            references.append(reference)
+        return references
 
     def run(self):
         variantSet = self._client.get_variant_set(self._variantSetId)
+        callSets = self._getCallSets()
+        # The server cannot tell an unset list of call set IDs from an
+        # empty one, so the calls to output are always listed.
         iterator = self._client.search_variants(
             start=self._start, end=self._end,
             reference_name=self._referenceName,
             variant_set_id=self._variantSetId,
-            call_set_ids=self._callSetIds)
+            call_set_ids=[callSet.id for callSet in callSets],
+            variant_filter=self._variantFilter)
         # do conversion
         vcfConverter = converters.VcfConverter(
-            variantSet, iterator, self._outputFile, self._binaryOutput)
+            variantSet, iterator, self._outputFile, self._binaryOutput,
+            callSets=callSets,
+            references=self._getReferences(variantSet),
+            compressedOutput=self._compressedOutput)
         vcfConverter.convert()
 
 
@@ -1854,16 +1929,19 @@ def getGa2VcfParser():
     addUrlArgument(parser)
     parser.add_argument("variantSetId", help="The variant set to convert")
     parser.add_argument(
-        "--outputFormat", "-O", choices=['vcf', 'bcf'], default="vcf",
+        "--outputFormat", "-O", choices=['vcf', 'vcf.gz', 'bcf'],
+        default="vcf",
         help=(
             "The format for object output. Currently supported are "
-            "'vcf' (default), which is a text-based format and "
-            "'bcf', which is the binary equivalent"))
+            "'vcf' (default), which is a text-based format, 'vcf.gz', "
+            "which is bgzipped VCF, indexed with tabix when written to "
+            "an output file, and 'bcf', which is the binary equivalent"))
     addReferenceNameArgument(parser)
     addCallSetIdsArgument(parser)
     addStartArgument(parser)
     addEndArgument(parser)
     addPageSizeArgument(parser)
+    addVariantFilterArgument(parser)
     return parser
 
 
@@ -1890,6 +1968,7 @@ class Ga2SamRunner(SearchReadsRunner):
         args.readGroupIds = args.readGroupId
         super(Ga2SamRunner, self).__init__(args)
         self._outputFile = args.outputFile
+        self._numThreads = args.numThreads
         self._binaryOutput = False
         if args.outputFormat == "bam":
             self._binaryOutput = True
@@ -1898,8 +1977,17 @@ class Ga2SamRunner(SearchReadsRunner):
         samConverter = converters.SamConverter(
             self._client, readGroupId=self._readGroupIds[0],
             referenceId=self._referenceId, start=self._start, end=self._end,
-            outputFileName=self._outputFile, binaryOutput=self._binaryOutput)
+            outputFileName=self._outputFile, binaryOutput=self._binaryOutput,
+            numThreads=self._numThreads)
+        startTime = time.time()
         samConverter.convert()
+        elapsedTime = time.time() - startTime
+        numReads = samConverter.getNumReads()
+        message = "Converted {} reads in {:.2f} seconds ({:.0f} reads/s)"
+        print(
+            message.format(
+                numReads, elapsedTime, numReads / max(elapsedTime, 1e-6)),
+            file=sys.stderr)
 
 
 def getGa2SamParser():
@@ -1921,6 +2009,12 @@ def getGa2SamParser():
             "The format for object output. Currently supported are "
             "'sam' (default), which is a text-based format and "
             "'bam', which is the binary equivalent"))
+    parser.add_argument(
+        "--numThreads", default=1, type=int,
+        help=(
+            "The number of threads used to compress BAM output. Reads "
+            "are fetched and converted while these compress the "
+            "previous reads."))
     addOutputFileArgument(parser)
     return parser
 
@@ -2047,6 +2141,23 @@ class RepoManager(object):
             else:
                 print("Aborted")
 
+    def _getProgressReporter(self, description):
+        """
+        Returns a function reporting the progress of a step in the form
+        used by the datamodel, progress(numDone, numTotal), on stderr, or
+        None if stderr is not a terminal.
+        """
+        if not sys.stderr.isatty():
+            return None
+
+        def reportProgress(numDone, numTotal):
+            sys.stderr.write("\r{}: {}/{}".format(
+                description, numDone, numTotal))
+            if numDone == numTotal:
+                sys.stderr.write("\n")
+            sys.stderr.flush()
+        return reportProgress
+
     def _updateRepo(self, func, *args, **kwargs):
         """
         Runs the specified function that updates the repo with the specified
@@ -2202,7 +2313,7 @@ class RepoManager(object):
                 raise exceptions.MissingIndexException(dataUrl)
         else:
             if indexFile is None:
-                indexFile = dataUrl + ".bai"
+                indexFile = reads.getDefaultIndexFile(dataUrl)
             dataUrl = self._getFilePath(self._args.dataFile,
                                         self._args.relativePath)
             indexFile = self._getFilePath(indexFile, self._args.relativePath)
@@ -2231,14 +2342,13 @@ class RepoManager(object):
             if self._args.name is None:
                 name = getNameFromPath(dataUrls[0])
             if os.path.isdir(dataUrls[0]):
-                # Read in the VCF files from the directory.
-                # TODO support uncompressed VCF and BCF files
+                # Read in the VCF and BCF files from the directory.
+                # TODO support uncompressed VCF files
                 vcfDir = dataUrls[0]
-                pattern = os.path.join(vcfDir, "*.vcf.gz")
-                dataUrls = glob.glob(pattern)
+                dataUrls = variants.getVariantFilesInDirectory(vcfDir)
                 if len(dataUrls) == 0:
                     raise exceptions.RepoManagerException(
-                        "Cannot find any VCF files in the directory "
+                        "Cannot find any VCF or BCF files in the directory "
                         "'{}'.".format(vcfDir))
                 dataUrls[0] = self._getFilePath(dataUrls[0],
                                                 self._args.relativePath)
@@ -2248,9 +2358,14 @@ class RepoManager(object):
                 "more than one VCF file is provided. Please provide a "
                 "name argument using --name.")
         parsed = urlparse.urlparse(dataUrls[0])
-        if parsed.scheme not in ['http', 'ftp']:
+        isLocal = parsed.scheme not in ['http', 'ftp']
+        if isLocal:
             dataUrls = map(lambda url: self._getFilePath(
                 url, self._args.relativePath), dataUrls)
+        elif self._args.transcodeBcf:
+            raise exceptions.RepoManagerException(
+                "Cannot transcode remote VCF files to BCF. Please download "
+                "the files to the local file system first.")
         # Now, get the index files for the data files that we've now obtained.
         indexFiles = self._args.indexFiles
         if indexFiles is None:
@@ -2265,14 +2380,29 @@ class RepoManager(object):
                         "based on remote URLs, please download the index "
                         "files to the local file system and provide them "
                         "with the --indexFiles argument".format(dataUrl))
-            # We assume that the indexes are made by adding .tbi
-            indexSuffix = ".tbi"
-            # TODO support BCF input properly here by adding .csi
-            indexFiles = [filename + indexSuffix for filename in dataUrls]
+            indexFiles = [
+                variants.getDefaultIndexFile(filename)
+                for filename in dataUrls]
         indexFiles = map(lambda url: self._getFilePath(
             url, self._args.relativePath), indexFiles)
+        if self._args.transcodeBcf:
+            self._transcodeVariantFiles(dataUrls, indexFiles)
+        if isLocal:
+            # Records are read from the BCF sidecars of the VCF files
+            # where these exist, as BCF is much faster to decode.
+            for j, dataUrl in enumerate(dataUrls):
+                sidecar = variants.getBcfSidecar(dataUrl)
+                if sidecar is not None:
+                    dataUrls[j], indexFiles[j] = sidecar
         variantSet = variants.HtslibVariantSet(dataset, name)
-        variantSet.populateFromFile(dataUrls, indexFiles)
+        variantSet.populateFromFile(
+            dataUrls, indexFiles, self._args.workers,
+            self._getProgressReporter("Scanning VCF/BCF files"))
+        if self._args.computeStatistics:
+            variantSet.computeStatistics()
+        if self._args.idIndexFile is not None:
+            variantSet.buildIdIndex(self._getFilePath(
+                self._args.idIndexFile, self._args.relativePath))
         # Get the reference set that is associated with the variant set.
         referenceSetName = self._args.referenceSetName
         if referenceSetName is None:
@@ -2298,6 +2428,16 @@ class RepoManager(object):
             for annotationSet in variantSet.getVariantAnnotationSets():
                 annotationSet.setOntology(ontology)
                 annotationSets.append(annotationSet)
+        if self._args.annotationIndexFile is not None:
+            if len(annotationSets) == 0:
+                raise exceptions.RepoManagerException(
+                    "An annotation index can only be built when adding "
+                    "the annotations of an annotated VCF file with "
+                    "--addAnnotationSets")
+            # A VariantSet has at most one VariantAnnotationSet.
+            for annotationSet in annotationSets:
+                annotationSet.buildIndex(self._getFilePath(
+                    self._args.annotationIndexFile, self._args.relativePath))
 
         # Add the annotation sets and the variant set as an atomic update
         def updateRepo():
@@ -2306,6 +2446,19 @@ class RepoManager(object):
                 self._repo.insertVariantAnnotationSet(annotationSet)
         self._updateRepo(updateRepo)
 
+    def _transcodeVariantFiles(self, dataUrls, indexFiles):
+        """
+        Transcodes the specified bgzipped VCF files to indexed BCF
+        sidecars, which are read in their place.
+        """
+        progress = self._getProgressReporter("Transcoding VCF files to BCF")
+        for j, (dataUrl, indexFile) in enumerate(zip(dataUrls, indexFiles)):
+            bcfPath = variants.getBcfSidecarPath(dataUrl)
+            if bcfPath is not None:
+                variants.transcodeVcfToBcf(dataUrl, indexFile, bcfPath)
+            if progress is not None:
+                progress(j + 1, len(dataUrls))
+
     def removeReferenceSet(self):
         """
         Removes a referenceSet from the repo.
@@ -2708,15 +2861,19 @@ class RepoManager(object):
         cls.addRelativePathOption(addReadGroupSetParser)
         addReadGroupSetParser.add_argument(
             "dataFile",
-            help="The file path or URL of the BAM file for this ReadGroupSet")
+            help=(
+                "The file path or URL of the BAM or CRAM file for this "
+                "ReadGroupSet. CRAM files are decoded using the FASTA "
+                "file of the ReadGroupSet's reference set"))
         addReadGroupSetParser.add_argument(
             "-I", "--indexFile", default=None,
             help=(
-                "The file path of the BAM index for this ReadGroupSet. "
-                "If the dataFile argument is a local file, this will "
-                "be automatically inferred by appending '.bai' to the "
-                "file name. If the dataFile is a remote URL the path to "
-                "a local file containing the BAM index must be provided"))
+                "The file path of the BAM or CRAM index for this "
+                "ReadGroupSet. If the dataFile argument is a local file, "
+                "this will be automatically inferred by appending '.bai' "
+                "(or '.crai' for CRAM) to the file name. If the dataFile "
+                "is a remote URL the path to a local file containing the "
+                "index must be provided"))
 
         addOntologyParser = addSubparser(
             subparsers, "add-ontology",
@@ -2765,7 +2922,7 @@ class RepoManager(object):
                 "The VCF/BCF files representing the new VariantSet. "
                 "These may be specified either one or more paths "
                 "to local files or remote URLS, or as a path to "
-                "a local directory containing VCF files. Either "
+                "a local directory containing VCF/BCF files. Either "
                 "a single directory argument may be passed or a "
                 "list of file paths/URLS, but not a mixture of "
                 "directories and paths.")
@@ -2784,6 +2941,39 @@ class RepoManager(object):
             help=(
                 "If the supplied VCF file contains annotations, create the "
                 "corresponding VariantAnnotationSet."))
+        addVariantSetParser.add_argument(
+            "-w", "--workers", type=int, default=None,
+            help=(
+                "The number of processes used to read the headers and "
+                "indexes of the VCF/BCF files. Defaults to the number of "
+                "CPUs; more may help for files on network storage."))
+        addVariantSetParser.add_argument(
+            "-S", "--computeStatistics", action="store_true",
+            help=(
+                "Compute summary statistics for the variant set, which are "
+                "served without reading the VCF/BCF files. This reads "
+                "through every file once, including remote files, so may "
+                "take a long time for large variant sets."))
+        addVariantSetParser.add_argument(
+            "-x", "--idIndexFile", default=None,
+            help=(
+                "Build an index of the variants at the specified path, so "
+                "that variants can be retrieved by ID without querying the "
+                "VCF/BCF index."))
+        addVariantSetParser.add_argument(
+            "-A", "--annotationIndexFile", default=None,
+            help=(
+                "Build an index of the annotations by effect, gene, "
+                "feature and impact at the specified path, so that "
+                "annotation searches on these read only the matching "
+                "records. Requires --addAnnotationSets."))
+        addVariantSetParser.add_argument(
+            "-B", "--transcodeBcf", action="store_true",
+            help=(
+                "Transcode the bgzipped VCF files to indexed BCF files "
+                "alongside them, which are much faster to decode. The "
+                "BCF file 'X.bcf' is read in place of 'X.vcf.gz' whenever "
+                "it exists when the VariantSet is added."))
 
         removeVariantSetParser = addSubparser(
             subparsers, "remove-variantset",
@@ -5,15 +5,155 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import requests
 import posixpath
 import logging
-
+import collections
+import functools
+import itertools
+import operator
+import sys
+import threading
+import Queue
+
+import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.variants as variants
 import ga4gh.protocol as protocol
 import ga4gh.pb as pb
 import ga4gh.exceptions as exceptions
 
 
+_end_of_pages = object()
+
+# The number of shards into which a region is split for each of the
+# threads requesting them, so that only a fraction of the region's
+# results are held in memory ahead of the caller.
+_shards_per_thread = 4
+
+
+class _DeferredResponse(object):
+    """
+    A response to a paged request that has been received but not yet
+    deserialised, along with the token for the following page.
+    """
+    def __init__(self, deserialize, next_page_token):
+        self.deserialize = deserialize
+        self.next_page_token = next_page_token
+
+
+def _prefetch(pages, num_pages):
+    """
+    Returns an iterator over the specified iterator of pages, which is
+    advanced on a background thread so that up to num_pages pages are
+    requested ahead of the caller. Exceptions raised while requesting a
+    page are raised again, with their original tracebacks, when the
+    caller reaches that page.
+    """
+    # The worker thread takes a ticket before requesting each page, and
+    # we return one each time the caller takes a page.
+    tickets = Queue.Queue()
+    for _ in range(num_pages):
+        tickets.put(None)
+    results = Queue.Queue()
+    stopped = threading.Event()
+
+    def run():
+        try:
+            while True:
+                tickets.get()
+                if stopped.is_set():
+                    break
+                page = next(pages, _end_of_pages)
+                results.put((page, None))
+                if page is _end_of_pages:
+                    break
+        except Exception:
+            results.put((None, sys.exc_info()))
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            page, exc_info = results.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if page is _end_of_pages:
+                break
+            tickets.put(None)
+            yield page
+    finally:
+        # Wake the worker thread, if it is waiting for a ticket, so that
+        # it stops when the caller abandons the iteration.
+        stopped.set()
+        tickets.put(None)
+
+
+def _split_interval(start, end, num_shards):
+    """
+    Returns a list of the (start, end) tuples for at most num_shards
+    contiguous, non-empty sub-intervals of equal width covering the
+    specified interval.
+    """
+    bounds = [
+        start + (end - start) * j // num_shards
+        for j in range(num_shards + 1)]
+    return [
+        (shard_start, shard_end)
+        for shard_start, shard_end in zip(bounds, bounds[1:])
+        if shard_start < shard_end]
+
+
+def _run_concurrently(iterators, num_threads):
+    """
+    Returns an iterator over the items of each of the specified iterators
+    in turn. Each iterator is exhausted on a background thread, and up to
+    num_threads of these run at once, ahead of the iterator the caller is
+    consuming. Exceptions raised by an iterator are raised again, with
+    their original tracebacks, when the caller reaches the point at which
+    they occurred.
+    """
+    stopped = threading.Event()
+
+    def run(iterator, results):
+        try:
+            for item in iterator:
+                if stopped.is_set():
+                    return
+                results.put((item, None))
+            results.put((_end_of_pages, None))
+        except Exception:
+            results.put((None, sys.exc_info()))
+
+    def start(iterator):
+        results = Queue.Queue()
+        thread = threading.Thread(target=run, args=(iterator, results))
+        thread.daemon = True
+        thread.start()
+        return results
+
+    iterators = iter(iterators)
+    running = collections.deque(
+        start(iterator)
+        for iterator in itertools.islice(iterators, num_threads))
+    try:
+        while len(running) > 0:
+            results = running.popleft()
+            while True:
+                item, exc_info = results.get()
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                if item is _end_of_pages:
+                    break
+                yield item
+            iterator = next(iterators, None)
+            if iterator is not None:
+                running.append(start(iterator))
+    finally:
+        stopped.set()
+
+
 class AbstractClient(object):
     """
     The abstract superclass of GA4GH Client objects.
@@ -21,6 +161,8 @@ class AbstractClient(object):
 
     def __init__(self, log_level=0):
         self._page_size = None
+        self._prefetch_pages = 0
+        self._parallelism = 1
         self._log_level = log_level
         self._protocol_bytes_received = 0
         logging.basicConfig()
@@ -35,6 +177,24 @@ class AbstractClient(object):
             raise exceptions.EmptyResponseException()
         return protocol.fromJson(json_response_string, protocol_response_class)
 
+    def _deserialize_page_response(
+            self, json_response_string, protocol_response_class):
+        """
+        Deserialises the specified response to a paged request. If this
+        client prefetches pages, only the next page token is read here,
+        and the response is deserialised when the caller reaches it, so
+        that the background thread can go on to request the next page.
+        """
+        if self._prefetch_pages > 0 and json_response_string:
+            deserialize = functools.partial(
+                self._deserialize_response, json_response_string,
+                protocol_response_class)
+            next_page_token = json.loads(json_response_string).get(
+                "nextPageToken", "")
+            return _DeferredResponse(deserialize, next_page_token)
+        return self._deserialize_response(
+            json_response_string, protocol_response_class)
+
     def _run_search_page_request(
             self, protocol_request, object_name, protocol_response_class):
         """
@@ -43,6 +203,40 @@ class AbstractClient(object):
         """
         raise NotImplemented()
 
+    def _get_pages(
+            self, run_page_request, protocol_request, get_next_page_token):
+        """
+        Yields the successive pages returned by run_page_request for the
+        specified request, until get_next_page_token returns an empty
+        page token for the last page.
+        """
+        not_done = True
+        while not_done:
+            page = run_page_request(protocol_request)
+            yield page
+            next_page_token = pb.string(get_next_page_token(page))
+            not_done = bool(next_page_token)
+            protocol_request.page_token = next_page_token
+
+    def _run_paged_request(
+            self, run_page_request, protocol_request,
+            get_next_page_token=operator.attrgetter("next_page_token")):
+        """
+        Returns an iterator over the pages returned by run_page_request
+        for the specified request, where get_next_page_token returns the
+        token for the page following the specified page. If this client
+        prefetches pages, these are requested on a background thread
+        while the caller consumes the previous pages.
+        """
+        pages = self._get_pages(
+            run_page_request, protocol_request, get_next_page_token)
+        if self._prefetch_pages > 0:
+            pages = (
+                page.deserialize() if isinstance(page, _DeferredResponse)
+                else page
+                for page in _prefetch(pages, self._prefetch_pages))
+        return pages
+
     def _run_search_request(
             self, protocol_request, object_name, protocol_response_class):
         """
@@ -51,17 +245,126 @@ class AbstractClient(object):
         listAttr.  If pages of results are present, repeat this process
         until the pageToken is null.
         """
-        not_done = True
-        while not_done:
-            response_object = self._run_search_page_request(
-                protocol_request, object_name, protocol_response_class)
-            value_list = getattr(
-                response_object,
-                protocol.getValueListName(protocol_response_class))
-            for extract in value_list:
+        run_page_request = functools.partial(
+            self._run_search_page_request, object_name=object_name,
+            protocol_response_class=protocol_response_class)
+        value_list_name = protocol.getValueListName(protocol_response_class)
+        for response_object in self._run_paged_request(
+                run_page_request, protocol_request):
+            for extract in getattr(response_object, value_list_name):
                 yield extract
-            not_done = bool(response_object.next_page_token)
-            protocol_request.page_token = response_object.next_page_token
+
+    def _get_shard_values(
+            self, run_page_request, protocol_request, value_list_name,
+            get_start, is_first_shard):
+        """
+        Yields the lists of values in the successive pages returned by
+        run_page_request for the specified request over a single shard of
+        a region. Except in the first shard, values that start before the
+        shard are dropped, as they are returned by the preceding shard.
+        """
+        for page in self._get_pages(
+                run_page_request, protocol_request,
+                operator.attrgetter("next_page_token")):
+            if isinstance(page, _DeferredResponse):
+                page = page.deserialize()
+            values = getattr(page, value_list_name)
+            if not is_first_shard:
+                values = [
+                    value for value in values
+                    if get_start(value) >= protocol_request.start]
+            yield values
+
+    def _run_sharded_search_request(
+            self, run_page_request, protocol_request, value_list_name,
+            get_start):
+        """
+        Runs the specified request, whose region is given by its start and
+        end fields, by splitting the region into shards and running the
+        page requests for up to self._parallelism shards concurrently.
+        We yield each object in value_list_name once, in the order of the
+        shards, and hence in coordinate order.
+        """
+        shards = []
+        for shard_start, shard_end in _split_interval(
+                protocol_request.start, protocol_request.end,
+                self._parallelism * _shards_per_thread):
+            shard_request = type(protocol_request)()
+            shard_request.CopyFrom(protocol_request)
+            shard_request.start = shard_start
+            shard_request.end = shard_end
+            shards.append(self._get_shard_values(
+                run_page_request, shard_request, value_list_name, get_start,
+                len(shards) == 0))
+        for values in _run_concurrently(shards, self._parallelism):
+            for value in values:
+                yield value
+
+    def _run_search_variants_page_request(
+            self, protocol_request, variant_filter):
+        """
+        Runs a complete transaction with the server to obtain a single
+        page of variants for the specified SearchVariantsRequest,
+        filtered on the server using the specified filter expression.
+        """
+        raise NotImplemented()
+
+    def _run_search_variants_request(self, protocol_request, variant_filter):
+        """
+        Runs the specified SearchVariantsRequest using the specified filter
+        expression, and yields each of the variants returned.
+        """
+        run_page_request = functools.partial(
+            self._run_search_variants_page_request,
+            variant_filter=variant_filter)
+        for response_object in self._run_paged_request(
+                run_page_request, protocol_request):
+            for variant in response_object.variants:
+                yield variant
+
+    def _run_search_variant_annotations_page_request(
+            self, protocol_request, annotation_filters):
+        """
+        Runs a complete transaction with the server to obtain a single
+        page of variant annotations for the specified
+        SearchVariantAnnotationsRequest, restricted on the server to the
+        annotations matching the specified dictionary of gene, featureId
+        and impact values.
+        """
+        raise NotImplemented()
+
+    def _run_search_variant_annotations_request(
+            self, protocol_request, annotation_filters):
+        """
+        Runs the specified SearchVariantAnnotationsRequest using the
+        specified annotation filters, and yields each of the variant
+        annotations returned.
+        """
+        run_page_request = functools.partial(
+            self._run_search_variant_annotations_page_request,
+            annotation_filters=annotation_filters)
+        for response_object in self._run_paged_request(
+                run_page_request, protocol_request):
+            for variant_annotation in response_object.variant_annotations:
+                yield variant_annotation
+
+    def _run_search_reads_batch_page_request(self, protocol_request):
+        """
+        Runs a complete transaction with the server to obtain a single
+        page of reads for the specified SearchReadsRequest as a
+        :class:`ga4gh.datamodel.reads.ReadAlignmentBatch`.
+        """
+        raise NotImplemented()
+
+    def _run_search_genotype_matrix_page_request(
+            self, protocol_request, phasing, genotype_likelihoods,
+            variant_filter):
+        """
+        Runs a complete transaction with the server to obtain a single
+        page of genotypes for the specified SearchVariantsRequest as a
+        :class:`ga4gh.datamodel.variants.GenotypeMatrix`.
+        """
+        raise NotImplemented()
 
     def _run_list_reference_bases_page_request(self, id_, protocol_request):
         """
@@ -80,17 +383,11 @@ class AbstractClient(object):
         request = protocol.ListReferenceBasesRequest()
         request.start = pb.int(start)
         request.end = pb.int(end)
-        not_done = True
-        # TODO We should probably use a StringIO here to make string buffering
-        # a bit more efficient.
-        bases_list = []
-        while not_done:
-            response = self._run_list_reference_bases_page_request(
-                id_, request)
-            bases_list.append(response.sequence)
-            not_done = bool(response.next_page_token)
-            request.page_token = response.next_page_token
-        return "".join(bases_list)
+        run_page_request = functools.partial(
+            self._run_list_reference_bases_page_request, id_)
+        return "".join(
+            response.sequence for response in self._run_paged_request(
+                run_page_request, request))
 
     def _run_get_request(self, object_name, protocol_response_class, id_):
         """
@@ -308,7 +605,7 @@ class AbstractClient(object):
 
     def search_variants(
             self, variant_set_id, start=None, end=None, reference_name=None,
-            call_set_ids=None):
+            call_set_ids=None, variant_filter=None):
         """
         Returns an iterator over the Variants fulfilling the specified
         conditions from the specified VariantSet.
@@ -328,6 +625,11 @@ class AbstractClient(object):
         :param list call_set_ids: Only return variant calls which belong to
             call sets with these IDs. If an empty array, returns variants
             without any call objects. If null, returns all variant calls.
+        :param str variant_filter: If not None, only return the variants
+            satisfying this filter expression, which is evaluated on the
+            server; for example, ``FILTER == PASS && QUAL >= 30``. See
+            :func:`ga4gh.datamodel.variants.compileVariantFilter` for the
+            syntax.
 
         :return: An iterator over the :class:`ga4gh.protocol.Variant` objects
             defined by the query parameters.
@@ -340,12 +642,75 @@ class AbstractClient(object):
         request.variant_set_id = variant_set_id
         request.call_set_ids.extend(pb.string(call_set_ids))
         request.page_size = pb.int(self._page_size)
+        if self._parallelism > 1 and end is not None:
+            if variant_filter is not None:
+                run_page_request = functools.partial(
+                    self._run_search_variants_page_request,
+                    variant_filter=variant_filter)
+            else:
+                run_page_request = functools.partial(
+                    self._run_search_page_request, object_name="variants",
+                    protocol_response_class=protocol.SearchVariantsResponse)
+            return self._run_sharded_search_request(
+                run_page_request, request, "variants",
+                operator.attrgetter("start"))
+        if variant_filter is not None:
+            return self._run_search_variants_request(request, variant_filter)
         return self._run_search_request(
             request, "variants", protocol.SearchVariantsResponse)
 
+    def search_genotype_matrices(
+            self, variant_set_id, start=None, end=None, reference_name=None,
+            call_set_ids=None, phasing=False, genotype_likelihoods=False,
+            variant_filter=None):
+        """
+        Returns an iterator over the pages of genotypes for the Variants
+        fulfilling the specified conditions, in the compact format provided
+        by :class:`ga4gh.datamodel.variants.GenotypeMatrix`. This is
+        considerably more efficient than :meth:`search_variants` for
+        queries over many call sets.
+
+        :param str variant_set_id: The ID of the
+            :class:`ga4gh.protocol.VariantSet` of interest.
+        :param int start: The start position (0-based) of this query.
+        :param int end: The end position (0-based, exclusive) of this query.
+        :param str reference_name: The name of the
+            :class:`ga4gh.protocol.Reference` we wish to return variants from.
+        :param list call_set_ids: The IDs of the
+            :class:`ga4gh.protocol.CallSet` to include, in the order of the
+            matrix columns. If this is not specified, all call sets in the
+            variant set are included.
+        :param bool phasing: If True, include the phasing of each call.
+        :param bool genotype_likelihoods: If True, include the genotype
+            likelihoods of each call.
+        :param str variant_filter: If not None, only include the variants
+            satisfying this filter expression, as for
+            :meth:`search_variants`.
+        :return: An iterator over the
+            :class:`ga4gh.datamodel.variants.GenotypeMatrix` objects
+            defined by the query parameters.
+        :rtype: iter
+        """
+        request = protocol.SearchVariantsRequest()
+        request.reference_name = pb.string(reference_name)
+        request.start = pb.int(start)
+        request.end = pb.int(end)
+        request.variant_set_id = variant_set_id
+        if call_set_ids is not None:
+            request.call_set_ids.extend(call_set_ids)
+        request.page_size = pb.int(self._page_size)
+        run_page_request = functools.partial(
+            self._run_search_genotype_matrix_page_request,
+            phasing=phasing, genotype_likelihoods=genotype_likelihoods,
+            variant_filter=variant_filter)
+        return self._run_paged_request(
+            run_page_request, request,
+            operator.attrgetter("nextPageToken"))
+
     def search_variant_annotations(
             self, variant_annotation_set_id, reference_name="",
-            reference_id="", start=0, end=0, effects=[]):
+            reference_id="", start=0, end=0, effects=[], gene=None,
+            feature_id=None, impact=None):
         """
         Returns an iterator over the Variant Annotations fulfilling
         the specified conditions from the specified VariantSet.
@@ -362,6 +727,15 @@ class AbstractClient(object):
             for which overlapping variants should be returned.
         :param str reference_name: The name of the
             :class:`ga4gh.protocol.Reference` we wish to return variants from.
+        :param str gene: If not None, only return the annotations of
+            variants with a transcript annotation on the gene with this
+            symbol.
+        :param str feature_id: If not None, only return the annotations of
+            variants with a transcript annotation on this feature.
+        :param str impact: If not None, only return the annotations of
+            variants with a transcript annotation of this impact, such as
+            ``HIGH``. A transcript annotation must match all of gene,
+            feature_id and impact.
 
         :return: An iterator over the
             :class:`ga4gh.protocol.VariantAnnotation` objects
@@ -381,6 +755,15 @@ class AbstractClient(object):
                 raise exceptions.BadRequestException(
                     "Each ontology term should have an id set")
         request.page_size = pb.int(self._page_size)
+        annotation_filters = {}
+        for name, value in [
+                ("gene", gene), ("featureId", feature_id),
+                ("impact", impact)]:
+            if value is not None:
+                annotation_filters[name] = value
+        if len(annotation_filters) != 0:
+            return self._run_search_variant_annotations_request(
+                request, annotation_filters)
         return self._run_search_request(
             request, "variantannotations",
             protocol.SearchVariantAnnotationsResponse)
@@ -641,9 +1024,51 @@ class AbstractClient(object):
         request.start = pb.int(start)
         request.end = pb.int(end)
         request.page_size = pb.int(self._page_size)
+        if self._parallelism > 1 and reference_id is not None \
+                and end is not None:
+            run_page_request = functools.partial(
+                self._run_search_page_request, object_name="reads",
+                protocol_response_class=protocol.SearchReadsResponse)
+            return self._run_sharded_search_request(
+                run_page_request, request, "alignments",
+                reads.getReadAlignmentStart)
         return self._run_search_request(
             request, "reads", protocol.SearchReadsResponse)
 
+    def search_reads_batches(
+            self, read_group_ids, reference_id, start=None, end=None):
+        """
+        Returns an iterator over the pages of Reads fulfilling the
+        specified conditions from the specified read_group_ids, in the
+        columnar format provided by
+        :class:`ga4gh.datamodel.reads.ReadAlignmentBatch`. This is
+        considerably more efficient than :meth:`search_reads` for clients
+        that process large numbers of reads. Unlike :meth:`search_reads`,
+        a reference_id must be specified.
+
+        :param str read_group_ids: The IDs of the
+            :class:`ga4gh.protocol.ReadGroup` of interest.
+        :param str reference_id: The name of the
+            :class:`ga4gh.protocol.Reference` we wish to return reads
+            mapped to.
+        :param int start: The start position (0-based) of this query.
+        :param int end: The end position (0-based, exclusive) of this query.
+            This defaults to the reference's length.
+        :return: An iterator over the
+            :class:`ga4gh.datamodel.reads.ReadAlignmentBatch` objects
+            defined by the query parameters.
+        :rtype: iter
+        """
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.extend(read_group_ids)
+        request.reference_id = pb.string(reference_id)
+        request.start = pb.int(start)
+        request.end = pb.int(end)
+        request.page_size = pb.int(self._page_size)
+        return self._run_paged_request(
+            self._run_search_reads_batch_page_request, request,
+            operator.attrgetter("nextPageToken"))
+
     def search_phenotype_association_sets(self, dataset_id):
         """
         Returns an iterator over the PhenotypeAssociationSets on the server.
@@ -758,15 +1183,31 @@ class HttpClient(AbstractClient):
         the :mod:`logging` module. This is :data:`logging.WARNING` by default.
     :param str authentication_key: The authentication key provided by the
         server after logging in.
+    :param int prefetch_pages: If greater than zero, the pages of search
+        results are requested on a background thread, up to this many
+        pages ahead of the page being consumed, so that the server and
+        the caller can work concurrently.
+    :param int parallelism: If greater than one, searches for reads and
+        variants over a region split the region into shards, and request
+        the pages for up to this many shards concurrently over a shared
+        pool of connections. The results are returned in the same order
+        as they would be otherwise.
     """
 
     def __init__(
             self, url_prefix, logLevel=logging.WARNING,
-            authentication_key=None):
+            authentication_key=None, prefetch_pages=0, parallelism=1):
         super(HttpClient, self).__init__(logLevel)
         self._url_prefix = url_prefix
+        self._prefetch_pages = prefetch_pages
+        self._parallelism = parallelism
         self._authentication_key = authentication_key
         self._session = requests.Session()
+        if parallelism > 1:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=parallelism)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
         self._setup_http_session()
         requests_log = logging.getLogger("requests.packages.urllib3")
         requests_log.setLevel(logLevel)
@@ -807,9 +1248,63 @@ class HttpClient(AbstractClient):
         response = self._session.post(
             url, params=self._get_http_parameters(), data=data)
         self._check_response_status(response)
-        return self._deserialize_response(
+        return self._deserialize_page_response(
             response.text, protocol_response_class)
 
+    def _run_search_variants_page_request(
+            self, protocol_request, variant_filter):
+        url = posixpath.join(self._url_prefix, 'variants/search')
+        data = protocol.toJson(protocol_request)
+        self._logger.debug("request:{}".format(data))
+        params = self._get_http_parameters()
+        params["filter"] = variant_filter
+        response = self._session.post(url, params=params, data=data)
+        self._check_response_status(response)
+        return self._deserialize_page_response(
+            response.text, protocol.SearchVariantsResponse)
+
+    def _run_search_variant_annotations_page_request(
+            self, protocol_request, annotation_filters):
+        url = posixpath.join(self._url_prefix, 'variantannotations/search')
+        data = protocol.toJson(protocol_request)
+        self._logger.debug("request:{}".format(data))
+        params = self._get_http_parameters()
+        params.update(annotation_filters)
+        response = self._session.post(url, params=params, data=data)
+        self._check_response_status(response)
+        return self._deserialize_page_response(
+            response.text, protocol.SearchVariantAnnotationsResponse)
+
+    def _run_search_reads_batch_page_request(self, protocol_request):
+        url = posixpath.join(self._url_prefix, 'reads/search')
+        data = protocol.toJson(protocol_request)
+        self._logger.debug("request:{}".format(data))
+        response = self._session.post(
+            url, params=self._get_http_parameters(), data=data,
+            headers={"Accept": reads.ReadAlignmentBatch.mimetype})
+        self._check_response_status(response)
+        self._protocol_bytes_received += len(response.content)
+        return reads.ReadAlignmentBatch.fromBytes(response.content)
+
+    def _run_search_genotype_matrix_page_request(
+            self, protocol_request, phasing, genotype_likelihoods,
+            variant_filter):
+        url = posixpath.join(self._url_prefix, 'variants/search')
+        data = protocol.toJson(protocol_request)
+        self._logger.debug("request:{}".format(data))
+        params = self._get_http_parameters()
+        params["phasing"] = "true" if phasing else "false"
+        params["genotypeLikelihoods"] = (
+            "true" if genotype_likelihoods else "false")
+        if variant_filter is not None:
+            params["filter"] = variant_filter
+        response = self._session.post(
+            url, params=params, data=data,
+            headers={"Accept": variants.GenotypeMatrix.mimetype})
+        self._check_response_status(response)
+        self._protocol_bytes_received += len(response.content)
+        return variants.GenotypeMatrix.fromBytes(response.content)
+
     def _run_get_request(self, object_name, protocol_response_class, id_):
         url_suffix = "{object_name}/{id}".format(
             object_name=object_name, id=id_)
@@ -826,7 +1321,7 @@ class HttpClient(AbstractClient):
         params.update(protocol.toJsonDict(request))
         response = self._session.get(url, params=params)
         self._check_response_status(response)
-        return self._deserialize_response(
+        return self._deserialize_page_response(
             response.text, protocol.ListReferenceBasesResponse)
 
 
@@ -853,30 +1348,33 @@ class LocalClient(AbstractClient):
             "rnaquantifications": self._backend.runGetRnaQuantification,
             "expressionlevels": self._backend.runGetExpressionLevel,
         }
-        self._search_method_map = {
-            "callsets": self._backend.runSearchCallSets,
-            "datasets": self._backend.runSearchDatasets,
-            "referencesets": self._backend.runSearchReferenceSets,
-            "references": self._backend.runSearchReferences,
-            "variantsets": self._backend.runSearchVariantSets,
-            "featuresets": self._backend.runSearchFeatureSets,
-            "variants": self._backend.runSearchVariants,
-            "features": self._backend.runSearchFeatures,
-            "readgroupsets": self._backend.runSearchReadGroupSets,
-            "reads": self._backend.runSearchReads,
-            "variantannotations": self._backend.runSearchVariantAnnotations,
+        # Search requests are passed to the backend as protocol objects,
+        # and the responses returned in the same way, so that no JSON
+        # serialisation is needed.
+        self._search_generator_map = {
+            "callsets": self._backend.callSetsGenerator,
+            "datasets": self._backend.datasetsGenerator,
+            "referencesets": self._backend.referenceSetsGenerator,
+            "references": self._backend.referencesGenerator,
+            "variantsets": self._backend.variantSetsGenerator,
+            "featuresets": self._backend.featureSetsGenerator,
+            "variants": self._backend.variantsGenerator,
+            "features": self._backend.featuresGenerator,
+            "readgroupsets": self._backend.readGroupSetsGenerator,
+            "reads": self._backend.readsGenerator,
+            "variantannotations": self._backend.variantAnnotationsGenerator,
             "variantannotationsets":
-                self._backend.runSearchVariantAnnotationSets,
-            "biosamples": self._backend.runSearchBioSamples,
-            "individuals": self._backend.runSearchIndividuals,
-            "genotypephenotype": self._backend.runSearchGenotypePhenotypes,
-            "phenotype": self._backend.runSearchPhenotypes,
+                self._backend.variantAnnotationSetsGenerator,
+            "biosamples": self._backend.bioSamplesGenerator,
+            "individuals": self._backend.individualsGenerator,
+            "genotypephenotype": self._backend.genotypesPhenotypesGenerator,
+            "phenotype": self._backend.phenotypesGenerator,
             "phenotype_association_sets":
-                self._backend.runSearchPhenotypeAssociationSets,
+                self._backend.phenotypeAssociationSetsGenerator,
             "rnaquantificationsets":
-                self._backend.runSearchRnaQuantificationSets,
-            "rnaquantifications": self._backend.runSearchRnaQuantifications,
-            "expressionlevels": self._backend.runSearchExpressionLevels,
+                self._backend.rnaQuantificationSetsGenerator,
+            "rnaquantifications": self._backend.rnaQuantificationsGenerator,
+            "expressionlevels": self._backend.expressionLevelsGenerator,
         }
 
     def _run_get_request(self, object_name, protocol_response_class, id_):
@@ -887,22 +1385,32 @@ class LocalClient(AbstractClient):
 
     def _run_search_page_request(
             self, protocol_request, object_name, protocol_response_class):
-        search_method = self._search_method_map[object_name]
-        response_json = search_method(protocol.toJson(protocol_request))
-        return self._deserialize_response(
-            response_json, protocol_response_class)
+        return self._backend.searchRequest(
+            protocol_request, protocol_response_class,
+            self._search_generator_map[object_name])
+
+    def _run_search_variants_page_request(
+            self, protocol_request, variant_filter):
+        return self._backend.searchVariants(protocol_request, variant_filter)
+
+    def _run_search_variant_annotations_page_request(
+            self, protocol_request, annotation_filters):
+        return self._backend.searchVariantAnnotations(
+            protocol_request,
+            geneName=annotation_filters.get("gene"),
+            featureId=annotation_filters.get("featureId"),
+            impact=annotation_filters.get("impact"))
+
+    def _run_search_reads_batch_page_request(self, protocol_request):
+        # The batch is built directly by the backend, so there is no
+        # need to serialise it.
+        return self._backend.searchReadsBatch(protocol_request)
+
+    def _run_search_genotype_matrix_page_request(
+            self, protocol_request, phasing, genotype_likelihoods,
+            variant_filter):
+        return self._backend.searchGenotypeMatrix(
+            protocol_request, phasing, genotype_likelihoods, variant_filter)
 
     def _run_list_reference_bases_page_request(self, id_, request):
-        request_args = protocol.toJsonDict(request)
-        # We need to remove end from this dict if it's not specified because
-        # of the way we're interacting with Flask and HTTP GET params.
-        # TODO: This is a really nasty way of doing things; we really
-        # should just have a request object and pass that around instead of an
-        # arguments dictionary.
-        if request.end is 0:
-            del request_args["end"]
-        if request.page_token == '':
-            del request_args["pageToken"]
-        response_json = self._backend.runListReferenceBases(id_, request_args)
-        return self._deserialize_response(
-            response_json, protocol.ListReferenceBasesResponse)
+        return self._backend.listReferenceBases(id_, request)
@@ -7,6 +7,15 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import collections
+import itertools
+import math
+import numbers
+import Queue
+import struct
+import sys
+import tempfile
+import threading
+import zlib
 
 import pysam
 
@@ -43,7 +52,8 @@ class SamConverter(object):
     """
     def __init__(
             self, client, readGroupId=None, referenceId=None,
-            start=None, end=None, outputFileName=None, binaryOutput=False):
+            start=None, end=None, outputFileName=None, binaryOutput=False,
+            numThreads=1, batchSize=1000):
         self._client = client
         self._readGroup = self._client.get_read_group(readGroupId)
         self._reference = self._client.get_reference(referenceId)
@@ -51,27 +61,64 @@ class SamConverter(object):
         self._end = end
         self._outputFileName = outputFileName
         self._binaryOutput = binaryOutput
+        self._numThreads = numThreads
+        self._batchSize = batchSize
+        self._numReads = 0
+
+    def getNumReads(self):
+        """
+        Returns the number of reads written by the last call to convert.
+        """
+        return self._numReads
 
     def convert(self):
         header = self._getHeader()
         targetIds = self._getTargetIds(header)
+        iterator = self._client.search_reads(
+            [self._readGroup.id], self._reference.id, self._start, self._end)
+        self._numReads = 0
+        if self._binaryOutput:
+            self._convertToBam(header, targetIds, iterator)
+            return
         # pysam can't write to file streams (except for stdout)
         # http://pysam.readthedocs.org/en/latest/usage.html#using-streams
-        if self._binaryOutput:
-            flags = "wb"
-        else:
-            flags = "wh"  # h for header
+        flags = "wh"  # h for header
         fileString = "-"
         if self._outputFileName is not None:
             fileString = self._outputFileName
         alignmentFile = pysam.AlignmentFile(fileString, flags, header=header)
-        iterator = self._client.search_reads(
-            [self._readGroup.id], self._reference.id, self._start, self._end)
         for read in iterator:
             alignedSegment = SamLine.toAlignedSegment(read, targetIds)
             alignmentFile.write(alignedSegment)
+            self._numReads += 1
         alignmentFile.close()
 
+    def _convertToBam(self, header, targetIds, iterator):
+        """
+        Writes the reads from the specified iterator in BAM format. The
+        reads are encoded directly as BAM records in batches of
+        batchSize reads, and the BGZF blocks compressed on numThreads
+        threads while the next batch is fetched and encoded.
+        """
+        if self._outputFileName is None:
+            fileObject = sys.stdout
+        else:
+            fileObject = open(self._outputFileName, "wb")
+        try:
+            writer = BgzfWriter(fileObject, self._numThreads)
+            writer.write(SamLine.toBamHeader(header))
+            while True:
+                batch = list(itertools.islice(iterator, self._batchSize))
+                if len(batch) == 0:
+                    break
+                writer.write(b"".join([
+                    SamLine.toBamRecord(read, targetIds) for read in batch]))
+                self._numReads += len(batch)
+            writer.close()
+        finally:
+            if fileObject is not sys.stdout:
+                fileObject.close()
+
     def _getHeader(self):
         # Create header information using self._reference
         header = {
@@ -113,6 +160,24 @@ class SamLine(object):
         "SA", "U2", ])
     _tagIntegerArrayFields = set(["FZ", ])
 
+    # The CIGAR operations that consume reference bases: M, D, N, = and X.
+    _bamReferenceCigarOperations = set([0, 2, 3, 7, 8])
+    # The BAM tag types for integers, with the corresponding struct
+    # format and range, in order of preference.
+    _bamIntegerTypes = [
+        (b"C", "B", 0, 2**8 - 1),
+        (b"c", "b", -2**7, 2**7 - 1),
+        (b"S", "H", 0, 2**16 - 1),
+        (b"s", "h", -2**15, 2**15 - 1),
+        (b"I", "I", 0, 2**32 - 1),
+        (b"i", "i", -2**31, 2**31 - 1),
+    ]
+    # Maps each pair of bases to the byte encoding them in a BAM record.
+    _bamSequencePairs = dict(
+        (first + second, chr(j << 4 | k))
+        for j, first in enumerate(b"=ACMGRSVTWYHKDBN")
+        for k, second in enumerate(b"=ACMGRSVTWYHKDBN"))
+
     def __init__(self):
         raise SamException("SamLine can't be instantiated")
 
@@ -157,6 +222,104 @@ class SamLine(object):
         ret.tags = cls.toTags(read)
         return ret
 
+    @classmethod
+    def toBamHeader(cls, header):
+        """
+        Returns the BAM encoding of the specified header dictionary, in
+        the form used by pysam, which must contain only HD and SQ lines.
+        """
+        text = "@HD\tVN:{}\n".format(header['HD']['VN'])
+        for headerLine in header.get('SQ', []):
+            text += "@SQ\tSN:{}\tLN:{}\n".format(
+                headerLine['SN'], headerLine['LN'])
+        text = text.encode(cls._encoding)
+        chunks = [b"BAM\x01", struct.pack("<i", len(text)), text]
+        chunks.append(struct.pack("<i", len(header.get('SQ', []))))
+        for headerLine in header.get('SQ', []):
+            name = headerLine['SN'].encode(cls._encoding) + b"\x00"
+            chunks.append(struct.pack("<i", len(name)))
+            chunks.append(name)
+            chunks.append(struct.pack("<i", headerLine['LN']))
+        return b"".join(chunks)
+
+    @classmethod
+    def toBamRecord(cls, read, targetIds):
+        """
+        Returns the BAM encoding of the specified read, which is the same
+        as that written by pysam for the result of toAlignedSegment.
+        """
+        readName = read.fragment_name.encode(cls._encoding) + b"\x00"
+        sequence = read.aligned_sequence.encode(cls._encoding)
+        position = int(read.alignment.position.position)
+        cigar = cls.toCigar(read)
+        referenceLength = sum(
+            length for operation, length in cigar
+            if operation in cls._bamReferenceCigarOperations)
+        qualities = bytes(bytearray(read.aligned_quality))
+        if len(qualities) == 0:
+            qualities = b"\xff" * len(sequence)
+        chunks = [
+            None,
+            struct.pack(
+                "<iiBBHHHiiii",
+                targetIds[read.alignment.position.reference_name],
+                position, len(readName), read.alignment.mapping_quality,
+                _reg2bin(position, position + max(referenceLength, 1)),
+                len(cigar), cls.toSamFlag(read), len(sequence),
+                targetIds[read.next_mate_position.reference_name],
+                int(read.next_mate_position.position),
+                read.fragment_length),
+            readName,
+            struct.pack(
+                "<{}I".format(len(cigar)),
+                *[length << 4 | operation for operation, length in cigar]),
+            cls._encodeBamSequence(sequence),
+            qualities]
+        for tag, value in cls.toTags(read):
+            chunks.append(cls._encodeBamTag(tag, value))
+        blockSize = sum(len(chunk) for chunk in chunks[1:])
+        chunks[0] = struct.pack("<i", blockSize)
+        return b"".join(chunks)
+
+    @classmethod
+    def _encodeBamSequence(cls, sequence):
+        sequence = sequence.upper()
+        if len(sequence) % 2 == 1:
+            # The last base is padded with the code for '=', which is 0.
+            sequence += b"="
+        pairs = cls._bamSequencePairs
+        try:
+            return b"".join([
+                pairs[sequence[j:j + 2]]
+                for j in range(0, len(sequence), 2)])
+        except KeyError:
+            raise SamException(
+                "unrecognized base in sequence '{}'".format(sequence))
+
+    @classmethod
+    def _getBamIntegerType(cls, minValue, maxValue):
+        for bamType, structType, lower, upper in cls._bamIntegerTypes:
+            if lower <= minValue and maxValue <= upper:
+                return bamType, structType
+        raise SamException(
+            "integer tag value out of range: {}".format(maxValue))
+
+    @classmethod
+    def _encodeBamTag(cls, tag, value):
+        if isinstance(value, numbers.Integral):
+            bamType, structType = cls._getBamIntegerType(value, value)
+            return tag + bamType + struct.pack("<" + structType, value)
+        elif isinstance(value, list):
+            bamType, structType = cls._getBamIntegerType(
+                min(value or [0]), max(value or [0]))
+            return tag + b"B" + bamType + struct.pack(
+                "<i{}{}".format(len(value), structType), len(value), *value)
+        elif len(value) == 1:
+            # pysam writes single characters as printable characters.
+            return tag + b"A" + value
+        else:
+            return tag + b"Z" + value + b"\x00"
+
     @classmethod
     def toSamFlag(cls, read):
         # based on algorithm here:
@@ -248,6 +411,156 @@ class SamLine(object):
         return retval
 
 
+def _reg2bin(start, end):
+    """
+    Returns the BAM index bin of the specified 0-based, half-open
+    interval, as computed in the SAM specification.
+    """
+    end -= 1
+    for shift, offset in [
+            (14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)]:
+        if start >> shift == end >> shift:
+            return offset + (start >> shift)
+    return 0
+
+
+##############################################################################
+# BGZF
+##############################################################################
+
+
+def _compressBgzfBlock(data, compressionLevel):
+    """
+    Returns the BGZF block containing the specified data, which must be
+    no longer than BgzfWriter.blockDataSize bytes.
+    """
+    compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, -15)
+    compressedData = compressor.compress(data) + compressor.flush()
+    if len(compressedData) + 26 > 2**16:
+        # The data cannot be compressed; store it as it is instead.
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        compressedData = compressor.compress(data) + compressor.flush()
+    return b"".join([
+        BgzfWriter.blockHeader,
+        struct.pack("<H", len(compressedData) + 25),
+        compressedData,
+        struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))])
+
+
+class _BgzfBlock(object):
+    """
+    A block of data written to a BgzfWriter, which is compressed on one
+    of its threads.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.compressedData = None
+        self.exception = None
+        self.done = threading.Event()
+
+    def compress(self, compressionLevel):
+        try:
+            self.compressedData = _compressBgzfBlock(
+                self.data, compressionLevel)
+        except Exception as exception:
+            self.exception = exception
+        self.data = None
+        self.done.set()
+
+
+class BgzfWriter(object):
+    """
+    Writes data to the specified file object in the blocked gzip format
+    used by BAM files. The blocks are compressed on a pool of numThreads
+    threads, which run in parallel as zlib releases the GIL while
+    compressing, and written in order. Memory use is bounded, as at most
+    maxPendingBlocks blocks are waiting to be compressed or written at
+    any time; by default, this is four per thread.
+    """
+    # As in htslib, so that compressed blocks are within the 64KiB limit.
+    blockDataSize = 0xff00
+    blockHeader = (
+        b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00")
+    endOfFileBlock = (
+        b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+        b"\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+
+    def __init__(
+            self, fileObject, numThreads=1, compressionLevel=6,
+            maxPendingBlocks=None):
+        self._file = fileObject
+        self._compressionLevel = compressionLevel
+        if maxPendingBlocks is None:
+            maxPendingBlocks = 4 * numThreads
+        self._maxPendingBlocks = max(maxPendingBlocks, 1)
+        self._buffer = []
+        self._bufferSize = 0
+        self._pendingBlocks = collections.deque()
+        self._blockQueue = Queue.Queue()
+        self._threads = []
+        for _ in range(max(numThreads, 1)):
+            thread = threading.Thread(target=self._compressBlocks)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _compressBlocks(self):
+        while True:
+            block = self._blockQueue.get()
+            if block is None:
+                break
+            block.compress(self._compressionLevel)
+
+    def _addBlock(self, data):
+        if len(self._pendingBlocks) >= self._maxPendingBlocks:
+            self._writeBlock()
+        block = _BgzfBlock(data)
+        self._pendingBlocks.append(block)
+        self._blockQueue.put(block)
+
+    def _writeBlock(self):
+        block = self._pendingBlocks.popleft()
+        block.done.wait()
+        if block.exception is not None:
+            raise block.exception
+        self._file.write(block.compressedData)
+
+    def write(self, data):
+        """
+        Writes the specified bytes.
+        """
+        self._buffer.append(data)
+        self._bufferSize += len(data)
+        if self._bufferSize >= self.blockDataSize:
+            data = b"".join(self._buffer)
+            numBlocks = len(data) // self.blockDataSize
+            for j in range(numBlocks):
+                self._addBlock(data[
+                    j * self.blockDataSize:(j + 1) * self.blockDataSize])
+            data = data[numBlocks * self.blockDataSize:]
+            self._buffer = [data]
+            self._bufferSize = len(data)
+
+    def close(self):
+        """
+        Writes the remaining data and the end-of-file marker block, and
+        stops the compression threads. The file object is not closed.
+        """
+        try:
+            if self._bufferSize > 0:
+                self._addBlock(b"".join(self._buffer))
+            self._buffer = []
+            self._bufferSize = 0
+            while len(self._pendingBlocks) > 0:
+                self._writeBlock()
+            self._file.write(self.endOfFileBlock)
+        finally:
+            for _ in self._threads:
+                self._blockQueue.put(None)
+            for thread in self._threads:
+                thread.join()
+
+
 ##############################################################################
 # VCF
 ##############################################################################
@@ -259,32 +572,246 @@ class VcfException(Exception):
 
 class VcfConverter(AbstractConverter):
     """
-    Converts the Variants represented by a SearchVariantsRequest into
-    VCF format using pysam.
+    Converts the Variants from the specified iterator into VCF or BCF
+    format. The header is built from the metadata of the VariantSet, the
+    specified CallSets, one sample for each, and the specified References,
+    one contig for each. Variants are formatted as VCF lines and written
+    in batches as they are received from the iterator, so that memory use
+    does not depend on the size of the region. If compressedOutput is
+    True, VCF output is bgzipped and, when written to a file, indexed
+    with tabix. BCF output is transcoded by pysam from a temporary
+    bgzipped VCF file, as pysam 0.9 cannot build new records.
     """
-    def _writeHeader(self):
-        variantSet = self._container
-        # TODO convert this into pysam types and write to the output file.
-        # For now, just print out some stuff to demonstrate how to get the
-        # attributes we have.
-        print("ID = ", variantSet.id)
-        print("Dataset ID = ", variantSet.datasetId)
-        print("Metadata = ")
-        for metadata in variantSet.metadata:
-            print("\t", metadata)
-
-    def _writeBody(self):
-        for variant in self._objectIterator:
-            # TODO convert each variant object into pysam objects and write to
-            # the output file. For now, just print the first variant and break.
-            print(variant)
-            break
+    _encoding = 'utf8'
+    _missingValues = set(["None", "."])
+
+    def __init__(
+            self, container, objectIterator, outputFile, binaryOutput,
+            callSets=None, references=None, compressedOutput=False,
+            batchSize=1000):
+        super(VcfConverter, self).__init__(
+            container, objectIterator, outputFile, binaryOutput)
+        self._callSets = list(callSets or [])
+        self._references = list(references or [])
+        self._compressedOutput = compressedOutput
+        self._batchSize = batchSize
+        # Maps the INFO and FORMAT keys declared in the header to their
+        # (Type, Number) pairs, in the order of the header.
+        self._infoTypes = collections.OrderedDict()
+        self._formatTypes = collections.OrderedDict()
+        self._referenceNames = set()
+        self._numVariants = 0
+
+    def getNumVariants(self):
+        """
+        Returns the number of variants written by the last call to
+        convert.
+        """
+        return self._numVariants
+
+    def _getHeader(self):
+        """
+        Returns the VCF header text, and sets the INFO and FORMAT types.
+        """
+        self._infoTypes.clear()
+        self._formatTypes.clear()
+        lines = ["##fileformat=VCFv4.2"]
+        for metadata in self._container.metadata:
+            prefix, _, name = metadata.key.partition(".")
+            if prefix == "INFO":
+                types = self._infoTypes
+            elif prefix == "FORMAT":
+                types = self._formatTypes
+            else:
+                continue
+            type_ = metadata.type or "String"
+            number = metadata.number or "."
+            lines.append(
+                '##{}=<ID={},Number={},Type={},Description="{}">'.format(
+                    prefix, name, number, type_,
+                    metadata.description.replace('"', '\\"')))
+            types[name] = type_, number
+        if "END" not in self._infoTypes:
+            lines.append(
+                '##INFO=<ID=END,Number=1,Type=Integer,'
+                'Description="End position of the variant">')
+        if len(self._callSets) > 0 and "GT" not in self._formatTypes:
+            lines.append(
+                '##FORMAT=<ID=GT,Number=1,Type=String,'
+                'Description="Genotype">')
+        for reference in self._references:
+            if reference.length > 0:
+                lines.append("##contig=<ID={},length={}>".format(
+                    reference.name, reference.length))
+            else:
+                lines.append("##contig=<ID={}>".format(reference.name))
+        columns = [
+            "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]
+        if len(self._callSets) > 0:
+            columns.append("FORMAT")
+            columns.extend(callSet.name for callSet in self._callSets)
+        lines.append("\t".join(columns))
+        return "".join(line + "\n" for line in lines)
+
+    @classmethod
+    def _formatValues(cls, values, number):
+        """
+        Returns the VCF text of the INFO or FORMAT field of the specified
+        Number from the specified list of protocol Values, which hold the
+        strings of the original values, or None if all are missing.
+        """
+        strings = [
+            "." if value.string_value in cls._missingValues
+            else value.string_value for value in values]
+        if all(string == "." for string in strings):
+            return None
+        if number in ("0", "1"):
+            strings = strings[:1]
+        return ",".join(strings)
+
+    def _formatInfo(self, variant):
+        fields = []
+        if "END" not in variant.info and \
+                variant.end != variant.start + len(variant.reference_bases):
+            fields.append("END={}".format(variant.end))
+        for key, values in variant.info.items():
+            if key not in self._infoTypes:
+                continue
+            type_, number = self._infoTypes[key]
+            value = self._formatValues(values.values, number)
+            if value is None:
+                continue
+            if type_ == "Flag":
+                fields.append(key)
+            else:
+                fields.append("{}={}".format(key, value))
+        return ";".join(fields) or "."
+
+    def _formatCall(self, call, keys):
+        """
+        Returns the VCF text of the specified Call for the specified list
+        of FORMAT keys, the first of which is GT.
+        """
+        separator = "|" if call.phaseset else "/"
+        fields = [separator.join(
+            "." if allele == -1 else str(allele)
+            for allele in call.genotype) or "."]
+        for key in keys[1:]:
+            value = None
+            if key == "GL":
+                if len(call.genotype_likelihood) > 0:
+                    value = ",".join(
+                        "." if math.isnan(likelihood)
+                        else "{:g}".format(likelihood)
+                        for likelihood in call.genotype_likelihood)
+            elif key in call.info:
+                value = self._formatValues(
+                    call.info[key].values, self._formatTypes[key][1])
+            fields.append("." if value is None else value)
+        return ":".join(fields)
+
+    def _formatVariant(self, variant):
+        """
+        Returns the VCF line for the specified Variant.
+        """
+        self._referenceNames.add(variant.reference_name)
+        columns = [
+            variant.reference_name, str(variant.start + 1),
+            ";".join(variant.names) or ".", variant.reference_bases,
+            ",".join(variant.alternate_bases) or ".", ".", ".",
+            self._formatInfo(variant)]
+        if len(self._callSets) > 0:
+            calls = dict((call.call_set_id, call) for call in variant.calls)
+            keys = ["GT"]
+            for key in self._formatTypes:
+                if key == "GT":
+                    continue
+                if key == "GL":
+                    present = any(
+                        len(call.genotype_likelihood) > 0
+                        for call in variant.calls)
+                else:
+                    present = any(key in call.info for call in variant.calls)
+                if present:
+                    keys.append(key)
+            columns.append(":".join(keys))
+            for callSet in self._callSets:
+                call = calls.get(callSet.id)
+                if call is None:
+                    columns.append(":".join("." * len(keys)))
+                else:
+                    columns.append(self._formatCall(call, keys))
+        return "\t".join(columns) + "\n"
+
+    def _writeVcf(self, writer):
+        """
+        Writes the header and the variants from the iterator in VCF
+        format to the specified writer.
+        """
+        writer.write(self._getHeader().encode(self._encoding))
+        while True:
+            batch = list(itertools.islice(
+                self._objectIterator, self._batchSize))
+            if len(batch) == 0:
+                break
+            writer.write("".join(
+                self._formatVariant(variant)
+                for variant in batch).encode(self._encoding))
+            self._numVariants += len(batch)
+
+    def _writeBgzippedVcf(self, fileObject):
+        writer = BgzfWriter(fileObject)
+        self._writeVcf(writer)
+        writer.close()
+
+    def _transcodeToBcf(self, vcfFileName):
+        """
+        Writes the records of the specified bgzipped VCF file to the
+        output in BCF format.
+        """
+        vcfFile = pysam.VariantFile(str(vcfFileName))
+        try:
+            header = vcfFile.header.copy()
+            # BCF records refer to contigs by their index in the header,
+            # so every contig with records must be declared there.
+            for referenceName in sorted(self._referenceNames):
+                referenceName = str(referenceName)
+                if referenceName not in header.contigs:
+                    header.contigs.add(referenceName)
+            bcfFile = pysam.VariantFile(
+                str(self._outputFile or "-"), b"wb", header=header)
+            try:
+                for record in vcfFile:
+                    bcfFile.write(record)
+            finally:
+                bcfFile.close()
+        finally:
+            vcfFile.close()
 
     def convert(self):
         """
         Run the conversion process.
         """
-        # TODO allocate the pysam VCF object which can be used for the
-        # conversion process. See the convert method for ga2sam above.
-        self._writeHeader()
-        self._writeBody()
+        self._numVariants = 0
+        self._referenceNames = set()
+        if self._binaryOutput:
+            with tempfile.NamedTemporaryFile(suffix=".vcf.gz") as vcfFile:
+                self._writeBgzippedVcf(vcfFile)
+                vcfFile.flush()
+                self._transcodeToBcf(vcfFile.name)
+            return
+        if self._outputFile is None:
+            fileObject = sys.stdout
+        else:
+            fileObject = open(self._outputFile, "wb")
+        try:
+            if self._compressedOutput:
+                self._writeBgzippedVcf(fileObject)
+            else:
+                self._writeVcf(fileObject)
+        finally:
+            if fileObject is not sys.stdout:
+                fileObject.close()
+        if self._outputFile is not None and self._compressedOutput:
+            pysam.tabix_index(
+                str(self._outputFile), preset="vcf", force=True)
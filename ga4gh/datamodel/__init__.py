@@ -6,11 +6,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import array
 import base64
 import collections
 import glob
 import json
 import os
+import struct
+import sys
 
 import ga4gh.exceptions as exceptions
 
@@ -476,6 +479,115 @@ class ExpressionLevelCompoundId(RnaQuantificationCompoundId):
     fields = RnaQuantificationCompoundId.fields + ['expression_level_id']
 
 
+class ColumnarBatch(object):
+    """
+    The base class of the columnar representations of pages of search
+    results. Rather than holding one protocol object per result, each
+    field is stored in a separate array.array column. Subclasses define
+    the columns and their typecodes in columnTypes, the columns that hold
+    offsets into concatenated variable length data (which are initialised
+    with a single zero entry) in offsetColumns, and the names of the other
+    attributes to store in the serialised header in headerFields.
+    """
+    magic = None
+    version = None
+    mimetype = None
+    columnTypes = []
+    offsetColumns = []
+    headerFields = []
+
+    def __init__(self):
+        self.nextPageToken = None
+        for name, typecode in self.columnTypes:
+            setattr(self, name, array.array(str(typecode)))
+        for name in self.offsetColumns:
+            getattr(self, name).append(0)
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def _postLoad(self):
+        """
+        Called after the header fields and columns of this batch have been
+        restored by fromBytes.
+        """
+        pass
+
+    def getNumBytes(self):
+        """
+        Returns the approximate size of the serialised form of this batch.
+        """
+        return sum(
+            len(column) * column.itemsize for column in (
+                getattr(self, name) for name, _ in self.columnTypes))
+
+    def toBytes(self):
+        """
+        Returns the binary serialisation of this batch. This consists of
+        the magic bytes, the length of the JSON header as a 4 byte little
+        endian integer, the JSON header itself and finally the raw
+        contents of each of the columns in the order listed in the header.
+        """
+        columns = []
+        for name, _ in self.columnTypes:
+            column = getattr(self, name)
+            columns.append(
+                [name, column.typecode, column.itemsize, len(column)])
+        header = {
+            "version": self.version,
+            "byteorder": sys.byteorder,
+            "length": len(self),
+            "nextPageToken": self.nextPageToken,
+            "columns": columns}
+        for name in self.headerFields:
+            header[name] = getattr(self, name)
+        header = json.dumps(header).encode()
+        data = [self.magic, struct.pack(b"<I", len(header)), header]
+        for name, _ in self.columnTypes:
+            data.append(getattr(self, name).tostring())
+        return b"".join(data)
+
+    @classmethod
+    def fromBytes(cls, data):
+        """
+        Returns a new instance of this class from the specified binary
+        serialisation, as produced by toBytes. Raises a ValueError if the
+        data is not a valid serialisation of this class.
+        """
+        magicLength = len(cls.magic)
+        if data[:magicLength] != cls.magic:
+            raise ValueError("Not a serialised {}".format(cls.__name__))
+        offset = magicLength + 4
+        headerLength, = struct.unpack(b"<I", data[magicLength:offset])
+        header = json.loads(data[offset:offset + headerLength])
+        offset += headerLength
+        if header["version"] != cls.version:
+            raise ValueError("Unsupported {} version {}".format(
+                cls.__name__, header["version"]))
+        batch = cls()
+        batch.nextPageToken = header["nextPageToken"]
+        for name in cls.headerFields:
+            setattr(batch, name, header[name])
+        for name, typecode, itemsize, length in header["columns"]:
+            column = array.array(str(typecode))
+            if column.itemsize != itemsize:
+                raise ValueError(
+                    "Unsupported item size {} for column {}".format(
+                        itemsize, name))
+            numBytes = itemsize * length
+            column.fromstring(data[offset:offset + numBytes])
+            offset += numBytes
+            if len(column) != length:
+                raise ValueError("Truncated column {}".format(name))
+            if header["byteorder"] != sys.byteorder:
+                column.byteswap()
+            setattr(batch, name, column)
+        batch._postLoad()
+        if len(batch) != header["length"]:
+            raise ValueError("Inconsistent {} length".format(cls.__name__))
+        return batch
+
+
 class DatamodelObject(object):
     """
     Superclass of all datamodel types. A datamodel object is a concrete
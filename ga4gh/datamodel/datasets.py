@@ -392,7 +392,8 @@ class SimulatedDataset(Dataset):
             numReadGroupSets=1, numReadGroupsPerReadGroupSet=1,
             numAlignments=1, numFeatureSets=1, numPhenotypeAssociationSets=1,
             numPhenotypeAssociations=2, numRnaQuantSets=2,
-            numExpressionLevels=2):
+            numExpressionLevels=2, readCoverage=0, readLength=100,
+            numTranscriptEffects=1):
         super(SimulatedDataset, self).__init__(localId)
         self._description = "Simulated dataset {}".format(localId)
 
@@ -426,7 +427,7 @@ class SimulatedDataset(Dataset):
                 self.addBioSample(bioSample2)
             self.addVariantSet(variantSet)
             variantAnnotationSet = variants.SimulatedVariantAnnotationSet(
-                variantSet, "simVas{}".format(i), seed)
+                variantSet, "simVas{}".format(i), seed, numTranscriptEffects)
             variantSet.addVariantAnnotationSet(variantAnnotationSet)
         # Reads
         for i in range(numReadGroupSets):
@@ -434,7 +435,8 @@ class SimulatedDataset(Dataset):
             seed = randomSeed + i
             readGroupSet = reads.SimulatedReadGroupSet(
                 self, localId, referenceSet, seed,
-                numReadGroupsPerReadGroupSet, numAlignments)
+                numReadGroupsPerReadGroupSet, numAlignments, readCoverage,
+                readLength)
             for rg in readGroupSet.getReadGroups():
                 bioSample = biodata.BioSample(
                     self, rg.getLocalId())
@@ -44,6 +44,9 @@ class Ontology(object):
         self._dataUrl = None
         # There can be duplicate names, so we need to store a list of IDs.
         self._nameIdMap = collections.defaultdict(list)
+        self._idNameMap = {}
+        # The IDs of the terms with an is_a relationship to each term.
+        self._childIdMap = collections.defaultdict(list)
 
     def _readFile(self):
         if not os.path.exists(self._dataUrl):
@@ -56,6 +59,9 @@ class Ontology(object):
                     self._dataUrl, "Duplicate ID {}".format(record.id))
             ids.add(record.id)
             self._nameIdMap[record.name].append(record.id)
+            self._idNameMap[record.id] = record.name
+            for parentId in record._parents:
+                self._childIdMap[parentId].append(record.id)
         self._sourceVersion = reader.format_version
         if len(ids) == 0:
             raise exceptions.OntologyFileFormatException(
@@ -118,6 +124,29 @@ class Ontology(object):
         """
         return self._nameIdMap[termName]
 
+    def getTermName(self, termId):
+        """
+        Returns the name of the ontology term with the specified ID, or
+        None if there is no such term.
+        """
+        return self._idNameMap.get(termId)
+
+    def getDescendantIds(self, termId):
+        """
+        Returns the set of IDs of the specified term and of all the terms
+        descended from it through is_a relationships, so that, for
+        example, the descendants of "coding_sequence_variant" include
+        "protein_altering_variant".
+        """
+        descendantIds = set([termId])
+        stack = [termId]
+        while len(stack) > 0:
+            for childId in self._childIdMap.get(stack.pop(), []):
+                if childId not in descendantIds:
+                    descendantIds.add(childId)
+                    stack.append(childId)
+        return descendantIds
+
     def getGaTermByName(self, name):
         """
         Returns a GA4GH OntologyTerm object by name.
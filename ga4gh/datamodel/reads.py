@@ -6,10 +6,18 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import datetime
+import errno
+import gzip
+import hashlib
+import heapq
+import itertools
 import json
-import os.path
+import os
 import random
+import struct
+import threading
 
 import pysam
 
@@ -39,6 +47,383 @@ def parseMalformedBamHeader(headerDict):
     return ret
 
 
+def getReadGroupTag(read):
+    """
+    Returns the value of the RG tag of the specified pysam read, or None
+    if it is not tagged with a read group.
+    """
+    if read.has_tag(b"RG"):
+        return read.get_tag(b"RG")
+    return None
+
+
+def getReadAlignmentStart(gaAlignment):
+    """
+    Returns the coordinate at which the specified GA ReadAlignment sorts
+    in a coordinate-sorted alignment file.
+    """
+    if gaAlignment.alignment.position.position == 0:
+        # unmapped read with mapped mate; see SAM standard 2.4.1
+        return gaAlignment.next_mate_position.position
+    else:
+        # usual case
+        return gaAlignment.alignment.position.position
+
+
+def getPysamReadStart(read):
+    """
+    Returns the coordinate at which the specified pysam read sorts, using
+    the same rules as getReadAlignmentStart does for the equivalent GA
+    ReadAlignment.
+    """
+    position = read.reference_start
+    if SamFlags.isFlagSet(read.flag, SamFlags.READ_UNMAPPED):
+        position = 0
+    if position == 0:
+        if SamFlags.isFlagSet(read.flag, SamFlags.MATE_UNMAPPED):
+            return 0
+        return read.next_reference_start
+    return position
+
+
+def getPysamReadAlignmentStart(pysamReadAlignment):
+    """
+    Returns the sort coordinate of the specified (read, readGroupId,
+    referenceNames) tuple.
+    """
+    return getPysamReadStart(pysamReadAlignment[0])
+
+
+def mergeReadAlignments(iterators, keyFunction=getReadAlignmentStart):
+    """
+    Returns an iterator over the GA ReadAlignments from the specified
+    coordinate-sorted iterators, merged into a single coordinate-sorted
+    stream. Ties are broken by the position of the source iterator in
+    the input list, so that the merged order is deterministic and can be
+    resumed by the paging machinery. Each input iterator is consumed
+    lazily and exactly once. Objects other than GA ReadAlignments can
+    be merged by providing the corresponding keyFunction.
+    """
+    heap = []
+    for index, iterator in enumerate(iterators):
+        obj = next(iterator, None)
+        if obj is not None:
+            heap.append((keyFunction(obj), index, obj, iterator))
+    heapq.heapify(heap)
+    while len(heap) > 0:
+        _, index, obj, iterator = heap[0]
+        yield obj
+        nextObj = next(iterator, None)
+        if nextObj is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(
+                heap, (keyFunction(nextObj), index, nextObj, iterator))
+
+
+class ReadAlignmentMerger(object):
+    """
+    A coordinate-ordered view over the reads in an arbitrary collection
+    of ReadGroups, which may be drawn from several ReadGroupSets and
+    therefore from several alignment files. The reads in each
+    ReadGroupSet are obtained using a single pass over its file, and the
+    per-file streams are combined using a heap-based k-way merge.
+    """
+    def __init__(self, readGroups):
+        self._readGroupSets = []
+        self._readGroupSetReadGroupsMap = {}
+        for readGroup in readGroups:
+            readGroupSet = readGroup.getParentContainer()
+            id_ = readGroupSet.getId()
+            if id_ not in self._readGroupSetReadGroupsMap:
+                self._readGroupSets.append(readGroupSet)
+                self._readGroupSetReadGroupsMap[id_] = []
+            self._readGroupSetReadGroupsMap[id_].append(readGroup)
+
+    def getReadGroupSets(self):
+        """
+        Returns the list of distinct ReadGroupSets in this merger, in the
+        order in which they were first encountered.
+        """
+        return self._readGroupSets
+
+    def getReadAlignments(self, reference, start=None, end=None):
+        """
+        Returns an iterator over the reads in all of the ReadGroups in
+        this merger, in coordinate order.
+        """
+        iterators = []
+        for readGroupSet in self._readGroupSets:
+            readGroups = self._readGroupSetReadGroupsMap[readGroupSet.getId()]
+            if len(readGroups) == len(readGroupSet.getReadGroupIds()):
+                iterator = readGroupSet.getReadAlignments(
+                    reference, start, end)
+            else:
+                iterator = readGroupSet.getReadAlignmentsForReadGroups(
+                    readGroups, reference, start, end)
+            iterators.append(iterator)
+        if len(iterators) == 1:
+            return iterators[0]
+        return mergeReadAlignments(iterators)
+
+    def getPysamReadAlignments(self, reference, start=None, end=None):
+        """
+        Returns an iterator over the (read, readGroupId, referenceNames)
+        tuples for the unconverted pysam reads in all of the ReadGroups in
+        this merger, in coordinate order.
+        """
+        iterators = []
+        for readGroupSet in self._readGroupSets:
+            readGroups = self._readGroupSetReadGroupsMap[readGroupSet.getId()]
+            if len(readGroups) == len(readGroupSet.getReadGroupIds()):
+                iterator = readGroupSet.getPysamReadAlignments(
+                    reference, start, end)
+            else:
+                iterator = readGroupSet.getPysamReadAlignmentsForReadGroups(
+                    readGroups, reference, start, end)
+            iterators.append(iterator)
+        if len(iterators) == 1:
+            return iterators[0]
+        return mergeReadAlignments(iterators, getPysamReadAlignmentStart)
+
+    def getUnmappedReadAlignments(self, sourceIndex=0, virtualOffset=None):
+        """
+        Returns an iterator over (read, sourceIndex, virtualOffset)
+        tuples for the unmapped reads in all of the ReadGroups in this
+        merger. Unmapped reads have no coordinates, so the ReadGroupSets
+        are visited in turn; sourceIndex is the index of the ReadGroupSet
+        a read was obtained from and virtualOffset is the file offset
+        immediately following it. Iteration may be resumed at any point
+        by passing these values back in.
+        """
+        for index in range(sourceIndex, len(self._readGroupSets)):
+            readGroupSet = self._readGroupSets[index]
+            readGroups = self._readGroupSetReadGroupsMap[readGroupSet.getId()]
+            offset = virtualOffset if index == sourceIndex else None
+            if len(readGroups) == len(readGroupSet.getReadGroupIds()):
+                iterator = readGroupSet.getUnmappedReadAlignments(offset)
+            else:
+                iterator = \
+                    readGroupSet.getUnmappedReadAlignmentsForReadGroups(
+                        readGroups, offset)
+            for gaAlignment, nextVirtualOffset in iterator:
+                yield gaAlignment, index, nextVirtualOffset
+
+
+def getDefaultIndexFile(dataUrl):
+    """
+    Returns the conventional path of the index for the specified BAM or
+    CRAM file.
+    """
+    if dataUrl.endswith(".cram"):
+        return dataUrl + ".crai"
+    return dataUrl + ".bai"
+
+
+def _readCramInteger(cramFile, maxFollowingBytes):
+    """
+    Reads an ITF-8 (maxFollowingBytes=4) or LTF-8 (maxFollowingBytes=8)
+    integer from the specified CRAM file. The number of leading one bits
+    of the first byte gives the number of bytes that follow it.
+    """
+    data = cramFile.read(1)
+    if len(data) == 0:
+        raise EOFError()
+    first = ord(data)
+    numFollowingBytes = 0
+    while numFollowingBytes < maxFollowingBytes and \
+            first & (0x80 >> numFollowingBytes):
+        numFollowingBytes += 1
+    data = cramFile.read(numFollowingBytes)
+    if len(data) != numFollowingBytes:
+        raise EOFError()
+    following = bytearray(data)
+    if numFollowingBytes == 4 and maxFollowingBytes == 4:
+        # The last byte of a five byte ITF-8 integer holds only 4 bits.
+        value = first & 0x0f
+        for byte in following[:3]:
+            value = value << 8 | byte
+        value = value << 4 | following[3] & 0x0f
+    else:
+        value = first & (0xff >> (numFollowingBytes + 1))
+        for byte in following:
+            value = value << 8 | byte
+    return value
+
+
+def readCramContainerHeader(cramFile, majorVersion):
+    """
+    Reads the header of the container at the current position of the
+    specified CRAM file, and returns the (headerSize, length, numRecords)
+    tuple, where length is the size of the container's blocks, which
+    follow the header. Returns None at the end of the file.
+    """
+    start = cramFile.tell()
+    data = cramFile.read(4)
+    if len(data) == 0:
+        return None
+    try:
+        if len(data) != 4:
+            raise EOFError()
+        length = struct.unpack(b"<i", data)[0]
+        for _ in range(3):
+            # Reference ID, start and span.
+            _readCramInteger(cramFile, 4)
+        numRecords = _readCramInteger(cramFile, 4)
+        # Record counter and number of bases.
+        _readCramInteger(cramFile, 8)
+        _readCramInteger(cramFile, 8)
+        # Number of blocks, then the landmarks.
+        _readCramInteger(cramFile, 4)
+        for _ in range(_readCramInteger(cramFile, 4)):
+            _readCramInteger(cramFile, 4)
+        if majorVersion >= 3:
+            # CRC32 of the header.
+            if len(cramFile.read(4)) != 4:
+                raise EOFError()
+    except EOFError:
+        raise exceptions.DataException("Truncated CRAM container header")
+    return cramFile.tell() - start, length, numRecords
+
+
+def readCramIndex(indexFile):
+    """
+    Returns the (headerSize, containerOffsets, unplacedOffset) tuple for
+    the CRAM file with the specified CRAI index, where headerSize is the
+    size of the file definition and header container preceding the first
+    data container, containerOffsets is the set of the offsets of the
+    indexed containers and unplacedOffset is the offset of the first
+    container holding unplaced reads, or None if there are none.
+    """
+    containerOffsets = set()
+    unplacedOffsets = []
+    with gzip.open(indexFile, "rb") as craiFile:
+        for line in craiFile:
+            fields = line.split(b"\t")
+            if len(fields) < 6:
+                continue
+            containerOffset = int(fields[3])
+            containerOffsets.add(containerOffset)
+            if int(fields[0]) == -1:
+                unplacedOffsets.append(containerOffset)
+    headerSize = min(containerOffsets) if containerOffsets else None
+    unplacedOffset = min(unplacedOffsets) if unplacedOffsets else None
+    return headerSize, containerOffsets, unplacedOffset
+
+
+class CramContainerStream(object):
+    """
+    Streams the header of a CRAM file followed by its containers from the
+    specified offset to the end of the file through a pipe, which pysam
+    reads as a CRAM file in its own right. pysam cannot seek within CRAM
+    files, so this allows decoding to start at any container without
+    reading the containers before it. The containers are written on a
+    separate thread, and their (offset, size, numRecords) tuples appended
+    to the queue returned by getContainers before they are written.
+    Writing stops when the reader closes the pipe.
+    """
+    _chunkSize = 2**16
+
+    def __init__(self, dataUrl, headerSize, containerOffset):
+        self._containers = collections.deque()
+        self._exception = None
+        self._readFd, writeFd = os.pipe()
+        self._thread = threading.Thread(
+            target=self._writeContainers,
+            args=(dataUrl, headerSize, containerOffset, writeFd))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def getPath(self):
+        """
+        Returns the path from which the stream is read.
+        """
+        return str("/dev/fd/{}".format(self._readFd))
+
+    def getContainers(self):
+        """
+        Returns the queue of the (offset, size, numRecords) tuples of the
+        containers written to the stream.
+        """
+        return self._containers
+
+    def closeReadEnd(self):
+        """
+        Closes our file descriptor for the read end of the pipe, which is
+        done once the reader has opened the stream by its path.
+        """
+        if self._readFd is not None:
+            os.close(self._readFd)
+            self._readFd = None
+
+    def close(self):
+        """
+        Waits for the writer to finish, which it does as soon as the
+        reader has closed the stream, and raises any error it met.
+        """
+        self.closeReadEnd()
+        self._thread.join()
+        if self._exception is not None:
+            raise exceptions.DataException(str(self._exception))
+
+    def _copy(self, cramFile, streamFile, size):
+        while size > 0:
+            data = cramFile.read(min(size, self._chunkSize))
+            if len(data) == 0:
+                raise exceptions.DataException("Truncated CRAM container")
+            streamFile.write(data)
+            size -= len(data)
+
+    def _writeContainers(self, dataUrl, headerSize, containerOffset, writeFd):
+        streamFile = os.fdopen(writeFd, "wb")
+        try:
+            with open(dataUrl, "rb") as cramFile:
+                majorVersion = ord(cramFile.read(5)[4:] or b"\x00")
+                cramFile.seek(0)
+                self._copy(cramFile, streamFile, headerSize)
+                offset = containerOffset
+                while True:
+                    cramFile.seek(offset)
+                    header = readCramContainerHeader(cramFile, majorVersion)
+                    if header is None:
+                        break
+                    headerLength, length, numRecords = header
+                    size = headerLength + length
+                    self._containers.append((offset, size, numRecords))
+                    cramFile.seek(offset)
+                    self._copy(cramFile, streamFile, size)
+                    offset += size
+            streamFile.close()
+        except IOError as exception:
+            # EPIPE means that the reader has stopped reading.
+            if exception.errno != errno.EPIPE:
+                self._exception = exception
+        except Exception as exception:
+            self._exception = exception
+        finally:
+            try:
+                streamFile.close()
+            except IOError:
+                pass
+
+
+def getCramPosition(containerOffset, recordIndex):
+    """
+    Returns the position within a CRAM file, as used in page tokens, of
+    the record with the specified index in the container at the specified
+    file offset.
+    """
+    return containerOffset << 32 | recordIndex
+
+
+def parseCramPosition(position):
+    """
+    Returns the (containerOffset, recordIndex) pair for the specified
+    position within a CRAM file.
+    """
+    return position >> 32, position & 0xffffffff
+
+
 class SamCigar(object):
     """
     Utility class for working with SAM CIGAR strings
@@ -94,49 +479,418 @@ class SamFlags(object):
         return flagAttr | flag
 
 
+class ReadAlignmentBatch(datamodel.ColumnarBatch):
+    """
+    A columnar representation of a batch of read alignments, intended for
+    analytics clients that process large numbers of reads. Rather than
+    holding one GA4GH ReadAlignment object per read, the batch stores each
+    field in a separate array, with the variable length fields (CIGARs,
+    sequences, qualities and fragment names) concatenated into a single
+    array and indexed by an offsets array containing one more entry than
+    there are reads. Batches are built directly from pysam reads, without
+    constructing intermediate protocol objects.
+
+    Read group IDs and reference names are stored once per batch, and
+    referred to by index from the readGroupIndexes, referenceIndexes and
+    nextReferenceIndexes columns. A reference index of -1 indicates that
+    no reference is defined. Flags and CIGAR operations are stored using
+    the SAM encoding; see SamFlags and SamCigar.
+    """
+    magic = b"GA4GHRAB"
+    version = 1
+    mimetype = "application/vnd.ga4gh.readalignmentbatch"
+    columnTypes = [
+        ("readGroupIndexes", "i"),
+        ("referenceIndexes", "i"),
+        ("positions", "i"),
+        ("nextReferenceIndexes", "i"),
+        ("nextPositions", "i"),
+        ("templateLengths", "i"),
+        ("flags", "H"),
+        ("mappingQualities", "B"),
+        ("cigarOffsets", "I"),
+        ("cigarOperations", "B"),
+        ("cigarLengths", "I"),
+        ("sequenceOffsets", "I"),
+        ("sequences", "B"),
+        ("qualityOffsets", "I"),
+        ("qualities", "B"),
+        ("fragmentNameOffsets", "I"),
+        ("fragmentNames", "B"),
+    ]
+    offsetColumns = [
+        "cigarOffsets", "sequenceOffsets", "qualityOffsets",
+        "fragmentNameOffsets"]
+    headerFields = ["readGroupIds", "referenceNames"]
+
+    def __init__(self):
+        super(ReadAlignmentBatch, self).__init__()
+        self.readGroupIds = []
+        self.referenceNames = []
+        self._readGroupIndexMap = {}
+        self._referenceIndexMap = {}
+
+    def __len__(self):
+        return len(self.flags)
+
+    def _postLoad(self):
+        self._readGroupIndexMap = dict(
+            (readGroupId, index)
+            for index, readGroupId in enumerate(self.readGroupIds))
+        self._referenceIndexMap = dict(
+            (referenceName, index)
+            for index, referenceName in enumerate(self.referenceNames))
+
+    def _getReadGroupIndex(self, readGroupId):
+        index = self._readGroupIndexMap.get(readGroupId)
+        if index is None:
+            index = len(self.readGroupIds)
+            self.readGroupIds.append(readGroupId)
+            self._readGroupIndexMap[readGroupId] = index
+        return index
+
+    def _getReferenceIndex(self, referenceNames, referenceId):
+        if referenceId == -1:
+            return -1
+        referenceName = referenceNames[referenceId]
+        index = self._referenceIndexMap.get(referenceName)
+        if index is None:
+            index = len(self.referenceNames)
+            self.referenceNames.append(referenceName)
+            self._referenceIndexMap[referenceName] = index
+        return index
+
+    def append(self, read, readGroupId, referenceNames):
+        """
+        Appends the specified pysam read to this batch. The referenceNames
+        argument is the list of reference names for the reference IDs in
+        the read's alignment file.
+        """
+        self.readGroupIndexes.append(self._getReadGroupIndex(readGroupId))
+        self.referenceIndexes.append(
+            self._getReferenceIndex(referenceNames, read.reference_id))
+        self.positions.append(read.reference_start)
+        self.nextReferenceIndexes.append(
+            self._getReferenceIndex(referenceNames, read.next_reference_id))
+        self.nextPositions.append(read.next_reference_start)
+        self.templateLengths.append(read.template_length)
+        self.flags.append(read.flag)
+        self.mappingQualities.append(read.mapping_quality)
+        cigar = read.cigartuples
+        if cigar is not None:
+            for operation, length in cigar:
+                self.cigarOperations.append(operation)
+                self.cigarLengths.append(length)
+        self.cigarOffsets.append(len(self.cigarOperations))
+        sequence = read.query_sequence
+        if sequence is not None:
+            self.sequences.fromstring(sequence)
+        self.sequenceOffsets.append(len(self.sequences))
+        qualities = read.query_qualities
+        if qualities is not None:
+            self.qualities.extend(qualities)
+        self.qualityOffsets.append(len(self.qualities))
+        self.fragmentNames.fromstring(read.query_name)
+        self.fragmentNameOffsets.append(len(self.fragmentNames))
+
+    def getReadGroupId(self, index):
+        """
+        Returns the read group ID of the read at the specified index.
+        """
+        return self.readGroupIds[self.readGroupIndexes[index]]
+
+    def getReferenceName(self, index):
+        """
+        Returns the reference name of the read at the specified index, or
+        None if this is not defined.
+        """
+        referenceIndex = self.referenceIndexes[index]
+        if referenceIndex == -1:
+            return None
+        return self.referenceNames[referenceIndex]
+
+    def getCigar(self, index):
+        """
+        Returns the list of (operation, length) tuples for the CIGAR of the
+        read at the specified index.
+        """
+        start = self.cigarOffsets[index]
+        end = self.cigarOffsets[index + 1]
+        return [
+            (self.cigarOperations[i], int(self.cigarLengths[i]))
+            for i in range(start, end)]
+
+    def getSequence(self, index):
+        """
+        Returns the sequence of the read at the specified index.
+        """
+        start = self.sequenceOffsets[index]
+        end = self.sequenceOffsets[index + 1]
+        return self.sequences[start:end].tostring()
+
+    def getQualities(self, index):
+        """
+        Returns the array of base qualities of the read at the specified
+        index.
+        """
+        start = self.qualityOffsets[index]
+        end = self.qualityOffsets[index + 1]
+        return self.qualities[start:end]
+
+    def getFragmentName(self, index):
+        """
+        Returns the fragment name of the read at the specified index.
+        """
+        start = self.fragmentNameOffsets[index]
+        end = self.fragmentNameOffsets[index + 1]
+        return self.fragmentNames[start:end].tostring()
+
+
 class AlignmentDataMixin(datamodel.PysamDatamodelMixin):
     """
     Mixin class that provides methods for getting read alignments
     from bam files
     """
     def _getReadAlignments(
-            self, reference, start, end, readGroupSet, readGroup):
-        """
-        Returns an iterator over the specified reads
-        """
-        # TODO If reference is None, return against all references,
-        # including unmapped reads.
+            self, reference, start, end, readGroupSet, readGroup,
+            readGroupLocalIds=None):
+        """
+        Returns an iterator over the specified reads. If readGroup is None
+        and readGroupLocalIds is not None, only reads tagged with one of
+        the specified read group local IDs are returned; other reads are
+        discarded before conversion.
+        """
+        for read, readGroupId in self._fetchReads(
+                reference, start, end, readGroupSet, readGroup,
+                readGroupLocalIds):
+            yield self.convertReadAlignment(read, readGroupSet, readGroupId)
+
+    def _getPysamReadAlignments(
+            self, reference, start, end, readGroupSet, readGroup,
+            readGroupLocalIds=None):
+        """
+        Returns an iterator over (read, readGroupId, referenceNames)
+        tuples for the specified reads, where read is the unconverted
+        pysam AlignedSegment and referenceNames is the list of reference
+        names for the file's reference IDs. Reads are selected in the same
+        way as for _getReadAlignments.
+        """
+        referenceNames = self.getReferenceNames()
+        for read, readGroupId in self._fetchReads(
+                reference, start, end, readGroupSet, readGroup,
+                readGroupLocalIds):
+            yield read, readGroupId, referenceNames
+
+    def _fetchReads(
+            self, reference, start, end, readGroupSet, readGroup,
+            readGroupLocalIds):
         samFile = self.getFileHandle(self._dataUrl)
         referenceName = reference.getLocalId().encode()
         # TODO deal with errors from htslib
         start, end = self.sanitizeAlignmentFileFetch(start, end)
         readAlignments = samFile.fetch(referenceName, start, end)
+        return self._selectReads(
+            readAlignments, readGroupSet, readGroup, readGroupLocalIds)
+
+    def _getUnmappedReadAlignments(
+            self, virtualOffset, readGroupSet, readGroup,
+            readGroupLocalIds=None):
+        """
+        Returns an iterator over (read, virtualOffset) pairs for the
+        unplaced reads stored at the end of the alignment file, where
+        virtualOffset is the BGZF virtual offset immediately following the
+        read. If the specified virtualOffset is None, iteration begins at
+        the start of the unplaced section, which is located using the
+        index. In either case we seek directly to the offset and read on
+        to the end of the file, so that the cost of a page does not depend
+        on how far into the section it lies.
+
+        For CRAM files, the offset is instead the position of the next
+        read as returned by getCramPosition: the file offset of its
+        container and its index within the container.
+        """
+        samFile = self.getFileHandle(self._dataUrl)
+        if samFile.is_cram:
+            for item in self._getUnmappedCramReadAlignments(
+                    virtualOffset, readGroupSet, readGroup,
+                    readGroupLocalIds):
+                yield item
+            return
+        if virtualOffset is None:
+            virtualOffset = self._getUnplacedVirtualOffset(samFile)
+        try:
+            samFile.seek(virtualOffset)
+        except (IOError, OSError, ValueError):
+            raise exceptions.BadPageTokenException(
+                "Invalid file offset in page token")
+        readAlignments = self._checkUnplaced(
+            samFile.fetch(until_eof=True))
+        for read, readGroupId in self._selectReads(
+                readAlignments, readGroupSet, readGroup, readGroupLocalIds):
+            # The selected reads are consumed one at a time, so the file
+            # is positioned immediately after the current read.
+            nextVirtualOffset = samFile.tell()
+            yield (
+                self.convertReadAlignment(read, readGroupSet, readGroupId),
+                nextVirtualOffset)
+
+    def _getUnplacedVirtualOffset(self, samFile):
+        """
+        Returns the BGZF virtual offset of the start of the unplaced
+        section of the specified BAM file. In a coordinate sorted file
+        this section immediately follows the last placed read, which is
+        the last read on the last reference that has any reads. We find
+        this read through the index by fetching increasingly large
+        windows at the end of each reference in turn, starting from the
+        last one.
+        """
+        references = zip(samFile.references, samFile.lengths)
+        for referenceName, length in reversed(references):
+            windowSize = 2**14
+            start = length
+            while start > 0:
+                start = max(0, length - windowSize)
+                virtualOffset = None
+                for _ in samFile.fetch(referenceName, start, length):
+                    # Reads are consumed one at a time, so the file is
+                    # positioned immediately after the current read.
+                    virtualOffset = samFile.tell()
+                if virtualOffset is not None:
+                    return virtualOffset
+                windowSize *= 16
+        # There are no placed reads, so the unplaced section starts
+        # immediately after the header.
+        samFile.reset()
+        return samFile.tell()
+
+    def _checkUnplaced(self, readAlignments):
         for readAlignment in readAlignments:
-            tags = dict(readAlignment.tags)
-            if readGroup is None:
-                if 'RG' in tags:
-                    alignmentReadGroupLocalId = tags['RG']
-                    readGroupCompoundId = datamodel.ReadGroupCompoundId(
-                        readGroupSet.getCompoundId(),
-                        str(alignmentReadGroupLocalId))
-                yield self.convertReadAlignment(
-                    readAlignment, readGroupSet, str(readGroupCompoundId))
-            else:
-                if self._filterReads:
-                    if 'RG' in tags and tags['RG'] == self._localId:
-                        yield self.convertReadAlignment(
-                            readAlignment, readGroupSet,
-                            str(readGroup.getCompoundId()))
-                else:
-                    yield self.convertReadAlignment(
-                        readAlignment, readGroupSet,
-                        str(readGroup.getCompoundId()))
+            if readAlignment.reference_id != -1:
+                raise exceptions.BadPageTokenException(
+                    "File offset in page token is not in the unmapped "
+                    "section")
+            yield readAlignment
+
+    def _getUnmappedCramReadAlignments(
+            self, position, readGroupSet, readGroup, readGroupLocalIds):
+        """
+        Returns an iterator over (read, position) pairs for the unplaced
+        reads in this CRAM file, where position is that of the following
+        read. Reading starts at the container holding the first unplaced
+        read, as listed in the index, or at the container given by the
+        specified position, so that the cost of a page does not depend on
+        how far into the file it lies.
+        """
+        headerSize, containerOffsets, unplacedOffset = self._getCramIndex()
+        if position is None:
+            if unplacedOffset is None:
+                return
+            containerOffset, recordIndex = unplacedOffset, 0
+        else:
+            containerOffset, recordIndex = parseCramPosition(position)
+            if containerOffset not in containerOffsets:
+                raise exceptions.BadPageTokenException(
+                    "Invalid container offset in page token")
+        stream = CramContainerStream(
+            self._dataUrl, headerSize, containerOffset)
+        try:
+            try:
+                samFile = pysam.AlignmentFile(
+                    stream.getPath(), "rc",
+                    reference_filename=self.getReferenceFilename())
+            finally:
+                stream.closeReadEnd()
+            try:
+                nextPosition = [None]
+                readAlignments = itertools.dropwhile(
+                    lambda readAlignment: readAlignment.reference_id != -1,
+                    self._getPositionedCramReads(
+                        samFile.fetch(until_eof=True),
+                        stream.getContainers(), recordIndex, nextPosition))
+                for read, readGroupId in self._selectReads(
+                        readAlignments, readGroupSet, readGroup,
+                        readGroupLocalIds):
+                    # The reads are consumed one at a time, so this is
+                    # the position following the current read.
+                    yield (
+                        self.convertReadAlignment(
+                            read, readGroupSet, readGroupId),
+                        nextPosition[0])
+            finally:
+                samFile.close()
+        finally:
+            stream.close()
+
+    def _getPositionedCramReads(
+            self, readAlignments, containers, recordIndex, nextPosition):
+        """
+        Returns an iterator over the specified reads decoded from a
+        CramContainerStream, skipping the first recordIndex reads. Before
+        each read is returned, nextPosition[0] is set to the position
+        following it.
+        """
+        index = numRecords = 0
+        for readAlignment in readAlignments:
+            while index == numRecords:
+                containerOffset, size, numRecords = containers.popleft()
+                index = 0
+            index += 1
+            if recordIndex > 0:
+                recordIndex -= 1
+                continue
+            if index == numRecords:
+                # The next read is the first of the next container.
+                containerOffset += size
+                index = numRecords = 0
+            nextPosition[0] = getCramPosition(containerOffset, index)
+            yield readAlignment
+
+    def _getCramIndex(self):
+        """
+        Returns the result of readCramIndex for the index of this CRAM
+        file, which is read once.
+        """
+        if self._cramIndex is None:
+            self._cramIndex = readCramIndex(self._indexFile)
+        return self._cramIndex
+
+    def _selectReads(
+            self, readAlignments, readGroupSet, readGroup, readGroupLocalIds):
+        """
+        Returns an iterator over (read, readGroupId) pairs for the pysam
+        reads in the specified iterator that belong to the requested read
+        groups. The iterator is consumed one read at a time.
+        """
+        if readGroup is not None:
+            readGroupId = str(readGroup.getCompoundId())
+            for readAlignment in readAlignments:
+                if self._filterReads and \
+                        getReadGroupTag(readAlignment) != self._localId:
+                    continue
+                yield readAlignment, readGroupId
+        else:
+            # Building compound IDs is relatively expensive, so we do
+            # this once per read group rather than once per read.
+            readGroupIds = {}
+            for readAlignment in readAlignments:
+                localId = getReadGroupTag(readAlignment)
+                if localId is None:
+                    localId = readGroupSet.defaultReadGroupName
+                if (readGroupLocalIds is not None and
+                        localId not in readGroupLocalIds):
+                    continue
+                readGroupId = readGroupIds.get(localId)
+                if readGroupId is None:
+                    readGroupId = str(datamodel.ReadGroupCompoundId(
+                        readGroupSet.getCompoundId(), str(localId)))
+                    readGroupIds[localId] = readGroupId
+                yield readAlignment, readGroupId
 
     def convertReadAlignment(self, read, readGroupSet, readGroupId):
         """
         Convert a pysam ReadAlignment to a GA4GH ReadAlignment
         """
-        samFile = self.getFileHandle(self._dataUrl)
+        referenceNames = self.getReferenceNames()
         # TODO fill out remaining fields
         # TODO refine in tandem with code in converters module
         ret = protocol.ReadAlignment()
@@ -149,8 +903,8 @@ class AlignmentDataMixin(datamodel.PysamDatamodelMixin):
             ret.alignment.CopyFrom(protocol.LinearAlignment())
             ret.alignment.mapping_quality = read.mapping_quality
             ret.alignment.position.CopyFrom(protocol.Position())
-            ret.alignment.position.reference_name = samFile.getrname(
-                read.reference_id)
+            ret.alignment.position.reference_name = referenceNames[
+                read.reference_id]
             ret.alignment.position.position = read.reference_start
             ret.alignment.position.strand = protocol.POS_STRAND
             if SamFlags.isFlagSet(read.flag, SamFlags.READ_REVERSE_STRAND):
@@ -173,8 +927,8 @@ class AlignmentDataMixin(datamodel.PysamDatamodelMixin):
         else:
             ret.next_mate_position.Clear()
             if read.next_reference_id != -1:
-                ret.next_mate_position.reference_name = samFile.getrname(
-                    read.next_reference_id)
+                ret.next_mate_position.reference_name = referenceNames[
+                    read.next_reference_id]
             else:
                 ret.next_mate_position.reference_name = ""
             ret.next_mate_position.position = read.next_reference_start
@@ -209,8 +963,11 @@ class AlignmentDataMixin(datamodel.PysamDatamodelMixin):
         if not os.path.exists(self._indexFile):
             raise exceptions.FileOpenFailedException(self._indexFile)
         try:
+            # The reference is only used when decoding CRAM, and is
+            # ignored for BAM.
             return pysam.AlignmentFile(
-                self._dataUrl, filepath_index=self._indexFile)
+                self._dataUrl, filepath_index=self._indexFile,
+                reference_filename=self.getReferenceFilename())
         except IOError as exception:
             # IOError thrown when the index file passed in is not actually
             # an index file... may also happen in other cases?
@@ -314,6 +1071,54 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
             self.getCompoundId(), gaAlignment.fragment_name)
         return str(compoundId)
 
+    def getReadAlignmentsForReadGroups(
+            self, readGroups, reference, start=None, end=None):
+        """
+        Returns a coordinate-ordered iterator over the reads in the
+        specified subset of the ReadGroups in this ReadGroupSet.
+        """
+        return mergeReadAlignments([
+            readGroup.getReadAlignments(reference, start, end)
+            for readGroup in readGroups])
+
+    def getPysamReadAlignments(self, reference, start=None, end=None):
+        """
+        Returns an iterator over (read, readGroupId, referenceNames)
+        tuples for the unconverted pysam reads in this ReadGroupSet. This
+        is only supported for ReadGroupSets backed by alignment files.
+        """
+        raise exceptions.NotImplementedException(
+            "Unconverted reads are not available for this ReadGroupSet")
+
+    def getPysamReadAlignmentsForReadGroups(
+            self, readGroups, reference, start=None, end=None):
+        """
+        Returns an iterator over (read, readGroupId, referenceNames)
+        tuples for the unconverted pysam reads in the specified subset of
+        the ReadGroups in this ReadGroupSet. This is only supported for
+        ReadGroupSets backed by alignment files.
+        """
+        raise exceptions.NotImplementedException(
+            "Unconverted reads are not available for this ReadGroupSet")
+
+    def getUnmappedReadAlignments(self, virtualOffset=None):
+        """
+        Returns an iterator over (read, virtualOffset) pairs for the
+        unmapped reads in this ReadGroupSet. By default, a ReadGroupSet
+        contains no unmapped reads.
+        """
+        return iter([])
+
+    def getUnmappedReadAlignmentsForReadGroups(
+            self, readGroups, virtualOffset=None):
+        """
+        Returns an iterator over (read, virtualOffset) pairs for the
+        unmapped reads in the specified subset of the ReadGroups in this
+        ReadGroupSet. By default, a ReadGroupSet contains no unmapped
+        reads.
+        """
+        return iter([])
+
     def getStats(self):
         """
         Returns the GA4GH protocol representation of this read group set's
@@ -327,11 +1132,12 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
 
 class SimulatedReadGroupSet(AbstractReadGroupSet):
     """
-    A simulated read group set
+    A simulated read group set. See SimulatedReadGroup for the reads
+    generated for each of its ReadGroups.
     """
     def __init__(
             self, parentContainer, localId, referenceSet, randomSeed=1,
-            numReadGroups=1, numAlignments=2):
+            numReadGroups=1, numAlignments=2, coverage=0, readLength=100):
         super(SimulatedReadGroupSet, self).__init__(
             parentContainer, localId)
         self._referenceSet = referenceSet
@@ -341,17 +1147,20 @@ class SimulatedReadGroupSet(AbstractReadGroupSet):
         for i in range(numReadGroups):
             localId = "rg{}".format(i)
             readGroup = SimulatedReadGroup(
-                self, localId, randomSeed + i, numAlignments)
+                self, localId, randomSeed + i, numAlignments, coverage,
+                readLength)
             self.addReadGroup(readGroup)
+        if coverage > 0:
+            self._numAlignedReads = sum(
+                readGroup.getNumAlignedReads()
+                for readGroup in self.getReadGroups())
 
     def getPrograms(self):
         return []
 
     def getReadAlignments(self, referenceId=None, start=None, end=None):
-        for readGroup in self.getReadGroups():
-            iterator = readGroup.getReadAlignments(referenceId, start, end)
-            for alignment in iterator:
-                yield alignment
+        return self.getReadAlignmentsForReadGroups(
+            self.getReadGroups(), referenceId, start, end)
 
 
 class HtslibReadGroupSet(AlignmentDataMixin, AbstractReadGroupSet):
@@ -365,6 +1174,14 @@ class HtslibReadGroupSet(AlignmentDataMixin, AbstractReadGroupSet):
         self._programs = []
         self._dataUrl = None
         self._indexFile = None
+        # The names of the references in the file header, indexed by the
+        # reference IDs used in the file.
+        self._referenceNames = None
+        # The result of readCramIndex for CRAM files, read on demand.
+        self._cramIndex = None
+        # Maps the DecodedReferenceStore directory to the reference
+        # filename with which the file is opened, as resolved for it.
+        self._referenceFilenames = {}
         # Used when we populate from a file. Not defined when we populate
         # from the DB.
         self._bamHeaderReferenceSetName = None
@@ -375,6 +1192,57 @@ class HtslibReadGroupSet(AlignmentDataMixin, AbstractReadGroupSet):
         """
         return self._getReadAlignments(reference, start, end, self, None)
 
+    def getReadAlignmentsForReadGroups(
+            self, readGroups, reference, start=None, end=None):
+        """
+        Returns an iterator over the reads in the specified subset of the
+        ReadGroups in this ReadGroupSet, using a single pass over the
+        underlying file.
+        """
+        readGroupLocalIds = set(
+            readGroup.getLocalId() for readGroup in readGroups)
+        return self._getReadAlignments(
+            reference, start, end, self, None, readGroupLocalIds)
+
+    def getPysamReadAlignments(self, reference, start=None, end=None):
+        """
+        Returns an iterator over (read, readGroupId, referenceNames)
+        tuples for the unconverted pysam reads in this ReadGroupSet.
+        """
+        return self._getPysamReadAlignments(
+            reference, start, end, self, None)
+
+    def getPysamReadAlignmentsForReadGroups(
+            self, readGroups, reference, start=None, end=None):
+        """
+        Returns an iterator over (read, readGroupId, referenceNames)
+        tuples for the unconverted pysam reads in the specified subset of
+        the ReadGroups in this ReadGroupSet.
+        """
+        readGroupLocalIds = set(
+            readGroup.getLocalId() for readGroup in readGroups)
+        return self._getPysamReadAlignments(
+            reference, start, end, self, None, readGroupLocalIds)
+
+    def getUnmappedReadAlignments(self, virtualOffset=None):
+        """
+        Returns an iterator over (read, virtualOffset) pairs for the
+        unmapped reads in this ReadGroupSet.
+        """
+        return self._getUnmappedReadAlignments(virtualOffset, self, None)
+
+    def getUnmappedReadAlignmentsForReadGroups(
+            self, readGroups, virtualOffset=None):
+        """
+        Returns an iterator over (read, virtualOffset) pairs for the
+        unmapped reads in the specified subset of the ReadGroups in this
+        ReadGroupSet.
+        """
+        readGroupLocalIds = set(
+            readGroup.getLocalId() for readGroup in readGroups)
+        return self._getUnmappedReadAlignments(
+            virtualOffset, self, None, readGroupLocalIds)
+
     def getBamHeaderReferenceSetName(self):
         """
         Returns the ReferenceSet name using in the BAM header.
@@ -396,6 +1264,11 @@ class HtslibReadGroupSet(AlignmentDataMixin, AbstractReadGroupSet):
         stats = protocol.fromJson(row[b'stats'], protocol.ReadStats)
         self._numAlignedReads = stats.aligned_read_count
         self._numUnalignedReads = stats.unaligned_read_count
+        # Repos created before referenceNames was stored do not have
+        # this column; we fall back to reading the file header on demand.
+        if b'referenceNames' in row.keys() and \
+                row[b'referenceNames'] is not None:
+            self._referenceNames = json.loads(row[b'referenceNames'])
 
     def populateFromFile(self, dataUrl, indexFile=None):
         """
@@ -406,9 +1279,18 @@ class HtslibReadGroupSet(AlignmentDataMixin, AbstractReadGroupSet):
         self._dataUrl = dataUrl
         self._indexFile = indexFile
         if indexFile is None:
-            self._indexFile = dataUrl + ".bai"
-        samFile = self.getFileHandle(self._dataUrl)
+            self._indexFile = getDefaultIndexFile(dataUrl)
+        # We do not use the file handle cache here, as the ReferenceSet
+        # (and hence the FASTA needed to decode CRAM) may not be known yet.
+        samFile = self.openFile(self._dataUrl)
+        try:
+            self._populateFromAlignmentFile(samFile)
+        finally:
+            samFile.close()
+
+    def _populateFromAlignmentFile(self, samFile):
         self._setHeaderFields(samFile)
+        self._referenceNames = list(samFile.references)
         if 'RG' not in samFile.header or len(samFile.header['RG']) == 0:
             readGroup = HtslibReadGroup(self, self.defaultReadGroupName)
             self.addReadGroup(readGroup)
@@ -429,8 +1311,14 @@ class HtslibReadGroupSet(AlignmentDataMixin, AbstractReadGroupSet):
             elif self._bamHeaderReferenceSetName != name:
                 raise exceptions.MultipleReferenceSetsInReadGroupSet(
                     self._dataUrl, name, self._bamFileReferenceName)
-        self._numAlignedReads = samFile.mapped
-        self._numUnalignedReads = samFile.unmapped
+        if samFile.is_cram:
+            # CRAM indexes do not record the number of mapped and
+            # unmapped reads, so these are unknown.
+            self._numAlignedReads = -1
+            self._numUnalignedReads = -1
+        else:
+            self._numAlignedReads = samFile.mapped
+            self._numUnalignedReads = samFile.unmapped
 
     def checkConsistency(self, dataRepository):
         pass
@@ -469,6 +1357,64 @@ class HtslibReadGroupSet(AlignmentDataMixin, AbstractReadGroupSet):
         """
         return self._indexFile
 
+    def getReferenceNames(self):
+        """
+        Returns the list of reference names in the header of the
+        alignment file for this ReadGroupSet, indexed by the reference
+        IDs used within the file.
+        """
+        if self._referenceNames is None:
+            samFile = self.getFileHandle(self._dataUrl)
+            self._referenceNames = list(samFile.references)
+        return self._referenceNames
+
+    def getReferenceFastaPath(self):
+        """
+        Returns the path of the FASTA file for the ReferenceSet that this
+        ReadGroupSet is aligned to, which is required to decode CRAM
+        files. Returns None if this is not available.
+        """
+        if isinstance(self._referenceSet, references.HtslibReferenceSet):
+            return self._referenceSet.getDataUrl()
+        return None
+
+    def setReferenceSet(self, referenceSet):
+        super(HtslibReadGroupSet, self).setReferenceSet(referenceSet)
+        self._referenceFilenames = {}
+
+    def getReferenceFilename(self):
+        """
+        Returns the reference FASTA with which to open the alignment file
+        for this ReadGroupSet. CRAM files are decoded from the process
+        wide DecodedReferenceStore where it can provide every sequence
+        listed in the file's header, in which case None is returned;
+        otherwise they are decoded from the ReferenceSet's FASTA file.
+        This is resolved once for each directory of the store.
+        """
+        fastaPath = self.getReferenceFastaPath()
+        if fastaPath is None or not self._dataUrl.endswith(".cram"):
+            return fastaPath
+        directory = references.decodedReferenceStore.getDirectory()
+        if directory not in self._referenceFilenames:
+            self._referenceFilenames[directory] = \
+                self._resolveCramReferenceFilename(fastaPath)
+        return self._referenceFilenames[directory]
+
+    def _resolveCramReferenceFilename(self, fastaPath):
+        # The header can be read without the reference.
+        samFile = pysam.AlignmentFile(
+            self._dataUrl, filepath_index=self._indexFile)
+        try:
+            md5checksums = [
+                sequence.get('M5')
+                for sequence in samFile.header.get('SQ', [])]
+        finally:
+            samFile.close()
+        if references.decodedReferenceStore.addReferences(
+                self._referenceSet, md5checksums):
+            return None
+        return fastaPath
+
 
 class AbstractReadGroup(datamodel.DatamodelObject):
     """
@@ -628,16 +1574,123 @@ class AbstractReadGroup(datamodel.DatamodelObject):
 
 class SimulatedReadGroup(AbstractReadGroup):
     """
-    A simulated readgroup
+    A simulated readgroup. By default, this holds the same small number
+    of unplaced reads for every reference. If a coverage is specified,
+    single-end reads of readLength bases are instead placed uniformly at
+    random along each reference, to this mean depth. These are generated
+    lazily in bins of binSize bases, each with its own seed, so that the
+    same reads are returned regardless of the query window.
     """
+    binSize = 2**14
 
-    def __init__(self, parentContainer, localId, randomSeed, numAlignments=2):
+    def __init__(
+            self, parentContainer, localId, randomSeed, numAlignments=2,
+            coverage=0, readLength=100):
         super(SimulatedReadGroup, self).__init__(parentContainer, localId)
         self._randomSeed = randomSeed
+        self._coverage = coverage
+        self._readLength = readLength
         self._numAlignedReads = self._parentContainer.getNumAlignedReads()
         self._numUnalignedReads = 0
+        if coverage > 0:
+            referenceSet = self._parentContainer.getReferenceSet()
+            self._numAlignedReads = sum(
+                int(self._getReadRate() * max(
+                    reference.getLength() - readLength + 1, 0))
+                for reference in referenceSet.getReferences())
+
+    def _getReadRate(self):
+        """
+        Returns the mean number of reads starting at each position.
+        """
+        return self._coverage / self._readLength
+
+    def getReadAlignments(self, reference=None, start=None, end=None):
+        if self._coverage > 0:
+            return self._getPlacedReadAlignments(reference, start, end)
+        return self._getUnplacedReadAlignments()
+
+    def _getPlacedReadAlignments(self, reference, start, end):
+        if start is None:
+            start = 0
+        # Reads lie entirely within the reference, and we must return the
+        # reads starting up to readLength - 1 bases before the query.
+        lastReadStart = reference.getLength() - self._readLength
+        if end is None or end > lastReadStart + 1:
+            end = lastReadStart + 1
+        binIndex = max(start - self._readLength + 1, 0) // self.binSize
+        while binIndex * self.binSize < end:
+            for readIndex, position in enumerate(
+                    self._getReadPositions(reference, binIndex)):
+                if position >= end:
+                    break
+                if position + self._readLength > start:
+                    yield self._createPlacedReadAlignment(
+                        reference, binIndex, readIndex, position)
+            binIndex += 1
+
+    def _getBinSeed(self, reference, binIndex):
+        """
+        Returns the seed for the specified bin of the specified reference.
+        The seeds of the reads in the bin follow it consecutively.
+        """
+        key = "{}:{}:{}".format(
+            self._randomSeed, reference.getLocalId(), binIndex)
+        return int(hashlib.md5(key.encode()).hexdigest(), 16)
+
+    def _getReadPositions(self, reference, binIndex):
+        """
+        Returns an iterator over the start positions of the reads in the
+        specified bin of the specified reference, in increasing order.
+        """
+        rng = random.Random(self._getBinSeed(reference, binIndex))
+        # The reads start at the points of a Poisson process, so the
+        # gaps between them are exponentially distributed.
+        readRate = self._getReadRate()
+        binEnd = (binIndex + 1) * self.binSize
+        point = binIndex * self.binSize
+        while True:
+            point += rng.expovariate(readRate)
+            if point >= binEnd:
+                break
+            yield int(point)
+
+    def _createPlacedReadAlignment(
+            self, reference, binIndex, readIndex, position):
+        rng = random.Random(
+            self._getBinSeed(reference, binIndex) + readIndex + 1)
+        randomFloat = rng.random
+        alignment = protocol.ReadAlignment()
+        alignment.fragment_name = "{}$simulated:{}:{}:{}".format(
+            self.getLocalId(), reference.getLocalId(), binIndex, readIndex)
+        alignment.fragment_length = self._readLength
+        alignment.aligned_sequence = reference.getBases(
+            position, position + self._readLength)
+        # TODO: are these reasonable quality values?
+        alignment.aligned_quality.extend([
+            20 + int(randomFloat() * 21) for _ in range(self._readLength)])
+        alignment.alignment.mapping_quality = 60
+        alignment.alignment.position.reference_name = \
+            reference.getLocalId()
+        alignment.alignment.position.position = position
+        alignment.alignment.position.strand = protocol.POS_STRAND
+        if randomFloat() < 0.5:
+            alignment.alignment.position.strand = protocol.NEG_STRAND
+        alignment.alignment.cigar.add(
+            operation=protocol.CigarUnit.ALIGNMENT_MATCH,
+            operation_length=self._readLength)
+        alignment.duplicate_fragment = False
+        alignment.failed_vendor_quality_checks = False
+        alignment.number_reads = 1
+        alignment.improper_placement = False
+        alignment.read_group_id = self.getId()
+        alignment.read_number = 0
+        alignment.secondary_alignment = False
+        alignment.supplementary_alignment = False
+        alignment.id = self._parentContainer.getReadAlignmentId(alignment)
+        return alignment
 
-    def getReadAlignments(self, referenceId=None, start=None, end=None):
+    def _getUnplacedReadAlignments(self):
         rng = random.Random(self._randomSeed)
 
         # We seed reads with sequential seeds starting from here. We hope no
@@ -717,6 +1770,7 @@ class HtslibReadGroup(AlignmentDataMixin, AbstractReadGroup):
         # These attributes are used in AlignmentDataMixin.openFile
         self._dataUrl = parentContainer.getDataUrl()
         self._indexFile = parentContainer.getIndexFile()
+        self._cramIndex = None
         self._filterReads = localId != HtslibReadGroupSet.defaultReadGroupName
         self._bioSampleId = None
         self._sampleName = None
@@ -772,6 +1826,20 @@ class HtslibReadGroup(AlignmentDataMixin, AbstractReadGroup):
         return self._getReadAlignments(
             reference, start, end, self._parentContainer, self)
 
+    def getReferenceNames(self):
+        """
+        Returns the list of reference names in the header of the
+        alignment file for this ReadGroup's ReadGroupSet.
+        """
+        return self._parentContainer.getReferenceNames()
+
+    def getReferenceFilename(self):
+        """
+        Returns the reference FASTA with which to open the alignment file
+        for this ReadGroup's ReadGroupSet.
+        """
+        return self._parentContainer.getReferenceFilename()
+
     def getPrograms(self):
         return self._parentContainer.getPrograms()
 
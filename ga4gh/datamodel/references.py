@@ -6,9 +6,13 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import hashlib
 import json
+import os
 import random
+import tempfile
+import threading
 
 import pysam
 
@@ -25,6 +29,180 @@ file that does not provide the 'AS' tag in the @SQ header.
 """
 
 
+class ReferenceSliceCache(object):
+    """
+    Process-wide LRU cache of decoded reference sequence. Sequence is
+    stored in fixed-size slices keyed by the FASTA file, the reference
+    name and the index of the slice within the reference, so that
+    overlapping queries against the same region of a reference share
+    the decoded bases rather than each re-reading the FASTA file.
+    """
+    def __init__(self, sliceSize=2**16):
+        self._sliceSize = sliceSize
+        self._cache = collections.OrderedDict()
+        # Initialize the value even if it will be set up by the config
+        self._maxCacheSize = 256
+        self._numHits = 0
+        self._numMisses = 0
+
+    def setMaxCacheSize(self, size):
+        """
+        Sets the maximum number of slices held in the cache
+        """
+        if size <= 0:
+            raise ValueError(
+                "The size of the cache must be a strictly positive value")
+        self._maxCacheSize = size
+        while len(self._cache) > self._maxCacheSize:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all slices from the cache.
+        """
+        self._cache.clear()
+        self._numHits = 0
+        self._numMisses = 0
+
+    def getNumCachedSlices(self):
+        """
+        Returns the number of slices currently held in the cache.
+        """
+        return len(self._cache)
+
+    def getHitRate(self):
+        """
+        Returns the fraction of slice lookups that were served from the
+        cache, or None if there have been no lookups.
+        """
+        numLookups = self._numHits + self._numMisses
+        if numLookups == 0:
+            return None
+        return self._numHits / numLookups
+
+    def _getSlice(self, fastaFile, dataUrl, referenceName, index):
+        key = (dataUrl, referenceName, index)
+        bases = self._cache.pop(key, None)
+        if bases is None:
+            self._numMisses += 1
+            start = index * self._sliceSize
+            bases = fastaFile.fetch(
+                referenceName, start, start + self._sliceSize)
+            if len(self._cache) >= self._maxCacheSize:
+                self._cache.popitem(last=False)
+        else:
+            self._numHits += 1
+        self._cache[key] = bases
+        return bases
+
+    def getBases(self, fastaFile, dataUrl, referenceName, start, end):
+        """
+        Returns the bases from start (inclusive) to end (exclusive) of
+        the specified reference in the specified FASTA file, which is
+        identified in the cache by its dataUrl.
+        """
+        firstIndex = start // self._sliceSize
+        lastIndex = (end - 1) // self._sliceSize
+        slices = [
+            self._getSlice(fastaFile, dataUrl, referenceName, index)
+            for index in range(firstIndex, lastIndex + 1)]
+        offset = firstIndex * self._sliceSize
+        return b"".join(slices)[start - offset:end - offset]
+
+
+# LRU cache of decoded reference sequence slices
+referenceSliceCache = ReferenceSliceCache()
+
+
+class DecodedReferenceStore(object):
+    """
+    Process-wide store of decoded reference sequences, from which htslib
+    reads reference slices when decoding CRAM. The store is a directory
+    in the layout of htslib's REF_CACHE: one file per sequence, named by
+    the MD5 checksum in the @SQ header lines of CRAM files and holding
+    only the upper-cased bases. htslib reads the slices it needs from
+    these files by offset, without parsing FASTA, and the operating
+    system's page cache shares them between all of the CRAM files and
+    queries (and server processes) that use the same reference.
+    """
+    def __init__(self):
+        self._directory = None
+        self._chunkSize = 2**20
+        self._lock = threading.Lock()
+
+    def setDirectory(self, directory):
+        """
+        Sets the directory of the store and points htslib's REF_CACHE
+        and REF_PATH at it. If directory is None, the store is disabled
+        and CRAM files are decoded directly from the FASTA file.
+        """
+        self._directory = directory
+        if directory is None:
+            os.environ.pop(str("REF_CACHE"), None)
+            os.environ.pop(str("REF_PATH"), None)
+        else:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            pattern = os.path.join(directory, "%s").encode()
+            # Setting REF_PATH also stops htslib from looking up
+            # references on remote servers.
+            os.environ[str("REF_CACHE")] = pattern
+            os.environ[str("REF_PATH")] = pattern
+
+    def getDirectory(self):
+        """
+        Returns the directory of the store, or None if it is disabled.
+        """
+        return self._directory
+
+    def _writeSequence(self, referenceSet, reference, path):
+        fastaFile = referenceSet.getFastaFile()
+        referenceName = reference.getLocalId().encode()
+        fd, tempPath = tempfile.mkstemp(dir=self._directory)
+        try:
+            with os.fdopen(fd, "wb") as outputFile:
+                for start in range(
+                        0, reference.getLength(), self._chunkSize):
+                    bases = fastaFile.fetch(
+                        referenceName, start, start + self._chunkSize)
+                    outputFile.write(bases.upper())
+            # Other threads and processes must never see a partial file.
+            os.rename(tempPath, path)
+        except:
+            os.unlink(tempPath)
+            raise
+
+    def addReferences(self, referenceSet, md5checksums):
+        """
+        Ensures that the sequences with the specified MD5 checksums from
+        the specified HtslibReferenceSet are in the store, writing any
+        that are missing. Returns True if all of them are available; if
+        the store is disabled or a checksum does not match a reference
+        in the set (for instance, because the FASTA file is soft-masked)
+        returns False, and the FASTA file must be used instead.
+        """
+        if self._directory is None or len(md5checksums) == 0:
+            return False
+        referenceMap = dict(
+            (reference.getMd5Checksum().lower(), reference)
+            for reference in referenceSet.getReferences())
+        with self._lock:
+            for md5checksum in md5checksums:
+                if md5checksum is None:
+                    return False
+                reference = referenceMap.get(md5checksum.lower())
+                if reference is None:
+                    return False
+                path = os.path.join(self._directory, md5checksum.lower())
+                if not os.path.exists(path):
+                    self._writeSequence(referenceSet, reference, path)
+        return True
+
+
+# Store of decoded reference sequences used when decoding CRAM
+decodedReferenceStore = DecodedReferenceStore()
+
+
 class AbstractReferenceSet(datamodel.DatamodelObject):
     """
     Class representing ReferenceSets. A ReferenceSet is a set of
@@ -361,7 +539,9 @@ class SimulatedReferenceSet(AbstractReferenceSet):
     """
     A simulated referenceSet
     """
-    def __init__(self, localId, randomSeed=0, numReferences=1):
+    def __init__(
+            self, localId, randomSeed=0, numReferences=1,
+            referenceLength=200):
         super(SimulatedReferenceSet, self).__init__(localId)
         self._randomSeed = randomSeed
         self._randomGenerator = random.Random()
@@ -379,7 +559,7 @@ class SimulatedReferenceSet(AbstractReferenceSet):
             referenceSeed = self._randomGenerator.getrandbits(32)
             referenceLocalId = "srs{}".format(i)
             reference = SimulatedReference(
-                self, referenceLocalId, referenceSeed)
+                self, referenceLocalId, referenceSeed, referenceLength)
             self.addReference(reference)
 
 
@@ -394,8 +574,11 @@ class SimulatedReference(AbstractReference):
         rng = random.Random()
         rng.seed(randomSeed)
         self._length = length
-        bases = [rng.choice('ACGT') for _ in range(self._length)]
-        self._bases = ''.join(bases)
+        # Equivalent to rng.choice('ACGT') for each base, but fast enough
+        # to simulate references of realistic length.
+        randomFloat = rng.random
+        self._bases = ''.join([
+            'ACGT'[int(randomFloat() * 4)] for _ in range(self._length)])
         self._md5checksum = hashlib.md5(self._bases).hexdigest()
         self._isDerived = bool(rng.randint(0, 1))
         self._sourceDivergence = 0
@@ -499,5 +682,7 @@ class HtslibReference(datamodel.PysamDatamodelMixin, AbstractReference):
         fastaFile = self._parentContainer.getFastaFile()
         localId = self.getLocalId().encode()
         # TODO we should have some error checking here...
-        bases = fastaFile.fetch(localId, start, end)
+        bases = referenceSliceCache.getBases(
+            fastaFile, self._parentContainer.getDataUrl(), localId,
+            start, end)
         return bases
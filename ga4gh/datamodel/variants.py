@@ -6,26 +6,43 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import array
+import collections
 import datetime
 import glob
 import hashlib
 import json
+import math
+import multiprocessing
+import operator
 import os
 import random
 import re
+import struct
+import threading
+import zlib
 
 import pysam
+import pysam.bcftools
 import google.protobuf.struct_pb2 as struct_pb2
 
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
 import ga4gh.datamodel as datamodel
-import ga4gh.pb as pb
+import ga4gh.sqliteBackend as sqliteBackend
 
 ANNOTATIONS_VEP_V82 = "VEP_v82"
 ANNOTATIONS_VEP_V77 = "VEP_v77"
 ANNOTATIONS_SNPEFF = "SNPEff"
 
+VARIANT_HASH_CRC32 = "crc32"
+VARIANT_HASH_MD5 = "md5"
+
+VCF_EXTENSION = ".vcf.gz"
+BCF_EXTENSION = ".bcf"
+TABIX_EXTENSION = ".tbi"
+CSI_EXTENSION = ".csi"
+
 
 def isUnspecified(str):
     """
@@ -35,6 +52,426 @@ def isUnspecified(str):
     return str == "" or str is None
 
 
+class VariantHasher(object):
+    """
+    Process-wide source of the hashes used within variant IDs to
+    distinguish variants starting at the same genomic coordinate. By
+    default a CRC32 of the alleles is used, which is much cheaper than
+    MD5 and ample for telling apart the handful of variants at a single
+    position. The MD5 mode reproduces the IDs issued by earlier versions
+    of the server.
+    """
+    hashFunctions = [VARIANT_HASH_CRC32, VARIANT_HASH_MD5]
+
+    def __init__(self):
+        # Initialize the value even if it will be set up by the config
+        self._hashFunction = VARIANT_HASH_CRC32
+
+    def setHashFunction(self, hashFunction):
+        """
+        Sets the hash function used for new variant IDs to one of
+        hashFunctions.
+        """
+        if hashFunction not in self.hashFunctions:
+            raise ValueError(
+                "Unknown variant hash function '{}'".format(hashFunction))
+        self._hashFunction = hashFunction
+
+    def getHashFunction(self):
+        """
+        Returns the hash function used for new variant IDs.
+        """
+        return self._hashFunction
+
+    def getHashFunctionForHash(self, hash_):
+        """
+        Returns the hash function that produced the specified hash, so
+        that IDs issued under either mode can still be resolved.
+        """
+        if len(hash_) == 32:
+            return VARIANT_HASH_MD5
+        return VARIANT_HASH_CRC32
+
+    def hashAlleles(self, referenceBases, alternateBases, hashFunction=None):
+        """
+        Returns the hash of the specified reference bases and sequence of
+        unicode alternate bases, using the specified hash function or the
+        configured one if this is None.
+        """
+        if hashFunction is None:
+            hashFunction = self._hashFunction
+        hash_str = referenceBases + str(tuple(alternateBases))
+        if hashFunction == VARIANT_HASH_MD5:
+            return hashlib.md5(hash_str).hexdigest()
+        return "{:08x}".format(zlib.crc32(hash_str) & 0xffffffff)
+
+
+variantHasher = VariantHasher()
+
+
+def _getByteSize(obj):
+    """
+    Returns the serialized size of the specified protocol object, or
+    tuple of protocol objects.
+    """
+    if isinstance(obj, tuple):
+        return sum(element.ByteSize() for element in obj)
+    return obj.ByteSize()
+
+
+def _getVariantInterval(variant):
+    return variant.start, variant.end
+
+
+def _getVariantAnnotationInterval(variantAnnotationPair):
+    variant, _ = variantAnnotationPair
+    return variant.start, variant.end
+
+
+class RegionCache(object):
+    """
+    Process-wide LRU cache of the GA4GH objects converted from the records
+    in variant files. The objects are stored in fixed-size bins keyed by
+    the source of the objects (e.g., a variant file and the CallSets
+    requested from it), the reference name and the index of the bin
+    within the reference, so that repeated and overlapping queries on
+    popular regions share the converted objects rather than each
+    re-reading and re-converting the same records. The size of the cache
+    is bounded by the total serialized size of the objects it holds, and
+    is 0, disabling the cache, until it is configured. The cache is shared
+    by the threads of the server, so its bins are accessed under a lock;
+    the objects in a missing bin are read without holding it.
+    """
+    def __init__(self, binSize=2**12, maxQueryBins=64):
+        self._binSize = binSize
+        # Queries spanning more bins than this are not cached, as they
+        # are scans of large regions rather than lookups of popular ones.
+        self._maxQueryBins = maxQueryBins
+        self._cache = collections.OrderedDict()
+        self._cacheSize = 0
+        self._maxCacheSize = 0
+        self._lock = threading.Lock()
+        self._numHits = 0
+        self._numMisses = 0
+
+    def setMaxCacheSize(self, size):
+        """
+        Sets the maximum total serialized size in bytes of the objects
+        held in the cache. A size of 0 disables the cache.
+        """
+        if size < 0:
+            raise ValueError(
+                "The size of the cache must be a positive value")
+        with self._lock:
+            self._maxCacheSize = size
+            while self._cacheSize > self._maxCacheSize:
+                self._removeLru()
+
+    def getMaxCacheSize(self):
+        """
+        Returns the maximum total serialized size in bytes of the objects
+        held in the cache.
+        """
+        return self._maxCacheSize
+
+    def clear(self):
+        """
+        Removes all bins from the cache.
+        """
+        with self._lock:
+            self._cache.clear()
+            self._cacheSize = 0
+            self._numHits = 0
+            self._numMisses = 0
+
+    def getNumCachedBins(self):
+        """
+        Returns the number of bins currently held in the cache.
+        """
+        return len(self._cache)
+
+    def getCacheSize(self):
+        """
+        Returns the total serialized size in bytes of the objects
+        currently held in the cache.
+        """
+        return self._cacheSize
+
+    def getHitRate(self):
+        """
+        Returns the fraction of bin lookups that were served from the
+        cache, or None if there have been no lookups.
+        """
+        numLookups = self._numHits + self._numMisses
+        if numLookups == 0:
+            return None
+        return self._numHits / numLookups
+
+    def _removeLru(self):
+        _, (_, size) = self._cache.popitem(last=False)
+        self._cacheSize -= size
+
+    def _getBin(self, key, referenceName, index, search):
+        binKey = (key, referenceName, index)
+        with self._lock:
+            entry = self._cache.pop(binKey, None)
+            if entry is not None:
+                self._numHits += 1
+                self._cache[binKey] = entry
+                return entry[0]
+            self._numMisses += 1
+        start = index * self._binSize
+        objects = list(search(start, start + self._binSize))
+        size = sum(_getByteSize(obj) for obj in objects)
+        with self._lock:
+            # Another thread may have filled the bin in the meantime.
+            if binKey not in self._cache and size <= self._maxCacheSize:
+                while self._cacheSize + size > self._maxCacheSize:
+                    self._removeLru()
+                self._cache[binKey] = objects, size
+                self._cacheSize += size
+        return objects
+
+    def getObjects(
+            self, key, referenceName, start, end, search, getInterval):
+        """
+        Returns an iterator over the objects overlapping the region from
+        start (inclusive) to end (exclusive) of the specified reference,
+        for the source identified by the specified key. The function
+        search(start, end) must return the objects in a region in order
+        of their start positions, and getInterval(obj) the (start, end)
+        interval of an object. Regions that are too large to cache are
+        passed directly to search.
+        """
+        if (self._maxCacheSize == 0 or end is None or start < 0 or
+                end <= start or
+                end - start > self._maxQueryBins * self._binSize):
+            for obj in search(start, end):
+                yield obj
+            return
+        firstIndex = start // self._binSize
+        lastIndex = (end - 1) // self._binSize
+        for index in range(firstIndex, lastIndex + 1):
+            binStart = index * self._binSize
+            for obj in self._getBin(key, referenceName, index, search):
+                objStart, objEnd = getInterval(obj)
+                if objStart >= end:
+                    break
+                # Objects starting before a bin are also in the previous
+                # bin, and so have already been returned.
+                if objEnd > start and (
+                        index == firstIndex or objStart >= binStart):
+                    yield obj
+
+
+# LRU cache of converted variants and variant annotations
+regionCache = RegionCache()
+
+
+_variantFilterTokenPattern = re.compile(r"""
+    \s*(?:
+        (?P<number>-?[0-9]+(?:\.[0-9]*)?(?:[eE][-+]?[0-9]+)?) |
+        (?P<string>"[^"]*"|'[^']*') |
+        (?P<operator>==|!=|<=|>=|<|>|&&|\|\||!|\(|\)) |
+        (?P<name>[A-Za-z_][A-Za-z0-9_.]*)
+    )""", re.VERBOSE)
+
+_variantFilterComparisons = {
+    "==": operator.eq, "!=": operator.ne, "<": operator.lt,
+    "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+def _getQualValues(record):
+    if record.qual is None:
+        return []
+    return [record.qual]
+
+
+def _getFilterValues(record):
+    return record.filter.keys()
+
+
+def _getIdValues(record):
+    if record.id is None:
+        return []
+    return record.id.split(';')
+
+
+def _getInfoValuesFunction(key):
+    def getInfoValues(record):
+        info = record.info
+        if key not in info:
+            return []
+        value = info[key]
+        if isinstance(value, tuple):
+            return [v for v in value if v is not None]
+        if value is None or value is False:
+            return []
+        return [value]
+    return getInfoValues
+
+
+def _toFloat32(value):
+    """
+    Returns the specified float rounded to single precision, as used for
+    the Float values in VCF records.
+    """
+    return struct.unpack(b'f', struct.pack(b'f', value))[0]
+
+
+def _getNumericComparison(op, number):
+    """
+    Returns a function comparing a field value with the specified number
+    using the specified comparison operator.
+    """
+    comparison = _variantFilterComparisons[op]
+    # VCF Float values are single precision, so we compare them with the
+    # number at the same precision.
+    number32 = _toFloat32(number)
+
+    def compare(value):
+        if isinstance(value, float):
+            return comparison(value, number32)
+        try:
+            return comparison(float(value), number)
+        except ValueError:
+            return False
+    return compare
+
+
+class _VariantFilterCompiler(object):
+    """
+    Compiles variant filter expressions into predicates over pysam
+    variant records. See compileVariantFilter.
+    """
+    def __init__(self, expression):
+        self._expression = expression
+        self._tokens = []
+        position = 0
+        expression = expression.rstrip()
+        while position < len(expression):
+            match = _variantFilterTokenPattern.match(expression, position)
+            if match is None:
+                self._fail("unexpected character at position {}".format(
+                    position))
+            self._tokens.append((match.lastgroup, match.group(
+                match.lastgroup)))
+            position = match.end()
+        self._position = 0
+
+    def _fail(self, message):
+        raise exceptions.InvalidVariantFilterException(
+            self._expression, message)
+
+    def _peek(self):
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None, None
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            self._fail("unexpected end of expression")
+        self._position += 1
+        return token
+
+    def compile(self):
+        predicate = self._parseDisjunction()
+        if self._peek()[0] is not None:
+            self._fail("unexpected '{}'".format(self._peek()[1]))
+        return predicate
+
+    def _parseDisjunction(self):
+        predicates = [self._parseConjunction()]
+        while self._peek() == ("operator", "||"):
+            self._next()
+            predicates.append(self._parseConjunction())
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda record: any(p(record) for p in predicates)
+
+    def _parseConjunction(self):
+        predicates = [self._parseUnary()]
+        while self._peek() == ("operator", "&&"):
+            self._next()
+            predicates.append(self._parseUnary())
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda record: all(p(record) for p in predicates)
+
+    def _parseUnary(self):
+        if self._peek() == ("operator", "!"):
+            self._next()
+            predicate = self._parseUnary()
+            return lambda record: not predicate(record)
+        if self._peek() == ("operator", "("):
+            self._next()
+            predicate = self._parseDisjunction()
+            if self._next() != ("operator", ")"):
+                self._fail("expected ')'")
+            return predicate
+        return self._parseComparison()
+
+    def _parseField(self):
+        tokenType, name = self._next()
+        if tokenType != "name":
+            self._fail("expected a field name, not '{}'".format(name))
+        if name == "QUAL":
+            return _getQualValues
+        elif name == "FILTER":
+            return _getFilterValues
+        elif name == "ID":
+            return _getIdValues
+        elif name.startswith("INFO.") and len(name) > len("INFO."):
+            return _getInfoValuesFunction(str(name[len("INFO."):]))
+        self._fail("unknown field '{}'".format(name))
+
+    def _parseComparison(self):
+        getValues = self._parseField()
+        tokenType, op = self._peek()
+        if tokenType != "operator" or op not in _variantFilterComparisons:
+            # A field on its own tests whether the field has any value.
+            return lambda record: len(getValues(record)) > 0
+        self._next()
+        tokenType, literal = self._next()
+        if tokenType == "number":
+            compare = _getNumericComparison(
+                "==" if op == "!=" else op, float(literal))
+        elif tokenType in ("string", "name"):
+            if op not in ("==", "!="):
+                self._fail("'{}' requires a numeric value".format(op))
+            if tokenType == "string":
+                literal = literal[1:-1]
+
+            def compare(value):
+                return value == literal
+        else:
+            self._fail("expected a value, not '{}'".format(literal))
+        if op == "!=":
+            # A field with several values differs from the literal only if
+            # none of its values are equal to it.
+            return lambda record: not any(
+                compare(value) for value in getValues(record))
+        return lambda record: any(
+            compare(value) for value in getValues(record))
+
+
+def compileVariantFilter(expression):
+    """
+    Compiles the specified variant filter expression into a function
+    that takes a pysam variant record and returns True if the record
+    satisfies the expression. Expressions compare the fields QUAL, FILTER,
+    ID and INFO.<key> with numbers or strings using ==, !=, <, <=, > and
+    >=, and may be combined using &&, ||, ! and parentheses; for example,
+    'FILTER == PASS && QUAL >= 30 && INFO.AF > 0.01'. A comparison holds
+    if it holds for any of the values of a field with several values,
+    except for != which holds if none of the values are equal. A field on
+    its own tests whether it has a value, as for INFO flags. Raises an
+    InvalidVariantFilterException if the expression is not valid.
+    """
+    return _VariantFilterCompiler(expression).compile()
+
+
 class CallSet(datamodel.DatamodelObject):
     """
     Class representing a CallSet. A CallSet basically represents the
@@ -247,6 +684,10 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         protocolElement.dataset_id = self.getParentContainer().getId()
         protocolElement.reference_set_id = self._referenceSet.getId()
         protocolElement.metadata.extend(self.getMetadata())
+        statistics = self.getStatistics()
+        if statistics is not None:
+            protocolElement.metadata.extend(
+                statistics.toProtocolElements(self))
         protocolElement.dataset_id = self.getParentContainer().getId()
         protocolElement.reference_set_id = self._referenceSet.getId()
         protocolElement.name = self.getLocalId()
@@ -258,6 +699,13 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         """
         raise NotImplementedError()
 
+    def getStatistics(self):
+        """
+        Returns the VariantSetStatistics for this VariantSet, or None if
+        these have not been computed.
+        """
+        return None
+
     def _createGaVariant(self):
         """
         Convenience method to set the common fields in a GA Variant
@@ -292,35 +740,83 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         return str(compoundId)
 
     @classmethod
-    def hashVariant(cls, gaVariant):
+    def hashVariant(cls, gaVariant, hashFunction=None):
         """
-        Produces an MD5 hash of the ga variant object to distinguish
+        Produces a hash of the ga variant object to distinguish
         it from other variants at the same genomic coordinate.
         """
-        hash_str = gaVariant.reference_bases + \
-            str(tuple(gaVariant.alternate_bases))
-        return hashlib.md5(hash_str).hexdigest()
+        return cls.hashAlleles(
+            gaVariant.reference_bases, gaVariant.alternate_bases,
+            hashFunction)
+
+    @classmethod
+    def hashAlleles(cls, referenceBases, alternateBases, hashFunction=None):
+        """
+        Produces the hash used by hashVariant for the specified reference
+        bases and sequence of unicode alternate bases.
+        """
+        return variantHasher.hashAlleles(
+            referenceBases, alternateBases, hashFunction)
+
+    def getGenotypeRecords(
+            self, referenceName, startPosition, endPosition, callSetIds=None,
+            variantFilter=None):
+        """
+        Returns an iterator over (record, variantId, callSetLookups)
+        tuples for the raw variant records in the specified region, as
+        required to build a GenotypeMatrix. This is only supported for
+        VariantSets backed by variant files.
+        """
+        raise exceptions.NotImplementedException(
+            "Genotype matrices are not available for this VariantSet")
 
 
 class SimulatedVariantSet(AbstractVariantSet):
     """
     A variant set that doesn't derive from a data store.
-    Used mostly for testing.
+    Used mostly for testing and benchmarking.
+
+    The positions of the variants are generated in blocks of blockSize
+    bases, each with its own seed, and each variant is generated from a
+    seed unique to its position, so that the same variants are produced
+    regardless of the query window.
+
+    The ith CallSet is given an info map with i keys. As this makes
+    building a set with thousands of CallSets quadratic, the number of
+    keys can be capped with maxCallSetInfoSize; by default it is not.
     """
+    blockSize = 2**14
+
     def __init__(
             self, parentContainer, referenceSet, localId, randomSeed=1,
-            numCalls=1, variantDensity=1):
+            numCalls=1, variantDensity=1, maxCallSetInfoSize=None):
         super(SimulatedVariantSet, self).__init__(parentContainer, localId)
         self._referenceSet = referenceSet
         self._randomSeed = randomSeed
         self._numCalls = numCalls
+        # The calls for each CallSet, one for each possible genotype,
+        # to be copied into the generated variants.
+        self._callTemplates = []
         for i in range(numCalls):
             callSetName = "simCallSet_{}".format(i)
             self.addCallSetFromName(callSetName)
             callSet = self.getCallSetByName(callSetName)
             # build up infos of increasing size
-            for j in range(i):
+            infoSize = i
+            if maxCallSetInfoSize is not None:
+                infoSize = min(i, maxCallSetInfoSize)
+            for j in range(infoSize):
                 callSet._info["key_{}".format(j)] = "value_{}".format(j)
+            # for now, the genotype is either [0,1], [1,0] or [1,1] with
+            # equal probability; probably will want to do something more
+            # sophisticated later.
+            # TODO What is a reasonable model for generating these
+            # likelihoods? Are these log-scaled? Spec does not say.
+            self._callTemplates.append([
+                protocol.Call(
+                    call_set_id=callSet.getId(), genotype=genotype,
+                    genotype_likelihood=[-100, -100, -100])
+                for genotype in [[0, 1], [1, 0], [1, 1]]])
         self._variantDensity = variantDensity
         self._metadata = self._createMetaData()
         now = protocol.convertDatetime(datetime.datetime.now())
@@ -369,16 +865,56 @@ class SimulatedVariantSet(AbstractVariantSet):
         return variant
 
     def getVariants(self, referenceName, startPosition, endPosition,
-                    callSetIds=None):
+                    callSetIds=None, variantFilter=None):
+        if variantFilter is not None:
+            raise exceptions.NotImplementedException(
+                "Variant filters are not supported for this VariantSet")
+        if endPosition is None:
+            # There is no reference length to bound the simulated
+            # variants, so open ended queries return nothing.
+            return
+        randomNumberGenerator = random.Random()
+        startBlock = startPosition // self.blockSize
+        endBlock = (endPosition - 1) // self.blockSize + 1
+        for blockIndex in range(startBlock, endBlock):
+            for position in self._getVariantPositions(blockIndex):
+                if position >= endPosition:
+                    break
+                if position >= startPosition:
+                    randomNumberGenerator.seed(self._randomSeed + position)
+                    yield self.generateVariant(
+                        referenceName, position, randomNumberGenerator)
+
+    def _getVariantPositions(self, blockIndex):
+        """
+        Returns an iterator over the positions of the variants in the
+        specified block, in increasing order. Each position holds a
+        variant with probability variantDensity, independently of the
+        others.
+        """
+        blockStart = blockIndex * self.blockSize
+        blockEnd = blockStart + self.blockSize
+        if self._variantDensity >= 1:
+            return iter(range(blockStart, blockEnd))
+        if self._variantDensity <= 0:
+            return iter([])
+        return self._getRandomVariantPositions(blockIndex, blockEnd)
+
+    def _getRandomVariantPositions(self, blockIndex, blockEnd):
         randomNumberGenerator = random.Random()
-        randomNumberGenerator.seed(self._randomSeed)
-        i = startPosition
-        while i < endPosition:
-            if randomNumberGenerator.random() < self._variantDensity:
-                randomNumberGenerator.seed(self._randomSeed + i)
-                yield self.generateVariant(
-                    referenceName, i, randomNumberGenerator)
-            i += 1
+        randomNumberGenerator.seed(self._randomSeed * 2**32 + blockIndex)
+        # The gaps between variants are geometrically distributed, so
+        # we only need one random number per variant rather than one
+        # per position.
+        logSkipProbability = math.log(1 - self._variantDensity)
+        position = blockIndex * self.blockSize - 1
+        while True:
+            position += 1 + int(
+                math.log(1 - randomNumberGenerator.random()) /
+                logSkipProbability)
+            if position >= blockEnd:
+                break
+            yield position
 
     def generateVariant(self, referenceName, position, randomNumberGenerator):
         """
@@ -397,18 +933,9 @@ class SimulatedVariantSet(AbstractVariantSet):
         alt = randomNumberGenerator.choice(
             [base for base in bases if base != ref])
         variant.alternate_bases.append(alt)
-        for callSet in self.getCallSets():
-            call = variant.calls.add()
-            call.call_set_id = callSet.getId()
-            # for now, the genotype is either [0,1], [1,1] or [1,0] with equal
-            # probability; probably will want to do something more
-            # sophisticated later.
-            randomChoice = randomNumberGenerator.choice(
-                [[0, 1], [1, 0], [1, 1]])
-            call.genotype.extend(randomChoice)
-            # TODO What is a reasonable model for generating these likelihoods?
-            # Are these log-scaled? Spec does not say.
-            call.genotype_likelihood.extend([-100, -100, -100])
+        choice = randomNumberGenerator.choice
+        variant.calls.extend([
+            choice(callTemplates) for callTemplates in self._callTemplates])
         variant.id = self.getVariantId(variant)
         return variant
 
@@ -420,6 +947,19 @@ def _encodeValue(value):
         return [struct_pb2.Value(string_value=str(value))]
 
 
+def _addEncodedValues(values, value):
+    """
+    Adds the encoded form of the specified value to the specified repeated
+    Value field in place, avoiding the copy made by extending it with the
+    result of _encodeValue.
+    """
+    if isinstance(value, (list, tuple)):
+        for v in value:
+            values.add(string_value=str(v))
+    else:
+        values.add(string_value=str(value))
+
+
 _nothing = object()
 
 
@@ -428,6 +968,688 @@ def isEmptyIter(it):
     return next(it, _nothing) is _nothing
 
 
+class GenotypeMatrix(datamodel.ColumnarBatch):
+    """
+    A compact representation of the genotypes of a set of CallSets over a
+    page of variants, intended for cohort analyses over many samples.
+    Rather than holding a GA4GH Call object for each sample in each
+    variant, the genotypes for each variant are stored as a dense row of
+    callSets x ploidy small integer allele indexes, where the ploidy of
+    each row is the largest ploidy of the calls in that variant. Missing
+    alleles, and the alleles of calls with fewer alleles than the ploidy
+    of their row, are stored as -1. The genotypes column uses signed
+    bytes unless an allele index does not fit, in which case it is
+    promoted to 16 bit integers.
+
+    If requested, the phasing of each call is stored in the phased column
+    as a dense variants x callSets matrix, and the genotype likelihoods
+    for each variant are stored as a dense row of callSets x N floats,
+    where N is the largest number of likelihoods of the calls in that
+    variant. Missing likelihoods are stored as NaN.
+
+    Matrices are built directly from the per-sample data in pysam VCF
+    records, without constructing intermediate protocol objects.
+    """
+    magic = b"GA4GHGTM"
+    version = 1
+    mimetype = "application/vnd.ga4gh.genotypematrix"
+    columnTypes = [
+        ("starts", "i"),
+        ("ends", "i"),
+        ("ploidies", "B"),
+        ("genotypeOffsets", "I"),
+        ("genotypes", "b"),
+        ("phased", "B"),
+        ("genotypeLikelihoodOffsets", "I"),
+        ("genotypeLikelihoods", "f"),
+    ]
+    offsetColumns = ["genotypeOffsets", "genotypeLikelihoodOffsets"]
+    headerFields = [
+        "callSetIds", "variantIds", "referenceName", "alleles",
+        "includePhasing", "includeGenotypeLikelihoods"]
+
+    def __init__(
+            self, callSetIds=[], includePhasing=False,
+            includeGenotypeLikelihoods=False):
+        super(GenotypeMatrix, self).__init__()
+        self.callSetIds = list(callSetIds)
+        self.variantIds = []
+        self.referenceName = None
+        self.alleles = []
+        self.includePhasing = includePhasing
+        self.includeGenotypeLikelihoods = includeGenotypeLikelihoods
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, record, variantId, callSetLookups):
+        """
+        Appends a row for the specified pysam VCF record to this matrix.
+        The callSetLookups must be the result of calling
+        getCallSetLookups for this matrix's callSetIds and the header of
+        the file containing the record.
+        """
+        self.variantIds.append(variantId)
+        self.referenceName = record.contig
+        self.alleles.append(list(record.alleles))
+        self.starts.append(record.start)
+        self.ends.append(record.stop)
+        samples = record.samples
+        calls = [samples[sampleIndex] for sampleIndex, _, _ in callSetLookups]
+        genotypes = [call.allele_indices for call in calls]
+        ploidy = max([len(genotype) for genotype in genotypes] or [0])
+        row = []
+        for genotype in genotypes:
+            row.extend(-1 if allele is None else allele for allele in genotype)
+            row.extend([-1] * (ploidy - len(genotype)))
+        if len(row) > 0 and self.genotypes.typecode == str("b") and \
+                max(row) > 127:
+            self.genotypes = array.array(str("h"), self.genotypes)
+        self.ploidies.append(ploidy)
+        self.genotypes.fromlist(row)
+        self.genotypeOffsets.append(len(self.genotypes))
+        if self.includePhasing:
+            self.phased.fromlist([int(call.phased) for call in calls])
+        if self.includeGenotypeLikelihoods:
+            self._appendGenotypeLikelihoods(record, calls)
+        self.genotypeLikelihoodOffsets.append(len(self.genotypeLikelihoods))
+
+    def _appendGenotypeLikelihoods(self, record, calls):
+        if b'GL' not in record.format:
+            return
+        nan = float('nan')
+        likelihoods = []
+        for call in calls:
+            values = call[b'GL']
+            if values is None:
+                # Missing likelihoods are padded with NaN below.
+                values = []
+            likelihoods.append([
+                nan if value is None else value for value in values])
+        numLikelihoods = max(
+            [len(callLikelihoods) for callLikelihoods in likelihoods] or [0])
+        row = []
+        for callLikelihoods in likelihoods:
+            row.extend(callLikelihoods)
+            row.extend([nan] * (numLikelihoods - len(callLikelihoods)))
+        self.genotypeLikelihoods.fromlist(row)
+
+    def getGenotype(self, variantIndex, callSetIndex):
+        """
+        Returns the list of allele indexes for the specified call, with
+        -1 for missing or padding alleles.
+        """
+        ploidy = self.ploidies[variantIndex]
+        start = self.genotypeOffsets[variantIndex] + callSetIndex * ploidy
+        return self.genotypes[start:start + ploidy].tolist()
+
+    def isPhased(self, variantIndex, callSetIndex):
+        """
+        Returns True if the specified call is phased. Phasing must have
+        been included when this matrix was built.
+        """
+        return bool(
+            self.phased[variantIndex * len(self.callSetIds) + callSetIndex])
+
+    def getGenotypeLikelihoods(self, variantIndex, callSetIndex):
+        """
+        Returns the list of genotype likelihoods for the specified call.
+        """
+        start = self.genotypeLikelihoodOffsets[variantIndex]
+        end = self.genotypeLikelihoodOffsets[variantIndex + 1]
+        if len(self.callSetIds) == 0:
+            return []
+        numLikelihoods = (end - start) // len(self.callSetIds)
+        start += callSetIndex * numLikelihoods
+        return self.genotypeLikelihoods[
+            start:start + numLikelihoods].tolist()
+
+
+def getVariantRecordOffsets(variantFile, dataUrl):
+    """
+    Returns an iterator over (virtualOffset, record) pairs for the records
+    in the specified pysam VariantFile, which must be positioned at the
+    first record of the file at dataUrl. Seeking the VariantFile to
+    virtualOffset positions it at the start of the record.
+
+    htslib reads VCF text through a read-ahead buffer that seeking the
+    file does not discard, so records of VCF files cannot be read back by
+    offset, and their virtualOffset is None. These are read with a tabix
+    query on their start position instead.
+    """
+    isBcf = dataUrl.endswith(BCF_EXTENSION)
+    while True:
+        offset = variantFile.tell() if isBcf else None
+        try:
+            record = next(variantFile)
+        except StopIteration:
+            break
+        yield offset, record
+
+
+class VariantIdIndex(sqliteBackend.SqliteBackedDataSource):
+    """
+    An SQLite index of the positions of the records within the variant
+    files of a VariantSet. For each (referenceName, start) pair, the index
+    holds the virtual file offset of the first record starting at that
+    position, so that a variant can be read directly given its ID rather
+    than by querying the tabix index. As the records of VCF files cannot
+    be read back by offset, only BCF files are indexed.
+    """
+    def createTable(self):
+        """
+        Creates the (empty) offsets table in this index.
+        """
+        self._dbconn.execute("DROP TABLE IF EXISTS VariantOffset")
+        self._dbconn.execute("""
+            CREATE TABLE VariantOffset (
+                referenceName TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                PRIMARY KEY (referenceName, start)
+            );
+        """)
+
+    def insertOffsets(self, variantFile, dataUrl):
+        """
+        Inserts the offsets of all the records in the specified pysam
+        VariantFile, which must be positioned at the first record of the
+        BCF file at dataUrl.
+        """
+        def offsetIterator():
+            previousKey = None
+            for offset, record in getVariantRecordOffsets(
+                    variantFile, dataUrl):
+                key = record.contig, record.start
+                if key != previousKey:
+                    yield key + (offset,)
+                    previousKey = key
+        self._dbconn.executemany(
+            "INSERT OR IGNORE INTO VariantOffset VALUES (?, ?, ?)",
+            offsetIterator())
+        self._dbconn.commit()
+
+    def getOffset(self, referenceName, start):
+        """
+        Returns the virtual file offset of the first record starting at the
+        specified position, or None if there is no such record.
+        """
+        query = self._dbconn.execute(
+            "SELECT offset FROM VariantOffset "
+            "WHERE referenceName = ? AND start = ?",
+            (referenceName, start))
+        row = query.fetchone()
+        if row is None:
+            return None
+        return row[b'offset']
+
+
+VARIANT_TYPE_SNP = "SNP"
+VARIANT_TYPE_MNP = "MNP"
+VARIANT_TYPE_INDEL = "INDEL"
+VARIANT_TYPE_SV = "SV"
+VARIANT_TYPE_MIXED = "MIXED"
+VARIANT_TYPE_REF = "REF"
+
+
+def getVariantType(referenceBases, alternateBases):
+    """
+    Returns the type of variant with the specified reference and
+    alternate bases: a SNP or MNP if all alternates are the same length
+    as the reference, an INDEL if they all differ in length, SV if any
+    alternate is a symbolic or breakend allele, MIXED if the alternates
+    are of different types, and REF if there are no alternates.
+    """
+    types = set()
+    for alt in alternateBases:
+        if alt == "*" or alt == ".":
+            continue
+        if alt.startswith("<") or "[" in alt or "]" in alt:
+            return VARIANT_TYPE_SV
+        if len(alt) != len(referenceBases):
+            types.add(VARIANT_TYPE_INDEL)
+        elif len(alt) == 1:
+            types.add(VARIANT_TYPE_SNP)
+        else:
+            types.add(VARIANT_TYPE_MNP)
+    if len(types) == 0:
+        return VARIANT_TYPE_REF
+    if len(types) > 1:
+        return VARIANT_TYPE_MIXED
+    return types.pop()
+
+
+class VariantSetStatistics(object):
+    """
+    Summary statistics for the variants in a VariantSet. These are
+    optionally computed in a single pass over the variant files when the
+    VariantSet is added to a repository, and consist of the number of
+    variants on each reference, the number of variants of each type, and
+    histograms of the alternate allele frequencies and of the variant
+    qualities.
+    """
+    variantTypes = [
+        VARIANT_TYPE_SNP, VARIANT_TYPE_MNP, VARIANT_TYPE_INDEL,
+        VARIANT_TYPE_SV, VARIANT_TYPE_MIXED, VARIANT_TYPE_REF]
+    alleleFrequencyBinWidth = 0.1
+    numAlleleFrequencyBins = 10
+    qualityBinWidth = 10
+    # The last quality bin holds all qualities >= 100.
+    numQualityBins = 11
+
+    def __init__(self):
+        self._referenceVariantCounts = {}
+        self._variantTypeCounts = dict(
+            (variantType, 0) for variantType in self.variantTypes)
+        self._alleleFrequencyHistogram = [0] * self.numAlleleFrequencyBins
+        self._qualityHistogram = [0] * self.numQualityBins
+
+    def _getAlleleFrequencyFunction(self, header):
+        """
+        Returns a function returning the alternate allele frequencies of
+        a record in a file with the specified header, taken from the AF
+        INFO field if present and calculated from AC and AN otherwise; or
+        None if the header defines neither.
+        """
+        infoKeys = header.info.keys()
+        if b"AF" in infoKeys:
+            def getAlleleFrequencies(record):
+                if b"AF" not in record.info:
+                    return []
+                value = record.info[b"AF"]
+                if not isinstance(value, tuple):
+                    value = (value,)
+                return [af for af in value if af is not None]
+            return getAlleleFrequencies
+        if b"AC" in infoKeys and b"AN" in infoKeys:
+            def getAlleleFrequencies(record):
+                if b"AC" not in record.info or b"AN" not in record.info:
+                    return []
+                an = record.info[b"AN"]
+                if not an:
+                    return []
+                value = record.info[b"AC"]
+                if not isinstance(value, tuple):
+                    value = (value,)
+                return [ac / an for ac in value if ac is not None]
+            return getAlleleFrequencies
+        return None
+
+    def addVariantFile(self, variantFile):
+        """
+        Adds all the records in the specified pysam VariantFile, which
+        must be positioned at the first record, to these statistics.
+        """
+        getAlleleFrequencies = self._getAlleleFrequencyFunction(
+            variantFile.header)
+        referenceVariantCounts = self._referenceVariantCounts
+        variantTypeCounts = self._variantTypeCounts
+        alleleFrequencyHistogram = self._alleleFrequencyHistogram
+        qualityHistogram = self._qualityHistogram
+        lastAlleleFrequencyBin = self.numAlleleFrequencyBins - 1
+        lastQualityBin = self.numQualityBins - 1
+        for record in variantFile:
+            referenceName = record.contig
+            referenceVariantCounts[referenceName] = (
+                referenceVariantCounts.get(referenceName, 0) + 1)
+            variantType = getVariantType(record.ref, record.alts or ())
+            variantTypeCounts[variantType] += 1
+            if getAlleleFrequencies is not None:
+                for af in getAlleleFrequencies(record):
+                    index = int(af * self.numAlleleFrequencyBins)
+                    index = max(0, min(index, lastAlleleFrequencyBin))
+                    alleleFrequencyHistogram[index] += 1
+            if record.qual is not None:
+                index = int(record.qual // self.qualityBinWidth)
+                index = max(0, min(index, lastQualityBin))
+                qualityHistogram[index] += 1
+
+    def getNumVariants(self):
+        """
+        Returns the total number of variants in the VariantSet.
+        """
+        return sum(self._referenceVariantCounts.values())
+
+    def getReferenceVariantCounts(self):
+        """
+        Returns a dictionary mapping reference names to the number of
+        variants on that reference.
+        """
+        return self._referenceVariantCounts
+
+    def getVariantTypeCounts(self):
+        """
+        Returns a dictionary mapping variant types to the number of
+        variants of that type.
+        """
+        return self._variantTypeCounts
+
+    def getAlleleFrequencyHistogram(self):
+        """
+        Returns the counts of alternate alleles in each of the allele
+        frequency bins [0, 0.1), [0.1, 0.2), ..., [0.9, 1.0].
+        """
+        return self._alleleFrequencyHistogram
+
+    def getQualityHistogram(self):
+        """
+        Returns the counts of variants in each of the quality bins
+        [0, 10), [10, 20), ..., [90, 100), [100, inf).
+        """
+        return self._qualityHistogram
+
+    def toJsonDict(self):
+        """
+        Returns a JSON serialisable dictionary representing these
+        statistics.
+        """
+        return {
+            "numVariants": self.getNumVariants(),
+            "referenceVariantCounts": self._referenceVariantCounts,
+            "variantTypeCounts": self._variantTypeCounts,
+            "alleleFrequencyBinWidth": self.alleleFrequencyBinWidth,
+            "alleleFrequencyHistogram": self._alleleFrequencyHistogram,
+            "qualityBinWidth": self.qualityBinWidth,
+            "qualityHistogram": self._qualityHistogram,
+        }
+
+    @classmethod
+    def fromJsonDict(cls, jsonDict):
+        """
+        Returns the VariantSetStatistics represented by the specified
+        dictionary, as returned by toJsonDict.
+        """
+        statistics = cls()
+        statistics._referenceVariantCounts = dict(
+            jsonDict["referenceVariantCounts"])
+        statistics._variantTypeCounts.update(jsonDict["variantTypeCounts"])
+        statistics._alleleFrequencyHistogram = list(
+            jsonDict["alleleFrequencyHistogram"])
+        statistics._qualityHistogram = list(jsonDict["qualityHistogram"])
+        return statistics
+
+    def toProtocolElements(self, variantSet):
+        """
+        Returns a list of VariantSetMetadata objects summarising these
+        statistics for the specified VariantSet.
+        """
+        def makeMetadata(key, value, description, info, type_="Integer"):
+            metadata = protocol.VariantSetMetadata()
+            metadata.key = key
+            metadata.value = str(value)
+            metadata.id = str(datamodel.VariantSetMetadataCompoundId(
+                variantSet.getCompoundId(), 'metadata:' + key))
+            metadata.type = type_
+            metadata.number = "."
+            metadata.description = description
+            for infoKey, infoValue in info:
+                metadata.info[infoKey].values.extend(_encodeValue(infoValue))
+            return metadata
+        return [
+            makeMetadata(
+                "stats.numVariants", self.getNumVariants(),
+                "Number of variants on each reference",
+                sorted(self._referenceVariantCounts.items())),
+            makeMetadata(
+                "stats.variantTypeCounts", "",
+                "Number of variants of each type",
+                [(variantType, self._variantTypeCounts[variantType])
+                 for variantType in self.variantTypes]),
+            makeMetadata(
+                "stats.alleleFrequencyHistogram", "",
+                "Number of alternate alleles in each allele frequency bin",
+                [("binWidth", self.alleleFrequencyBinWidth),
+                 ("counts", self._alleleFrequencyHistogram)],
+                # The bin width is fractional.
+                type_="Float"),
+            makeMetadata(
+                "stats.qualityHistogram", "",
+                "Number of variants in each quality bin; the last bin "
+                "holds all qualities >= {}".format(
+                    self.qualityBinWidth * (self.numQualityBins - 1)),
+                [("binWidth", self.qualityBinWidth),
+                 ("counts", self._qualityHistogram)]),
+        ]
+
+
+def getAnnotationType(header, dataUrl):
+    """
+    Returns the type of the variant annotations described by the specified
+    pysam VariantHeader of the specified file, or None if the file is not
+    annotated. Raises a ValueError if the annotations are not supported.
+    """
+    annotationType = None
+    for record in header.records:
+        if record.type == "GENERIC":
+            if record.key == "SnpEffVersion":
+                annotationType = ANNOTATIONS_SNPEFF
+            elif record.key == "VEP":
+                version = record.value.split()[0]
+                # TODO we need _much_ more sophisticated processing
+                # of VEP versions here. When do they become
+                # incompatible?
+                if version == "v82":
+                    annotationType = ANNOTATIONS_VEP_V82
+                elif version == "v77":
+                    annotationType = ANNOTATIONS_VEP_V77
+                else:
+                    # TODO raise a proper typed exception there with
+                    # the file name as an argument.
+                    raise ValueError(
+                        "Unsupported VEP version {} in '{}'".format(
+                            version, dataUrl))
+    if annotationType is None:
+        infoKeys = header.info.keys()
+        if 'CSQ' in infoKeys or 'ANN' in infoKeys:
+            # TODO likewise, we want a properly typed exception that
+            # we can throw back to the repo manager UI and display
+            # as an import error.
+            raise ValueError(
+                "Unsupported annotations in '{}'".format(dataUrl))
+    return annotationType
+
+
+class VariantFileHeader(object):
+    """
+    The values read from the header and index of a VCF/BCF file that are
+    needed to populate a VariantSet: the contigs in the index and whether
+    each has records, the header's version, INFO and FORMAT fields and
+    samples, and the type of its annotations. These are plain values, so
+    that files can be scanned in worker processes.
+    """
+    def __init__(self, varFile, dataUrl, indexFile):
+        self.dataUrl = dataUrl
+        self.indexFile = indexFile
+        self.indexed = varFile.index is not None
+        # The (contig, hasRecords) pairs in the order of the index.
+        self.contigs = []
+        if self.indexed:
+            for chrom in varFile.index:
+                # Unlike Tabix indices, CSI indices include all contigs
+                # defined in the BCF header.  Thus we must test each one to
+                # see if records exist or else they are likely to trigger
+                # spurious overlapping errors.
+                chrom = HtslibVariantSet.sanitizeVariantFileFetch(chrom)[0]
+                self.contigs.append(
+                    (chrom, not isEmptyIter(varFile.fetch(chrom))))
+        header = varFile.header
+        self.version = header.version
+        self.formats = [
+            (value.name, value.type, value.number, value.description)
+            for _, value in header.formats.items()]
+        self.infos = [
+            (value.name, value.type, value.number, value.description)
+            for _, value in header.info.items()]
+        self.samples = list(header.samples)
+        # Unsupported annotations are only an error if this file's
+        # annotations are used, so the message is kept for the VariantSet.
+        self.annotationType = None
+        self.annotationError = None
+        try:
+            self.annotationType = getAnnotationType(header, dataUrl)
+        except ValueError as error:
+            self.annotationError = str(error)
+
+    def hasRecords(self):
+        """
+        Returns True if any of the contigs in this file has records.
+        """
+        return any(hasRecords for _, hasRecords in self.contigs)
+
+
+def scanVariantFile(dataUrlIndexFilePair):
+    """
+    Returns the VariantFileHeader for the specified (dataUrl, indexFile)
+    pair. This is a module function so that it can be run in a
+    multiprocessing Pool.
+    """
+    dataUrl, indexFile = dataUrlIndexFilePair
+    varFile = pysam.VariantFile(dataUrl, index_filename=indexFile)
+    try:
+        return VariantFileHeader(varFile, dataUrl, indexFile)
+    finally:
+        varFile.close()
+
+
+def _scanVariantFileAt(indexedPair):
+    index, dataUrlIndexFilePair = indexedPair
+    return index, scanVariantFile(dataUrlIndexFilePair)
+
+
+def scanVariantFiles(dataUrlIndexFilePairs, numWorkers=1, progress=None):
+    """
+    Returns the list of VariantFileHeaders for the specified list of
+    (dataUrl, indexFile) pairs, in the same order. If numWorkers is
+    greater than 1, the files are scanned concurrently in a pool of this
+    many processes; if it is None, one process per CPU is used. If
+    progress is not None, it is called as progress(numScanned, numFiles)
+    as each file is scanned.
+    """
+    numFiles = len(dataUrlIndexFilePairs)
+    if numWorkers is None:
+        numWorkers = multiprocessing.cpu_count()
+    numWorkers = min(numWorkers, numFiles)
+    indexedPairs = list(enumerate(dataUrlIndexFilePairs))
+    pool = None
+    if numWorkers > 1:
+        pool = multiprocessing.Pool(numWorkers)
+        results = pool.imap_unordered(_scanVariantFileAt, indexedPairs)
+    else:
+        results = (_scanVariantFileAt(pair) for pair in indexedPairs)
+    headers = [None] * numFiles
+    try:
+        for numScanned, (index, header) in enumerate(results, 1):
+            headers[index] = header
+            if progress is not None:
+                progress(numScanned, numFiles)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return headers
+
+
+def getDefaultIndexFile(dataUrl):
+    """
+    Returns the default path of the index of the specified variant file.
+    BCF files are indexed with CSI indexes, and bgzipped VCF files with
+    either tabix or CSI indexes; we assume a tabix index unless only a
+    CSI index exists.
+    """
+    if dataUrl.endswith(BCF_EXTENSION):
+        return dataUrl + CSI_EXTENSION
+    if (not os.path.exists(dataUrl + TABIX_EXTENSION) and
+            os.path.exists(dataUrl + CSI_EXTENSION)):
+        return dataUrl + CSI_EXTENSION
+    return dataUrl + TABIX_EXTENSION
+
+
+def getBcfSidecarPath(dataUrl):
+    """
+    Returns the path of the BCF sidecar of the specified bgzipped VCF
+    file, which replaces its .vcf.gz extension with .bcf. Returns None if
+    the file is not a bgzipped VCF file.
+    """
+    if not dataUrl.endswith(VCF_EXTENSION):
+        return None
+    return dataUrl[:-len(VCF_EXTENSION)] + BCF_EXTENSION
+
+
+def getBcfSidecar(dataUrl):
+    """
+    Returns the (dataUrl, indexFile) pair of the BCF sidecar of the
+    specified bgzipped VCF file, or None if the file has no indexed BCF
+    sidecar that is at least as recent as the VCF file itself.
+    """
+    bcfPath = getBcfSidecarPath(dataUrl)
+    if bcfPath is None:
+        return None
+    indexFile = bcfPath + CSI_EXTENSION
+    if not (os.path.exists(dataUrl) and os.path.exists(bcfPath) and
+            os.path.exists(indexFile)):
+        return None
+    if os.path.getmtime(bcfPath) < os.path.getmtime(dataUrl):
+        return None
+    return bcfPath, indexFile
+
+
+def getVariantFilesInDirectory(directory):
+    """
+    Returns the sorted list of the bgzipped VCF and BCF files in the
+    specified directory. Where a bgzipped VCF file has a BCF sidecar, only
+    one of the two is listed: the sidecar if it is indexed and up to date,
+    as for getBcfSidecar, and the VCF file otherwise.
+    """
+    bcfFiles = set(glob.glob(os.path.join(directory, "*" + BCF_EXTENSION)))
+    dataUrls = []
+    for vcfFile in glob.glob(os.path.join(directory, "*" + VCF_EXTENSION)):
+        bcfPath = getBcfSidecarPath(vcfFile)
+        if bcfPath in bcfFiles:
+            bcfFiles.remove(bcfPath)
+            if getBcfSidecar(vcfFile) is not None:
+                vcfFile = bcfPath
+        dataUrls.append(vcfFile)
+    return sorted(dataUrls + list(bcfFiles))
+
+
+def transcodeVcfToBcf(dataUrl, indexFile, bcfPath):
+    """
+    Writes the records of the specified indexed, bgzipped VCF file to a
+    BCF file at the specified path and builds its CSI index. Returns the
+    path of the index.
+    """
+    # pysam requires byte strings for paths and contig names.
+    bcfPath = str(bcfPath)
+    vcfFile = pysam.VariantFile(str(dataUrl), index_filename=str(indexFile))
+    try:
+        header = vcfFile.header.copy()
+        # BCF records refer to contigs by their index in the header, so
+        # every contig with records must be declared there. VCF files
+        # do not require this.
+        if vcfFile.index is not None:
+            for contig in vcfFile.index:
+                contig = str(contig)
+                if contig not in header.contigs:
+                    header.contigs.add(contig)
+        bcfFile = pysam.VariantFile(bcfPath, b"wb", header=header)
+        try:
+            for record in vcfFile:
+                bcfFile.write(record)
+        finally:
+            bcfFile.close()
+    finally:
+        vcfFile.close()
+    # pysam does not reset the option parser of the bcftools commands
+    # between calls, so we remove any stale index rather than passing -f.
+    indexPath = bcfPath + CSI_EXTENSION
+    if os.path.exists(indexPath):
+        os.unlink(indexPath)
+    # bcftools index writes nothing to stdout, and capturing it fails
+    # when sys.stdout is not a real file.
+    pysam.bcftools.index(bcfPath, catch_stdout=False)
+    return indexPath
+
+
 class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
     """
     Class representing a single variant set backed by a directory of indexed
@@ -437,6 +1659,8 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         super(HtslibVariantSet, self).__init__(parentContainer, localId)
         self._chromFileMap = {}
         self._metadata = None
+        self._idIndexFile = None
+        self._statistics = None
 
     def isAnnotated(self):
         """
@@ -457,6 +1681,52 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         """
         return set(self._chromFileMap.values())
 
+    def getIdIndexFile(self):
+        """
+        Returns the path of the VariantIdIndex for this VariantSet, or None
+        if variants are looked up using the tabix index.
+        """
+        return self._idIndexFile
+
+    def buildIdIndex(self, idIndexFile):
+        """
+        Builds a VariantIdIndex for the BCF files in this VariantSet at the
+        specified path, and uses it to look up variants by ID. Variants in
+        VCF files are still looked up through the tabix index.
+        """
+        with VariantIdIndex(idIndexFile) as idIndex:
+            idIndex.createTable()
+            for dataUrlIndexFilePair in self.getDataUrlIndexPairs():
+                if not dataUrlIndexFilePair[0].endswith(BCF_EXTENSION):
+                    continue
+                varFile = self.openFile(dataUrlIndexFilePair, samples=[])
+                try:
+                    idIndex.insertOffsets(varFile, dataUrlIndexFilePair[0])
+                finally:
+                    varFile.close()
+        self._idIndexFile = idIndexFile
+
+    def getStatistics(self):
+        """
+        Returns the VariantSetStatistics for this VariantSet, or None if
+        these were not computed when it was added to the repository.
+        """
+        return self._statistics
+
+    def computeStatistics(self):
+        """
+        Computes the VariantSetStatistics for this VariantSet by reading
+        through each of its variant files once.
+        """
+        statistics = VariantSetStatistics()
+        for dataUrlIndexFilePair in self.getDataUrlIndexPairs():
+            varFile = self.openFile(dataUrlIndexFilePair, samples=[])
+            try:
+                statistics.addVariantFile(varFile)
+            finally:
+                varFile.close()
+        self._statistics = statistics
+
     def populateFromRow(self, row):
         """
         Populates this VariantSet from the specified DB row.
@@ -473,34 +1743,40 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
             metadata = protocol.fromJson(json.dumps(jsonDict),
                                          protocol.VariantSetMetadata)
             self._metadata.append(metadata)
+        # Repos created before the ID index was supported do not have
+        # this column.
+        if b'idIndexFile' in row.keys():
+            self._idIndexFile = row[b'idIndexFile']
+        if b'stats' in row.keys() and row[b'stats'] is not None:
+            self._statistics = VariantSetStatistics.fromJsonDict(
+                json.loads(row[b'stats']))
 
-    def populateFromFile(self, dataUrls, indexFiles):
+    def populateFromFile(
+            self, dataUrls, indexFiles, numWorkers=1, progress=None):
         """
         Populates this variant set using the specified lists of data
         files and indexes. These must be in the same order, such that
-        the jth index file corresponds to the jth data file.
+        the jth index file corresponds to the jth data file. The headers
+        and indexes are scanned by scanVariantFiles using the specified
+        numWorkers and progress function, and the results are merged in
+        the order of the files.
         """
         assert len(dataUrls) == len(indexFiles)
-        for dataUrl, indexFile in zip(dataUrls, indexFiles):
-            varFile = pysam.VariantFile(dataUrl, index_filename=indexFile)
-            try:
-                self._populateFromVariantFile(varFile, dataUrl, indexFile)
-            finally:
-                varFile.close()
+        headers = scanVariantFiles(
+            zip(dataUrls, indexFiles), numWorkers, progress)
+        for header in headers:
+            self._populateFromVariantFileHeader(header)
 
-    def populateFromDirectory(self, vcfDirectory):
+    def populateFromDirectory(
+            self, vcfDirectory, numWorkers=1, progress=None):
         """
-        Populates this VariantSet by examing all the VCF files in the
-        specified directory. This is mainly used for as a convenience
+        Populates this VariantSet by examing all the VCF and BCF files in
+        the specified directory. This is mainly used for as a convenience
         for testing purposes.
         """
-        pattern = os.path.join(vcfDirectory, "*.vcf.gz")
-        dataFiles = []
-        indexFiles = []
-        for vcfFile in glob.glob(pattern):
-            dataFiles.append(vcfFile)
-            indexFiles.append(vcfFile + ".tbi")
-        self.populateFromFile(dataFiles, indexFiles)
+        dataFiles = getVariantFilesInDirectory(vcfDirectory)
+        indexFiles = [getDefaultIndexFile(dataFile) for dataFile in dataFiles]
+        self.populateFromFile(dataFiles, indexFiles, numWorkers, progress)
 
     def getVcfHeaderReferenceSetName(self):
         """
@@ -509,157 +1785,197 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         # TODO implemenent
         return None
 
-    def checkConsistency(self):
+    def checkConsistency(self, numWorkers=1, progress=None):
         """
-        Perform consistency check on the variant set
+        Perform consistency check on the variant set. The files are
+        scanned by scanVariantFiles using the specified numWorkers and
+        progress function.
         """
-        for referenceName, (dataUrl, indexFile) in self._chromFileMap.items():
-            varFile = pysam.VariantFile(dataUrl, index_filename=indexFile)
-            try:
-                for chrom in varFile.index:
-                    chrom, _, _ = self.sanitizeVariantFileFetch(chrom)
-                    if not isEmptyIter(varFile.fetch(chrom)):
-                        self._checkMetadata(varFile)
-                        self._checkCallSetIds(varFile)
-            finally:
-                varFile.close()
+        headers = scanVariantFiles(
+            sorted(self.getDataUrlIndexPairs()), numWorkers, progress)
+        for header in headers:
+            if header.hasRecords():
+                self._checkMetadata(header)
+                self._checkCallSetIds(header)
 
-    def _populateFromVariantFile(self, varFile, dataUrl, indexFile):
+    def _populateFromVariantFileHeader(self, header):
         """
         Populates the instance variables of this VariantSet from the specified
-        pysam VariantFile object.
-        """
-        if varFile.index is None:
-            raise exceptions.NotIndexedException(dataUrl)
-        for chrom in varFile.index:
-            # Unlike Tabix indices, CSI indices include all contigs defined
-            # in the BCF header.  Thus we must test each one to see if
-            # records exist or else they are likely to trigger spurious
-            # overlapping errors.
-            chrom, _, _ = self.sanitizeVariantFileFetch(chrom)
-            if not isEmptyIter(varFile.fetch(chrom)):
+        VariantFileHeader.
+        """
+        if not header.indexed:
+            raise exceptions.NotIndexedException(header.dataUrl)
+        for chrom, hasRecords in header.contigs:
+            if hasRecords:
                 if chrom in self._chromFileMap:
-                    raise exceptions.OverlappingVcfException(dataUrl, chrom)
-            self._chromFileMap[chrom] = dataUrl, indexFile
-        self._updateMetadata(varFile)
-        self._updateCallSetIds(varFile)
-        self._updateVariantAnnotationSets(varFile, dataUrl)
+                    raise exceptions.OverlappingVcfException(
+                        header.dataUrl, chrom)
+                self._chromFileMap[chrom] = header.dataUrl, header.indexFile
+        self._updateMetadata(header)
+        self._updateCallSetIds(header)
+        self._updateVariantAnnotationSets(header)
 
-    def _updateVariantAnnotationSets(self, variantFile, dataUrl):
+    def _updateVariantAnnotationSets(self, header):
         """
         Updates the variant annotation set associated with this variant using
-        information in the specified pysam variantFile.
+        information in the specified VariantFileHeader.
         """
         # TODO check the consistency of this between VCF files.
         if not self.isAnnotated():
-            annotationType = None
-            for record in variantFile.header.records:
-                if record.type == "GENERIC":
-                    if record.key == "SnpEffVersion":
-                        annotationType = ANNOTATIONS_SNPEFF
-                    elif record.key == "VEP":
-                        version = record.value.split()[0]
-                        # TODO we need _much_ more sophisticated processing
-                        # of VEP versions here. When do they become
-                        # incompatible?
-                        if version == "v82":
-                            annotationType = ANNOTATIONS_VEP_V82
-                        elif version == "v77":
-                            annotationType = ANNOTATIONS_VEP_V77
-                        else:
-                            # TODO raise a proper typed exception there with
-                            # the file name as an argument.
-                            raise ValueError(
-                                "Unsupported VEP version {} in '{}'".format(
-                                    version, dataUrl))
-            if annotationType is None:
-                infoKeys = variantFile.header.info.keys()
-                if 'CSQ' in infoKeys or 'ANN' in infoKeys:
-                    # TODO likewise, we want a properly typed exception that
-                    # we can throw back to the repo manager UI and display
-                    # as an import error.
-                    raise ValueError(
-                        "Unsupported annotations in '{}'".format(dataUrl))
-            if annotationType is not None:
+            if header.annotationError is not None:
+                raise ValueError(header.annotationError)
+            if header.annotationType is not None:
+                # The analysis is built from the full header, which is read
+                # again from this one file.
                 vas = HtslibVariantAnnotationSet(self, self.getLocalId())
-                vas.populateFromFile(variantFile, annotationType)
+                variantFile = self.openFile(
+                    (header.dataUrl, header.indexFile))
+                try:
+                    vas.populateFromFile(variantFile, header.annotationType)
+                finally:
+                    variantFile.close()
                 self.addVariantAnnotationSet(vas)
 
-    def _updateMetadata(self, variantFile):
+    def _updateMetadata(self, header):
         """
         Updates the metadata for his variant set based on the specified
-        variant file
+        VariantFileHeader
         """
-        metadata = self._getMetadataFromVcf(variantFile)
+        metadata = self._getMetadataFromHeader(header)
         if self._metadata is None:
             self._metadata = metadata
 
-    def _checkMetadata(self, variantFile):
+    def _checkMetadata(self, header):
         """
         Checks that metadata is consistent
         """
-        metadata = self._getMetadataFromVcf(variantFile)
+        metadata = self._getMetadataFromHeader(header)
         if self._metadata is not None and self._metadata != metadata:
-            raise exceptions.InconsistentMetaDataException(
-                variantFile.filename)
+            raise exceptions.InconsistentMetaDataException(header.dataUrl)
 
-    def _checkCallSetIds(self, variantFile):
+    def _checkCallSetIds(self, header):
         """
         Checks callSetIds for consistency
         """
         if len(self._callSetIdMap) > 0:
             callSetIds = set([
-                self.getCallSetId(sample)
-                for sample in variantFile.header.samples])
+                self.getCallSetId(sample) for sample in header.samples])
             if callSetIds != set(self._callSetIdMap.keys()):
                 raise exceptions.InconsistentCallSetIdException(
-                    variantFile.filename)
+                    header.dataUrl)
 
     def getNumVariants(self):
         """
-        Returns the total number of variants in this VariantSet.
+        Returns the total number of variants in this VariantSet, or 0 if
+        the statistics for this VariantSet have not been computed.
         """
-        # TODO How do we get the number of records in a VariantFile?
-        return 0
+        if self._statistics is None:
+            return 0
+        return self._statistics.getNumVariants()
 
-    def _updateCallSetIds(self, variantFile):
+    def _updateCallSetIds(self, header):
         """
-        Updates the call set IDs based on the specified variant file.
+        Updates the call set IDs based on the specified VariantFileHeader.
         """
         if len(self._callSetIdMap) == 0:
-            for sample in variantFile.header.samples:
+            for sample in header.samples:
                 self.addCallSetFromName(sample)
 
-    def openFile(self, dataUrlIndexFilePair):
+    def openFile(self, dataUrlIndexFilePair, samples=None):
+        """
+        Opens the specified variant file. If samples is not None, only
+        the columns of this list of sample names are decoded, and the
+        records of the file contain only these samples.
+        """
         dataUrl, indexFile = dataUrlIndexFilePair
-        return pysam.VariantFile(dataUrl, index_filename=indexFile)
+        varFile = pysam.VariantFile(dataUrl, index_filename=indexFile)
+        if samples is not None:
+            varFile.subset_samples(samples)
+        return varFile
+
+    def _openSampleSubset(self, dataUrlIndexFileSamples):
+        dataUrl, indexFile, samples = dataUrlIndexFileSamples
+        return self.openFile((dataUrl, indexFile), list(samples))
+
+    def getSampleSubsetFileHandle(self, dataUrlIndexFilePair, samples):
+        """
+        Returns a cached handle on the specified variant file that decodes
+        only the columns of the specified list of sample names, or all
+        samples if this is None. Parsing the sample columns dominates the
+        cost of reading wide VCF files, so queries for a few CallSets, or
+        none, are much faster on such a handle. As pysam cannot change
+        the samples of an open file, a handle is cached for each subset.
+        """
+        if samples is not None:
+            samples = tuple(sorted(set(samples)))
+            if len(samples) == len(self._callSetIds):
+                samples = None
+        if samples is None:
+            return self.getFileHandle(dataUrlIndexFilePair)
+        return datamodel.fileHandleCache.getFileHandle(
+            tuple(dataUrlIndexFilePair) + (samples,), self._openSampleSubset)
 
-    def _convertGaCall(self, callSet, pysamCall):
-        phaseset = None
+    def getSampleNames(self, callSetIds):
+        """
+        Returns the list of sample names of the specified callSetIds.
+        """
+        return [
+            str(self.getCallSet(callSetId).getSampleName())
+            for callSetId in callSetIds]
+
+    def _convertGaCall(self, call, callSetName, callSetId, pysamCall):
+        """
+        Fills in the specified GA Call from the specified pysam call.
+        """
+        call.call_set_name = callSetName
+        call.call_set_id = callSetId
+        # Alleles that are not called are represented by -1.
+        call.genotype.extend(
+            -1 if allele is None else allele
+            for allele in pysamCall.allele_indices)
         if pysamCall.phased:
-            phaseset = str(pysamCall.phased)
-        genotypeLikelihood = []
-        info = {}
+            call.phaseset = str(pysamCall.phased)
         for key, value in pysamCall.iteritems():
             if key == 'GL' and value is not None:
-                genotypeLikelihood = list(value)
+                # Missing likelihoods are kept as NaN so that the others
+                # stay at the index of their genotype; a GL that is
+                # missing entirely is left empty.
+                if any(likelihood is not None for likelihood in value):
+                    call.genotype_likelihood.extend(
+                        float('nan') if likelihood is None else likelihood
+                        for likelihood in value)
             elif key != 'GT':
-                info[key] = _encodeValue(value)
-        call = protocol.Call()
-        call.call_set_name = callSet.getSampleName()
-        call.call_set_id = callSet.getId()
-        call.genotype.extend(list(pysamCall.allele_indices))
-        call.phaseset = pb.string(phaseset)
-        call.genotype_likelihood.extend(genotypeLikelihood)
-        for key in info:
-            call.info[key].values.extend(info[key])
-        return call
-
-    def convertVariant(self, record, callSetIds):
+                _addEncodedValues(call.info[key].values, value)
+
+    def getCallSetLookups(self, callSetIds, header):
+        """
+        Returns the list of (sampleIndex, sampleName, callSetId) tuples
+        for the specified list of callSetIds, where sampleIndex is the
+        index of the corresponding sample in VCF records with the
+        specified pysam header. These are resolved once per query, so
+        that converting each record does not require looking up every
+        CallSet again.
+        """
+        sampleIndexes = dict(
+            (sampleName, index)
+            for index, sampleName in enumerate(header.samples))
+        callSetLookups = []
+        for callSetId in callSetIds:
+            sampleName = self.getCallSet(callSetId).getSampleName()
+            callSetLookups.append(
+                (sampleIndexes[str(sampleName)], sampleName, callSetId))
+        return callSetLookups
+
+    def convertVariant(
+            self, record, callSetIds, callSetLookups=None, alleleHashes=None):
         """
         Converts the specified pysam variant record into a GA4GH Variant
         object. Only calls for the specified list of callSetIds will
-        be included.
+        be included. If callSetLookups is provided, it must be the
+        result of calling getCallSetLookups for these callSetIds and the
+        header of the file handle the record was read from; otherwise
+        each sample is looked up by name. The alleleHashes dictionary is
+        passed on to getPysamVariantId.
         """
         variant = self._createGaVariant()
         variant.reference_name = record.contig
@@ -676,13 +1992,20 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
             if value is not None:
                 if isinstance(value, str):
                     value = value.split(',')
-                variant.info[key].values.extend(_encodeValue(value))
-        for callSetId in callSetIds:
-            callSet = self.getCallSet(callSetId)
-            pysamCall = record.samples[str(callSet.getSampleName())]
-            variant.calls.add().CopyFrom(
-                self._convertGaCall(callSet, pysamCall))
-        variant.id = self.getVariantId(variant)
+                _addEncodedValues(variant.info[key].values, value)
+        if len(callSetIds) > 0:
+            if callSetLookups is None:
+                callSetLookups = []
+                for callSetId in callSetIds:
+                    sampleName = self.getCallSet(callSetId).getSampleName()
+                    callSetLookups.append(
+                        (str(sampleName), sampleName, callSetId))
+            samples = record.samples
+            calls = variant.calls
+            for sampleIndex, sampleName, callSetId in callSetLookups:
+                self._convertGaCall(
+                    calls.add(), sampleName, callSetId, samples[sampleIndex])
+        variant.id = self.getPysamVariantId(record, alleleHashes)
         return variant
 
     def getVariant(self, compoundId):
@@ -691,51 +2014,200 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         else:
             raise exceptions.ObjectNotFoundException(compoundId)
         start = int(compoundId.start)
-        referenceName, startPosition, endPosition = \
-            self.sanitizeVariantFileFetch(
-                compoundId.reference_name, start, start + 1)
-        cursor = self.getFileHandle(varFileName).fetch(
-            referenceName, startPosition, endPosition)
+        varFile = self.getFileHandle(varFileName)
+        if self._idIndexFile is not None and \
+                varFileName[0].endswith(BCF_EXTENSION):
+            cursor = self._getIndexedRecords(
+                varFileName, compoundId.reference_name, start)
+        else:
+            referenceName, startPosition, endPosition = \
+                self.sanitizeVariantFileFetch(
+                    compoundId.reference_name, start, start + 1)
+            cursor = varFile.fetch(referenceName, startPosition, endPosition)
+        hashFunction = variantHasher.getHashFunctionForHash(compoundId.md5)
         for record in cursor:
-            variant = self.convertVariant(record, self._callSetIds)
             if (record.start == start and
-                    compoundId.md5 == self.hashVariant(variant)):
-                return variant
+                    compoundId.md5 == self._hashPysamAlleles(
+                        record, hashFunction)):
+                callSetLookups = self.getCallSetLookups(
+                    self._callSetIds, varFile.header)
+                return self.convertVariant(
+                    record, self._callSetIds, callSetLookups)
             elif record.start > start:
                 raise exceptions.ObjectNotFoundException()
         raise exceptions.ObjectNotFoundException(compoundId)
 
-    def getPysamVariants(self, referenceName, startPosition, endPosition):
+    def _getIndexedRecords(self, dataUrlIndexFilePair, referenceName, start):
+        """
+        Returns an iterator over the pysam VCF records on the specified
+        reference in the specified variant file from the first record
+        starting at the specified position, as located by the
+        VariantIdIndex. Seeking the cached handle would move it under any
+        other query iterating over it, so the records are read from a
+        handle of their own, which is closed with the iterator.
+        """
+        with VariantIdIndex(self._idIndexFile) as idIndex:
+            offset = idIndex.getOffset(referenceName, start)
+        if offset is not None:
+            varFile = self.openFile(dataUrlIndexFilePair)
+            try:
+                varFile.seek(offset)
+                for record in varFile:
+                    if record.contig != referenceName:
+                        break
+                    yield record
+            finally:
+                varFile.close()
+
+    def getPysamVariants(
+            self, referenceName, startPosition, endPosition,
+            variantFilter=None, samples=None):
         """
         Returns an iterator over the pysam VCF records corresponding to the
-        specified query.
+        specified query. If variantFilter is specified, it must be a
+        function returned by compileVariantFilter, and only the records
+        satisfying it are returned. If samples is not None, the records
+        contain only the columns of this list of sample names, as for
+        getSampleSubsetFileHandle.
+        """
+        _, cursor = self._fetchPysamVariants(
+            referenceName, startPosition, endPosition, variantFilter,
+            samples)
+        for record in cursor:
+            yield record
+
+    def _fetchPysamVariants(
+            self, referenceName, startPosition, endPosition,
+            variantFilter=None, samples=None):
         """
-        if referenceName in self._chromFileMap:
-            varFileName = self._chromFileMap[referenceName]
-            referenceName, startPosition, endPosition = \
-                self.sanitizeVariantFileFetch(
-                    referenceName, startPosition, endPosition)
-            cursor = self.getFileHandle(varFileName).fetch(
+        Returns a (header, cursor) tuple for the specified query, where
+        cursor is an iterator over the records as for getPysamVariants,
+        and header is the pysam header of the file handle they are read
+        from, or None if there is no data for the specified reference.
+        """
+        if referenceName not in self._chromFileMap:
+            return None, iter([])
+        varFileName = self._chromFileMap[referenceName]
+        referenceName, startPosition, endPosition = \
+            self.sanitizeVariantFileFetch(
                 referenceName, startPosition, endPosition)
-            for record in cursor:
-                yield record
+        varFile = self.getSampleSubsetFileHandle(varFileName, samples)
+        cursor = varFile.fetch(referenceName, startPosition, endPosition)
+        if variantFilter is not None:
+            cursor = (record for record in cursor if variantFilter(record))
+        return varFile.header, cursor
 
     def getVariants(self, referenceName, startPosition, endPosition,
-                    callSetIds=[]):
+                    callSetIds=[], variantFilter=None):
         """
         Returns an iterator over the specified variants. The parameters
         correspond to the attributes of a GASearchVariantsRequest object.
+        The variantFilter is applied to the records before conversion, as
+        for getPysamVariants. Unfiltered queries are served through the
+        regionCache, so the returned objects may be shared and must not
+        be modified.
+        """
+        callSetIds = self._getRequestedCallSetIds(callSetIds)
+        if variantFilter is not None or \
+                referenceName not in self._chromFileMap:
+            variantIter = self._getVariants(
+                referenceName, startPosition, endPosition, callSetIds,
+                variantFilter)
+        else:
+            _, startPosition, endPosition = self.sanitizeVariantFileFetch(
+                referenceName, startPosition, endPosition)
+            key = (
+                self.getId(), self._chromFileMap[referenceName],
+                tuple(callSetIds), variantHasher.getHashFunction())
+            variantIter = regionCache.getObjects(
+                key, referenceName, startPosition, endPosition,
+                lambda start, end: self._getVariants(
+                    referenceName, start, end, callSetIds),
+                _getVariantInterval)
+        for variant in variantIter:
+            yield variant
+
+    def _getVariants(
+            self, referenceName, startPosition, endPosition, callSetIds,
+            variantFilter=None):
+        header, cursor = self._fetchPysamVariants(
+            referenceName, startPosition, endPosition, variantFilter,
+            self.getSampleNames(callSetIds))
+        if header is not None:
+            # All records for a reference come from the same file, so the
+            # lookups only need to be resolved once.
+            callSetLookups = self.getCallSetLookups(callSetIds, header)
+            alleleHashes = {}
+            for record in cursor:
+                yield self.convertVariant(
+                    record, callSetIds, callSetLookups, alleleHashes)
+
+    def _getRequestedCallSetIds(self, callSetIds):
+        """
+        Returns the specified list of callSetIds, or all of the callSetIds
+        in this VariantSet if this is None. Raises a
+        CallSetNotInVariantSetException if any of the callSetIds are not
+        in this VariantSet.
         """
         if callSetIds is None:
-            callSetIds = self._callSetIds
+            return self._callSetIds
+        for callSetId in callSetIds:
+            if callSetId not in self._callSetIdToIndex:
+                raise exceptions.CallSetNotInVariantSetException(
+                    callSetId, self.getId())
+        return callSetIds
+
+    def _hashPysamAlleles(self, record, hashFunction=None):
+        """
+        Returns the hash of the alleles of the specified pysam variant
+        record, as produced by hashVariant for the corresponding GA Variant.
+        """
+        alternateBases = []
+        if record.alts is not None:
+            alternateBases = [alt.decode() for alt in record.alts]
+        return self.hashAlleles(record.ref, alternateBases, hashFunction)
+
+    def getPysamVariantId(self, record, alleleHashes=None):
+        """
+        Returns the ID of the GA Variant corresponding to the specified
+        pysam variant record, without converting the record. If
+        alleleHashes is provided, it is used to memoize the hashes of the
+        alleles seen so far within the current query; most records share
+        one of a few common allele combinations, so this avoids hashing
+        each record.
+        """
+        if alleleHashes is None:
+            hash_ = self._hashPysamAlleles(record)
         else:
-            for callSetId in callSetIds:
-                if callSetId not in self._callSetIds:
-                    raise exceptions.CallSetNotInVariantSetException(
-                        callSetId, self.getId())
-        for record in self.getPysamVariants(
-                referenceName, startPosition, endPosition):
-            yield self.convertVariant(record, callSetIds)
+            key = record.ref, record.alts
+            hash_ = alleleHashes.get(key)
+            if hash_ is None:
+                hash_ = self._hashPysamAlleles(record)
+                alleleHashes[key] = hash_
+        compoundId = datamodel.VariantCompoundId(
+            self.getCompoundId(), record.contig, str(record.start), hash_)
+        return str(compoundId)
+
+    def getGenotypeRecords(
+            self, referenceName, startPosition, endPosition, callSetIds=None,
+            variantFilter=None):
+        """
+        Returns an iterator over (record, variantId, callSetLookups)
+        tuples for the pysam variant records in the specified region,
+        where callSetLookups is the result of getCallSetLookups for the
+        specified callSetIds, or for all CallSets if this is None. The
+        variantFilter is applied as for getPysamVariants.
+        """
+        callSetIds = self._getRequestedCallSetIds(callSetIds)
+        header, cursor = self._fetchPysamVariants(
+            referenceName, startPosition, endPosition, variantFilter,
+            self.getSampleNames(callSetIds))
+        if header is not None:
+            callSetLookups = self.getCallSetLookups(callSetIds, header)
+            alleleHashes = {}
+            for record in cursor:
+                variantId = self.getPysamVariantId(record, alleleHashes)
+                yield record, variantId, callSetLookups
 
     def getMetadataId(self, metadata):
         """
@@ -744,13 +2216,9 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         return str(datamodel.VariantSetMetadataCompoundId(
             self.getCompoundId(), 'metadata:' + metadata.key))
 
-    def _getMetadataFromVcf(self, varFile):
-        # All the metadata is available via each varFile.header, including:
-        #    records: header records
+    def _getMetadataFromHeader(self, header):
+        # The metadata is built from the VariantFileHeader, including:
         #    version: VCF version
-        #    samples -- not immediately needed
-        #    contigs -- not immediately needed
-        #    filters -- not immediately needed
         #    info
         #    formats
 
@@ -769,23 +2237,20 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
             return metadata
 
         ret = []
-        header = varFile.header
         ret.append(buildMetadata(key="version", value=header.version))
-        formats = header.formats.items()
-        infos = header.info.items()
         # TODO: currently ALT field is not implemented through pysam
         # NOTE: contigs field is different between vcf files,
         # so it's not included in metadata
         # NOTE: filters in not included in metadata unless needed
-        for prefix, content in [("FORMAT", formats), ("INFO", infos)]:
-            for contentKey, value in content:
-                description = value.description.strip('"')
-                key = "{0}.{1}".format(prefix, value.name)
+        for prefix, content in [
+                ("FORMAT", header.formats), ("INFO", header.infos)]:
+            for name, type_, number, description in content:
+                key = "{0}.{1}".format(prefix, name)
                 if key != "FORMAT.GT":
                     ret.append(buildMetadata(
-                        key=key, type_=value.type,
-                        number="{}".format(value.number),
-                        description=description))
+                        key=key, type_=type_,
+                        number="{}".format(number),
+                        description=description.strip('"')))
         return ret
 
 #############################################
@@ -891,7 +2356,8 @@ class AbstractVariantAnnotationSet(datamodel.DatamodelObject):
             "{}\t{}\t{}\t{}".format(
                 gaTranscriptEffect.alternate_bases,
                 gaTranscriptEffect.feature_id,
-                effs, gaTranscriptEffect.hgvs_annotation)
+                effs,
+                _hgvsAnnotationToString(gaTranscriptEffect.hgvs_annotation))
             ).hexdigest()
 
     def hashVariantAnnotation(cls, gaVariant, gaVariantAnnotation):
@@ -923,12 +2389,17 @@ class AbstractVariantAnnotationSet(datamodel.DatamodelObject):
 class SimulatedVariantAnnotationSet(AbstractVariantAnnotationSet):
     """
     A variant annotation set that doesn't derive from a data store.
-    Used mostly for testing.
+    Used mostly for testing and benchmarking. Each variant is annotated
+    with numTranscriptEffects transcript effects for each alternate
+    allele.
     """
-    def __init__(self, variantSet, localId, randomSeed):
+    def __init__(
+            self, variantSet, localId, randomSeed, numTranscriptEffects=1):
         super(SimulatedVariantAnnotationSet, self).__init__(
             variantSet, localId)
         self._randomSeed = randomSeed
+        self._featureIds = ["E4TB33F"] + [
+            "E4TB33F.{}".format(i) for i in range(1, numTranscriptEffects)]
         self._analysis = self._createAnalysis()
 
     def _createAnalysis(self):
@@ -946,7 +2417,14 @@ class SimulatedVariantAnnotationSet(AbstractVariantAnnotationSet):
         ann = self.generateVariantAnnotation(variant, randomNumberGenerator)
         return ann
 
-    def getVariantAnnotations(self, referenceName, start, end):
+    def getVariantAnnotations(
+            self, referenceName, start, end, effectIds=None, geneName=None,
+            featureId=None, impact=None):
+        if geneName is not None or featureId is not None or \
+                impact is not None:
+            raise exceptions.NotImplementedException(
+                "Searching by gene, feature or impact is not supported for "
+                "this VariantAnnotationSet")
         for variant in self._variantSet.getVariants(referenceName, start, end):
             yield variant, self.generateVariantAnnotation(variant)
 
@@ -966,12 +2444,13 @@ class SimulatedVariantAnnotationSet(AbstractVariantAnnotationSet):
         ann.variant_annotation_set_id = str(self.getCompoundId())
         ann.variant_id = variant.id
         ann.created = datetime.datetime.now().isoformat() + "Z"
-        # make a transcript effect for each alternate base element
-        # multiplied by a random integer (1,5)
+        # make a transcript effect for each feature and alternate base
+        # element
         for base in variant.alternate_bases:
-            ann.transcript_effects.add().CopyFrom(
-                self.generateTranscriptEffect(
-                    variant, ann, base, randomNumberGenerator))
+            for featureId in self._featureIds:
+                ann.transcript_effects.add().CopyFrom(
+                    self.generateTranscriptEffect(
+                        variant, ann, base, randomNumberGenerator, featureId))
         ann.id = self.getVariantAnnotationId(variant, ann)
         return ann
 
@@ -1017,11 +2496,12 @@ class SimulatedVariantAnnotationSet(AbstractVariantAnnotationSet):
         return effect
 
     def generateTranscriptEffect(
-            self, variant, ann, alts, randomNumberGenerator):
+            self, variant, ann, alts, randomNumberGenerator,
+            featureId="E4TB33F"):
         effect = self._createGaTranscriptEffect()
         effect.alternate_bases = alts
         # TODO how to make these featureIds sensical?
-        effect.feature_id = "E4TB33F"
+        effect.feature_id = featureId
         effect = self._addTranscriptEffectLocations(effect, ann, variant)
         effect = self._addTranscriptEffectOntologyTerm(
             effect, randomNumberGenerator)
@@ -1032,16 +2512,329 @@ class SimulatedVariantAnnotationSet(AbstractVariantAnnotationSet):
         return effect
 
 
+_hgvsCPattern = re.compile(r".*c.(\d+)(\D+)>(\D+)")
+_hgvsPPattern = re.compile(r".*p.(\D+)(\d+)(\D+)", flags=re.UNICODE)
+
+
+def _parsePosition(pos):
+    """
+    Returns the zero-based start of the specified position/length string
+    from an annotation, or None if it cannot be parsed.
+    """
+    if isUnspecified(pos):
+        return None
+    coordLen = pos.split('/')
+    if len(coordLen) > 1:
+        return int(coordLen[0]) - 1
+    return None
+
+
+def _parseHgvsC(hgvsc):
+    """
+    Returns the tuple (start, referenceSequence, alternateSequence) for
+    the specified coding DNA HGVS annotation, or None if it cannot be
+    parsed.
+    """
+    if isUnspecified(hgvsc):
+        return None
+    match = _hgvsCPattern.match(hgvsc)
+    if match:
+        pos = int(match.group(1))
+        if pos > 0:
+            return pos - 1, match.group(2), match.group(3)
+    return None
+
+
+def _parseHgvsP(hgvsp):
+    """
+    Returns the tuple (start, referenceSequence, alternateSequence) for
+    the specified protein HGVS annotation, or None if it cannot be parsed.
+    """
+    if isUnspecified(hgvsp):
+        return None
+    match = _hgvsPPattern.match(hgvsp)
+    if match is not None:
+        return int(match.group(2)) - 1, match.group(1), match.group(3)
+    return None
+
+
+def _toAlleleLocation(location):
+    """
+    Returns a GA4GH AlleleLocation for the specified tuple (start,
+    referenceSequence, alternateSequence), or None if it is None.
+    """
+    if location is None:
+        return None
+    allLoc = protocol.AlleleLocation()
+    allLoc.start, allLoc.reference_sequence, allLoc.alternate_sequence = (
+        location)
+    return allLoc
+
+
+# Text format strings that can be written without escaping.
+_plainTextPattern = re.compile(r"^[ !#-&(-\[\]-~]*$")
+
+
+def _hgvsAnnotationToString(hgvsAnnotation):
+    """
+    Returns the protobuf text format of the specified HGVSAnnotation,
+    formatting the common case of values containing only printable ASCII
+    characters directly rather than using the text_format module.
+    """
+    values = (
+        ("genomic", hgvsAnnotation.genomic),
+        ("transcript", hgvsAnnotation.transcript),
+        ("protein", hgvsAnnotation.protein))
+    if not all(_plainTextPattern.match(value) for _, value in values):
+        return "{}".format(hgvsAnnotation)
+    return "".join(
+        '{}: "{}"\n'.format(name, value) for name, value in values if value)
+
+
+class TranscriptEffectParser(object):
+    """
+    Parses the annotations in the CSQ or ANN INFO field of an annotated
+    VCF into the fields needed to build a GA4GH TranscriptEffect. The
+    positions of these fields are taken from the annotation format given
+    in the description of the INFO field in the VCF header, so that the
+    field indexes are worked out once for each VariantAnnotationSet.
+    """
+    # The names used for each of the fields we read by VEP and SnpEff,
+    # with whitespace removed.
+    fieldNames = {
+        "alternateBases": ["Allele"],
+        "effects": ["Consequence", "Annotation"],
+        "featureId": ["Feature", "Feature_ID"],
+        "hgvsC": ["HGVSc", "HGVS.c"],
+        "hgvsP": ["HGVSp", "HGVS.p"],
+        "cdnaPosition": ["cDNA_position", "cDNA.pos/cDNA.length"],
+        "proteinPosition": ["Protein_position", "AA.pos/AA.length"],
+        # Older VEP versions only give the gene ID.
+        "gene": ["SYMBOL", "Gene_Name", "Gene"],
+        "impact": ["IMPACT", "Annotation_Impact"],
+    }
+    transcriptEffectFields = [
+        "alternateBases", "effects", "featureId", "hgvsC", "hgvsP",
+        "cdnaPosition", "proteinPosition"]
+    indexFields = ["gene", "featureId", "effects", "impact"]
+
+    def __init__(self, annotationFormat):
+        names = [re.sub(r"\s+", "", name) for name in annotationFormat]
+        self._numFields = len(names)
+        fieldIndexes = {}
+        for field, aliases in self.fieldNames.items():
+            # Fields that are not in the format are read from the empty
+            # string appended to each annotation.
+            fieldIndexes[field] = -1
+            for alias in aliases:
+                if alias in names:
+                    fieldIndexes[field] = names.index(alias)
+                    break
+        self._getFields = operator.itemgetter(*[
+            fieldIndexes[field] for field in self.transcriptEffectFields])
+        self._getIndexFields = operator.itemgetter(*[
+            fieldIndexes[field] for field in self.indexFields])
+
+    @classmethod
+    def parseFormat(cls, description):
+        """
+        Returns the list of field names in the annotation format given in
+        the specified INFO field description, or None if it does not
+        describe the format. VEP gives the format as "... Format:
+        Allele|Consequence|..." and SnpEff as "...: 'Allele | Annotation
+        | ...' ".
+        """
+        if "Format:" in description:
+            annotationFormat = description.split("Format:", 1)[1]
+        elif ":" in description:
+            annotationFormat = description.split(":", 1)[1]
+        else:
+            return None
+        annotationFormat = annotationFormat.strip().strip("'\"").strip()
+        names = [name.strip() for name in annotationFormat.split("|")]
+        if names[0] != "Allele":
+            return None
+        return names
+
+    def _split(self, annotation):
+        values = annotation.split("|")
+        if len(values) < self._numFields:
+            values.extend([""] * (self._numFields - len(values)))
+        values.append("")
+        return values
+
+    def parse(self, annotation):
+        """
+        Returns the tuple (alternateBases, effects, featureId, hgvsC,
+        hgvsP, cdnaPosition, proteinPosition) of strings from the
+        specified annotation.
+        """
+        return self._getFields(self._split(annotation))
+
+    def parseIndexFields(self, annotation):
+        """
+        Returns the tuple (gene, featureId, effects, impact) of strings
+        from the specified annotation, as stored in a
+        VariantAnnotationIndex.
+        """
+        return self._getIndexFields(self._split(annotation))
+
+
+class VariantAnnotationIndex(sqliteBackend.SqliteBackedDataSource):
+    """
+    An SQLite index of the annotations in the variant files of an
+    annotated VariantSet. There is a row for each SO effect of each
+    annotation, holding the gene, feature ID and impact of the annotation
+    along with the position of its record, so that the records matching a
+    search by effect, gene, feature or impact can be read directly rather
+    than by scanning the whole region. Records of BCF files are read at
+    their virtual file offset, and those of VCF files, which have no
+    offset, by a tabix query on their start position. The ID of the
+    record is also held so that the record read can be checked against
+    the index.
+    """
+    # SQLite limits the number of parameters in a statement.
+    _maxEffectsPerQuery = 500
+
+    def createTable(self):
+        """
+        Creates the (empty) annotations table in this index.
+        """
+        self._dbconn.execute("DROP TABLE IF EXISTS VariantAnnotation")
+        self._dbconn.execute("""
+            CREATE TABLE VariantAnnotation (
+                referenceName TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL,
+                offset INTEGER,
+                recordId TEXT,
+                gene TEXT,
+                featureId TEXT,
+                effect TEXT,
+                impact TEXT
+            );
+        """)
+        for column in ["effect", "gene", "featureId", "impact"]:
+            self._dbconn.execute(
+                "CREATE INDEX VariantAnnotation_{0} ON "
+                "VariantAnnotation ({0}, referenceName, start)".format(
+                    column))
+
+    def insertAnnotations(self, variantFile, dataUrl, infoKey, parser):
+        """
+        Inserts the annotations in the specified INFO field of all the
+        records in the specified pysam VariantFile, which must be
+        positioned at the first record of the file at dataUrl, using the
+        specified TranscriptEffectParser.
+        """
+        infoKey = infoKey.encode()
+
+        def rowIterator():
+            for offset, record in getVariantRecordOffsets(
+                    variantFile, dataUrl):
+                if infoKey not in record.info:
+                    continue
+                rows = set()
+                for annotation in record.info[infoKey]:
+                    gene, featureId, effects, impact = \
+                        parser.parseIndexFields(annotation)
+                    for effect in effects.split("&"):
+                        rows.add((gene, featureId, effect, impact))
+                for row in rows:
+                    yield (
+                        record.contig, record.start, record.stop,
+                        offset, record.id) + row
+        self._dbconn.executemany(
+            "INSERT INTO VariantAnnotation "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rowIterator())
+        self._dbconn.commit()
+
+    def getLocations(
+            self, referenceName, start, end, effects=None, gene=None,
+            featureId=None, impact=None):
+        """
+        Returns the sorted list of the (offset, start, recordId) tuples
+        locating the records overlapping the specified region with an
+        annotation matching all of the specified values. If effects is not
+        None, it is the collection of SO effect names to match.
+        """
+        conditions = ["referenceName = ?"]
+        values = [referenceName]
+        if start is not None:
+            conditions.append("end > ?")
+            values.append(start)
+        if end is not None:
+            conditions.append("start < ?")
+            values.append(end)
+        for column, value in [
+                ("gene", gene), ("featureId", featureId),
+                ("impact", impact)]:
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                values.append(value)
+        sql = (
+            "SELECT DISTINCT offset, start, recordId "
+            "FROM VariantAnnotation WHERE " + " AND ".join(conditions))
+        if effects is None:
+            queries = [(sql, values)]
+        else:
+            effects = sorted(effects)
+            queries = []
+            for j in range(0, len(effects), self._maxEffectsPerQuery):
+                chunk = effects[j:j + self._maxEffectsPerQuery]
+                queries.append((
+                    sql + " AND effect IN ({})".format(
+                        ", ".join("?" * len(chunk))),
+                    values + chunk))
+        locations = set()
+        for query, queryValues in queries:
+            for row in self._dbconn.execute(query, queryValues):
+                locations.add(
+                    (row[b'offset'], row[b'start'], row[b'recordId']))
+        return sorted(locations)
+
+
 class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
     """
     Class representing a single variant annotation derived from an
     annotated variant set.
     """
+    # The annotation formats used when the VCF header does not give them.
+    _defaultAnnotationFormats = {
+        ANNOTATIONS_VEP_V77: [
+            "Allele", "Gene", "Feature", "Feature_type", "Consequence",
+            "cDNA_position", "CDS_position", "Protein_position",
+            "Amino_acids", "Codons", "Existing_variation", "DISTANCE",
+            "STRAND", "SIFT", "PolyPhen", "MOTIF_NAME", "MOTIF_POS",
+            "HIGH_INF_POS", "MOTIF_SCORE_CHANGE"],
+        ANNOTATIONS_VEP_V82: [
+            "Allele", "Consequence", "IMPACT", "SYMBOL", "Gene",
+            "Feature_type", "Feature", "BIOTYPE", "EXON", "INTRON", "HGVSc",
+            "HGVSp", "cDNA_position", "CDS_position", "Protein_position",
+            "Amino_acids", "Codons", "Existing_variation", "DISTANCE",
+            "STRAND", "SYMBOL_SOURCE", "HGNC_ID", "HGVS_OFFSET"],
+        ANNOTATIONS_SNPEFF: [
+            "Allele", "Annotation", "Annotation_Impact", "Gene_Name",
+            "Gene_ID", "Feature_Type", "Feature_ID", "Transcript_BioType",
+            "Rank", "HGVS.c", "HGVS.p", "cDNA.pos / cDNA.length",
+            "CDS.pos / CDS.length", "AA.pos / AA.length", "Distance",
+            "ERRORS / WARNINGS / INFO"],
+    }
+
     def __init__(self, variantSet, localId):
         super(HtslibVariantAnnotationSet, self).__init__(variantSet, localId)
+        self._transcriptEffectParser = None
+        self._ontologyTermsMap = {}
+        self._indexFile = None
+
+    def setOntology(self, ontology):
+        super(HtslibVariantAnnotationSet, self).setOntology(ontology)
+        self._ontologyTermsMap = {}
 
     def populateFromFile(self, varFile, annotationType):
         self._annotationType = annotationType
+        self._transcriptEffectParser = None
         self._analysis = self._getAnnotationAnalysis(varFile)
         self._creationTime = self._analysis.created
         self._updatedTime = datetime.datetime.now().isoformat() + "Z"
@@ -1051,9 +2844,14 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         Populates this VariantAnnotationSet from the specified DB row.
         """
         self._annotationType = row[b'annotationType']
+        self._transcriptEffectParser = None
         self._analysis = protocol.fromJson(row[b'analysis'], protocol.Analysis)
         self._creationTime = row[b'created']
         self._updatedTime = row[b'updated']
+        # Repos created before the annotation index was supported do not
+        # have this column.
+        if b'indexFile' in row.keys():
+            self._indexFile = row[b'indexFile']
 
     def getAnnotationType(self):
         """
@@ -1062,6 +2860,34 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         """
         return self._annotationType
 
+    def getIndexFile(self):
+        """
+        Returns the path of the VariantAnnotationIndex for this
+        VariantAnnotationSet, or None if searches scan the requested region.
+        """
+        return self._indexFile
+
+    def buildIndex(self, indexFile):
+        """
+        Builds a VariantAnnotationIndex for the annotations in the variant
+        files of this VariantAnnotationSet at the specified path, and uses
+        it for searches by effect, gene, feature or impact.
+        """
+        parser = self.getTranscriptEffectParser()
+        infoKey = self._getAnnotationInfoKey()
+        variantSet = self._variantSet
+        with VariantAnnotationIndex(indexFile) as index:
+            index.createTable()
+            for dataUrlIndexFilePair in variantSet.getDataUrlIndexPairs():
+                varFile = variantSet.openFile(
+                    dataUrlIndexFilePair, samples=[])
+                try:
+                    index.insertAnnotations(
+                        varFile, dataUrlIndexFilePair[0], infoKey, parser)
+                finally:
+                    varFile.close()
+        self._indexFile = indexFile
+
     def _getAnnotationAnalysis(self, varFile):
         """
         Assembles metadata within the VCF header into a GA4GH Analysis object.
@@ -1111,28 +2937,233 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
             self._compoundId, "analysis"))
         return analysis
 
-    def getVariantAnnotations(self, referenceName, startPosition, endPosition):
+    def getVariantAnnotations(
+            self, referenceName, startPosition, endPosition, effectIds=None,
+            geneName=None, featureId=None, impact=None):
         """
         Generator for iterating through variant annotations in this
         variant annotation set.
         :param referenceName:
         :param startPosition:
         :param endPosition:
-        :return: generator of protocol.VariantAnnotation
-        """
-        # TODO Refactor this so that we use the annotationType information
-        # where it makes most sense, and rename the various methods so that
-        # it's clear what program/version combination they operate on.
-        variantIter = self._variantSet.getPysamVariants(
-            referenceName, startPosition, endPosition)
-        if self._annotationType == ANNOTATIONS_SNPEFF:
-            transcriptConverter = self.convertTranscriptEffectSnpEff
-        elif self._annotationType == ANNOTATIONS_VEP_V82:
-            transcriptConverter = self.convertTranscriptEffectVEP
+        :param effectIds: if not None, the set of SO term IDs of the
+            effects requested. Records whose annotations do not mention
+            any of these terms are skipped before conversion.
+        :param geneName: if not None, only records with an annotation
+            for this gene symbol are returned.
+        :param featureId: if not None, only records with an annotation
+            for this feature are returned.
+        :param impact: if not None, only records with an annotation of
+            this impact (e.g. HIGH or MODERATE) are returned. An
+            annotation must match all of geneName, featureId and impact.
+        :return: generator of (protocol.Variant,
+            protocol.VariantAnnotation) pairs. Queries are served
+            through the regionCache, so the returned objects may be
+            shared and must not be modified.
+        """
+        dataUrlIndexMap = self._variantSet.getReferenceToDataUrlIndexMap()
+        if referenceName not in dataUrlIndexMap:
+            return
+        _, startPosition, endPosition = \
+            self._variantSet.sanitizeVariantFileFetch(
+                referenceName, startPosition, endPosition)
+        if effectIds is not None:
+            effectIds = tuple(sorted(effectIds))
+        ontologyName = None
+        if self._ontology is not None:
+            ontologyName = self._ontology.getName()
+        key = (
+            self.getId(), dataUrlIndexMap[referenceName], ontologyName,
+            effectIds, geneName, featureId, impact,
+            variantHasher.getHashFunction())
+        for pair in regionCache.getObjects(
+                key, referenceName, startPosition, endPosition,
+                lambda start, end: self._getVariantAnnotations(
+                    referenceName, start, end, effectIds, geneName,
+                    featureId, impact),
+                _getVariantAnnotationInterval):
+            yield pair
+
+    def _getVariantAnnotations(
+            self, referenceName, startPosition, endPosition, effectIds,
+            geneName, featureId, impact):
+        parser = self.getTranscriptEffectParser()
+        effectNames = None
+        effectsFilter = None
+        if effectIds is not None and self._ontology is not None:
+            effectNames = self._getEffectNames(effectIds)
+            effectsFilter = self._getEffectsFilter(effectNames)
+        annotationSelector = None
+        if geneName is not None or featureId is not None or \
+                impact is not None:
+            annotationSelector = self._getAnnotationSelector(
+                parser, geneName, featureId, impact)
+        if self._indexFile is not None and (
+                effectsFilter is not None or annotationSelector is not None):
+            variantIter = self._getIndexedRecords(
+                referenceName, startPosition, endPosition, effectNames,
+                geneName, featureId, impact)
         else:
-            transcriptConverter = self.convertTranscriptEffectCSQ
+            variantIter = self._variantSet.getPysamVariants(
+                referenceName, startPosition, endPosition, samples=[])
+        key = self._getAnnotationInfoKey().encode()
         for record in variantIter:
-            yield self.convertVariantAnnotation(record, transcriptConverter)
+            if effectsFilter is not None or annotationSelector is not None:
+                info = record.info
+                if key not in info:
+                    continue
+                annotations = info[key]
+                if effectsFilter is not None and \
+                        not effectsFilter(annotations):
+                    continue
+                if annotationSelector is not None and \
+                        not annotationSelector(annotations):
+                    continue
+            yield self.convertVariantAnnotation(record, parser)
+
+    def _getIndexedRecords(
+            self, referenceName, startPosition, endPosition, effectNames,
+            geneName, featureId, impact):
+        """
+        Returns an iterator over the pysam VCF records in the specified
+        region that the VariantAnnotationIndex lists as having annotations
+        matching the specified values.
+        """
+        dataUrlIndexMap = self._variantSet.getReferenceToDataUrlIndexMap()
+        if referenceName not in dataUrlIndexMap:
+            return
+        referenceName, startPosition, endPosition = \
+            self._variantSet.sanitizeVariantFileFetch(
+                referenceName, startPosition, endPosition)
+        with VariantAnnotationIndex(self._indexFile) as index:
+            locations = None
+            # A record may match the effects and the other values in
+            # different annotations, so these are looked up separately.
+            if effectNames is not None:
+                locations = set(index.getLocations(
+                    referenceName, startPosition, endPosition,
+                    effects=effectNames))
+            if geneName is not None or featureId is not None or \
+                    impact is not None:
+                geneLocations = set(index.getLocations(
+                    referenceName, startPosition, endPosition,
+                    gene=geneName, featureId=featureId, impact=impact))
+                if locations is None:
+                    locations = geneLocations
+                else:
+                    locations &= geneLocations
+        dataUrl = dataUrlIndexMap[referenceName]
+        # Seeking the cached handle would move it under any other query
+        # iterating over it, so the records are read from a handle of
+        # their own.
+        varFile = self._variantSet.openFile(dataUrl, [])
+        fetchedStart = None
+        try:
+            for offset, start, recordId in sorted(locations):
+                if offset is not None:
+                    varFile.seek(offset)
+                    records = [next(varFile, None)]
+                else:
+                    # VCF records have no offset, so all the records
+                    # starting at this position are read at once.
+                    if start != fetchedStart:
+                        fetched = list(varFile.fetch(
+                            referenceName, start, start + 1))
+                        fetchedStart = start
+                    records = [
+                        record for record in fetched
+                        if record.start == start and record.id == recordId]
+                    records = records or [None]
+                for record in records:
+                    if (record is None or record.contig != referenceName or
+                            record.start != start or
+                            record.id != recordId):
+                        raise exceptions.DataException(
+                            "Annotation index '{}' does not match '{}'".format(
+                                self._indexFile, dataUrl))
+                    yield record
+        finally:
+            varFile.close()
+
+    def _getAnnotationSelector(self, parser, geneName, featureId, impact):
+        """
+        Returns a function returning True if any of the specified raw
+        annotation strings of a record matches all of the specified
+        values that are not None.
+        """
+        def annotationSelector(annotations):
+            for annotation in annotations:
+                gene, feature, _, annotationImpact = \
+                    parser.parseIndexFields(annotation)
+                if ((geneName is None or gene == geneName) and
+                        (featureId is None or feature == featureId) and
+                        (impact is None or annotationImpact == impact)):
+                    return True
+            return False
+        return annotationSelector
+
+    def _getEffectNames(self, effectIds):
+        """
+        Returns the set of the names of the specified SO term IDs, as
+        used in the annotations. Unknown IDs are ignored.
+        """
+        names = set()
+        for effectId in effectIds:
+            name = self._ontology.getTermName(effectId)
+            if name is not None:
+                names.add(name)
+        return names
+
+    def _getEffectsFilter(self, names):
+        """
+        Returns a function that screens the raw annotation strings of a
+        record, returning True if any of them contains one of the
+        specified SO term names as an effect. This is a cheap test that
+        may accept records containing the names in other fields, so the
+        converted transcript effects must still be checked.
+        """
+        if len(names) == 0:
+            return lambda annotations: False
+        pattern = re.compile("[|&](?:{})(?=[|&]|$)".format(
+            "|".join(re.escape(name) for name in sorted(names))))
+
+        def effectsFilter(annotations):
+            for annotation in annotations:
+                if pattern.search(annotation) is not None:
+                    return True
+            return False
+        return effectsFilter
+
+    def _getAnnotationInfoKey(self):
+        """
+        Returns the INFO key holding the annotations for this
+        VariantAnnotationSet's annotation type.
+        """
+        if self._annotationType in (ANNOTATIONS_SNPEFF, ANNOTATIONS_VEP_V82):
+            return "ANN"
+        return "CSQ"
+
+    def getTranscriptEffectParser(self):
+        """
+        Returns the TranscriptEffectParser for the annotations in this
+        VariantAnnotationSet, compiled from the annotation format in the
+        VCF header if it is given there.
+        """
+        if self._transcriptEffectParser is None:
+            annotationFormat = None
+            key = "INFO." + self._getAnnotationInfoKey()
+            if key in self._analysis.info:
+                for value in self._analysis.info[key].values:
+                    annotationFormat = TranscriptEffectParser.parseFormat(
+                        value.string_value)
+                    if annotationFormat is not None:
+                        break
+            if annotationFormat is None:
+                annotationFormat = self._defaultAnnotationFormats[
+                    self._annotationType]
+            self._transcriptEffectParser = TranscriptEffectParser(
+                annotationFormat)
+        return self._transcriptEffectParser
 
     def convertLocation(self, pos):
         """
@@ -1141,14 +3172,12 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         :param pos:
         :return: protocol.AlleleLocation
         """
-        if isUnspecified(pos):
+        start = _parsePosition(pos)
+        if start is None:
             return None
-        coordLen = pos.split('/')
-        if len(coordLen) > 1:
-            allLoc = self._createGaAlleleLocation()
-            allLoc.start = int(coordLen[0]) - 1
-            return allLoc
-        return None
+        allLoc = self._createGaAlleleLocation()
+        allLoc.start = start
+        return allLoc
 
     def convertLocationHgvsC(self, hgvsc):
         """
@@ -1157,18 +3186,7 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         :param hgvsc:
         :return:
         """
-        if isUnspecified(hgvsc):
-            return None
-        match = re.match(".*c.(\d+)(\D+)>(\D+)", hgvsc)
-        if match:
-            pos = int(match.group(1))
-            if pos > 0:
-                allLoc = self._createGaAlleleLocation()
-                allLoc.start = pos - 1
-                allLoc.reference_sequence = match.group(2)
-                allLoc.alternate_sequence = match.group(3)
-                return allLoc
-        return None
+        return _toAlleleLocation(_parseHgvsC(hgvsc))
 
     def convertLocationHgvsP(self, hgvsp):
         """
@@ -1177,51 +3195,7 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         :param hgvsp:
         :return: protocol.AlleleLocation
         """
-        if isUnspecified(hgvsp):
-            return None
-        match = re.match(".*p.(\D+)(\d+)(\D+)", hgvsp, flags=re.UNICODE)
-        if match is not None:
-            allLoc = self._createGaAlleleLocation()
-            allLoc.reference_sequence = match.group(1)
-            allLoc.start = int(match.group(2)) - 1
-            allLoc.alternate_sequence = match.group(3)
-            return allLoc
-        return None
-
-    def addCDSLocation(self, effect, cdnaPos):
-        hgvsC = effect.hgvs_annotation.transcript
-        allele_location = None
-        if not isUnspecified(hgvsC):
-            allele_location = self.convertLocationHgvsC(hgvsC)
-            if allele_location:
-                effect.cds_location.CopyFrom(self.convertLocationHgvsC(hgvsC))
-        if allele_location is None and self.convertLocation(cdnaPos):
-                effect.cds_location.CopyFrom(self.convertLocation(cdnaPos))
-        else:
-            # These are not stored in the VCF
-            effect.cds_location.alternate_sequence = ""
-            effect.cds_location.reference_sequence = ""
-
-    def addProteinLocation(self, effect, protPos):
-        hgvsP = effect.hgvs_annotation.protein
-        protein_location = None
-        if not isUnspecified(hgvsP):
-            protein_location = self.convertLocationHgvsP(hgvsP)
-            if protein_location:
-                effect.protein_location.CopyFrom(
-                    self.convertLocationHgvsP(hgvsP))
-        if protein_location is None and self.convertLocation(protPos):
-            effect.protein_location.CopyFrom(self.convertLocation(protPos))
-
-    def addCDNALocation(self, effect, cdnaPos):
-        hgvsC = effect.hgvs_annotation.transcript
-        if self.convertLocation(cdnaPos):
-            effect.cdna_location.CopyFrom(self.convertLocation(cdnaPos))
-        if self.convertLocationHgvsC(hgvsC):
-            effect.cdna_location.alternate_sequence = \
-                self.convertLocationHgvsC(hgvsC).alternate_sequence
-            effect.cdna_location.reference_sequence = \
-                self.convertLocationHgvsC(hgvsC).reference_sequence
+        return _toAlleleLocation(_parseHgvsP(hgvsp))
 
     def addLocations(self, effect, protPos, cdnaPos):
         """
@@ -1233,95 +3207,99 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
         :param cdnaPos: String representing coding DNA location
         :return: effect protocol.TranscriptEffect
         """
-        self.addCDSLocation(effect, cdnaPos)
-        self.addCDNALocation(effect, cdnaPos)
-        self.addProteinLocation(effect, protPos)
+        self._addLocations(
+            effect, effect.hgvs_annotation.transcript,
+            effect.hgvs_annotation.protein, cdnaPos, protPos)
         return effect
 
-    def convertTranscriptEffectCSQ(self, annStr, hgvsG):
-        """
-        Takes the consequence string of an annotated VCF using a
-        CSQ field as opposed to ANN and returns an array of
-        transcript effects.
-        :param annStr: String
-        :param hgvsG: String
-        :return: [protocol.TranscriptEffect]
-        """
-        # Allele|Gene|Feature|Feature_type|Consequence|cDNA_position|
-        # CDS_position|Protein_position|Amino_acids|Codons|Existing_variation|
-        # DISTANCE|STRAND|SIFT|PolyPhen|MOTIF_NAME|MOTIF_POS|HIGH_INF_POS|MOTIF_SCORE_CHANGE
-
-        (alt, gene, featureId, featureType, effects, cdnaPos,
-         cdsPos, protPos, aminos, codons, existingVar, distance,
-         strand, sift, polyPhen, motifName, motifPos,
-         highInfPos, motifScoreChange) = annStr.split('|')
-        terms = effects.split("&")
-        transcriptEffects = []
-        for term in terms:
-            transcriptEffects.append(
-                self._createCsqTranscriptEffect(
-                    alt, term, protPos,
-                    cdnaPos, featureId))
-        return transcriptEffects
-
-    def _createCsqTranscriptEffect(
-            self, alt, term, protPos, cdnaPos, featureId):
-        effect = self._createGaTranscriptEffect()
-        effect.alternate_bases = alt
-        effect.effects.extend(self.convertSeqOntology(term))
-        effect.feature_id = featureId
-        # These are not present in the data
-        self.addLocations(effect, protPos, cdnaPos)
-        effect.id = self.getTranscriptEffectId(effect)
-        return effect
+    def _addLocations(self, effect, hgvsC, hgvsP, cdnaPos, protPos):
+        # Each string is parsed once, and the locations are set directly
+        # in the effect rather than copied from new AlleleLocations.
+        cdsLocation = _parseHgvsC(hgvsC)
+        cdnaStart = _parsePosition(cdnaPos)
+        # The CDS location is always present, but the sequences are not
+        # stored in the VCF.
+        if cdsLocation is not None:
+            effect.cds_location.start = cdsLocation[0]
+        elif cdnaStart is not None:
+            effect.cds_location.start = cdnaStart
+        else:
+            effect.cds_location.SetInParent()
+        if cdnaStart is not None:
+            effect.cdna_location.start = cdnaStart
+        if cdsLocation is not None:
+            effect.cdna_location.reference_sequence = cdsLocation[1]
+            effect.cdna_location.alternate_sequence = cdsLocation[2]
+        proteinLocation = _parseHgvsP(hgvsP)
+        if proteinLocation is not None:
+            (effect.protein_location.start,
+             effect.protein_location.reference_sequence,
+             effect.protein_location.alternate_sequence) = proteinLocation
+        else:
+            proteinStart = _parsePosition(protPos)
+            if proteinStart is not None:
+                effect.protein_location.start = proteinStart
 
-    def convertTranscriptEffectVEP(self, annStr, hgvsG):
+    def convertTranscriptEffects(self, annStr, hgvsG, parser):
         """
-        Takes the ANN string of a VEP generated VCF, splits it
-        and returns a populated GA4GH transcript effect object.
+        Takes an annotation string from the CSQ or ANN INFO field, splits
+        it using the specified TranscriptEffectParser and returns an array
+        of populated GA4GH transcript effects.
         :param annStr: String
         :param hgvsG: String
-        :return: effect protocol.TranscriptEffect
+        :param parser: TranscriptEffectParser
+        :return: [protocol.TranscriptEffect]
         """
-        effect = self._createGaTranscriptEffect()
-        (alt, effects, impact, symbol, geneName, featureType,
-         featureId, trBiotype, exon, intron, hgvsC, hgvsP,
-         cdnaPos, cdsPos, protPos, aminos, codons,
-         existingVar, distance, strand, symbolSource,
-         hgncId, hgvsOffset) = annStr.split('|')
-        effect.alternate_bases = alt
-        effect.effects.extend(self.convertSeqOntology(effects))
-        effect.feature_id = featureId
-        effect.hgvs_annotation.CopyFrom(protocol.HGVSAnnotation())
-        effect.hgvs_annotation.genomic = hgvsG
-        effect.hgvs_annotation.transcript = hgvsC
-        effect.hgvs_annotation.protein = hgvsP
-        self.addLocations(effect, protPos, cdnaPos)
-        effect.id = self.getTranscriptEffectId(effect)
-        return effect
+        annotation = self._createGaVariantAnnotation()
+        self._addTranscriptEffects(
+            annotation.transcript_effects, annStr, hgvsG, parser)
+        return list(annotation.transcript_effects)
 
-    def convertTranscriptEffectSnpEff(self, annStr, hgvsG):
+    def _addTranscriptEffects(self, transcriptEffects, annStr, hgvsG, parser):
         """
-        Takes the ANN string of a SnpEff generated VCF, splits it
-        and returns a populated GA4GH transcript effect object.
-        :param annStr: String
-        :param hgvsG: String
-        :return: effect protocol.TranscriptEffect()
+        Adds the transcript effects for the specified annotation string to
+        the specified repeated TranscriptEffect field in place. CSQ
+        annotations produce an effect for each consequence term, and ANN
+        annotations a single effect with the specified genomic HGVS
+        annotation.
         """
-        effect = self._createGaTranscriptEffect()
-        # SnpEff and VEP don't agree on this :)
-        (alt, effects, impact, geneName, geneId, featureType,
-            featureId, trBiotype, rank, hgvsC, hgvsP, cdnaPos,
-            cdsPos, protPos, distance, errsWarns) = annStr.split('|')
-        effect.alternate_bases = alt
-        effect.effects.extend(self.convertSeqOntology(effects))
-        effect.feature_id = featureId
-        effect.hgvs_annotation.genomic = hgvsG
-        effect.hgvs_annotation.transcript = hgvsC
-        effect.hgvs_annotation.protein = hgvsP
-        self.addLocations(effect, protPos, cdnaPos)
-        effect.id = self.getTranscriptEffectId(effect)
-        return effect
+        (alt, effects, featureId, hgvsC, hgvsP, cdnaPos,
+         protPos) = parser.parse(annStr)
+        terms = self._getOntologyTerms(effects)
+        if self._annotationType in (ANNOTATIONS_SNPEFF, ANNOTATIONS_VEP_V82):
+            effect = transcriptEffects.add()
+            effect.alternate_bases = alt
+            for term in terms:
+                effect.effects.add(**term)
+            effect.feature_id = featureId
+            effect.hgvs_annotation.genomic = hgvsG
+            effect.hgvs_annotation.transcript = hgvsC
+            effect.hgvs_annotation.protein = hgvsP
+            self._addLocations(effect, hgvsC, hgvsP, cdnaPos, protPos)
+            effect.id = self.getTranscriptEffectId(effect)
+        else:
+            for term in terms:
+                effect = transcriptEffects.add()
+                effect.alternate_bases = alt
+                effect.effects.add(**term)
+                effect.feature_id = featureId
+                # HGVS annotations are not present in the data
+                self._addLocations(effect, "", "", cdnaPos, protPos)
+                effect.id = self.getTranscriptEffectId(effect)
+
+    def _getOntologyTerms(self, seqOntStr):
+        """
+        Returns the fields of the ontology terms for the specified string
+        of sequence ontology effects as a list of dictionaries, memoizing
+        the lookups.
+        """
+        terms = self._ontologyTermsMap.get(seqOntStr)
+        if terms is None:
+            terms = [
+                dict((field.name, value) for field, value in term.ListFields())
+                for term in self.convertSeqOntology(seqOntStr)]
+            self._ontologyTermsMap[seqOntStr] = terms
+        return terms
 
     def convertSeqOntology(self, seqOntStr):
         """
@@ -1335,35 +3313,28 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
             self._ontology.getGaTermByName(soName)
             for soName in seqOntStr.split('&')]
 
-    def convertVariantAnnotation(self, record, transcriptConverter):
+    def convertVariantAnnotation(self, record, parser):
         """
         Converts the specfied pysam variant record into a GA4GH variant
-        annotation object using the specified function to convert the
-        transcripts.
+        annotation object using the specified TranscriptEffectParser to
+        convert the transcripts.
         """
         variant = self._variantSet.convertVariant(record, [])
         annotation = self._createGaVariantAnnotation()
         annotation.variant_id = variant.id
         # Convert annotations from INFO field into TranscriptEffect
-        transcriptEffects = []
-        hgvsG = record.info.get(b'HGVS.g')
-        if transcriptConverter != self.convertTranscriptEffectCSQ:
-            annotations = record.info.get(b'ANN')
-            transcriptEffects = self._convertAnnotations(
-                annotations, variant, hgvsG, transcriptConverter)
-        else:
-            annotations = record.info.get('CSQ'.encode())
-            transcriptEffects = []
-            for ann in annotations:
-                transcriptEffects.extend(
-                    self.convertTranscriptEffectCSQ(ann, hgvsG))
-        annotation.transcript_effects.extend(transcriptEffects)
+        info = record.info
+        hgvsG = info[b'HGVS.g'] if b'HGVS.g' in info else None
+        key = self._getAnnotationInfoKey().encode()
+        annotations = info[key] if key in info else None
+        self._convertAnnotations(
+            annotation.transcript_effects, annotations, variant, hgvsG,
+            parser)
         annotation.id = self.getVariantAnnotationId(variant, annotation)
         return variant, annotation
 
     def _convertAnnotations(
-            self, annotations, variant, hgvsG, transcriptConverter):
-        transcriptEffects = []
+            self, transcriptEffects, annotations, variant, hgvsG, parser):
         if annotations is not None:
             for index, ann in enumerate(annotations):
                 altshgvsG = ""
@@ -1371,6 +3342,5 @@ class HtslibVariantAnnotationSet(AbstractVariantAnnotationSet):
                     # The HGVS.g field contains an element for
                     # each alternate allele
                     altshgvsG = hgvsG[index % len(variant.alternate_bases)]
-                transcriptEffects.append(
-                    transcriptConverter(ann, altshgvsG))
-        return transcriptEffects
+                self._addTranscriptEffects(
+                    transcriptEffects, ann, altshgvsG, parser)
@@ -221,6 +221,7 @@ class AbstractDataRepository(object):
                     "\t", variantSet.getLocalId(),
                     variantSet.getReferenceSet().getLocalId(),
                     variantSet.getId(),
+                    variantSet.getNumVariants(),
                     sep="\t")
                 if variantSet.getNumVariantAnnotationSets() > 0:
                     print("\t\tVariantAnnotationSets:")
@@ -390,7 +391,9 @@ class SimulatedDataRepository(AbstractDataRepository):
             numReadGroupSets=1, numReadGroupsPerReadGroupSet=1,
             numPhenotypeAssociations=2,
             numPhenotypeAssociationSets=1,
-            numAlignments=2, numRnaQuantSets=2, numExpressionLevels=2):
+            numAlignments=2, numRnaQuantSets=2, numExpressionLevels=2,
+            referenceLength=200, readCoverage=0, readLength=100,
+            numTranscriptEffects=1):
         super(SimulatedDataRepository, self).__init__()
 
         # References
@@ -398,7 +401,8 @@ class SimulatedDataRepository(AbstractDataRepository):
             localId = "referenceSet{}".format(i)
             seed = randomSeed + i
             referenceSet = references.SimulatedReferenceSet(
-                localId, seed, numReferencesPerReferenceSet)
+                localId, seed, numReferencesPerReferenceSet,
+                referenceLength)
             self.addReferenceSet(referenceSet)
 
         # Datasets
@@ -416,7 +420,9 @@ class SimulatedDataRepository(AbstractDataRepository):
                 numPhenotypeAssociations=numPhenotypeAssociations,
                 numPhenotypeAssociationSets=numPhenotypeAssociationSets,
                 numRnaQuantSets=numRnaQuantSets,
-                numExpressionLevels=numExpressionLevels)
+                numExpressionLevels=numExpressionLevels,
+                readCoverage=readCoverage, readLength=readLength,
+                numTranscriptEffects=numTranscriptEffects)
             self.addDataset(dataset)
 
 
@@ -437,7 +443,16 @@ class SqlDataRepository(AbstractDataRepository):
         def __str__(self):
             return "{}.{}".format(self.major, self.minor)
 
-    version = SchemaVersion("2.1")
+    version = SchemaVersion("2.5")
+    # Columns added by minor schema versions, as (table, column, type).
+    # Repos created with an older minor version are upgraded in place
+    # when they are opened for writing.
+    addedColumns = [
+        ("ReadGroupSet", "referenceNames", "TEXT"),
+        ("VariantSet", "idIndexFile", "TEXT"),
+        ("VariantSet", "stats", "TEXT"),
+        ("VariantAnnotationSet", "indexFile", "TEXT"),
+    ]
     systemKeySchemaVersion = "schemaVersion"
     systemKeyCreationTimeStamp = "creationTimeStamp"
 
@@ -483,6 +498,8 @@ class SqlDataRepository(AbstractDataRepository):
         cursor = self._dbConnection.cursor()
         cursor.execute("PRAGMA foreign_keys = ON;")
         self._dbConnection.commit()
+        if mode == MODE_WRITE:
+            self._upgradeSchema(cursor)
         if mode == MODE_READ:
             # This is part of the transitional behaviour where
             # we load the whole DB into memory to get access to
@@ -637,6 +654,42 @@ class SqlDataRepository(AbstractDataRepository):
             raise exceptions.RepoSchemaVersionMismatchException(
                 schemaVersion, self.version)
 
+    def _upgradeSchema(self, cursor):
+        """
+        Adds any columns missing from a repo created with an older minor
+        schema version and records the current version in the System table.
+        Does nothing for a repo that has not been initialised yet.
+        """
+        if not self._tableExists(cursor, "System"):
+            return
+        cursor.execute(
+            "SELECT value FROM System WHERE key = ?;",
+            (self.systemKeySchemaVersion,))
+        row = cursor.fetchone()
+        if row is None:
+            return
+        schemaVersion = self.SchemaVersion(row[0])
+        if schemaVersion.major != self.version.major:
+            raise exceptions.RepoSchemaVersionMismatchException(
+                schemaVersion, self.version)
+        if int(schemaVersion.minor) >= int(self.version.minor):
+            return
+        for table, column, type_ in self.addedColumns:
+            cursor.execute("PRAGMA table_info({});".format(table))
+            if column not in [info[1] for info in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE {} ADD COLUMN {} {};".format(
+                    table, column, type_))
+        cursor.execute(
+            "UPDATE System SET value = ? WHERE key = ?;",
+            (str(self.version), self.systemKeySchemaVersion))
+        self._dbConnection.commit()
+
+    def _tableExists(self, cursor, table):
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name = ?;", (table,))
+        return cursor.fetchone() is not None
+
     def _createOntologyTable(self, cursor):
         sql = """
             CREATE TABLE Ontology(
@@ -952,6 +1005,7 @@ class SqlDataRepository(AbstractDataRepository):
                 stats TEXT NOT NULL,
                 dataUrl TEXT NOT NULL,
                 indexFile TEXT NOT NULL,
+                referenceNames TEXT,
                 UNIQUE (datasetId, name),
                 FOREIGN KEY(datasetId) REFERENCES Dataset(id)
                     ON DELETE CASCADE,
@@ -967,13 +1021,14 @@ class SqlDataRepository(AbstractDataRepository):
         sql = """
             INSERT INTO ReadGroupSet (
                 id, datasetId, referenceSetId, name, programs, stats,
-                dataUrl, indexFile)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+                dataUrl, indexFile, referenceNames)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
         """
         programsJson = json.dumps(
             [protocol.toJsonDict(program) for program in
              readGroupSet.getPrograms()])
         statsJson = json.dumps(protocol.toJsonDict(readGroupSet.getStats()))
+        referenceNamesJson = json.dumps(readGroupSet.getReferenceNames())
         cursor = self._dbConnection.cursor()
         try:
             cursor.execute(sql, (
@@ -982,7 +1037,7 @@ class SqlDataRepository(AbstractDataRepository):
                 readGroupSet.getReferenceSet().getId(),
                 readGroupSet.getLocalId(),
                 programsJson, statsJson, readGroupSet.getDataUrl(),
-                readGroupSet.getIndexFile()))
+                readGroupSet.getIndexFile(), referenceNamesJson))
         except sqlite3.IntegrityError:
             raise exceptions.DuplicateNameException(
                 readGroupSet.getLocalId(),
@@ -1033,6 +1088,7 @@ class SqlDataRepository(AbstractDataRepository):
                 annotationType TEXT,
                 created TEXT,
                 updated TEXT,
+                indexFile TEXT,
                 UNIQUE (variantSetId, name),
                 FOREIGN KEY(variantSetId) REFERENCES VariantSet(id)
                     ON DELETE CASCADE,
@@ -1048,8 +1104,8 @@ class SqlDataRepository(AbstractDataRepository):
         sql = """
             INSERT INTO VariantAnnotationSet (
                 id, variantSetId, ontologyId, name, analysis, annotationType,
-                created, updated)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+                created, updated, indexFile)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
         """
         analysisJson = json.dumps(
             protocol.toJsonDict(variantAnnotationSet.getAnalysis()))
@@ -1062,7 +1118,8 @@ class SqlDataRepository(AbstractDataRepository):
             analysisJson,
             variantAnnotationSet.getAnnotationType(),
             variantAnnotationSet.getCreationTime(),
-            variantAnnotationSet.getUpdatedTime()))
+            variantAnnotationSet.getUpdatedTime(),
+            variantAnnotationSet.getIndexFile()))
 
     def _readVariantAnnotationSetTable(self, cursor):
         cursor.row_factory = sqlite3.Row
@@ -1130,6 +1187,8 @@ class SqlDataRepository(AbstractDataRepository):
                 updated TEXT,
                 metadata TEXT,
                 dataUrlIndexMap TEXT NOT NULL,
+                idIndexFile TEXT,
+                stats TEXT,
                 UNIQUE (datasetID, name),
                 FOREIGN KEY(datasetId) REFERENCES Dataset(id)
                     ON DELETE CASCADE,
@@ -1145,8 +1204,9 @@ class SqlDataRepository(AbstractDataRepository):
         sql = """
             INSERT INTO VariantSet (
                 id, datasetId, referenceSetId, name, created, updated,
-                metadata, dataUrlIndexMap)
-            VALUES (?, ?, ?, ?, datetime('now'), datetime('now'), ?, ?);
+                metadata, dataUrlIndexMap, idIndexFile, stats)
+            VALUES (?, ?, ?, ?, datetime('now'), datetime('now'), ?, ?, ?,
+                ?);
         """
         cursor = self._dbConnection.cursor()
         # We cheat a little here with the VariantSetMetadata, and encode these
@@ -1156,11 +1216,15 @@ class SqlDataRepository(AbstractDataRepository):
             [protocol.toJsonDict(metadata) for metadata in
              variantSet.getMetadata()])
         urlMapJson = json.dumps(variantSet.getReferenceToDataUrlIndexMap())
+        statsJson = None
+        if variantSet.getStatistics() is not None:
+            statsJson = json.dumps(variantSet.getStatistics().toJsonDict())
         try:
             cursor.execute(sql, (
                 variantSet.getId(), variantSet.getParentContainer().getId(),
                 variantSet.getReferenceSet().getId(), variantSet.getLocalId(),
-                metadataJson, urlMapJson))
+                metadataJson, urlMapJson, variantSet.getIdIndexFile(),
+                statsJson))
         except sqlite3.IntegrityError:
             raise exceptions.DuplicateNameException(
                 variantSet.getLocalId(),
@@ -145,6 +145,12 @@ class InvalidJsonException(BadRequestException):
         self.message = "Cannot parse JSON: '{}'".format(jsonString)
 
 
+class InvalidVariantFilterException(BadRequestException):
+    def __init__(self, expression, msg):
+        self.message = "Invalid variant filter '{}': {}".format(
+            expression, msg)
+
+
 class Validator(object):
     """
     Check that a JSON dictionary is a valid representation of a protocol
@@ -222,6 +228,13 @@ class VariantSetNotFoundException(NotFoundException):
             variantSetId)
 
 
+class VariantSetStatisticsNotFoundException(NotFoundException):
+    def __init__(self, variantSetId):
+        self.message = (
+            "Statistics have not been computed for the VariantSet "
+            "'{}'".format(variantSetId))
+
+
 class PhenotypeAssociationSetNotFoundException(NotFoundException):
     def __init__(self, paSetId):
         self.message = (
@@ -335,13 +348,6 @@ class NotImplementedException(RuntimeException):
             self.message = message
 
 
-class UnmappedReadsNotSupported(NotImplementedException):
-    def __init__(self):
-        self.message = (
-            "Unmapped reads are not yet supported; "
-            "please specify a reference")
-
-
 class CallSetNotInVariantSetException(NotFoundException):
     """
     Indicates a request was made for a callSet not in the actual variantSet
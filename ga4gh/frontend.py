@@ -25,6 +25,9 @@ import requests
 import ga4gh
 import ga4gh.backend as backend
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.references as references
+import ga4gh.datamodel.variants as variants
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
 import ga4gh.datarepo as datarepo
@@ -33,6 +36,8 @@ from logging import StreamHandler
 
 
 MIMETYPE = "application/json"
+READ_BATCH_MIMETYPE = reads.ReadAlignmentBatch.mimetype
+GENOTYPE_MATRIX_MIMETYPE = variants.GenotypeMatrix.mimetype
 SEARCH_ENDPOINT_METHODS = ['POST', 'OPTIONS']
 SECRET_KEY_LENGTH = 24
 
@@ -89,6 +94,21 @@ class ServerStatus(object):
         ]
         return [(k, app.config[k]) for k in keys]
 
+    def getCacheStatistics(self):
+        """
+        Returns a list of (name, numCachedItems, hitRate) tuples
+        describing the server's caches, where hitRate is None if a cache
+        has not been used.
+        """
+        return [
+            ("Reference sequence slices",
+             references.referenceSliceCache.getNumCachedSlices(),
+             references.referenceSliceCache.getHitRate()),
+            ("Variant and annotation regions",
+             variants.regionCache.getNumCachedBins(),
+             variants.regionCache.getHitRate()),
+        ]
+
     def getPreciseUptime(self):
         """
         Returns the server precisely.
@@ -216,6 +236,17 @@ def configure(configFile=None, baseConfig="ProductionConfig",
     # Setup file handle cache max size
     datamodel.fileHandleCache.setMaxCacheSize(
         app.config["FILE_HANDLE_CACHE_MAX_SIZE"])
+    # Setup the maximum number of cached reference sequence slices
+    references.referenceSliceCache.setMaxCacheSize(
+        app.config["REFERENCE_SLICE_CACHE_MAX_SIZE"])
+    # Setup the store of decoded reference sequences used to decode CRAM
+    references.decodedReferenceStore.setDirectory(
+        app.config["DECODED_REFERENCE_STORE_DIRECTORY"])
+    # Setup the maximum size of the cache of converted variants
+    variants.regionCache.setMaxCacheSize(app.config["REGION_CACHE_MAX_SIZE"])
+    # Setup the hash function used within variant IDs
+    variants.variantHasher.setHashFunction(
+        app.config["VARIANT_HASH_FUNCTION"])
     # Setup CORS
     cors.CORS(app, allow_headers='Content-Type')
     app.serverStatus = ServerStatus()
@@ -235,8 +266,13 @@ def configure(configFile=None, baseConfig="ProductionConfig",
             "SIMULATED_BACKEND_NUM_REFERENCE_SETS"]
         numReferencesPerReferenceSet = app.config[
             "SIMULATED_BACKEND_NUM_REFERENCES_PER_REFERENCE_SET"]
+        referenceLength = app.config["SIMULATED_BACKEND_REFERENCE_LENGTH"]
         numAlignmentsPerReadGroup = app.config[
             "SIMULATED_BACKEND_NUM_ALIGNMENTS_PER_READ_GROUP"]
+        readCoverage = app.config["SIMULATED_BACKEND_READ_COVERAGE"]
+        readLength = app.config["SIMULATED_BACKEND_READ_LENGTH"]
+        numTranscriptEffects = app.config[
+            "SIMULATED_BACKEND_NUM_TRANSCRIPT_EFFECTS"]
         numReadGroupsPerReadGroupSet = app.config[
             "SIMULATED_BACKEND_NUM_READ_GROUPS_PER_READ_GROUP_SET"]
         numPhenotypeAssociations = app.config[
@@ -253,8 +289,11 @@ def configure(configFile=None, baseConfig="ProductionConfig",
             variantDensity=variantDensity, numVariantSets=numVariantSets,
             numReferenceSets=numReferenceSets,
             numReferencesPerReferenceSet=numReferencesPerReferenceSet,
+            referenceLength=referenceLength,
             numReadGroupsPerReadGroupSet=numReadGroupsPerReadGroupSet,
             numAlignments=numAlignmentsPerReadGroup,
+            readCoverage=readCoverage, readLength=readLength,
+            numTranscriptEffects=numTranscriptEffects,
             numPhenotypeAssociations=numPhenotypeAssociations,
             numPhenotypeAssociationSets=numPhenotypeAssociationSets,
             numRnaQuantSets=numRnaQuantSets,
@@ -322,22 +361,35 @@ def configure(configFile=None, baseConfig="ProductionConfig",
             app.oidcClient.store_registration_info(response)
 
 
-def getFlaskResponse(responseString, httpStatus=200):
+def getFlaskResponse(responseString, httpStatus=200, mimetype=MIMETYPE):
     """
     Returns a Flask response object for the specified data and HTTP status.
     """
-    return flask.Response(responseString, status=httpStatus, mimetype=MIMETYPE)
+    return flask.Response(responseString, status=httpStatus, mimetype=mimetype)
 
 
-def handleHttpPost(request, endpoint):
+def handleHttpPost(request, endpoint, mimetype=MIMETYPE):
     """
     Handles the specified HTTP POST request, which maps to the specified
-    protocol handler endpoint and protocol request class.
+    protocol handler endpoint and protocol request class. The response
+    is returned with the specified mimetype.
     """
     if request.mimetype != MIMETYPE:
         raise exceptions.UnsupportedMediaTypeException()
     responseStr = endpoint(request.get_data())
-    return getFlaskResponse(responseStr)
+    return getFlaskResponse(responseStr, mimetype=mimetype)
+
+
+def getBooleanArgument(request, key):
+    """
+    Returns the value of the specified boolean query string argument in
+    the specified request, which is False if it is not present.
+    """
+    value = request.args.get(key, "false")
+    if value not in ["true", "false"]:
+        raise exceptions.BadRequestException(
+            "Invalid value '{}' for boolean argument '{}'".format(value, key))
+    return value == "true"
 
 
 def handleList(id_, endpoint, request):
@@ -455,13 +507,13 @@ def handleFlaskListRequest(id_, flaskRequest, endpoint):
         raise exceptions.MethodNotAllowedException()
 
 
-def handleFlaskPostRequest(flaskRequest, endpoint):
+def handleFlaskPostRequest(flaskRequest, endpoint, mimetype=MIMETYPE):
     """
     Handles the specified flask request for one of the POST URLS
     Invokes the specified endpoint to generate a response.
     """
     if flaskRequest.method == "POST":
-        return handleHttpPost(flaskRequest, endpoint)
+        return handleHttpPost(flaskRequest, endpoint, mimetype)
     elif flaskRequest.method == "OPTIONS":
         return handleHttpOptions()
     else:
@@ -543,6 +595,14 @@ def searchReadGroupSets():
 
 @DisplayedRoute('/reads/search', postMethod=True)
 def searchReads():
+    # Clients may request the columnar ReadAlignmentBatch format in place
+    # of JSON using the Accept header.
+    bestMatch = flask.request.accept_mimetypes.best_match(
+        [MIMETYPE, READ_BATCH_MIMETYPE], default=MIMETYPE)
+    if bestMatch == READ_BATCH_MIMETYPE:
+        return handleFlaskPostRequest(
+            flask.request, app.backend.runSearchReadsBatch,
+            READ_BATCH_MIMETYPE)
     return handleFlaskPostRequest(
         flask.request, app.backend.runSearchReads)
 
@@ -567,8 +627,25 @@ def searchVariantSets():
 
 @DisplayedRoute('/variants/search', postMethod=True)
 def searchVariants():
-    return handleFlaskPostRequest(
-        flask.request, app.backend.runSearchVariants)
+    # Variants may be filtered on the server using the filter query string
+    # argument; see variants.compileVariantFilter for the syntax.
+    variantFilter = flask.request.args.get("filter")
+    # Clients may request a GenotypeMatrix in place of JSON using the
+    # Accept header, optionally including phasing and genotype likelihoods.
+    bestMatch = flask.request.accept_mimetypes.best_match(
+        [MIMETYPE, GENOTYPE_MATRIX_MIMETYPE], default=MIMETYPE)
+    if bestMatch == GENOTYPE_MATRIX_MIMETYPE:
+        endpoint = functools.partial(
+            app.backend.runSearchGenotypeMatrix,
+            includePhasing=getBooleanArgument(flask.request, "phasing"),
+            includeGenotypeLikelihoods=getBooleanArgument(
+                flask.request, "genotypeLikelihoods"),
+            variantFilter=variantFilter)
+        return handleFlaskPostRequest(
+            flask.request, endpoint, GENOTYPE_MATRIX_MIMETYPE)
+    endpoint = functools.partial(
+        app.backend.runSearchVariants, variantFilter=variantFilter)
+    return handleFlaskPostRequest(flask.request, endpoint)
 
 
 @DisplayedRoute('/variantannotationsets/search', postMethod=True)
@@ -579,8 +656,14 @@ def searchVariantAnnotationSets():
 
 @DisplayedRoute('/variantannotations/search', postMethod=True)
 def searchVariantAnnotations():
-    return handleFlaskPostRequest(
-        flask.request, app.backend.runSearchVariantAnnotations)
+    # Annotations may also be searched by the gene, featureId and impact
+    # query string arguments, which the request schema does not provide.
+    endpoint = functools.partial(
+        app.backend.runSearchVariantAnnotations,
+        geneName=flask.request.args.get("gene"),
+        featureId=flask.request.args.get("featureId"),
+        impact=flask.request.args.get("impact"))
+    return handleFlaskPostRequest(flask.request, endpoint)
 
 
 @DisplayedRoute('/datasets/search', postMethod=True)
@@ -655,6 +738,12 @@ def getVariantSet(id):
         id, flask.request, app.backend.runGetVariantSet)
 
 
+@DisplayedRoute('/variantsets/<id>/stats')
+def getVariantSetStatistics(id):
+    return handleFlaskGetRequest(
+        id, flask.request, app.backend.runGetVariantSetStatistics)
+
+
 @DisplayedRoute(
     '/variants/<no(search):id>',
     pathDisplay='/variants/<id>')
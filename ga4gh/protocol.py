@@ -208,13 +208,20 @@ class SearchResponseBuilder(object):
             (self._bufferSize >= self._maxBufferSize)
         )
 
+    def getResponse(self):
+        """
+        Returns the SearchResponse object that has been built by this
+        SearchResponseBuilder.
+        """
+        self._protoObject.next_page_token = pb.string(self._nextPageToken)
+        return self._protoObject
+
     def getSerializedResponse(self):
         """
         Returns a string version of the SearchResponse that has
         been built by this SearchResponseBuilder.
         """
-        self._protoObject.next_page_token = pb.string(self._nextPageToken)
-        s = toJson(self._protoObject)
+        s = toJson(self.getResponse())
         return s
 
 
@@ -9,6 +9,8 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import os
+import tempfile
 
 
 class BaseConfig(object):
@@ -29,8 +31,15 @@ class BaseConfig(object):
     SIMULATED_BACKEND_NUM_VARIANT_SETS = 1
     SIMULATED_BACKEND_NUM_REFERENCE_SETS = 1
     SIMULATED_BACKEND_NUM_REFERENCES_PER_REFERENCE_SET = 1
+    SIMULATED_BACKEND_REFERENCE_LENGTH = 200
     SIMULATED_BACKEND_NUM_ALIGNMENTS_PER_READ_GROUP = 2
+    # If READ_COVERAGE is non-zero, reads of READ_LENGTH bases are placed
+    # along the references to this mean depth instead of generating
+    # NUM_ALIGNMENTS_PER_READ_GROUP unplaced reads.
+    SIMULATED_BACKEND_READ_COVERAGE = 0
+    SIMULATED_BACKEND_READ_LENGTH = 100
     SIMULATED_BACKEND_NUM_READ_GROUPS_PER_READ_GROUP_SET = 2
+    SIMULATED_BACKEND_NUM_TRANSCRIPT_EFFECTS = 1
     SIMULATED_BACKEND_NUM_PHENOTYPE_ASSOCIATIONS = 2
     SIMULATED_BACKEND_NUM_PHENOTYPE_ASSOCIATION_SETS = 2
     SIMULATED_BACKEND_NUM_RNA_QUANTIFICATION_SETS = 2
@@ -38,6 +47,24 @@ class BaseConfig(object):
 
     FILE_HANDLE_CACHE_MAX_SIZE = 50
 
+    REFERENCE_SLICE_CACHE_MAX_SIZE = 256
+
+    # The directory holding the decoded reference sequences from which
+    # CRAM files are decoded; if None, CRAM files are decoded directly
+    # from the reference set's FASTA file.
+    DECODED_REFERENCE_STORE_DIRECTORY = os.path.join(
+        tempfile.gettempdir(), "ga4gh-decoded-references")
+
+    # The maximum total serialized size in bytes of the converted variants
+    # and variant annotations cached for popular regions; 0 disables the
+    # cache. The cached objects take roughly 40 times this much memory in
+    # each server process, so 2**20 costs about 40 MB.
+    REGION_CACHE_MAX_SIZE = 0
+
+    # The hash used within variant IDs; either "crc32" or "md5". The md5
+    # mode issues the same variant IDs as earlier versions of the server.
+    VARIANT_HASH_FUNCTION = "crc32"
+
     LANDING_MESSAGE_HTML = "landing_message.html"
 
 
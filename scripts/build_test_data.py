@@ -51,7 +51,8 @@ def buildTestData(dataDirectory='tests/data', relativePaths=False):
         name = "vs_{}".format(j)
         run(
             "add-variantset", repoFile, datasetName, useRelativePath,
-            dataFile, "-R NCBI37", "-n ", name, "-aO", sequenceOntologyName)
+            dataFile, "-R NCBI37", "-n ", name, "-S", "-aO",
+            sequenceOntologyName)
 
     pattern = os.path.join(
         prefix, "datasets/dataset1/sequenceAnnotations", "*.db")
@@ -7,6 +7,7 @@ from __future__ import unicode_literals
 
 import re
 import time
+import itertools
 import pstats
 import argparse
 import cProfile
@@ -16,6 +17,7 @@ import guppy
 import utils
 utils.ga4ghImportGlue()
 import ga4gh.backend as backend  # noqa
+import ga4gh.client as client  # noqa
 import ga4gh.protocol as protocol  # noqa
 import ga4gh.datarepo as datarepo  # noqa
 
@@ -48,6 +50,20 @@ class CpuProfilerBackend(backend.Backend):
         self.profiler.disable()
 
 
+class JsonLocalClient(client.LocalClient):
+    """
+    A LocalClient that sends each variants search page through the JSON
+    entry point of the backend, as an HTTP server would, for comparison
+    with the direct protocol object path.
+    """
+    def _run_search_variants_page_request(
+            self, protocol_request, variant_filter):
+        response_json = self._backend.runSearchVariants(
+            protocol.toJson(protocol_request), variant_filter)
+        return self._deserialize_response(
+            response_json, protocol.SearchVariantsResponse)
+
+
 def _heavyQuery(variantSetId, callSetIds):
     """
     Very heavy query: calls for the specified list of callSetIds
@@ -57,19 +73,18 @@ def _heavyQuery(variantSetId, callSetIds):
     request = protocol.SearchVariantsRequest()
     request.reference_name = '2'
     request.variant_set_id = variantSetId
-    for callSetId in callSetIds:
-        request.call_set_ids.add(callSetId)
+    request.call_set_ids.extend(callSetIds or [])
     request.page_size = 100
     request.end = 100000
     return request
 
 
-def timeOneSearch(queryString):
+def timeOneSearch(queryString, variantFilter=None):
     """
     Returns (search result as JSON string, time elapsed during search)
     """
     startTime = time.clock()
-    resultString = backend.runSearchVariants(queryString)
+    resultString = backend.runSearchVariants(queryString, variantFilter)
     endTime = time.clock()
     elapsedTime = endTime - startTime
     return resultString, elapsedTime
@@ -88,7 +103,8 @@ def extractNextPageToken(resultString):
     return None
 
 
-def benchmarkOneQuery(request, repeatLimit=3, pageLimit=3):
+def benchmarkOneQuery(
+        request, repeatLimit=3, pageLimit=3, variantFilter=None):
     """
     Repeat the query several times; perhaps don't go through *all* the
     pages.  Returns minimum time to run backend.searchVariants() to execute
@@ -98,7 +114,7 @@ def benchmarkOneQuery(request, repeatLimit=3, pageLimit=3):
     times = []
     queryString = protocol.toJson(request)
     for i in range(0, repeatLimit):
-        resultString, elapsedTime = timeOneSearch(queryString)
+        resultString, elapsedTime = timeOneSearch(queryString, variantFilter)
         accruedTime = elapsedTime
         pageCount = 1
         token = extractNextPageToken(resultString)
@@ -107,7 +123,8 @@ def benchmarkOneQuery(request, repeatLimit=3, pageLimit=3):
             pageRequest = request
             pageRequest.page_token = token
             pageRequestString = protocol.toJson(pageRequest)
-            resultString, elapsedTime = timeOneSearch(pageRequestString)
+            resultString, elapsedTime = timeOneSearch(
+                pageRequestString, variantFilter)
             accruedTime += elapsedTime
             pageCount = pageCount + 1
             token = extractNextPageToken(resultString)
@@ -121,6 +138,31 @@ def benchmarkOneQuery(request, repeatLimit=3, pageLimit=3):
     # return sum(times[2:])/len(times[2:])
     return min(times)
 
+
+def benchmarkClient(
+        clientClass, request, repeatLimit=3, pageLimit=3,
+        variantFilter=None):
+    """
+    Returns the minimum time taken to fetch up to pageLimit pages of the
+    specified request using an instance of the specified LocalClient
+    class, including the conversion of the variants to protocol objects
+    in the client.
+    """
+    times = []
+    theClient = clientClass(backend)
+    theClient.set_page_size(request.page_size)
+    callSetIds = list(request.call_set_ids)
+    for i in range(0, repeatLimit):
+        startTime = time.clock()
+        variants = theClient.search_variants(
+            request.variant_set_id, request.start, request.end,
+            request.reference_name, callSetIds, variantFilter)
+        for _ in itertools.islice(variants, request.page_size * pageLimit):
+            pass
+        times.append(time.clock() - startTime)
+    return min(times)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description="GA4GH reference server benchmark")
@@ -146,6 +188,18 @@ if __name__ == '__main__':
             or '*' (with the single quotes!) to indicate 'all call sets'.
             Omit this option to indicate 'no call sets'.
             """)
+    parser.add_argument(
+        "--filter", default=None,
+        help="""Only return the variants satisfying this filter expression,
+            for example 'QUAL >= 30'. The filter is evaluated before the
+            variants are converted, so comparing with a run without the
+            filter shows the cost saved for the variants filtered out.
+            """)
+    parser.add_argument(
+        "--localClient", default=False, action="store_true",
+        help="""Also time fetching the same pages with a LocalClient,
+            using both the JSON entry points and the protocol object
+            methods of the backend.""")
 
     args = parser.parse_args()
 
@@ -172,9 +226,20 @@ if __name__ == '__main__':
 
     minTime = benchmarkOneQuery(
         _heavyQuery(args.variantSetId, callSetIds), args.repeatLimit,
-        args.pageLimit)
+        args.pageLimit, args.filter)
     print(minTime)
 
+    if args.localClient:
+        request = _heavyQuery(args.variantSetId, callSetIds)
+        jsonTime = benchmarkClient(
+            JsonLocalClient, request, args.repeatLimit, args.pageLimit,
+            args.filter)
+        protocolTime = benchmarkClient(
+            client.LocalClient, request, args.repeatLimit, args.pageLimit,
+            args.filter)
+        print("LocalClient via JSON:", jsonTime)
+        print("LocalClient via protocol objects:", protocolTime)
+
     if args.profile == 'cpu':
         stats = pstats.Stats(backend.profiler)
         stats.sort_stats('time')
@@ -0,0 +1,70 @@
+"""
+Benchmark for the generation of simulated variants, timing how
+SimulatedVariantSet scales with the number of variants and CallSets.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import time
+
+import utils
+utils.ga4ghImportGlue()
+import ga4gh.datamodel.datasets as datasets  # noqa
+import ga4gh.datamodel.references as references  # noqa
+import ga4gh.datamodel.variants as variants  # noqa
+
+
+def benchmarkSimulatedVariants(
+        numCalls, variantDensity, length, maxCallSetInfoSize=None):
+    """
+    Builds a SimulatedVariantSet with the specified parameters and
+    generates all of its variants in the first length bases. Returns
+    (construction time, number of variants, generation time).
+    """
+    startTime = time.time()
+    variantSet = variants.SimulatedVariantSet(
+        datasets.Dataset("dataset"),
+        references.SimulatedReferenceSet("referenceSet"), "variantSet",
+        randomSeed=1, numCalls=numCalls, variantDensity=variantDensity,
+        maxCallSetInfoSize=maxCallSetInfoSize)
+    constructionTime = time.time() - startTime
+    startTime = time.time()
+    numVariants = 0
+    for _ in variantSet.getVariants("1", 0, length):
+        numVariants += 1
+    return constructionTime, numVariants, time.time() - startTime
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Simulated variant generation benchmark")
+    parser.add_argument(
+        '--numCalls', type=int, default=1000, metavar='N',
+        help='the number of CallSets (default: %(default)s)')
+    parser.add_argument(
+        '--variantDensity', type=float, default=1, metavar='D',
+        help='the probability of a variant at each position '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--length', type=int, default=1000, metavar='N',
+        help='the number of bases to generate variants for '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--maxCallSetInfoSize', type=int, default=None, metavar='N',
+        help='cap the number of info keys of each CallSet '
+             '(default: no cap)')
+    args = parser.parse_args()
+
+    constructionTime, numVariants, generationTime = \
+        benchmarkSimulatedVariants(
+            args.numCalls, args.variantDensity, args.length,
+            args.maxCallSetInfoSize)
+    print("construction: {:.2f}s".format(constructionTime))
+    print("{} variants x {} calls: {:.2f}s".format(
+        numVariants, args.numCalls, generationTime))
+    if generationTime > 0:
+        print("{:.0f} variants/s, {:.0f} calls/s".format(
+            numVariants / generationTime,
+            numVariants * args.numCalls / generationTime))
@@ -8,6 +8,7 @@ from __future__ import unicode_literals
 import os
 import glob
 import hashlib
+import zlib
 
 import vcf
 
@@ -442,6 +443,14 @@ class VariantSetTest(datadriven.DataDrivenTest):
                 gotVariant = variantSet.getVariant(compoundId)
                 self.assertEqual(str(compoundId), gotVariant.id)
 
+                # IDs issued with the MD5 compatibility mode still resolve
+                legacyCompoundId = datamodel.VariantCompoundId(
+                    variantSet.getCompoundId(), reference_name,
+                    str(variant.start),
+                    self._hashVariant(variant, variants.VARIANT_HASH_MD5))
+                gotVariant = variantSet.getVariant(legacyCompoundId)
+                self.assertEqual(str(compoundId), gotVariant.id)
+
                 # negative test: change start position to past variant
                 wrongStart = variant.end
                 compoundId = datamodel.VariantCompoundId(
@@ -467,10 +476,12 @@ class VariantSetTest(datadriven.DataDrivenTest):
                 with self.assertRaises(exceptions.ObjectNotFoundException):
                     variantSet.getVariant(compoundId)
 
-    def _hashVariant(self, record):
+    def _hashVariant(self, record, hashFunction=variants.VARIANT_HASH_CRC32):
         if record.ALT[0] is None:
             alts = tuple()
         else:
             alts = tuple([unicode(sub) for sub in record.ALT])
         hash_str = record.REF + str(alts)
-        return hashlib.md5(hash_str).hexdigest()
+        if hashFunction == variants.VARIANT_HASH_MD5:
+            return hashlib.md5(hash_str).hexdigest()
+        return "{:08x}".format(zlib.crc32(hash_str) & 0xffffffff)
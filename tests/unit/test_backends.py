@@ -7,13 +7,19 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import unittest
 
+import pysam
+
 import ga4gh.exceptions as exceptions
 import ga4gh.backend as backend
 import ga4gh.datarepo as datarepo
 import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.variants as variants
 import ga4gh.datamodel.references as references
+import ga4gh.protocol as protocol
 
 import tests.paths as paths
 
@@ -177,6 +183,766 @@ class TestSqlRepoTestData(unittest.TestCase):
             self.assertEqual(self._dataRepo.getReferenceSetByName(name), rs)
 
 
+class TestMergedReadsSearch(unittest.TestCase):
+    """
+    Tests searching for reads in ReadGroups drawn from several
+    ReadGroupSets, which requires merging reads across files.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        dataset = dataRepo.getDatasetByIndex(0)
+        self._readGroupSets = [
+            readGroupSet for readGroupSet in dataset.getReadGroupSets()
+            if readGroupSet.getReferenceSet().getLocalId() == "NCBI37"]
+        self._referenceSet = self._readGroupSets[0].getReferenceSet()
+        # Use a strict subset of the ReadGroups in one of the sets.
+        self._readGroups = []
+        for readGroupSet in self._readGroupSets:
+            readGroups = readGroupSet.getReadGroups()
+            if len(readGroups) > 1:
+                readGroups = readGroups[:-1]
+            self._readGroups.extend(readGroups)
+
+    def _getRequest(self, reference, pageSize=None):
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.extend(
+            readGroup.getId() for readGroup in self._readGroups)
+        request.reference_id = reference.getId()
+        if pageSize is not None:
+            request.page_size = pageSize
+        return request
+
+    def _getAllPages(self, request):
+        alignments = []
+        while True:
+            responseStr = self._backend.runSearchReads(
+                protocol.toJson(request))
+            response = protocol.fromJson(
+                responseStr, protocol.SearchReadsResponse)
+            alignments.extend(response.alignments)
+            if not response.next_page_token:
+                break
+            request.page_token = response.next_page_token
+        return alignments
+
+    def testMergedReads(self):
+        self.assertGreater(len(self._readGroupSets), 1)
+        numReads = 0
+        for reference in self._referenceSet.getReferences():
+            expected = []
+            for readGroup in self._readGroups:
+                expected.extend(
+                    alignment.id + alignment.read_group_id
+                    for alignment in readGroup.getReadAlignments(reference))
+            alignments = list(
+                alignment for alignment, _ in self._backend.readsGenerator(
+                    self._getRequest(reference)))
+            self.assertEqual(
+                sorted(expected),
+                sorted(a.id + a.read_group_id for a in alignments))
+            starts = [
+                backend.ReadsIntervalIterator._getStart(alignment)
+                for alignment in alignments]
+            self.assertEqual(starts, sorted(starts))
+            # Paging one read at a time must reproduce the same order.
+            pagedAlignments = self._getAllPages(
+                self._getRequest(reference, 1))
+            self.assertEqual(alignments, pagedAlignments)
+            numReads += len(alignments)
+        self.assertGreater(numReads, 0)
+
+    def testMismatchedReferenceSets(self):
+        dataset = self._backend.getDataRepository().getDatasetByIndex(0)
+        otherReadGroupSet = [
+            readGroupSet for readGroupSet in dataset.getReadGroupSets()
+            if readGroupSet.getReferenceSet() != self._referenceSet][0]
+        request = self._getRequest(self._referenceSet.getReferences()[0])
+        request.read_group_ids.append(
+            otherReadGroupSet.getReadGroups()[0].getId())
+        with self.assertRaises(exceptions.BadRequestException):
+            self._backend.readsGenerator(request)
+
+    def testDuplicateReadGroupIds(self):
+        request = self._getRequest(self._referenceSet.getReferences()[0])
+        request.read_group_ids.append(self._readGroups[0].getId())
+        with self.assertRaises(exceptions.BadRequestException):
+            self._backend.readsGenerator(request)
+
+
+class TestUnmappedReadsSearch(unittest.TestCase):
+    """
+    Tests searching for unmapped reads, which are paged using file
+    offsets rather than genomic coordinates.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        dataset = dataRepo.getDatasetByIndex(0)
+        self._readGroupSets = dataset.getReadGroupSets()
+        self._readGroupIds = []
+        for readGroupSet in self._readGroupSets:
+            self._readGroupIds.extend(readGroupSet.getReadGroupIds())
+
+    def _getExpectedFragmentNames(self):
+        fragmentNames = []
+        for readGroupSet in self._readGroupSets:
+            samFile = pysam.AlignmentFile(readGroupSet.getDataUrl())
+            fragmentNames.extend(
+                read.query_name for read in samFile.fetch(until_eof=True)
+                if read.reference_id == -1)
+            samFile.close()
+        return fragmentNames
+
+    def _getAlignments(self, pageSize=None, pageToken=None):
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.extend(self._readGroupIds)
+        if pageSize is not None:
+            request.page_size = pageSize
+        alignments = []
+        while True:
+            responseStr = self._backend.runSearchReads(
+                protocol.toJson(request))
+            response = protocol.fromJson(
+                responseStr, protocol.SearchReadsResponse)
+            alignments.extend(response.alignments)
+            if not response.next_page_token:
+                break
+            request.page_token = response.next_page_token
+        return alignments
+
+    def testUnmappedReads(self):
+        expected = self._getExpectedFragmentNames()
+        self.assertGreater(len(expected), 0)
+        alignments = self._getAlignments()
+        self.assertEqual(
+            expected, [alignment.fragment_name for alignment in alignments])
+        for alignment in alignments:
+            self.assertFalse(alignment.HasField("alignment"))
+        self.assertEqual(alignments, self._getAlignments(pageSize=1))
+
+    def testBadPageToken(self):
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.extend(self._readGroupIds)
+        for pageToken in ["-1:0", "0:-1", "{}:0".format(
+                len(self._readGroupSets))]:
+            request.page_token = pageToken
+            with self.assertRaises(exceptions.BadPageTokenException):
+                self._backend.readsGenerator(request)
+
+
+class TestReadsBatchSearch(unittest.TestCase):
+    """
+    Tests searching for reads in the columnar ReadAlignmentBatch format.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        dataset = dataRepo.getDatasetByIndex(0)
+        self._readGroupSets = [
+            readGroupSet for readGroupSet in dataset.getReadGroupSets()
+            if readGroupSet.getReferenceSet().getLocalId() == "NCBI37"]
+        self._referenceSet = self._readGroupSets[0].getReferenceSet()
+        self._readGroupIds = []
+        for readGroupSet in self._readGroupSets:
+            self._readGroupIds.extend(readGroupSet.getReadGroupIds())
+
+    def _getRequest(self, reference, pageSize=None):
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.extend(self._readGroupIds)
+        request.reference_id = reference.getId()
+        if pageSize is not None:
+            request.page_size = pageSize
+        return request
+
+    def _getAlignments(self, request):
+        return [
+            alignment for alignment, _ in self._backend.readsGenerator(
+                request)]
+
+    def _getBatches(self, request):
+        batches = []
+        while True:
+            batch = reads.ReadAlignmentBatch.fromBytes(
+                self._backend.runSearchReadsBatch(protocol.toJson(request)))
+            batches.append(batch)
+            if not batch.nextPageToken:
+                break
+            request.page_token = batch.nextPageToken
+        return batches
+
+    def _verifyBatch(self, batch, alignments):
+        self.assertEqual(len(batch), len(alignments))
+        for index, alignment in enumerate(alignments):
+            self.assertEqual(
+                batch.getReadGroupId(index), alignment.read_group_id)
+            self.assertEqual(
+                batch.getFragmentName(index), alignment.fragment_name)
+            self.assertEqual(
+                batch.getSequence(index), alignment.aligned_sequence)
+            self.assertEqual(
+                list(batch.getQualities(index)),
+                list(alignment.aligned_quality))
+            self.assertEqual(
+                batch.templateLengths[index], alignment.fragment_length)
+            flags = batch.flags[index]
+            self.assertEqual(
+                reads.SamFlags.isFlagSet(
+                    flags, reads.SamFlags.DUPLICATE_READ),
+                alignment.duplicate_fragment)
+            if alignment.HasField("alignment"):
+                self.assertEqual(
+                    batch.getReferenceName(index),
+                    alignment.alignment.position.reference_name)
+                self.assertEqual(
+                    batch.positions[index],
+                    alignment.alignment.position.position)
+                self.assertEqual(
+                    batch.mappingQualities[index],
+                    alignment.alignment.mapping_quality)
+                self.assertEqual(
+                    [(reads.SamCigar.int2ga(operation), length)
+                     for operation, length in batch.getCigar(index)],
+                    [(unit.operation, unit.operation_length)
+                     for unit in alignment.alignment.cigar])
+
+    def testBatchesMatchReadAlignments(self):
+        numReads = 0
+        for reference in self._referenceSet.getReferences():
+            alignments = self._getAlignments(self._getRequest(reference))
+            batch = self._backend.searchReadsBatch(
+                self._getRequest(reference))
+            self.assertIsNone(batch.nextPageToken)
+            self._verifyBatch(batch, alignments)
+            numReads += len(batch)
+        self.assertGreater(numReads, 0)
+
+    def testPaging(self):
+        for reference in self._referenceSet.getReferences():
+            alignments = self._getAlignments(self._getRequest(reference))
+            for pageSize in [1, 2, 3]:
+                batches = self._getBatches(
+                    self._getRequest(reference, pageSize))
+                for batch in batches:
+                    self.assertLessEqual(len(batch), pageSize)
+                offset = 0
+                for batch in batches:
+                    self._verifyBatch(
+                        batch, alignments[offset:offset + len(batch)])
+                    offset += len(batch)
+                self.assertEqual(offset, len(alignments))
+
+    def testMaxResponseLength(self):
+        reference = self._referenceSet.getReferences()[0]
+        request = self._getRequest(reference)
+        numReads = len(self._backend.searchReadsBatch(request))
+        self.assertGreater(numReads, 1)
+        self._backend.setMaxResponseLength(1)
+        batches = self._getBatches(self._getRequest(reference))
+        self.assertEqual(len(batches), numReads)
+
+    def testSerialisation(self):
+        reference = self._referenceSet.getReferences()[0]
+        batch = self._backend.searchReadsBatch(self._getRequest(reference, 2))
+        self.assertIsNotNone(batch.nextPageToken)
+        other = reads.ReadAlignmentBatch.fromBytes(batch.toBytes())
+        self.assertEqual(other.readGroupIds, batch.readGroupIds)
+        self.assertEqual(other.referenceNames, batch.referenceNames)
+        self.assertEqual(other.nextPageToken, batch.nextPageToken)
+        for name, _ in reads.ReadAlignmentBatch.columnTypes:
+            self.assertEqual(getattr(other, name), getattr(batch, name))
+        for data in [b"", b"not a batch", batch.toBytes()[:-1]]:
+            with self.assertRaises(ValueError):
+                reads.ReadAlignmentBatch.fromBytes(data)
+
+    def testReferenceIdRequired(self):
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.extend(self._readGroupIds)
+        with self.assertRaises(exceptions.BadRequestException):
+            self._backend.searchReadsBatch(request)
+
+    def testSimulatedReadsNotSupported(self):
+        simulatedBackend = backend.Backend(
+            datarepo.SimulatedDataRepository())
+        dataset = simulatedBackend.getDataRepository().getDatasetByIndex(0)
+        readGroupSet = dataset.getReadGroupSets()[0]
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.extend(readGroupSet.getReadGroupIds())
+        request.reference_id = readGroupSet.getReferenceSet().getReferences(
+            )[0].getId()
+        with self.assertRaises(exceptions.NotImplementedException):
+            simulatedBackend.searchReadsBatch(request)
+
+
+class TestGenotypeMatrixSearch(unittest.TestCase):
+    """
+    Tests searching for variant genotypes in the GenotypeMatrix format.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        dataset = dataRepo.getDatasetByIndex(0)
+        self._variantSets = [
+            variantSet for variantSet in dataset.getVariantSets()
+            if variantSet.getNumCallSets() > 1]
+
+    def _getRequest(self, variantSet, referenceName, pageSize=None):
+        request = protocol.SearchVariantsRequest()
+        request.variant_set_id = variantSet.getId()
+        request.reference_name = referenceName
+        request.start = 0
+        request.end = 2**31 - 1
+        if pageSize is not None:
+            request.page_size = pageSize
+        return request
+
+    def _getVariants(self, request):
+        return [
+            variant for variant, _ in self._backend.variantsGenerator(
+                request)]
+
+    def _getMatrices(self, request):
+        matrices = []
+        while True:
+            matrix = variants.GenotypeMatrix.fromBytes(
+                self._backend.runSearchGenotypeMatrix(
+                    protocol.toJson(request), includePhasing=True))
+            matrices.append(matrix)
+            if not matrix.nextPageToken:
+                break
+            request.page_token = matrix.nextPageToken
+        return matrices
+
+    def _verifyMatrix(self, matrix, gaVariants):
+        self.assertEqual(len(matrix), len(gaVariants))
+        for variantIndex, gaVariant in enumerate(gaVariants):
+            self.assertEqual(matrix.variantIds[variantIndex], gaVariant.id)
+            self.assertEqual(
+                matrix.callSetIds,
+                [call.call_set_id for call in gaVariant.calls])
+            ploidy = matrix.ploidies[variantIndex]
+            for callSetIndex, call in enumerate(gaVariant.calls):
+                genotype = list(call.genotype)
+                genotype += [-1] * (ploidy - len(genotype))
+                self.assertEqual(
+                    matrix.getGenotype(variantIndex, callSetIndex), genotype)
+                if matrix.includePhasing:
+                    self.assertEqual(
+                        matrix.isPhased(variantIndex, callSetIndex),
+                        call.phaseset != "")
+
+    def testMatricesMatchVariants(self):
+        numVariants = 0
+        for variantSet in self._variantSets:
+            for referenceName in variantSet.getReferenceToDataUrlIndexMap():
+                request = self._getRequest(variantSet, referenceName)
+                request.call_set_ids.extend(
+                    callSet.getId() for callSet in variantSet.getCallSets())
+                gaVariants = self._getVariants(request)
+                for pageSize in [1, 3, None]:
+                    request = self._getRequest(
+                        variantSet, referenceName, pageSize)
+                    offset = 0
+                    for matrix in self._getMatrices(request):
+                        if pageSize is not None:
+                            self.assertLessEqual(len(matrix), pageSize)
+                        self._verifyMatrix(
+                            matrix, gaVariants[offset:offset + len(matrix)])
+                        offset += len(matrix)
+                    self.assertEqual(offset, len(gaVariants))
+                numVariants += len(gaVariants)
+        self.assertGreater(numVariants, 0)
+
+    def testCallSetSubset(self):
+        variantSet = self._variantSets[0]
+        referenceName = sorted(variantSet.getReferenceToDataUrlIndexMap())[0]
+        callSetIds = [
+            callSet.getId() for callSet in variantSet.getCallSets()][::-2]
+        request = self._getRequest(variantSet, referenceName)
+        request.call_set_ids.extend(callSetIds)
+        matrix = self._backend.searchGenotypeMatrix(request)
+        self.assertEqual(matrix.callSetIds, callSetIds)
+        self.assertEqual(len(matrix.phased), 0)
+        self._verifyMatrix(matrix, self._getVariants(request)[:len(matrix)])
+        request.call_set_ids.append("notACallSet")
+        with self.assertRaises(exceptions.CallSetNotInVariantSetException):
+            self._backend.searchGenotypeMatrix(request)
+
+    def testSimulatedVariantsNotSupported(self):
+        simulatedBackend = backend.Backend(
+            datarepo.SimulatedDataRepository())
+        dataset = simulatedBackend.getDataRepository().getDatasetByIndex(0)
+        request = self._getRequest(dataset.getVariantSets()[0], "1")
+        with self.assertRaises(exceptions.NotImplementedException):
+            simulatedBackend.searchGenotypeMatrix(request)
+
+
+class TestVariantFilterSearch(unittest.TestCase):
+    """
+    Tests searching for variants using a variant filter expression.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        self._dataset = dataRepo.getDatasetByIndex(0)
+        self._variantFilter = "INFO.AF > 0.3 && FILTER == PASS"
+
+    def _getRequest(self, variantSet, referenceName, pageSize=None):
+        request = protocol.SearchVariantsRequest()
+        request.variant_set_id = variantSet.getId()
+        request.reference_name = referenceName
+        request.start = 0
+        request.end = 2**31 - 1
+        if pageSize is not None:
+            request.page_size = pageSize
+        return request
+
+    def _getFilteredVariantIds(self, variantSet, referenceName):
+        variantFilter = variants.compileVariantFilter(self._variantFilter)
+        return [
+            variantSet.getPysamVariantId(record)
+            for record in variantSet.getPysamVariants(
+                referenceName, 0, 2**31 - 1) if variantFilter(record)]
+
+    def _getVariantIds(self, request):
+        variantIds = []
+        while True:
+            response = protocol.fromJson(
+                self._backend.runSearchVariants(
+                    protocol.toJson(request), self._variantFilter),
+                protocol.SearchVariantsResponse)
+            if request.page_size > 0:
+                self.assertLessEqual(
+                    len(response.variants), request.page_size)
+            variantIds.extend(variant.id for variant in response.variants)
+            if not response.next_page_token:
+                break
+            request.page_token = response.next_page_token
+        return variantIds
+
+    def testFilteredSearch(self):
+        numVariants = 0
+        numFilteredVariants = 0
+        for variantSet in self._dataset.getVariantSets():
+            referenceName = sorted(
+                variantSet.getReferenceToDataUrlIndexMap())[0]
+            expectedIds = self._getFilteredVariantIds(
+                variantSet, referenceName)
+            for pageSize in [1, 3, None]:
+                request = self._getRequest(
+                    variantSet, referenceName, pageSize)
+                self.assertEqual(self._getVariantIds(request), expectedIds)
+            numFilteredVariants += len(expectedIds)
+            numVariants += len(list(variantSet.getPysamVariants(
+                referenceName, 0, 2**31 - 1)))
+        self.assertGreater(numFilteredVariants, 0)
+        self.assertLess(numFilteredVariants, numVariants)
+
+    def testFilteredGenotypeMatrix(self):
+        for variantSet in self._dataset.getVariantSets():
+            if variantSet.getNumCallSets() > 0:
+                break
+        referenceName = sorted(variantSet.getReferenceToDataUrlIndexMap())[0]
+        request = self._getRequest(variantSet, referenceName, 1000)
+        matrix = self._backend.searchGenotypeMatrix(
+            request, variantFilter=self._variantFilter)
+        self.assertEqual(
+            matrix.variantIds,
+            self._getFilteredVariantIds(variantSet, referenceName))
+
+    def testInvalidFilter(self):
+        variantSet = self._dataset.getVariantSets()[0]
+        referenceName = sorted(variantSet.getReferenceToDataUrlIndexMap())[0]
+        request = self._getRequest(variantSet, referenceName)
+        with self.assertRaises(exceptions.InvalidVariantFilterException):
+            self._backend.runSearchVariants(
+                protocol.toJson(request), "QUAL >")
+
+
+class TestProtocolObjectSearch(unittest.TestCase):
+    """
+    Tests that the methods taking and returning protocol objects give
+    the same responses as the corresponding JSON entry points.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        self._dataset = dataRepo.getDatasetByIndex(0)
+
+    def _getVariantsRequest(self, pageToken=""):
+        variantSet = self._dataset.getVariantSets()[0]
+        request = protocol.SearchVariantsRequest()
+        request.variant_set_id = variantSet.getId()
+        request.reference_name = sorted(
+            variantSet.getReferenceToDataUrlIndexMap())[0]
+        request.start = 0
+        request.end = 2**31 - 1
+        request.page_size = 3
+        request.page_token = pageToken
+        return request
+
+    def testSearchRequest(self):
+        request = protocol.SearchDatasetsRequest()
+        response = self._backend.searchRequest(
+            request, protocol.SearchDatasetsResponse,
+            self._backend.datasetsGenerator)
+        self.assertIsInstance(response, protocol.SearchDatasetsResponse)
+        self.assertEqual(
+            response,
+            protocol.fromJson(
+                self._backend.runSearchDatasets(protocol.toJson(request)),
+                protocol.SearchDatasetsResponse))
+
+    def testDefaultPageSizeLeavesRequestUnchanged(self):
+        request = protocol.SearchDatasetsRequest()
+        self._backend.searchRequest(
+            request, protocol.SearchDatasetsResponse,
+            self._backend.datasetsGenerator)
+        self.assertEqual(request, protocol.SearchDatasetsRequest())
+        request = self._getVariantsRequest()
+        request.page_size = 0
+        expected = protocol.SearchVariantsRequest()
+        expected.CopyFrom(request)
+        self._backend.searchVariants(request)
+        self._backend.searchGenotypeMatrix(request)
+        self.assertEqual(request, expected)
+
+    def testSearchVariants(self):
+        for variantFilter in [None, "FILTER == PASS"]:
+            pageToken = ""
+            for _ in range(3):
+                response = self._backend.searchVariants(
+                    self._getVariantsRequest(pageToken), variantFilter)
+                jsonResponse = protocol.fromJson(
+                    self._backend.runSearchVariants(
+                        protocol.toJson(self._getVariantsRequest(pageToken)),
+                        variantFilter),
+                    protocol.SearchVariantsResponse)
+                self.assertGreater(len(response.variants), 0)
+                self.assertEqual(response, jsonResponse)
+                pageToken = response.next_page_token
+
+    def testListReferenceBases(self):
+        referenceSet = self._backend.getDataRepository().getReferenceSets()[0]
+        reference = referenceSet.getReferences()[0]
+        request = protocol.ListReferenceBasesRequest()
+        request.start = 5
+        response = self._backend.listReferenceBases(
+            reference.getId(), request)
+        self.assertEqual(response.offset, 5)
+        self.assertEqual(
+            response,
+            protocol.fromJson(
+                self._backend.runListReferenceBases(
+                    reference.getId(), {"start": "5"}),
+                protocol.ListReferenceBasesResponse))
+
+
+class TestVariantSetStatistics(unittest.TestCase):
+    """
+    Tests the variant set statistics stored in the test data repository.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        self._dataset = dataRepo.getDatasetByIndex(0)
+
+    def testGetVariantSetStatistics(self):
+        for variantSet in self._dataset.getVariantSets():
+            statistics = json.loads(
+                self._backend.runGetVariantSetStatistics(variantSet.getId()))
+            self.assertEqual(statistics["variantSetId"], variantSet.getId())
+            referenceVariantCounts = {}
+            for referenceName in variantSet.getReferenceToDataUrlIndexMap():
+                referenceVariantCounts[referenceName] = len(list(
+                    variantSet.getPysamVariants(referenceName, 0, 2**31 - 1)))
+            self.assertEqual(
+                statistics["referenceVariantCounts"], referenceVariantCounts)
+            self.assertEqual(
+                statistics["numVariants"],
+                sum(referenceVariantCounts.values()))
+            self.assertEqual(
+                statistics["numVariants"], variantSet.getNumVariants())
+            self.assertEqual(
+                sum(statistics["variantTypeCounts"].values()),
+                statistics["numVariants"])
+
+    def testVariantSetMetadata(self):
+        for variantSet in self._dataset.getVariantSets():
+            gaVariantSet = protocol.fromJson(
+                self._backend.runGetVariantSet(variantSet.getId()),
+                protocol.VariantSet)
+            metadataMap = dict(
+                (metadata.key, metadata) for metadata in gaVariantSet.metadata)
+            metadata = metadataMap["stats.numVariants"]
+            self.assertEqual(
+                int(metadata.value), variantSet.getNumVariants())
+            self.assertEqual(
+                sum(int(values.values[0].string_value)
+                    for values in metadata.info.values()),
+                variantSet.getNumVariants())
+            for key in [
+                    "stats.variantTypeCounts",
+                    "stats.alleleFrequencyHistogram",
+                    "stats.qualityHistogram"]:
+                self.assertIn(key, metadataMap)
+            self.assertEqual(
+                metadataMap["stats.alleleFrequencyHistogram"].type, "Float")
+
+    def testStatisticsNotComputed(self):
+        variantSet = variants.SimulatedVariantSet(
+            self._dataset, None, "simulated")
+        self.assertIsNone(variantSet.getStatistics())
+        self._dataset.addVariantSet(variantSet)
+        with self.assertRaises(
+                exceptions.VariantSetStatisticsNotFoundException):
+            self._backend.runGetVariantSetStatistics(variantSet.getId())
+
+
+class TestVariantAnnotationEffectFilter(unittest.TestCase):
+    """
+    Tests searching for variant annotations by effect.
+    """
+    def setUp(self):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepo)
+        self._dataset = dataRepo.getDatasetByIndex(0)
+
+    def _getAnnotationSets(self):
+        for variantSet in self._dataset.getVariantSets():
+            for annotationSet in variantSet.getVariantAnnotationSets():
+                yield annotationSet
+
+    def _searchAnnotations(
+            self, annotationSet, referenceName, effectIds, featureId=None,
+            start=0, end=2**31 - 1):
+        request = protocol.SearchVariantAnnotationsRequest()
+        request.variant_annotation_set_id = annotationSet.getId()
+        request.reference_name = referenceName
+        request.start = start
+        request.end = end
+        request.page_size = 3
+        for effectId in effectIds:
+            request.effects.add(id=effectId)
+        annotations = []
+        while True:
+            response = protocol.fromJson(
+                self._backend.runSearchVariantAnnotations(
+                    protocol.toJson(request), featureId=featureId),
+                protocol.SearchVariantAnnotationsResponse)
+            annotations.extend(response.variant_annotations)
+            if not response.next_page_token:
+                break
+            request.page_token = response.next_page_token
+        return annotations
+
+    def _getExpectedAnnotations(self, annotationSet, referenceName, termIds):
+        annotations = []
+        for _, annotation in annotationSet.getVariantAnnotations(
+                referenceName, 0, 2**31 - 1):
+            transcriptEffects = [
+                effect for effect in annotation.transcript_effects
+                if any(term.id in termIds for term in effect.effects)]
+            if len(transcriptEffects) > 0:
+                annotation.ClearField(b'transcript_effects')
+                annotation.transcript_effects.extend(transcriptEffects)
+                annotations.append(annotation)
+        return annotations
+
+    def _verifyEffectSearch(self, effectId):
+        numAnnotations = 0
+        for annotationSet in self._getAnnotationSets():
+            ontology = annotationSet.getOntology()
+            termIds = ontology.getDescendantIds(effectId)
+            for referenceName in annotationSet.getVariantSet(
+                    ).getReferenceToDataUrlIndexMap():
+                annotations = self._searchAnnotations(
+                    annotationSet, referenceName, [effectId])
+                self.assertEqual(annotations, self._getExpectedAnnotations(
+                    annotationSet, referenceName, termIds))
+                numAnnotations += len(annotations)
+        return numAnnotations
+
+    def testDescendantEffects(self):
+        # coding_sequence_variant matches missense_variant,
+        # synonymous_variant, stop_gained and others.
+        self.assertGreater(self._verifyEffectSearch("SO:0001580"), 0)
+        for annotationSet in self._getAnnotationSets():
+            ontology = annotationSet.getOntology()
+            self.assertIn(
+                "SO:0001583", ontology.getDescendantIds("SO:0001580"))
+
+    def testExactEffects(self):
+        # missense_variant has no descendants in the data.
+        self.assertGreater(self._verifyEffectSearch("SO:0001583"), 0)
+
+    def testUnknownEffect(self):
+        self.assertEqual(self._verifyEffectSearch("SO:9999999"), 0)
+
+    def testFeatureId(self):
+        numAnnotations = 0
+        for annotationSet in self._getAnnotationSets():
+            for referenceName in annotationSet.getVariantSet(
+                    ).getReferenceToDataUrlIndexMap():
+                annotations = list(annotationSet.getVariantAnnotations(
+                    referenceName, 0, 2**31 - 1))
+                if len(annotations) == 0:
+                    continue
+                annotations = [annotation for _, annotation in annotations]
+                featureId = annotations[-1].transcript_effects[0].feature_id
+                expected = [
+                    annotation for annotation in annotations
+                    if any(effect.feature_id == featureId
+                           for effect in annotation.transcript_effects)]
+                self.assertEqual(
+                    self._searchAnnotations(
+                        annotationSet, referenceName, [], featureId),
+                    expected)
+                numAnnotations += len(expected)
+        self.assertGreater(numAnnotations, 0)
+
+    def testCachedAnnotationsNotModified(self):
+        # Searches on small regions are served through the regionCache
+        # when it is enabled, so removing the non-matching effects must
+        # not modify the shared annotations.
+        self.addCleanup(
+            variants.regionCache.setMaxCacheSize,
+            variants.regionCache.getMaxCacheSize())
+        variants.regionCache.setMaxCacheSize(2**20)
+        effectId = "SO:0001631"
+        numAnnotations = 0
+        for annotationSet in self._getAnnotationSets():
+            effectIds = annotationSet.getOntology().getDescendantIds(effectId)
+            for referenceName in annotationSet.getVariantSet(
+                    ).getReferenceToDataUrlIndexMap():
+                variant, _ = next(annotationSet.getVariantAnnotations(
+                    referenceName, 0, 2**31 - 1))
+                start, end = variant.start, variant.start + 200000
+                expected = []
+                for _, annotation in annotationSet.getVariantAnnotations(
+                        referenceName, start, end, effectIds):
+                    expected.append(protocol.VariantAnnotation())
+                    expected[-1].CopyFrom(annotation)
+                self._searchAnnotations(
+                    annotationSet, referenceName, [effectId], start=start,
+                    end=end)
+                self.assertEqual(
+                    [annotation for _, annotation in
+                     annotationSet.getVariantAnnotations(
+                         referenceName, start, end, effectIds)],
+                    expected)
+                numAnnotations += len(expected)
+        self.assertGreater(numAnnotations, 0)
+
+
 class TestTopLevelObjectGenerator(unittest.TestCase):
     """
     Tests the generator used for top level objects
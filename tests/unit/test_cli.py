@@ -39,13 +39,13 @@ class TestGa2VcfArguments(unittest.TestCase):
     Tests the ga2vcf cli can parse all arguments it is supposed to
     """
     def testParseArguments(self):
-        cliInput = """--key KEY -O vcf --outputFile /dev/null
+        cliInput = """--key KEY -O vcf.gz --outputFile /dev/null
         --referenceName REFERENCENAME --callSetIds CALL,SET,IDS --start 0
         --end 1 --pageSize 2 BASEURL VARIANTSETID"""
         parser = cli.getGa2VcfParser()
         args = parser.parse_args(cliInput.split())
         self.assertEqual(args.key, "KEY")
-        self.assertEqual(args.outputFormat, "vcf")
+        self.assertEqual(args.outputFormat, "vcf.gz")
         self.assertEqual(args.outputFile, "/dev/null")
         self.assertEqual(args.referenceName, "REFERENCENAME")
         self.assertEqual(args.callSetIds, "CALL,SET,IDS")
@@ -61,14 +61,18 @@ class TestGa2SamArguments(unittest.TestCase):
     Tests the ga2sam cli can parse all arguments it is supposed to
     """
     def testParseArguments(self):
-        cliInput = """--key KEY --outputFormat sam
-        --pageSize 1 --start 2 --end 3 --outputFile OUT.SAM
+        cliInput = """--key KEY --prefetchPages 4 --parallelism 2
+        --outputFormat sam
+        --pageSize 1 --start 2 --end 3 --outputFile OUT.SAM --numThreads 4
         --referenceId REFERENCEID BASEURL READGROUPID"""
         parser = cli.getGa2SamParser()
         args = parser.parse_args(cliInput.split())
         self.assertEqual(args.key, "KEY")
+        self.assertEqual(args.prefetchPages, 4)
+        self.assertEqual(args.parallelism, 2)
         self.assertEqual(args.outputFormat, "sam")
         self.assertEqual(args.outputFile, "OUT.SAM")
+        self.assertEqual(args.numThreads, 4)
         self.assertEqual(args.referenceId, "REFERENCEID")
         self.assertEqual(args.start, 2)
         self.assertEqual(args.end, 3)
@@ -111,8 +115,10 @@ class TestClientArguments(unittest.TestCase):
         cliInput = (
             "variants-search --referenceName REFERENCENAME "
             "--callSetIds CALL,SET,IDS --start 0 "
-            "--end 1 --pageSize 2 --variantSetId VARIANTSETID BASEURL")
+            "--end 1 --pageSize 2 --variantSetId VARIANTSETID "
+            "--filter QUAL>30 BASEURL")
         args = self.parser.parse_args(cliInput.split())
+        self.assertEqual(args.filter, "QUAL>30")
         self.assertEqual(args.start, 0)
         self.assertEqual(args.end, 1)
         self.assertEqual(args.referenceName, "REFERENCENAME")
@@ -356,8 +362,22 @@ class TestClientArguments(unittest.TestCase):
         self.assertEqual(args.effects, "EFFECTS")
         self.assertEqual(args.pageSize, 3)
         self.assertEqual(args.baseUrl, "BASEURL")
+        self.assertEqual(args.gene, None)
+        self.assertEqual(args.featureId, None)
+        self.assertEqual(args.impact, None)
         self.assertEquals(args.runner, cli.SearchVariantAnnotationsRunner)
 
+    def testVariantAnnotationsSearchByGene(self):
+        cliInput = (
+            "variantannotations-search "
+            "--variantAnnotationSetId VARIANTANNOTATIONSETID "
+            "--referenceName REFERENCENAME --gene GENE "
+            "--featureId FEATUREID --impact IMPACT BASEURL")
+        args = self.parser.parse_args(cliInput.split())
+        self.assertEqual(args.gene, "GENE")
+        self.assertEqual(args.featureId, "FEATUREID")
+        self.assertEqual(args.impact, "IMPACT")
+
     def testVariationAnnotationSetsSearch(self):
         cliInput = (
             "variantannotationsets-search "
@@ -567,8 +587,49 @@ class TestRepoManagerCli(unittest.TestCase):
         self.assertEquals(args.datasetName, self.datasetName)
         self.assertEquals(args.dataFiles, [self.filePath])
         self.assertEquals(args.indexFiles, None)
+        self.assertEquals(args.idIndexFile, None)
+        self.assertEquals(args.annotationIndexFile, None)
+        self.assertEquals(args.workers, None)
+        self.assertEquals(args.transcodeBcf, False)
+        self.assertEquals(args.computeStatistics, False)
         self.assertEquals(args.runner, "addVariantSet")
 
+    def testAddVariantSetWithWorkers(self):
+        cliInput = "add-variantset {} {} {} -w 8".format(
+            self.registryPath, self.datasetName, self.filePath)
+        args = self.parser.parse_args(cliInput.split())
+        self.assertEquals(args.workers, 8)
+
+    def testAddVariantSetWithTranscodeBcf(self):
+        cliInput = "add-variantset {} {} {} -B".format(
+            self.registryPath, self.datasetName, self.filePath)
+        args = self.parser.parse_args(cliInput.split())
+        self.assertEquals(args.transcodeBcf, True)
+
+    def testAddVariantSetWithStatistics(self):
+        cliInput = "add-variantset {} {} {} -S".format(
+            self.registryPath, self.datasetName, self.filePath)
+        args = self.parser.parse_args(cliInput.split())
+        self.assertEquals(args.computeStatistics, True)
+
+    def testAddVariantSetWithIdIndex(self):
+        idIndexFile = "ids.db"
+        cliInput = "add-variantset {} {} {} -x {}".format(
+            self.registryPath, self.datasetName, self.filePath, idIndexFile)
+        args = self.parser.parse_args(cliInput.split())
+        self.assertEquals(args.dataFiles, [self.filePath])
+        self.assertEquals(args.idIndexFile, idIndexFile)
+        self.assertEquals(args.runner, "addVariantSet")
+
+    def testAddVariantSetWithAnnotationIndex(self):
+        annotationIndexFile = "annotations.db"
+        cliInput = "add-variantset {} {} {} -aA {}".format(
+            self.registryPath, self.datasetName, self.filePath,
+            annotationIndexFile)
+        args = self.parser.parse_args(cliInput.split())
+        self.assertEquals(args.addAnnotationSets, True)
+        self.assertEquals(args.annotationIndexFile, annotationIndexFile)
+
     def testAddVariantSetWithIndexFiles(self):
         file1 = "file1"
         file2 = "file2"
@@ -694,6 +755,8 @@ class TestOutputFormats(unittest.TestCase):
             self.key = 'key'
             self.baseUrl = 'baseUrl'
             self.verbose = 'verbose'
+            self.prefetchPages = 0
+            self.parallelism = 1
 
     class FakeObject(protocol.message.Message):
         __metaclass__ = python_message.GeneratedProtocolMessageType
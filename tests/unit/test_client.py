@@ -5,6 +5,9 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import functools
+import sys
+import traceback
 import unittest
 
 import mock
@@ -13,6 +16,9 @@ import ga4gh.protocol as protocol
 import ga4gh.backend as backend
 import ga4gh.client as client
 import ga4gh.datarepo as datarepo
+import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.variants as variants
+import tests.paths as paths
 import tests.utils as utils
 import ga4gh.exceptions as exceptions
 
@@ -411,6 +417,7 @@ class DummyResponse(object):
     """
     def __init__(self, text):
         self.text = text
+        self.content = text
         self.status_code = 200
 
 
@@ -440,6 +447,7 @@ class DummyRequestsSession(object):
             "references": self._backend.runSearchReferences,
             "variantsets": self._backend.runSearchVariantSets,
             "variants": self._backend.runSearchVariants,
+            "variantannotations": self._backend.runSearchVariantAnnotations,
             "readgroupsets": self._backend.runSearchReadGroupSets,
             "reads": self._backend.runSearchReads,
             "rnaquantifications": self._backend.runSearchRnaQuantifications,
@@ -486,7 +494,7 @@ class DummyRequestsSession(object):
             result = method(id_)
         return DummyResponse(result)
 
-    def post(self, url, params=None, data=None):
+    def post(self, url, params=None, data=None, headers=None):
         self.checkSessionParameters()
         assert url.startswith(self._urlPrefix)
         suffix = url[len(self._urlPrefix):]
@@ -496,6 +504,26 @@ class DummyRequestsSession(object):
         datatype = suffix[1:-len(searchSuffix)]
         assert datatype in self._searchMethodMap
         method = self._searchMethodMap[datatype]
+        accept = None if headers is None else headers.get("Accept")
+        if accept == reads.ReadAlignmentBatch.mimetype:
+            assert datatype == "reads"
+            method = self._backend.runSearchReadsBatch
+        elif accept == variants.GenotypeMatrix.mimetype:
+            assert datatype == "variants"
+            method = functools.partial(
+                self._backend.runSearchGenotypeMatrix,
+                includePhasing=params["phasing"] == "true",
+                includeGenotypeLikelihoods=(
+                    params["genotypeLikelihoods"] == "true"))
+        if params is not None and "filter" in params:
+            assert datatype == "variants"
+            method = functools.partial(
+                method, variantFilter=params["filter"])
+        if datatype == "variantannotations":
+            method = functools.partial(
+                method, geneName=params.get("gene"),
+                featureId=params.get("featureId"),
+                impact=params.get("impact"))
         result = method(data)
         return DummyResponse(result)
 
@@ -504,9 +532,11 @@ class DummyHttpClient(client.HttpClient):
     """
     Client in which we intercept calls to the underlying requests connection.
     """
-    def __init__(self, backend):
+    def __init__(self, backend, prefetch_pages=0, parallelism=1):
         self._urlPrefix = "http://example.com"
-        super(DummyHttpClient, self).__init__(self._urlPrefix)
+        super(DummyHttpClient, self).__init__(
+            self._urlPrefix, prefetch_pages=prefetch_pages,
+            parallelism=parallelism)
         self._session = DummyRequestsSession(backend, self._urlPrefix)
         self._setup_http_session()
 
@@ -725,3 +755,374 @@ class TestPagingHttp(PagingMixin, unittest.TestCase):
 
     def getClient(self):
         return DummyHttpClient(self.backend)
+
+
+class TestPagingHttpPrefetch(PagingMixin, unittest.TestCase):
+    """
+    Tests paging using the HTTP client, prefetching pages on a
+    background thread.
+    """
+
+    def getClient(self):
+        return DummyHttpClient(self.backend, prefetch_pages=2)
+
+    def testAbandonedSearch(self):
+        self.client.set_page_size(1)
+        references = self.client.search_references(
+            self.datamodelReferenceSet.getId())
+        self.assertEqual(next(references), self.references[0])
+        references.close()
+        self.verifyAllReferences()
+
+    def testPageRequestError(self):
+        self.client.set_page_size(1)
+        references = self.client.search_references(
+            self.datamodelReferenceSet.getId())
+        self.assertEqual(next(references), self.references[0])
+        with mock.patch.object(
+                self.client._session, "post",
+                side_effect=exceptions.ServerError()):
+            with self.assertRaises(exceptions.ServerError):
+                list(references)
+
+    def testPageRequestErrorTraceback(self):
+        # The traceback of an error raised on the background thread
+        # must include the frames in which it was raised.
+        self.client.set_page_size(1)
+        references = self.client.search_references(
+            self.datamodelReferenceSet.getId())
+        self.assertEqual(next(references), self.references[0])
+        with mock.patch.object(
+                self.client._session, "post",
+                side_effect=exceptions.ServerError()):
+            try:
+                list(references)
+            except exceptions.ServerError:
+                functionNames = [
+                    frame[2] for frame in
+                    traceback.extract_tb(sys.exc_info()[2])]
+            else:
+                self.fail("ServerError not raised")
+        self.assertIn("_run_search_page_request", functionNames)
+
+
+class TestShardedSearchHttp(unittest.TestCase):
+    """
+    Tests that searches for reads and variants split into shards of the
+    region return the same results as the unsharded searches.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.backend = backend.Backend(datarepo.SimulatedDataRepository(
+            randomSeed=100, numDatasets=1,
+            numVariantSets=1, numCalls=2, variantDensity=0.5,
+            numReferenceSets=1, numReferencesPerReferenceSet=1,
+            numReadGroupSets=1, numReadGroupsPerReadGroupSet=2,
+            referenceLength=200, readCoverage=5, readLength=20))
+        cls.dataRepo = cls.backend.getDataRepository()
+
+    def setUp(self):
+        self.client = DummyHttpClient(self.backend)
+        self.shardedClient = DummyHttpClient(self.backend, parallelism=3)
+        self.dataset = self.dataRepo.getDatasetByIndex(0)
+
+    def testSplitInterval(self):
+        self.assertEqual(
+            client._split_interval(10, 20, 3), [(10, 13), (13, 16), (16, 20)])
+        self.assertEqual(client._split_interval(0, 2, 4), [(0, 1), (1, 2)])
+        self.assertEqual(client._split_interval(5, 5, 4), [])
+
+    def testVariants(self):
+        variantSetId = self.dataset.getVariantSets()[0].getId()
+        for pageSize in [None, 1, 3]:
+            self.client.set_page_size(pageSize)
+            self.shardedClient.set_page_size(pageSize)
+            for start, end in [(0, 100), (7, 33), (40, 41)]:
+                expected = list(self.client.search_variants(
+                    variantSetId, start, end, "fixme"))
+                variants = list(self.shardedClient.search_variants(
+                    variantSetId, start, end, "fixme"))
+                self.assertEqual(variants, expected)
+
+    def testReads(self):
+        readGroupSet = self.dataset.getReadGroupSets()[0]
+        readGroupIds = [
+            readGroup.getId() for readGroup in readGroupSet.getReadGroups()]
+        referenceId = readGroupSet.getReferenceSet().getReferences()[
+            0].getId()
+        for pageSize in [None, 1, 4]:
+            self.client.set_page_size(pageSize)
+            self.shardedClient.set_page_size(pageSize)
+            for start, end in [(0, 200), (3, 57)]:
+                expected = list(self.client.search_reads(
+                    readGroupIds, referenceId, start, end))
+                self.assertGreater(len(expected), 0)
+                reads = list(self.shardedClient.search_reads(
+                    readGroupIds, referenceId, start, end))
+                self.assertEqual(reads, expected)
+
+    def testUnmappedReadsWithMappedMates(self):
+        # An unmapped read with a mapped mate sorts at its mate's
+        # position, so it must not be dropped from a later shard as if
+        # it started at 0.
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        testBackend = backend.Backend(dataRepo)
+        testClient = DummyHttpClient(testBackend)
+        shardedClient = DummyHttpClient(testBackend, parallelism=2)
+        dataset = dataRepo.getDatasetByName("dataset1")
+        readGroupSet = dataset.getReadGroupSetByName("HG00533")
+        readGroupIds = [
+            readGroup.getId() for readGroup in readGroupSet.getReadGroups()]
+        referenceId = readGroupSet.getReferenceSet().getReferenceByName(
+            "1").getId()
+        # The mate is at 10004, past the end of the first of 8 shards.
+        start, end = 9000, 17000
+        expected = list(testClient.search_reads(
+            readGroupIds, referenceId, start, end))
+        unmappedReads = [
+            read for read in expected if not read.HasField("alignment")]
+        self.assertEqual(len(unmappedReads), 1)
+        self.assertEqual(unmappedReads[0].next_mate_position.position, 10004)
+        # The backend runs on the client's threads here, and the pysam
+        # handles it caches are not safe to share between threads, so
+        # the shards are requested one at a time.
+        runConcurrently = client._run_concurrently
+        with mock.patch.object(
+                client, "_run_concurrently",
+                lambda iterators, numThreads: runConcurrently(iterators, 1)):
+            reads = list(shardedClient.search_reads(
+                readGroupIds, referenceId, start, end))
+        self.assertEqual(reads, expected)
+
+
+class ReadsBatchMixin(object):
+    """
+    Tests searching for reads in the columnar ReadAlignmentBatch format
+    using the test data repository.
+    """
+    @classmethod
+    def setUpClass(cls):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        cls.backend = backend.Backend(dataRepo)
+        cls.dataRepo = dataRepo
+
+    def setUp(self):
+        self.client = self.getClient()
+
+    def verifyReadsBatches(self):
+        numReads = 0
+        for dmDataset in self.dataRepo.getDatasets():
+            for dmReadGroupSet in dmDataset.getReadGroupSets():
+                readGroupIds = dmReadGroupSet.getReadGroupIds()
+                for dmReference in \
+                        dmReadGroupSet.getReferenceSet().getReferences():
+                    alignments = list(self.client.search_reads(
+                        readGroupIds, dmReference.getId()))
+                    batches = list(self.client.search_reads_batches(
+                        readGroupIds, dmReference.getId()))
+                    fragmentNames = []
+                    for batch in batches:
+                        fragmentNames.extend(
+                            batch.getFragmentName(index)
+                            for index in range(len(batch)))
+                    self.assertEqual(
+                        fragmentNames,
+                        [alignment.fragment_name
+                         for alignment in alignments])
+                    numReads += len(alignments)
+        self.assertGreater(numReads, 0)
+
+    def testDefaultPageSize(self):
+        self.verifyReadsBatches()
+
+    def testPageSize1(self):
+        self.client.set_page_size(1)
+        self.verifyReadsBatches()
+
+
+class TestReadsBatchLocal(ReadsBatchMixin, unittest.TestCase):
+    """
+    Tests searching for read batches using the local client.
+    """
+
+    def getClient(self):
+        return client.LocalClient(self.backend)
+
+
+class TestReadsBatchHttp(ReadsBatchMixin, unittest.TestCase):
+    """
+    Tests searching for read batches using the HTTP client.
+    """
+
+    def getClient(self):
+        return DummyHttpClient(self.backend)
+
+
+class GenotypeMatrixMixin(object):
+    """
+    Tests searching for variant genotypes in the GenotypeMatrix format
+    using the test data repository.
+    """
+    @classmethod
+    def setUpClass(cls):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        cls.backend = backend.Backend(dataRepo)
+        cls.dataRepo = dataRepo
+
+    def setUp(self):
+        self.client = self.getClient()
+
+    def verifyGenotypeMatrices(self):
+        numVariants = 0
+        for dmDataset in self.dataRepo.getDatasets():
+            for dmVariantSet in dmDataset.getVariantSets():
+                if dmVariantSet.getNumCallSets() < 2:
+                    continue
+                callSetIds = [
+                    callSet.getId() for callSet in dmVariantSet.getCallSets()]
+                for referenceName in sorted(
+                        dmVariantSet.getReferenceToDataUrlIndexMap())[:1]:
+                    gaVariants = list(self.client.search_variants(
+                        dmVariantSet.getId(), 0, 2**31 - 1, referenceName,
+                        callSetIds))
+                    variantIds = []
+                    genotypes = []
+                    for matrix in self.client.search_genotype_matrices(
+                            dmVariantSet.getId(), 0, 2**31 - 1,
+                            referenceName, phasing=True):
+                        self.assertEqual(matrix.callSetIds, callSetIds)
+                        variantIds.extend(matrix.variantIds)
+                        for variantIndex in range(len(matrix)):
+                            genotypes.append([
+                                matrix.getGenotype(variantIndex, index)
+                                for index in range(len(callSetIds))])
+                    self.assertEqual(
+                        variantIds, [variant.id for variant in gaVariants])
+                    self.assertEqual(genotypes, [
+                        [list(call.genotype) for call in variant.calls]
+                        for variant in gaVariants])
+                    numVariants += len(gaVariants)
+        self.assertGreater(numVariants, 0)
+
+    def testDefaultPageSize(self):
+        self.verifyGenotypeMatrices()
+
+    def testPageSize2(self):
+        self.client.set_page_size(2)
+        self.verifyGenotypeMatrices()
+
+    def testVariantFilter(self):
+        expression = "INFO.AF > 0.3 && FILTER == PASS"
+        variantFilter = variants.compileVariantFilter(expression)
+        self.client.set_page_size(2)
+        numVariants = 0
+        for dmDataset in self.dataRepo.getDatasets():
+            for dmVariantSet in dmDataset.getVariantSets():
+                if dmVariantSet.getNumCallSets() < 2:
+                    continue
+                referenceName = sorted(
+                    dmVariantSet.getReferenceToDataUrlIndexMap())[0]
+                expectedIds = [
+                    dmVariantSet.getPysamVariantId(record)
+                    for record in dmVariantSet.getPysamVariants(
+                        referenceName, 0, 2**31 - 1, variantFilter)]
+                gaVariants = list(self.client.search_variants(
+                    dmVariantSet.getId(), 0, 2**31 - 1, referenceName,
+                    variant_filter=expression))
+                self.assertEqual(
+                    [variant.id for variant in gaVariants], expectedIds)
+                variantIds = []
+                for matrix in self.client.search_genotype_matrices(
+                        dmVariantSet.getId(), 0, 2**31 - 1, referenceName,
+                        variant_filter=expression):
+                    variantIds.extend(matrix.variantIds)
+                self.assertEqual(variantIds, expectedIds)
+                numVariants += len(expectedIds)
+        self.assertGreater(numVariants, 0)
+
+
+class TestGenotypeMatrixLocal(GenotypeMatrixMixin, unittest.TestCase):
+    """
+    Tests searching for genotype matrices using the local client.
+    """
+
+    def getClient(self):
+        return client.LocalClient(self.backend)
+
+
+class TestGenotypeMatrixHttp(GenotypeMatrixMixin, unittest.TestCase):
+    """
+    Tests searching for genotype matrices using the HTTP client.
+    """
+
+    def getClient(self):
+        return DummyHttpClient(self.backend)
+
+
+class VariantAnnotationFiltersMixin(object):
+    """
+    Tests searching for variant annotations by gene, feature and impact
+    using the test data repository.
+    """
+    @classmethod
+    def setUpClass(cls):
+        dataRepo = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepo.open(datarepo.MODE_READ)
+        cls.backend = backend.Backend(dataRepo)
+        cls.dataRepo = dataRepo
+
+    def setUp(self):
+        self.client = self.getClient()
+
+    def testGeneAndImpact(self):
+        self.client.set_page_size(2)
+        numAnnotations = 0
+        for dmDataset in self.dataRepo.getDatasets():
+            for dmVariantSet in dmDataset.getVariantSets():
+                for dmAnnotationSet in dmVariantSet.getVariantAnnotationSets():
+                    parser = dmAnnotationSet.getTranscriptEffectParser()
+                    key = dmAnnotationSet._getAnnotationInfoKey()
+                    referenceName = sorted(
+                        dmVariantSet.getReferenceToDataUrlIndexMap())[0]
+                    record = next(dmVariantSet.getPysamVariants(
+                        referenceName, 0, 2**31 - 1))
+                    gene, featureId, effects, impact = \
+                        parser.parseIndexFields(record.info[key.encode()][0])
+                    expectedIds = [
+                        annotation.id for _, annotation in
+                        dmAnnotationSet.getVariantAnnotations(
+                            referenceName, 0, 2**31 - 1, geneName=gene,
+                            impact=impact)]
+                    gaAnnotations = list(
+                        self.client.search_variant_annotations(
+                            dmAnnotationSet.getId(), referenceName,
+                            start=0, end=2**31 - 1, gene=gene,
+                            impact=impact))
+                    self.assertEqual(
+                        [annotation.id for annotation in gaAnnotations],
+                        expectedIds)
+                    numAnnotations += len(expectedIds)
+        self.assertGreater(numAnnotations, 0)
+
+
+class TestVariantAnnotationFiltersLocal(
+        VariantAnnotationFiltersMixin, unittest.TestCase):
+    """
+    Tests searching for variant annotations by gene using the local client.
+    """
+
+    def getClient(self):
+        return client.LocalClient(self.backend)
+
+
+class TestVariantAnnotationFiltersHttp(
+        VariantAnnotationFiltersMixin, unittest.TestCase):
+    """
+    Tests searching for variant annotations by gene using the HTTP client.
+    """
+
+    def getClient(self):
+        return DummyHttpClient(self.backend)
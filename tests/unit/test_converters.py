@@ -5,6 +5,10 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import gzip
+import os
+import random
 import tempfile
 import unittest
 
@@ -14,6 +18,7 @@ import ga4gh.backend as backend
 import ga4gh.client as client
 import ga4gh.converters as converters
 import ga4gh.datarepo as datarepo
+import ga4gh.protocol as protocol
 import tests.paths as paths
 import tests.utils as utils
 
@@ -113,3 +118,188 @@ class TestSamConverter(unittest.TestCase):
                     for readGroup in readGroupSet.getReadGroups():
                         self.verifyFullConversion(
                             readGroupSet, readGroup, reference)
+
+    def _getReadGroupAndReferenceWithReads(self):
+        for dataset in self._backend.getDataRepository().getDatasets():
+            for readGroupSet in dataset.getReadGroupSets():
+                referenceSet = readGroupSet.getReferenceSet()
+                for readGroup in readGroupSet.getReadGroups():
+                    for reference in referenceSet.getReferences():
+                        reads = self._client.search_reads(
+                            [readGroup.getId()], reference.getId())
+                        if next(reads, None) is not None:
+                            return readGroup, reference
+        self.fail("No read group has reads")
+
+    def testBamConversion(self):
+        readGroup, reference = self._getReadGroupAndReferenceWithReads()
+        with tempfile.NamedTemporaryFile() as fileHandle:
+            converter = converters.SamConverter(
+                self._client, readGroup.getId(), reference.getId(),
+                outputFileName=fileHandle.name, binaryOutput=True,
+                numThreads=2, batchSize=7)
+            converter.convert()
+            samFile = pysam.AlignmentFile(fileHandle.name, "rb")
+            try:
+                convertedReads = list(samFile.fetch(until_eof=True))
+            finally:
+                samFile.close()
+        self.assertEqual(converter.getNumReads(), len(convertedReads))
+        self.assertGreater(len(convertedReads), 0)
+        # The BAM records must be the same as those pysam writes for
+        # SamLine.toAlignedSegment.
+        targetIds = collections.defaultdict(int, {reference.getName(): 0})
+        reads = self._client.search_reads(
+            [readGroup.getId()], reference.getId())
+        for read, converted in zip(reads, convertedReads):
+            segment = converters.SamLine.toAlignedSegment(read, targetIds)
+            for attribute in [
+                    "query_name", "query_sequence", "flag", "reference_id",
+                    "reference_start", "mapping_quality", "cigartuples",
+                    "next_reference_id", "next_reference_start",
+                    "template_length", "tags"]:
+                self.assertEqual(
+                    getattr(converted, attribute),
+                    getattr(segment, attribute))
+            # pysam returns the qualities it read as an array, but those
+            # it was given as they were.
+            self.assertEqual(
+                list(converted.query_qualities),
+                list(segment.query_qualities))
+
+    def testBamTags(self):
+        # Single characters are written with type A, as pysam does.
+        self.assertEqual(
+            converters.SamLine._encodeBamTag(b"XT", b"M"), b"XTAM")
+        self.assertEqual(
+            converters.SamLine._encodeBamTag(b"MD", b"36"), b"MDZ36\x00")
+        self.assertEqual(
+            converters.SamLine._encodeBamTag(b"NM", 3), b"NMC\x03")
+
+
+class TestBgzfWriter(unittest.TestCase):
+    """
+    Tests for the multithreaded BGZF writer.
+    """
+    def verifyRoundTrip(self, data, numThreads, maxPendingBlocks=None):
+        with tempfile.NamedTemporaryFile() as fileHandle:
+            writer = converters.BgzfWriter(
+                fileHandle, numThreads, maxPendingBlocks=maxPendingBlocks)
+            for j in range(0, len(data), 1000):
+                writer.write(data[j:j + 1000])
+            writer.close()
+            fileHandle.flush()
+            with open(fileHandle.name, "rb") as bgzfFile:
+                compressed = bgzfFile.read()
+            with gzip.GzipFile(fileHandle.name, "rb") as gzipFile:
+                self.assertEqual(gzipFile.read(), data)
+        self.assertTrue(compressed.endswith(
+            converters.BgzfWriter.endOfFileBlock))
+        # Every block, including the last, is at most 64KiB long.
+        offset = 0
+        while offset < len(compressed):
+            self.assertEqual(
+                compressed[offset:offset + 16],
+                converters.BgzfWriter.blockHeader)
+            blockSize = ord(compressed[offset + 16]) + 256 * ord(
+                compressed[offset + 17]) + 1
+            self.assertLessEqual(blockSize, 2**16)
+            offset += blockSize
+        self.assertEqual(offset, len(compressed))
+
+    def testCompressibleData(self):
+        randomNumberGenerator = random.Random(5)
+        data = b"".join(
+            randomNumberGenerator.choice([b"ACGT", b"TTAG", b"GGCC"])
+            for _ in range(100000))
+        for numThreads in [1, 4]:
+            self.verifyRoundTrip(data, numThreads)
+        self.verifyRoundTrip(data, 3, maxPendingBlocks=1)
+
+    def testIncompressibleData(self):
+        self.verifyRoundTrip(os.urandom(3 * 2**16 + 5), 2)
+
+    def testEmpty(self):
+        self.verifyRoundTrip(b"", 1)
+
+
+class TestVcfConverter(unittest.TestCase):
+    """
+    Tests for the GA4GH variants API -> VCF conversion.
+    """
+    def setUp(self):
+        dataRepository = datarepo.SqlDataRepository(paths.testDataRepo)
+        dataRepository.open(datarepo.MODE_READ)
+        self._backend = backend.Backend(dataRepository)
+        self._client = client.LocalClient(self._backend)
+        dataset = dataRepository.getDatasetByIndex(0)
+        for variantSet in dataset.getVariantSets():
+            if variantSet.getNumCallSets() > 0:
+                break
+        self._variantSet = variantSet
+        self._referenceName = sorted(
+            variantSet.getReferenceToDataUrlIndexMap())[0]
+
+    def convert(self, outputFileName, binaryOutput, compressedOutput):
+        """
+        Converts all the variants on the first reference of the test
+        variant set to the specified file, and returns the converter.
+        """
+        gaVariantSet = self._client.get_variant_set(self._variantSet.getId())
+        callSets = list(self._client.search_call_sets(gaVariantSet.id))
+        iterator = self._client.search_variants(
+            gaVariantSet.id, 0, 2**31 - 1, self._referenceName,
+            call_set_ids=[callSet.id for callSet in callSets])
+        reference = protocol.Reference()
+        reference.name = self._referenceName
+        converter = converters.VcfConverter(
+            gaVariantSet, iterator, outputFileName, binaryOutput,
+            callSets=callSets, references=[reference],
+            compressedOutput=compressedOutput, batchSize=3)
+        converter.convert()
+        return converter
+
+    def verifyConversion(self, fileName, converter):
+        sourceRecords = list(self._variantSet.getPysamVariants(
+            self._referenceName, 0, 2**31 - 1))
+        self.assertGreater(len(sourceRecords), 0)
+        self.assertEqual(converter.getNumVariants(), len(sourceRecords))
+        variantFile = pysam.VariantFile(fileName)
+        try:
+            convertedRecords = list(variantFile)
+            self.assertEqual(
+                list(variantFile.header.samples),
+                [str(callSet.getSampleName())
+                 for callSet in self._variantSet.getCallSets()])
+            self.assertEqual(len(convertedRecords), len(sourceRecords))
+            for source, converted in zip(sourceRecords, convertedRecords):
+                self.assertEqual(source.contig, converted.contig)
+                self.assertEqual(source.start, converted.start)
+                self.assertEqual(source.stop, converted.stop)
+                self.assertEqual(source.alleles, converted.alleles)
+                for sampleName in variantFile.header.samples:
+                    self.assertEqual(
+                        source.samples[sampleName].allele_indices,
+                        converted.samples[sampleName].allele_indices)
+        finally:
+            variantFile.close()
+
+    def testVcf(self):
+        with tempfile.NamedTemporaryFile(suffix=".vcf") as fileHandle:
+            converter = self.convert(fileHandle.name, False, False)
+            self.verifyConversion(fileHandle.name, converter)
+
+    def testBcf(self):
+        with tempfile.NamedTemporaryFile(suffix=".bcf") as fileHandle:
+            converter = self.convert(fileHandle.name, True, False)
+            self.verifyConversion(fileHandle.name, converter)
+
+    def testBgzippedVcf(self):
+        with tempfile.NamedTemporaryFile(suffix=".vcf.gz") as fileHandle:
+            converter = self.convert(fileHandle.name, False, True)
+            indexFileName = fileHandle.name + ".tbi"
+            try:
+                self.assertTrue(os.path.exists(indexFileName))
+                self.verifyConversion(fileHandle.name, converter)
+            finally:
+                os.unlink(indexFileName)
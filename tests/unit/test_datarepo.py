@@ -6,11 +6,18 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import sqlite3
 import tempfile
 import unittest
 
+import pysam
+
+import ga4gh.datamodel as datamodel
 import ga4gh.datarepo as datarepo
 import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
+
+import tests.paths as paths
 
 
 prefix = "ga4gh_datarepo_test"
@@ -59,6 +66,73 @@ class TestDataRepoVersion(AbstractDataRepoTest):
                 exceptions.RepoSchemaVersionMismatchException):
             anotherRepo.open(datarepo.MODE_READ)
 
+    def _getColumns(self, db, table):
+        return [info[1] for info in db.execute(
+            "PRAGMA table_info({});".format(table))]
+
+    def testOlderMinorVersionUpgraded(self):
+        repo = datarepo.SqlDataRepository(self._repoPath)
+        repo.open(datarepo.MODE_WRITE)
+        repo.initialise()
+        repo.commit()
+        repo.close()
+        # Rewrite the tables as an older minor version created them.
+        olderVersion = "{}.0".format(repo.version.major)
+        with sqlite3.connect(self._repoPath) as db:
+            for table, column, _ in repo.addedColumns:
+                columns = [
+                    name for name in self._getColumns(db, table)
+                    if name != column]
+                db.execute("CREATE TABLE Old AS SELECT {} FROM {};".format(
+                    ", ".join(columns), table))
+                db.execute("DROP TABLE {};".format(table))
+                db.execute("ALTER TABLE Old RENAME TO {};".format(table))
+            db.execute(
+                "UPDATE System SET value = ? WHERE key = ?;",
+                (olderVersion, repo.systemKeySchemaVersion))
+        anotherRepo = datarepo.SqlDataRepository(self._repoPath)
+        anotherRepo.open(datarepo.MODE_WRITE)
+        anotherRepo.close()
+        with sqlite3.connect(self._repoPath) as db:
+            for table, column, _ in repo.addedColumns:
+                self.assertIn(column, self._getColumns(db, table))
+        anotherRepo = datarepo.SqlDataRepository(self._repoPath)
+        anotherRepo.open(datarepo.MODE_READ)
+        self.assertEqual(anotherRepo._schemaVersion, str(repo.version))
+
+
+class TestReadGroupSetHeaderData(unittest.TestCase):
+    """
+    Tests that the header-derived state of ReadGroupSets is served from
+    the repo without opening the alignment files.
+    """
+    def setUp(self):
+        self._fileHandleCache = datamodel.fileHandleCache
+        datamodel.fileHandleCache = datamodel.PysamFileHandleCache()
+        self._repo = datarepo.SqlDataRepository(paths.testDataRepo)
+        self._repo.open(datarepo.MODE_READ)
+
+    def tearDown(self):
+        datamodel.fileHandleCache = self._fileHandleCache
+
+    def testHeaderDataWithoutFileAccess(self):
+        readGroupSets = []
+        for dataset in self._repo.getDatasets():
+            for readGroupSet in dataset.getReadGroupSets():
+                readGroupSets.append(readGroupSet)
+                protocol.toJson(readGroupSet.toProtocolElement())
+                self.assertGreater(len(readGroupSet.getReferenceNames()), 0)
+        self.assertGreater(len(readGroupSets), 0)
+        self.assertEqual(
+            len(datamodel.fileHandleCache.getCachedFiles()), 0)
+        for readGroupSet in readGroupSets:
+            samFile = pysam.AlignmentFile(readGroupSet.getDataUrl())
+            self.assertEqual(
+                readGroupSet.getReferenceNames(), list(samFile.references))
+            self.assertEqual(
+                readGroupSet.getNumAlignedReads(), samFile.mapped)
+            samFile.close()
+
 
 class TestBadDatabase(AbstractDataRepoTest):
     """
@@ -6,9 +6,19 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import itertools
+import os
+import random
+import shutil
+import tempfile
 import unittest
 
+import pysam
+
+import ga4gh.datamodel.datasets as datasets
 import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.references as references
+import ga4gh.exceptions as exceptions
 import ga4gh.protocol as protocol
 
 
@@ -247,3 +257,172 @@ class TestSamFlags(unittest.TestCase):
             self.flag, reads.SamFlags.FIRST_IN_PAIR))
         self.assertTrue(reads.SamFlags.isFlagSet(
             self.flag, reads.SamFlags.FAILED_QUALITY_CHECK))
+
+
+class TestCramReadGroupSet(unittest.TestCase):
+    """
+    Tests that a ReadGroupSet backed by a CRAM file returns the same
+    reads as one backed by the equivalent BAM file.
+    """
+    _numUnplacedReads = 7
+
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp(prefix="ga4gh_cram_test")
+        rng = random.Random(1)
+        sequence = "".join(rng.choice("ACGT") for _ in range(2000))
+        fastaPath = os.path.join(self._tempDir, "ref.fa")
+        with open(fastaPath, "w") as fastaFile:
+            fastaFile.write(">chr1\n")
+            for i in range(0, len(sequence), 60):
+                fastaFile.write(sequence[i:i + 60] + "\n")
+        pysam.faidx(str(fastaPath), catch_stdout=False)
+        self._referenceSet = references.HtslibReferenceSet("ref")
+        self._referenceSet.populateFromFile(fastaPath)
+        self._reference = self._referenceSet.getReferenceByName("chr1")
+        header = {
+            "HD": {"VN": "1.0", "SO": "coordinate"},
+            "SQ": [{"SN": "chr1", "LN": len(sequence)}],
+            "RG": [{"ID": "rg1", "SM": "sample"}]}
+        self._bamPath = os.path.join(self._tempDir, "reads.bam")
+        self._cramPath = os.path.join(self._tempDir, "reads.cram")
+        for path, mode in [(self._bamPath, "wb"), (self._cramPath, "wc")]:
+            samFile = pysam.AlignmentFile(
+                path, mode, header=header, reference_filename=fastaPath)
+            for i in range(50):
+                read = pysam.AlignedSegment()
+                read.query_name = str("read{}".format(i))
+                read.reference_id = 0
+                read.reference_start = i * 30
+                read.query_sequence = str(sequence[i * 30:i * 30 + 40])
+                read.query_qualities = pysam.qualitystring_to_array(b"I" * 40)
+                read.cigartuples = [(0, 40)]
+                read.mapping_quality = 30
+                # CRAM does not store the mate of unpaired reads.
+                read.next_reference_id = -1
+                read.next_reference_start = -1
+                read.tags = [(b"RG", b"rg1")]
+                samFile.write(read)
+            for i in range(self._numUnplacedReads):
+                read = pysam.AlignedSegment()
+                read.query_name = str("unplaced{}".format(i))
+                read.is_unmapped = True
+                read.reference_id = -1
+                read.reference_start = -1
+                read.query_sequence = str(sequence[i * 30:i * 30 + 40])
+                read.query_qualities = pysam.qualitystring_to_array(b"I" * 40)
+                read.tags = [(b"RG", b"rg1")]
+                samFile.write(read)
+            samFile.close()
+            pysam.index(str(path), catch_stdout=False)
+        dataset = datasets.Dataset("ds")
+        self._bamReadGroupSet = reads.HtslibReadGroupSet(dataset, "bam")
+        self._bamReadGroupSet.populateFromFile(self._bamPath)
+        self._bamReadGroupSet.setReferenceSet(self._referenceSet)
+        self._cramReadGroupSet = reads.HtslibReadGroupSet(dataset, "cram")
+        self._cramReadGroupSet.populateFromFile(self._cramPath)
+        self._cramReadGroupSet.setReferenceSet(self._referenceSet)
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def _getReads(self, readGroupSet, start, end):
+        alignments = list(readGroupSet.getReadAlignments(
+            self._reference, start, end))
+        for alignment in alignments:
+            alignment.id = ""
+            alignment.read_group_id = ""
+            # htslib regenerates these tags when decoding CRAM
+            for key in ["MD", "NM"]:
+                if key in alignment.info:
+                    del alignment.info[key]
+        return alignments
+
+    def testDefaultIndexFile(self):
+        self.assertEqual(
+            self._cramReadGroupSet.getIndexFile(), self._cramPath + ".crai")
+        self.assertEqual(
+            self._bamReadGroupSet.getIndexFile(), self._bamPath + ".bai")
+
+    def testReadCounts(self):
+        self.assertEqual(self._bamReadGroupSet.getNumAlignedReads(), 50)
+        self.assertEqual(self._cramReadGroupSet.getNumAlignedReads(), -1)
+        self.assertEqual(self._cramReadGroupSet.getNumUnalignedReads(), -1)
+
+    def testReadsMatchBam(self):
+        for start, end in [(0, 2000), (100, 400), (1500, 1600)]:
+            bamReads = self._getReads(self._bamReadGroupSet, start, end)
+            cramReads = self._getReads(self._cramReadGroupSet, start, end)
+            self.assertGreater(len(bamReads), 0)
+            self.assertEqual(bamReads, cramReads)
+        readGroup = self._cramReadGroupSet.getReadGroups()[0]
+        self.assertEqual(
+            len(list(readGroup.getReadAlignments(self._reference))), 50)
+
+    def _getUnmappedReadNames(self, readGroupSet, pageSize):
+        # Reads pages in the same way as the backend, which reads one
+        # object beyond the end of each page.
+        names = []
+        position = None
+        while True:
+            iterator = readGroupSet.getUnmappedReadAlignments(position)
+            page = list(itertools.islice(iterator, pageSize + 1))
+            iterator.close()
+            names.extend(
+                alignment.fragment_name for alignment, _ in page[:pageSize])
+            if len(page) <= pageSize:
+                return names
+            position = page[pageSize - 1][1]
+
+    def testUnmappedReadsMatchBam(self):
+        expected = [
+            "unplaced{}".format(i) for i in range(self._numUnplacedReads)]
+        for pageSize in [1, 2, 3, 100]:
+            self.assertEqual(
+                self._getUnmappedReadNames(self._bamReadGroupSet, pageSize),
+                expected)
+            self.assertEqual(
+                self._getUnmappedReadNames(self._cramReadGroupSet, pageSize),
+                expected)
+
+    def testUnmappedCramPositions(self):
+        _, containerOffsets, unplacedOffset = reads.readCramIndex(
+            self._cramReadGroupSet.getIndexFile())
+        self.assertIn(unplacedOffset, containerOffsets)
+        names = [
+            alignment.fragment_name for alignment, _ in
+            self._cramReadGroupSet.getUnmappedReadAlignments()]
+        self.assertEqual(len(names), self._numUnplacedReads)
+        # Reading resumes from any position, in a container listed in the
+        # index.
+        positions = [
+            position for _, position in
+            self._cramReadGroupSet.getUnmappedReadAlignments()]
+        for i, position in enumerate(positions[:-1]):
+            containerOffset, _ = reads.parseCramPosition(position)
+            self.assertIn(containerOffset, containerOffsets)
+            self.assertEqual(
+                [alignment.fragment_name for alignment, _ in
+                 self._cramReadGroupSet.getUnmappedReadAlignments(
+                     position)],
+                names[i + 1:])
+        invalidPosition = reads.getCramPosition(unplacedOffset + 1, 0)
+        with self.assertRaises(exceptions.BadPageTokenException):
+            list(self._cramReadGroupSet.getUnmappedReadAlignments(
+                invalidPosition))
+
+    def testDecodedReferenceStore(self):
+        storeDirectory = os.path.join(self._tempDir, "store")
+        references.decodedReferenceStore.setDirectory(storeDirectory)
+        try:
+            self.assertIsNone(self._cramReadGroupSet.getReferenceFilename())
+            self.assertEqual(
+                os.listdir(storeDirectory),
+                [self._reference.getMd5Checksum()])
+            bamReads = self._getReads(self._bamReadGroupSet, 0, 2000)
+            cramReads = self._getReads(self._cramReadGroupSet, 0, 2000)
+            self.assertEqual(bamReads, cramReads)
+        finally:
+            references.decodedReferenceStore.setDirectory(None)
+        self.assertEqual(
+            self._cramReadGroupSet.getReferenceFilename(),
+            self._referenceSet.getDataUrl())
@@ -6,13 +6,20 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import shutil
+import tempfile
 import unittest
 
+import pysam
+
 import ga4gh.backend as backend
 import ga4gh.datamodel.references as references
 import ga4gh.exceptions as exceptions
 import ga4gh.datarepo as datarepo
 
+import tests.paths as paths
+
 
 class TestAbstractReferenceSet(unittest.TestCase):
     """
@@ -91,3 +98,91 @@ class TestAbstractReference(unittest.TestCase):
             self.assertRaises(
                 exceptions.ReferenceRangeErrorException,
                 self._reference.checkQueryRange, badRange[0], badRange[1])
+
+
+class TestReferenceSliceCache(unittest.TestCase):
+    """
+    Unit tests for the cache of decoded reference sequence slices.
+    """
+    def setUp(self):
+        self._dataUrl = paths.ncbi37FaPath
+        self._fastaFile = pysam.FastaFile(self._dataUrl)
+        self._referenceName = self._fastaFile.references[0]
+        self._length = self._fastaFile.get_reference_length(
+            self._referenceName)
+        self._cache = references.ReferenceSliceCache(sliceSize=16)
+
+    def _getBases(self, start, end):
+        return self._cache.getBases(
+            self._fastaFile, self._dataUrl, self._referenceName, start, end)
+
+    def testGetBases(self):
+        for start, end in [
+                (0, 1), (0, 16), (15, 17), (3, 70), (16, 32),
+                (0, self._length), (self._length - 1, self._length)]:
+            self.assertEqual(
+                self._getBases(start, end),
+                self._fastaFile.fetch(self._referenceName, start, end))
+
+    def testHitRate(self):
+        self.assertIsNone(self._cache.getHitRate())
+        self._getBases(0, 16)
+        self.assertEqual(self._cache.getHitRate(), 0)
+        self._getBases(1, 15)
+        self.assertEqual(self._cache.getHitRate(), 0.5)
+        self._cache.clear()
+        self.assertIsNone(self._cache.getHitRate())
+        self.assertEqual(self._cache.getNumCachedSlices(), 0)
+
+    def testMaxCacheSize(self):
+        self._cache.setMaxCacheSize(2)
+        self._getBases(0, 64)
+        self.assertEqual(self._cache.getNumCachedSlices(), 2)
+        # The most recently used slices are retained
+        self._getBases(48, 64)
+        self.assertEqual(self._cache.getHitRate(), 0.2)
+        self._cache.setMaxCacheSize(1)
+        self.assertEqual(self._cache.getNumCachedSlices(), 1)
+        with self.assertRaises(ValueError):
+            self._cache.setMaxCacheSize(0)
+
+
+class TestDecodedReferenceStore(unittest.TestCase):
+    """
+    Unit tests for the store of decoded reference sequences used to
+    decode CRAM files.
+    """
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="ga4gh_store_test")
+        self._store = references.DecodedReferenceStore()
+        self._referenceSet = references.HtslibReferenceSet("NCBI37")
+        self._referenceSet.populateFromFile(paths.ncbi37FaPath)
+
+    def tearDown(self):
+        self._store.setDirectory(None)
+        shutil.rmtree(self._directory)
+
+    def testAddReferences(self):
+        self._store.setDirectory(self._directory)
+        fastaFile = pysam.FastaFile(paths.ncbi37FaPath)
+        md5checksums = []
+        for reference in self._referenceSet.getReferences():
+            md5checksums.append(reference.getMd5Checksum())
+            self.assertTrue(self._store.addReferences(
+                self._referenceSet, md5checksums))
+            path = os.path.join(self._directory, md5checksums[-1])
+            with open(path, "rb") as sequenceFile:
+                self.assertEqual(
+                    sequenceFile.read(),
+                    fastaFile.fetch(reference.getLocalId().encode()).upper())
+        self.assertEqual(
+            sorted(os.listdir(self._directory)), sorted(md5checksums))
+
+    def testUnavailableReferences(self):
+        md5checksum = self._referenceSet.getReferences()[0].getMd5Checksum()
+        self.assertFalse(self._store.addReferences(
+            self._referenceSet, [md5checksum]))
+        self._store.setDirectory(self._directory)
+        for md5checksums in [[], [None], ["0" * 32], [md5checksum, None]]:
+            self.assertFalse(self._store.addReferences(
+                self._referenceSet, md5checksums))
@@ -8,6 +8,7 @@ from __future__ import unicode_literals
 import os
 import glob
 import shutil
+import sqlite3
 import tempfile
 import unittest
 
@@ -679,6 +680,80 @@ class TestAddVariantSet(AbstractRepoManagerTest):
         finally:
             shutil.rmtree(tempdir)
 
+    def testIdIndex(self):
+        tempdir = tempfile.mkdtemp(prefix="ga4gh_test_add_variantset")
+        name = "test_name"
+        try:
+            idIndexFile = os.path.join(tempdir, "ids.db")
+            cmd = (
+                "add-variantset {} {} {} --name={} --referenceSetName={} "
+                "--idIndexFile={}".format(
+                    self._repoPath, self._datasetName, self.vcfDir, name,
+                    self._referenceSetName, idIndexFile))
+            self.runCommand(cmd)
+            repo = self.readRepo()
+            dataset = repo.getDatasetByName(self._datasetName)
+            variantSet = dataset.getVariantSetByName(name)
+            self.assertEqual(variantSet.getIdIndexFile(), idIndexFile)
+            for referenceName in variantSet.getReferenceToDataUrlIndexMap():
+                for variant in variantSet.getVariants(
+                        referenceName, 0, 2**31, None):
+                    compoundId = datamodel.VariantCompoundId.parse(
+                        variant.id)
+                    self.assertEqual(
+                        variantSet.getVariant(compoundId), variant)
+                compoundId = datamodel.VariantCompoundId(
+                    variantSet.getCompoundId(), referenceName, "0", "hash")
+                self.assertRaises(
+                    exceptions.ObjectNotFoundException,
+                    variantSet.getVariant, compoundId)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def testTranscodeBcf(self):
+        tempdir = tempfile.mkdtemp(prefix="ga4gh_test_add_variantset")
+        try:
+            dataFiles = []
+            for vcfFile in self.vcfFiles:
+                dataFile = os.path.join(tempdir, os.path.basename(vcfFile))
+                shutil.copyfile(vcfFile, dataFile)
+                shutil.copyfile(vcfFile + ".tbi", dataFile + ".tbi")
+                dataFiles.append(dataFile)
+            bcfFiles = [
+                vcfFile[:-len(".vcf.gz")] + ".bcf" for vcfFile in dataFiles]
+            bcfIndexFiles = [bcfFile + ".csi" for bcfFile in bcfFiles]
+            cmd = (
+                "add-variantset {} {} {} --name=transcoded "
+                "--referenceSetName={} --transcodeBcf".format(
+                    self._repoPath, self._datasetName, " ".join(dataFiles),
+                    self._referenceSetName))
+            self.runCommand(cmd)
+            self.verifyVariantSet("transcoded", bcfFiles, bcfIndexFiles)
+            # Existing sidecars are used without --transcodeBcf, for
+            # files and directories.
+            cmd = "add-variantset {} {} {} --name=files -R {}".format(
+                self._repoPath, self._datasetName, " ".join(dataFiles),
+                self._referenceSetName)
+            self.runCommand(cmd)
+            self.verifyVariantSet("files", bcfFiles, bcfIndexFiles)
+            cmd = "add-variantset {} {} {} --name=directory -R {}".format(
+                self._repoPath, self._datasetName, tempdir,
+                self._referenceSetName)
+            self.runCommand(cmd)
+            self.verifyVariantSet("directory", bcfFiles, bcfIndexFiles)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def testTranscodeBcfRemoteFiles(self):
+        dataFile = "http://example.com/example.vcf.gz"
+        cmd = (
+            "add-variantset {} {} {} -I example.vcf.gz.tbi "
+            "--referenceSetName={} --name=remote --transcodeBcf".format(
+                self._repoPath, self._datasetName, dataFile,
+                self._referenceSetName))
+        self.assertRaises(
+            exceptions.RepoManagerException, self.runCommand, cmd)
+
     def testAddVariantSetWithSameName(self):
         # Default name
         vcfDir = self.vcfDir
@@ -759,6 +834,75 @@ class TestAddAnnotatedVariantSet(AbstractRepoManagerTest):
         variantSet = dataset.getVariantSetByName(name)
         self.assertEqual(len(variantSet.getVariantAnnotationSets()), 1)
 
+    def testAnnotationIndex(self):
+        tempdir = tempfile.mkdtemp(prefix="ga4gh_test_add_variantset")
+        try:
+            indexFile = os.path.join(tempdir, "annotations.db")
+            for name, options in [
+                    ("scanned", ""),
+                    ("indexed", "-A {}".format(indexFile))]:
+                cmd = "add-variantset {} {} {} -R {} -n {} -aO {} {}".format(
+                    self._repoPath, self._datasetName, self.vcfDir,
+                    self._referenceSetName, name, self._ontologyName,
+                    options)
+                self.runCommand(cmd)
+            repo = self.readRepo()
+            dataset = repo.getDatasetByName(self._datasetName)
+            annotationSets = [
+                dataset.getVariantSetByName(name).getVariantAnnotationSets()[0]
+                for name in ["scanned", "indexed"]]
+            self.assertEqual(annotationSets[0].getIndexFile(), None)
+            self.assertEqual(annotationSets[1].getIndexFile(), indexFile)
+            # Search on the values of the first annotation in the file.
+            variantSet = annotationSets[1].getParentContainer()
+            referenceName = sorted(
+                variantSet.getReferenceToDataUrlIndexMap().keys())[0]
+            parser = annotationSets[1].getTranscriptEffectParser()
+            key = annotationSets[1]._getAnnotationInfoKey()
+            record = next(variantSet.getPysamVariants(
+                referenceName, 0, 2**31))
+            gene, featureId, effects, impact = parser.parseIndexFields(
+                record.info[key.encode()][0])
+            effectId = annotationSets[1].getOntology().getTermIds(
+                effects.split("&")[0])[0]
+            searches = [
+                {"geneName": "not_a_gene"},
+                {"geneName": gene},
+                {"featureId": featureId, "impact": impact},
+                {"effectIds": set([effectId])},
+                {"effectIds": set([effectId]), "geneName": gene},
+            ]
+            for search in searches:
+                results = []
+                for annotationSet in annotationSets:
+                    results.append([
+                        (variant.start, [
+                            effect.id
+                            for effect in annotation.transcript_effects])
+                        for variant, annotation in
+                        annotationSet.getVariantAnnotations(
+                            referenceName, 0, 2**31, **search)])
+                self.assertEqual(results[0], results[1])
+            self.assertGreater(len(results[0]), 0)
+            # Records that do not match the index are not returned.
+            dbconn = sqlite3.connect(indexFile)
+            dbconn.execute("UPDATE VariantAnnotation SET start = start + 1")
+            dbconn.commit()
+            dbconn.close()
+            self.assertRaises(
+                exceptions.DataException, list,
+                annotationSets[1].getVariantAnnotations(
+                    referenceName, 0, 2**31, featureId=featureId))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def testAnnotationIndexNoAnnotations(self):
+        cmd = "add-variantset {} {} {} -R {} -A {}".format(
+            self._repoPath, self._datasetName, self.vcfDir,
+            self._referenceSetName, "annotations.db")
+        self.assertRaises(
+            exceptions.RepoManagerException, self.runCommand, cmd)
+
     def testAnnotationsNoOntology(self):
         name = "test_vs_annotations"
         cmd = "add-variantset {} {} {} -R {} -n {} -a".format(
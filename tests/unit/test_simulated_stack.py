@@ -915,14 +915,21 @@ class TestSimulatedStack(unittest.TestCase):
                             self.assertEqual(
                                 alignment.read_group_id, readGroup.getId())
 
-    def testUnsupportedReadOperations(self):
+    def testUnmappedReads(self):
+        # Simulated ReadGroupSets have no unmapped reads.
         path = '/reads/search'
-
-        # unmapped Reads
         request = protocol.SearchReadsRequest()
         request.read_group_ids.extend([self.readGroup.getId()])
         request.reference_id = ""
-        self.verifySearchMethodNotSupported(request, path)
+        responseData = self.sendSearchRequest(
+            path, request, protocol.SearchReadsResponse)
+        self.assertEqual(len(responseData.alignments), 0)
+        self.assertEqual(responseData.next_page_token, "")
+
+    def testUnsupportedReadOperations(self):
+        path = '/reads/search'
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.extend([self.readGroup.getId()])
 
         # multiple ReadGroupSets set mismatch
         request.read_group_ids.append(self.readGroup.getId())
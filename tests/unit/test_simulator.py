@@ -110,6 +110,61 @@ class TestSimulatedVariantSet(unittest.TestCase):
         variantListTwo = self._getSimulatedVariantsList()
         self.assertEqual(variantListOne, variantListTwo)
 
+    def testQueryWindowIndependence(self):
+        # the variants produced at a position must not depend on the
+        # query window, including windows spanning several blocks
+        self.variantDensity = 0.1
+        simulatedVariantSet = self._getSimulatedVariantSet()
+        blockSize = simulatedVariantSet.blockSize
+        start, end = blockSize - 100, 3 * blockSize + 100
+        variantList = list(simulatedVariantSet.getVariants(
+            self.referenceName, start, end))
+        self.assertGreater(len(variantList), 0)
+        windows = [
+            (start, blockSize), (blockSize, blockSize + 7),
+            (blockSize + 7, 2 * blockSize + 1), (2 * blockSize + 1, end)]
+        windowVariantList = []
+        for windowStart, windowEnd in windows:
+            windowVariantList.extend(simulatedVariantSet.getVariants(
+                self.referenceName, windowStart, windowEnd))
+        self.assertEqual(variantList, windowVariantList)
+        for variant in variantList:
+            compoundId = datamodel.VariantCompoundId.parse(variant.id)
+            self.assertEqual(
+                simulatedVariantSet.getVariant(compoundId), variant)
+
+    def testVariantDensity(self):
+        self.variantDensity = 0.25
+        simulatedVariantSet = self._getSimulatedVariantSet()
+        numPositions = 10 * simulatedVariantSet.blockSize
+        positions = [
+            variant.start for variant in simulatedVariantSet.getVariants(
+                self.referenceName, 0, numPositions)]
+        self.assertEqual(positions, sorted(set(positions)))
+        self.assertAlmostEqual(
+            len(positions) / numPositions, self.variantDensity, delta=0.02)
+        self.variantDensity = 0
+        simulatedVariantSet = self._getSimulatedVariantSet()
+        self.assertEqual(
+            list(simulatedVariantSet.getVariants(
+                self.referenceName, 0, numPositions)), [])
+
+    def testCallSetInfoSize(self):
+        self.numCalls = 5
+        simulatedVariantSet = self._getSimulatedVariantSet()
+        self.assertEqual(
+            [len(callSet._info)
+             for callSet in simulatedVariantSet.getCallSets()],
+            [0, 1, 2, 3, 4])
+        simulatedVariantSet = variants.SimulatedVariantSet(
+            datasets.Dataset('dataset1'),
+            references.SimulatedReferenceSet("srs1"), 'variantSet1',
+            numCalls=self.numCalls, maxCallSetInfoSize=2)
+        self.assertEqual(
+            [len(callSet._info)
+             for callSet in simulatedVariantSet.getCallSets()],
+            [0, 1, 2, 2, 2])
+
     def _assertEqualVariantLists(self, variantListOne, variantListTwo):
         # need to make time-dependent fields equal before the comparison,
         # otherwise we're introducing a race condition
@@ -155,6 +210,28 @@ class TestSimulatedVariantAnnotationSet(unittest.TestCase):
                 "Expect time format to be in ISO8601")
             self.assertEqual(variant.id, ann.variant_id)
 
+    def testNumTranscriptEffects(self):
+        dataset = datasets.Dataset('dataset1')
+        referenceSet = references.SimulatedReferenceSet("srs1")
+        simulatedVariantSet = variants.SimulatedVariantSet(
+            dataset, referenceSet, 'variantSet1', randomSeed=self.randomSeed,
+            numCalls=self.numCalls, variantDensity=self.variantDensity)
+        numTranscriptEffects = 4
+        simulatedVariantAnnotationSet = variants.SimulatedVariantAnnotationSet(
+            simulatedVariantSet, "variantAnnotationSetId", self.randomSeed,
+            numTranscriptEffects)
+        annotations = list(simulatedVariantAnnotationSet.getVariantAnnotations(
+            self.referenceName, self.startPosition, self.endPosition))
+        self.assertEqual(
+            len(annotations), self.endPosition - self.startPosition)
+        for variant, ann in annotations:
+            self.assertEqual(
+                len(ann.transcript_effects),
+                numTranscriptEffects * len(variant.alternate_bases))
+            self.assertEqual(
+                len(set(effect.id for effect in ann.transcript_effects)),
+                len(ann.transcript_effects))
+
 
 class TestSimulatedReadGroupSet(unittest.TestCase):
     """
@@ -169,3 +246,55 @@ class TestSimulatedReadGroupSet(unittest.TestCase):
         for readGroup in simulatedReadGroupSet.getReadGroups():
             alignments = list(readGroup.getReadAlignments())
             self.assertGreater(len(alignments), 0)
+
+    def testPlacedReads(self):
+        dataset = datasets.Dataset('dataset1')
+        referenceLength = 50000
+        coverage = 5
+        readLength = 50
+        referenceSet = references.SimulatedReferenceSet(
+            "srs1", numReferences=2, referenceLength=referenceLength)
+        simulatedReadGroupSet = reads.SimulatedReadGroupSet(
+            dataset, "readGroupSetId", referenceSet, numReadGroups=2,
+            coverage=coverage, readLength=readLength)
+        self.assertEqual(
+            simulatedReadGroupSet.getNumAlignedReads(),
+            sum(readGroup.getNumAlignedReads()
+                for readGroup in simulatedReadGroupSet.getReadGroups()))
+        for reference in referenceSet.getReferences():
+            self.assertEqual(reference.getLength(), referenceLength)
+            alignments = list(
+                simulatedReadGroupSet.getReadAlignments(reference))
+            expectedNumReads = 2 * coverage * referenceLength / readLength
+            self.assertAlmostEqual(
+                len(alignments) / expectedNumReads, 1, delta=0.1)
+            self.assertEqual(
+                len(set(alignment.id for alignment in alignments)),
+                len(alignments))
+            starts = [
+                alignment.alignment.position.position
+                for alignment in alignments]
+            self.assertEqual(starts, sorted(starts))
+            for alignment in alignments:
+                start = alignment.alignment.position.position
+                self.assertEqual(
+                    alignment.alignment.position.reference_name,
+                    reference.getLocalId())
+                self.assertEqual(
+                    alignment.aligned_sequence,
+                    reference.getBases(start, start + readLength))
+                self.assertEqual(len(alignment.aligned_quality), readLength)
+            # The reads overlapping a window must not depend on the
+            # window, including windows spanning several bins.
+            binSize = reads.SimulatedReadGroup.binSize
+            for start, end in [
+                    (0, 10), (binSize - 10, binSize + 10),
+                    (100, 2 * binSize + 100),
+                    (referenceLength - 10, referenceLength)]:
+                self.assertEqual(
+                    list(simulatedReadGroupSet.getReadAlignments(
+                        reference, start, end)),
+                    [alignment for alignment in alignments
+                     if alignment.alignment.position.position < end and
+                     alignment.alignment.position.position +
+                     readLength > start])
@@ -102,3 +102,104 @@ class TestHtslibVariantAnnotationSet(unittest.TestCase):
         expected = hashlib.md5("\t\t[]\t").hexdigest()
         hashed = self._variantAnnotationSet.getTranscriptEffectId(effect)
         self.assertEqual(hashed, expected)
+
+    def _getAnnotatedVariantAnnotationSet(self):
+        variantAnnotationSet = self._variantSet.getVariantAnnotationSets()[0]
+        variantAnnotationSet.setOntology(
+            self._repo.getOntologyByName(paths.ontologyName))
+        return variantAnnotationSet
+
+    def testAnnotationFormat(self):
+        variantAnnotationSet = self._getAnnotatedVariantAnnotationSet()
+        parser = variantAnnotationSet.getTranscriptEffectParser()
+        annotation = (
+            "A|missense_variant|MODERATE|OR4F5|OR4F5|transcript|"
+            "NM_001005484.1|Coding|1/1|c.431T>A|p.Ile144Asn|431/918|"
+            "431/918|144/305||")
+        self.assertEqual(parser.parse(annotation), (
+            "A", "missense_variant", "NM_001005484.1", "c.431T>A",
+            "p.Ile144Asn", "431/918", "144/305"))
+        # Missing trailing fields are read as empty strings.
+        self.assertEqual(
+            parser.parse("A|intron_variant"),
+            ("A", "intron_variant", "", "", "", "", ""))
+
+    def testParseFormat(self):
+        tests = [
+            ("Consequence annotations from Ensembl VEP. Format: "
+             "Allele|Consequence|IMPACT|SYMBOL",
+             ["Allele", "Consequence", "IMPACT", "SYMBOL"]),
+            ("Functional annotations: 'Allele | Annotation | "
+             "cDNA.pos / cDNA.length' ",
+             ["Allele", "Annotation", "cDNA.pos / cDNA.length"]),
+            ("Consequence annotations", None),
+            ("Format: Consequence|Allele", None),
+        ]
+        for description, annotationFormat in tests:
+            self.assertEqual(
+                variants.TranscriptEffectParser.parseFormat(description),
+                annotationFormat)
+
+    def testHeaderFieldOrder(self):
+        # The field indexes come from the format, not fixed positions.
+        parser = variants.TranscriptEffectParser(
+            ["Feature", "Allele", "Protein_position", "Consequence"])
+        self.assertEqual(
+            parser.parse("NM_1|T|144/305|stop_gained"),
+            ("T", "stop_gained", "NM_1", "", "", "", "144/305"))
+
+    def testParseIndexFields(self):
+        parser = variants.TranscriptEffectParser(
+            variants.HtslibVariantAnnotationSet._defaultAnnotationFormats[
+                variants.ANNOTATIONS_SNPEFF])
+        self.assertEqual(
+            parser.parseIndexFields(
+                "A|missense_variant|MODERATE|OR4F5|OR4F5|transcript|"
+                "NM_001005484.1|Coding"),
+            ("OR4F5", "NM_001005484.1", "missense_variant", "MODERATE"))
+        # VEP v77 annotations have no symbol or impact.
+        parser = variants.TranscriptEffectParser(
+            variants.HtslibVariantAnnotationSet._defaultAnnotationFormats[
+                variants.ANNOTATIONS_VEP_V77])
+        self.assertEqual(
+            parser.parseIndexFields(
+                "T|ENSG00000223972|ENST00000456328|Transcript|"
+                "non_coding_transcript_exon_variant&intron_variant"),
+            ("ENSG00000223972", "ENST00000456328",
+             "non_coding_transcript_exon_variant&intron_variant", ""))
+
+    def testConvertTranscriptEffects(self):
+        variantAnnotationSet = self._getAnnotatedVariantAnnotationSet()
+        parser = variantAnnotationSet.getTranscriptEffectParser()
+        annotation = (
+            "A|missense_variant&splice_region_variant|MODERATE|OR4F5|OR4F5|"
+            "transcript|NM_001005484.1|Coding|1/1|NM_001005484.1:c.431T>A|"
+            "NM_001005484.1:p.Ile144Asn|431/918|431/918|144/305||")
+        effects = variantAnnotationSet.convertTranscriptEffects(
+            annotation, "1:g.69521T>A", parser)
+        self.assertEqual(len(effects), 1)
+        effect = effects[0]
+        self.assertEqual(
+            [term.term for term in effect.effects],
+            ["missense_variant", "splice_region_variant"])
+        self.assertEqual(effect.feature_id, "NM_001005484.1")
+        self.assertEqual(effect.hgvs_annotation.genomic, "1:g.69521T>A")
+        self.assertEqual(effect.cds_location.start, 430)
+        self.assertEqual(effect.cdna_location.start, 430)
+        self.assertEqual(effect.cdna_location.reference_sequence, "T")
+        self.assertEqual(effect.protein_location.start, 143)
+        self.assertEqual(effect.protein_location.alternate_sequence, "Asn")
+        self.assertEqual(
+            effect.id, variantAnnotationSet.getTranscriptEffectId(effect))
+
+    def testTranscriptEffectIdEscaping(self):
+        # Values that need escaping in the text format are hashed the
+        # same way as before.
+        effect = protocol.TranscriptEffect()
+        effect.hgvs_annotation.genomic = 'a"b\\c'
+        effect.hgvs_annotation.protein = "p.Ile144'"
+        expected = hashlib.md5(
+            "\t\t[]\t{}".format(effect.hgvs_annotation)).hexdigest()
+        self.assertEqual(
+            self._variantAnnotationSet.getTranscriptEffectId(effect),
+            expected)
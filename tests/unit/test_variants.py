@@ -6,11 +6,23 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 
+import pysam
+
+import ga4gh.datamodel as datamodel
 import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
 import ga4gh.datamodel.variants as variants
 import ga4gh.datamodel.datasets as datasets
+import tests.paths as paths
 
 
 class TestAbstractVariantSet(unittest.TestCase):
@@ -81,3 +93,902 @@ class TestAbstractVariantSet(unittest.TestCase):
     def testVariantSetProtocolElement(self):
         self.assertRaises(AttributeError,
                           self._variantSet.toProtocolElement)
+
+
+class TestVariantHasher(unittest.TestCase):
+    """
+    Tests the hashes used within variant IDs.
+    """
+    def setUp(self):
+        self._hasher = variants.VariantHasher()
+
+    def testDefaultHashFunction(self):
+        self.assertEqual(
+            self._hasher.getHashFunction(), variants.VARIANT_HASH_CRC32)
+        hash_ = self._hasher.hashAlleles("A", ["C"])
+        self.assertEqual(len(hash_), 8)
+        self.assertEqual(hash_, self._hasher.hashAlleles("A", ["C"]))
+        self.assertNotEqual(hash_, self._hasher.hashAlleles("A", ["G"]))
+        self.assertNotEqual(hash_, self._hasher.hashAlleles("A", ["C", "G"]))
+        self.assertEqual(
+            self._hasher.getHashFunctionForHash(hash_),
+            variants.VARIANT_HASH_CRC32)
+
+    def testMd5Compatibility(self):
+        expected = hashlib.md5("A(u'C',)").hexdigest()
+        self.assertEqual(
+            self._hasher.hashAlleles(
+                "A", ["C"], variants.VARIANT_HASH_MD5), expected)
+        self._hasher.setHashFunction(variants.VARIANT_HASH_MD5)
+        self.assertEqual(self._hasher.hashAlleles("A", ["C"]), expected)
+        self.assertEqual(
+            self._hasher.getHashFunctionForHash(expected),
+            variants.VARIANT_HASH_MD5)
+
+    def testUnknownHashFunction(self):
+        self.assertRaises(ValueError, self._hasher.setHashFunction, "sha1")
+
+
+class TestHtslibVariantSetCalls(unittest.TestCase):
+    """
+    Tests the conversion of calls in VCF files whose samples are not
+    listed in the same order.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp(prefix="ga4gh_variants_test")
+        self._samples = ["s0", "s1", "s2"]
+        dataUrls = []
+        indexFiles = []
+        for referenceName, samples in [
+                ("chr1", self._samples), ("chr2", self._samples[::-1])]:
+            path = os.path.join(self._tempDir, referenceName + ".vcf")
+            with open(path, "w") as vcfFile:
+                vcfFile.write("##fileformat=VCFv4.1\n")
+                vcfFile.write("##contig=<ID={}>\n".format(referenceName))
+                vcfFile.write(
+                    '##FORMAT=<ID=GT,Number=1,Type=String,'
+                    'Description="Genotype">\n')
+                vcfFile.write(
+                    '##FORMAT=<ID=DP,Number=1,Type=Integer,'
+                    'Description="Depth">\n')
+                vcfFile.write("\t".join([
+                    "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+                    "INFO", "FORMAT"] + samples) + "\n")
+                for position in range(1, 4):
+                    # The depth of each call identifies its sample.
+                    calls = [
+                        "0/1:{}".format(self._samples.index(sample))
+                        for sample in samples]
+                    vcfFile.write("\t".join([
+                        referenceName, str(position), ".", "A", "G", "50",
+                        "PASS", ".", "GT:DP"] + calls) + "\n")
+            dataUrls.append(pysam.tabix_index(path, preset="vcf"))
+            indexFiles.append(dataUrls[-1] + ".tbi")
+        self._variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("datasetId"), "variantSetId")
+        self._variantSet.populateFromFile(dataUrls, indexFiles)
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def _verifyCalls(self, callSetIds):
+        for referenceName in ["chr1", "chr2"]:
+            gaVariants = list(self._variantSet.getVariants(
+                referenceName, 0, 10, callSetIds))
+            self.assertEqual(len(gaVariants), 3)
+            for gaVariant in gaVariants:
+                self.assertEqual(
+                    [call.call_set_id for call in gaVariant.calls],
+                    callSetIds)
+                for call in gaVariant.calls:
+                    sampleName = self._variantSet.getCallSet(
+                        call.call_set_id).getSampleName()
+                    self.assertEqual(call.call_set_name, sampleName)
+                    self.assertEqual(
+                        call.info["DP"].values[0].string_value,
+                        str(self._samples.index(sampleName)))
+                    self.assertEqual(list(call.genotype), [0, 1])
+
+    def testAllCallSets(self):
+        self._verifyCalls([
+            callSet.getId() for callSet in self._variantSet.getCallSets()])
+
+    def testCallSetSubsets(self):
+        callSetIds = [
+            callSet.getId() for callSet in self._variantSet.getCallSets()]
+        self._verifyCalls(callSetIds[::-1])
+        self._verifyCalls(callSetIds[1:])
+        self._verifyCalls([])
+
+    def testCallSetNotInVariantSet(self):
+        with self.assertRaises(exceptions.CallSetNotInVariantSetException):
+            list(self._variantSet.getVariants("chr1", 0, 10, ["notACallSet"]))
+
+
+class TestVariantFilter(unittest.TestCase):
+    """
+    Tests compiled variant filter expressions against the records in
+    a VCF file.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp(prefix="ga4gh_variant_filter_test")
+        rows = [
+            # ID, QUAL, FILTER, INFO
+            ("rs1", "50", "PASS", "AF=0.5;DB;TYPE=snp"),
+            ("rs2", "10", "q10", "AF=0.01;TYPE=snp"),
+            (".", ".", ".", "AF=0.2,0.7;TYPE=indel"),
+            ("rs4;rs5", "30", "q10;lowDP", "."),
+            ("rs6", "30.5", "PASS", "AF=0.14;DB;TYPE=snp"),
+        ]
+        path = os.path.join(self._tempDir, "chr1.vcf")
+        with open(path, "w") as vcfFile:
+            vcfFile.write("##fileformat=VCFv4.1\n")
+            vcfFile.write("##contig=<ID=chr1>\n")
+            vcfFile.write(
+                '##INFO=<ID=AF,Number=A,Type=Float,Description="AF">\n')
+            vcfFile.write(
+                '##INFO=<ID=DB,Number=0,Type=Flag,Description="dbSNP">\n')
+            vcfFile.write(
+                '##INFO=<ID=TYPE,Number=1,Type=String,Description="Type">\n')
+            vcfFile.write(
+                '##FILTER=<ID=q10,Description="Quality below 10">\n')
+            vcfFile.write(
+                '##FILTER=<ID=lowDP,Description="Low depth">\n')
+            vcfFile.write("\t".join([
+                "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+                "INFO"]) + "\n")
+            for position, (id_, qual, filter_, info) in enumerate(rows):
+                vcfFile.write("\t".join([
+                    "chr1", str(position + 1), id_, "A", "G", qual, filter_,
+                    info]) + "\n")
+        dataUrl = pysam.tabix_index(path, preset="vcf")
+        self._variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("datasetId"), "variantSetId")
+        self._variantSet.populateFromFile([dataUrl], [dataUrl + ".tbi"])
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def _getFilteredStarts(self, expression):
+        variantFilter = variants.compileVariantFilter(expression)
+        return [
+            record.start for record in self._variantSet.getPysamVariants(
+                "chr1", 0, 10, variantFilter)]
+
+    def testComparisons(self):
+        tests = [
+            ("QUAL >= 30", [0, 3, 4]),
+            ("QUAL < 30", [1]),
+            ("QUAL == 30.5", [4]),
+            ("QUAL", [0, 1, 3, 4]),
+            ("FILTER == PASS", [0, 4]),
+            ("FILTER != PASS", [1, 2, 3]),
+            ("FILTER == lowDP", [3]),
+            ("FILTER != q10", [0, 2, 4]),
+            ("ID == rs5", [3]),
+            ("ID", [0, 1, 3, 4]),
+            ("INFO.AF > 0.1", [0, 2, 4]),
+            ("INFO.AF > 0.6", [2]),
+            ("INFO.AF == 0.14", [4]),
+            ("INFO.AF != 0.5", [1, 2, 3, 4]),
+            ("INFO.DB", [0, 4]),
+            ("!INFO.DB", [1, 2, 3]),
+            ("INFO.TYPE == 'indel'", [2]),
+            ('INFO.TYPE != "snp"', [2, 3]),
+            ("INFO.TYPE > 1", []),
+        ]
+        for expression, starts in tests:
+            self.assertEqual(
+                self._getFilteredStarts(expression), starts, expression)
+
+    def testCombinations(self):
+        tests = [
+            ("FILTER == PASS && QUAL > 40", [0]),
+            ("FILTER==PASS||QUAL<20", [0, 1, 4]),
+            ("INFO.DB && INFO.AF < 0.3 || ID == rs2", [1, 4]),
+            ("INFO.DB && (INFO.AF < 0.3 || ID == rs2)", [4]),
+            ("!(FILTER == PASS || FILTER == q10)", [2]),
+            ("QUAL > 20 && QUAL < 40 && FILTER == PASS", [4]),
+        ]
+        for expression, starts in tests:
+            self.assertEqual(
+                self._getFilteredStarts(expression), starts, expression)
+
+    def testGetVariants(self):
+        variantFilter = variants.compileVariantFilter("FILTER == PASS")
+        gaVariants = list(self._variantSet.getVariants(
+            "chr1", 0, 10, variantFilter=variantFilter))
+        self.assertEqual([variant.start for variant in gaVariants], [0, 4])
+        allVariants = list(self._variantSet.getVariants("chr1", 0, 10))
+        self.assertEqual(gaVariants, [allVariants[0], allVariants[4]])
+
+    def testInvalidExpressions(self):
+        expressions = [
+            "", "QUAL >", "QUAL > 1 &&", "(QUAL > 1", "QUAL > 1)",
+            "PASS == FILTER", "FILTER < PASS", "INFO. > 1", "QUAL = 1",
+            "QUAL > 1 FILTER", "QUAL > $", "INFO.AF > (1)"]
+        for expression in expressions:
+            self.assertRaises(
+                exceptions.InvalidVariantFilterException,
+                variants.compileVariantFilter, expression)
+
+    def testSimulatedVariantSet(self):
+        variantSet = variants.SimulatedVariantSet(
+            datasets.Dataset("datasetId"), None, "variantSetId")
+        variantFilter = variants.compileVariantFilter("QUAL > 1")
+        self.assertRaises(
+            exceptions.NotImplementedException, list,
+            variantSet.getVariants(
+                "chr1", 0, 10, variantFilter=variantFilter))
+
+
+class TestVariantSetStatistics(unittest.TestCase):
+    """
+    Tests the summary statistics computed over the records in the VCF
+    files of a variant set.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp(prefix="ga4gh_variant_stats_test")
+        rows = [
+            # CHROM, REF, ALT, QUAL, INFO
+            ("chr1", "A", "G", "5", "AC=1;AN=10"),
+            ("chr1", "AC", "GT", "15", "AC=5;AN=10"),
+            ("chr1", "A", "AT", "150", "AC=10;AN=10"),
+            ("chr1", "A", "<DEL>", ".", "."),
+            ("chr2", "A", "G,AT", "99.9", "AC=1,2;AN=10"),
+            ("chr2", "A", ".", "20", "AN=10"),
+        ]
+        dataUrls = []
+        for referenceName in ["chr1", "chr2"]:
+            path = os.path.join(self._tempDir, referenceName + ".vcf")
+            with open(path, "w") as vcfFile:
+                vcfFile.write("##fileformat=VCFv4.1\n")
+                vcfFile.write("##contig=<ID={}>\n".format(referenceName))
+                vcfFile.write(
+                    '##INFO=<ID=AC,Number=A,Type=Integer,'
+                    'Description="AC">\n')
+                vcfFile.write(
+                    '##INFO=<ID=AN,Number=1,Type=Integer,'
+                    'Description="AN">\n')
+                vcfFile.write("\t".join([
+                    "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+                    "INFO"]) + "\n")
+                position = 1
+                for chrom, ref, alt, qual, info in rows:
+                    if chrom == referenceName:
+                        vcfFile.write("\t".join([
+                            chrom, str(position), ".", ref, alt, qual,
+                            "PASS", info]) + "\n")
+                        position += 1
+            dataUrls.append(pysam.tabix_index(path, preset="vcf"))
+        self._variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("datasetId"), "variantSetId")
+        self._variantSet.populateFromFile(
+            dataUrls, [dataUrl + ".tbi" for dataUrl in dataUrls])
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def testGetVariantType(self):
+        tests = [
+            ("A", ["G"], variants.VARIANT_TYPE_SNP),
+            ("AC", ["GT"], variants.VARIANT_TYPE_MNP),
+            ("A", ["AT"], variants.VARIANT_TYPE_INDEL),
+            ("AT", ["A", "*"], variants.VARIANT_TYPE_INDEL),
+            ("A", ["<DEL>"], variants.VARIANT_TYPE_SV),
+            ("A", ["G]chr2:10]"], variants.VARIANT_TYPE_SV),
+            ("A", ["G", "AT"], variants.VARIANT_TYPE_MIXED),
+            ("A", [], variants.VARIANT_TYPE_REF),
+        ]
+        for referenceBases, alternateBases, variantType in tests:
+            self.assertEqual(
+                variants.getVariantType(referenceBases, alternateBases),
+                variantType)
+
+    def testComputeStatistics(self):
+        self.assertIsNone(self._variantSet.getStatistics())
+        self.assertEqual(self._variantSet.getNumVariants(), 0)
+        self._variantSet.computeStatistics()
+        statistics = self._variantSet.getStatistics()
+        self.assertEqual(self._variantSet.getNumVariants(), 6)
+        self.assertEqual(
+            statistics.getReferenceVariantCounts(), {"chr1": 4, "chr2": 2})
+        self.assertEqual(statistics.getVariantTypeCounts(), {
+            variants.VARIANT_TYPE_SNP: 1, variants.VARIANT_TYPE_MNP: 1,
+            variants.VARIANT_TYPE_INDEL: 1, variants.VARIANT_TYPE_SV: 1,
+            variants.VARIANT_TYPE_MIXED: 1, variants.VARIANT_TYPE_REF: 1})
+        # Frequencies are calculated from AC and AN, and an AF of 1.0
+        # belongs in the last bin.
+        self.assertEqual(
+            statistics.getAlleleFrequencyHistogram(),
+            [0, 2, 1, 0, 0, 1, 0, 0, 0, 1])
+        self.assertEqual(
+            statistics.getQualityHistogram(),
+            [1, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1])
+
+    def testSerialisation(self):
+        self._variantSet.computeStatistics()
+        statistics = self._variantSet.getStatistics()
+        jsonDict = json.loads(json.dumps(statistics.toJsonDict()))
+        self.assertEqual(jsonDict["numVariants"], 6)
+        other = variants.VariantSetStatistics.fromJsonDict(jsonDict)
+        self.assertEqual(other.toJsonDict(), statistics.toJsonDict())
+
+
+class TestScanVariantFiles(unittest.TestCase):
+    """
+    Tests scanning the headers and indexes of the VCF files of a variant
+    set, sequentially and in a pool of worker processes.
+    """
+    def testScanVariantFile(self):
+        header = variants.scanVariantFile(
+            (paths.vcfPath1, paths.vcfIndexPath1))
+        self.assertTrue(header.indexed)
+        self.assertTrue(header.hasRecords())
+        self.assertEqual(header.dataUrl, paths.vcfPath1)
+        self.assertGreater(len(header.samples), 0)
+        self.assertIn("GT", [name for name, _, _, _ in header.formats])
+        self.assertIsNone(header.annotationType)
+        self.assertIsNone(header.annotationError)
+
+    def _populate(self, vcfDirectory, numWorkers):
+        variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("datasetId"), "variantSetId")
+        progress = []
+        variantSet.populateFromDirectory(
+            vcfDirectory, numWorkers,
+            lambda numScanned, numFiles: progress.append(
+                (numScanned, numFiles)))
+        numFiles = len(variantSet.getDataUrlIndexPairs())
+        self.assertEqual(
+            progress, [(j + 1, numFiles) for j in range(numFiles)])
+        return variantSet
+
+    def testWorkers(self):
+        for vcfDirectory in [paths.vcfDirPath, paths.annotatedVcfPath]:
+            variantSet = self._populate(vcfDirectory, 1)
+            for numWorkers in [3, None]:
+                other = self._populate(vcfDirectory, numWorkers)
+                self.assertEqual(
+                    other.getReferenceToDataUrlIndexMap(),
+                    variantSet.getReferenceToDataUrlIndexMap())
+                self.assertEqual(
+                    other.getMetadata(), variantSet.getMetadata())
+                self.assertEqual(
+                    [callSet.getId() for callSet in other.getCallSets()],
+                    [callSet.getId() for callSet in variantSet.getCallSets()])
+                self.assertEqual(
+                    len(other.getVariantAnnotationSets()),
+                    len(variantSet.getVariantAnnotationSets()))
+                other.checkConsistency(numWorkers)
+
+    def testMergeOrder(self):
+        # Headers are merged in the order of the files, whatever order
+        # the workers finish in.
+        pairs = [
+            (paths.vcfPath1, paths.vcfIndexPath1),
+            (paths.vcfPath2, paths.vcfIndexPath2)]
+        for numWorkers in [1, 2]:
+            headers = variants.scanVariantFiles(pairs, numWorkers)
+            self.assertEqual(
+                [(header.dataUrl, header.indexFile) for header in headers],
+                pairs)
+
+
+class TestRegionCache(unittest.TestCase):
+    """
+    Unit tests for the cache of converted objects in regions of variant
+    files.
+    """
+    def setUp(self):
+        self._variants = []
+        for start, end in [
+                (0, 1), (3, 40), (5, 6), (15, 17), (16, 17), (20, 90),
+                (31, 32), (32, 36), (47, 48), (64, 65), (70, 71)]:
+            variant = protocol.Variant()
+            variant.start = start
+            variant.end = end
+            self._variants.append(variant)
+        self._cache = variants.RegionCache(binSize=16, maxQueryBins=4)
+        self._cache.setMaxCacheSize(2**20)
+        self._numSearches = 0
+
+    def _search(self, start, end):
+        self._numSearches += 1
+        return [
+            variant for variant in self._variants
+            if variant.start < end and variant.end > start]
+
+    def _getObjects(self, start, end, key="key"):
+        return list(self._cache.getObjects(
+            key, "1", start, end, self._search,
+            lambda variant: (variant.start, variant.end)))
+
+    def testGetObjects(self):
+        for start in range(0, 72):
+            for end in range(start + 1, start + 72):
+                # Queries are the same whether the bins are cached or not.
+                for _ in range(2):
+                    self.assertEqual(
+                        self._getObjects(start, end),
+                        self._search(start, end))
+
+    def testLargeQueries(self):
+        self.assertEqual(self._getObjects(0, 72), self._search(0, 72))
+        self.assertIsNone(self._cache.getHitRate())
+        self.assertEqual(self._cache.getNumCachedBins(), 0)
+
+    def testHitRate(self):
+        self.assertIsNone(self._cache.getHitRate())
+        self._getObjects(0, 16)
+        self.assertEqual(self._cache.getHitRate(), 0)
+        self._getObjects(1, 15)
+        self.assertEqual(self._cache.getHitRate(), 0.5)
+        self.assertEqual(self._numSearches, 1)
+        self._getObjects(1, 15, "otherKey")
+        self.assertEqual(self._numSearches, 2)
+        self._cache.clear()
+        self.assertIsNone(self._cache.getHitRate())
+        self.assertEqual(self._cache.getNumCachedBins(), 0)
+        self.assertEqual(self._cache.getCacheSize(), 0)
+
+    def testDisabledByDefault(self):
+        cache = variants.RegionCache()
+        self.assertEqual(cache.getMaxCacheSize(), 0)
+        self.assertEqual(
+            list(cache.getObjects(
+                "key", "1", 0, 16, self._search,
+                lambda variant: (variant.start, variant.end))),
+            self._search(0, 16))
+        self.assertEqual(cache.getNumCachedBins(), 0)
+
+    def testThreads(self):
+        results = []
+
+        def worker():
+            for start in range(0, 64, 3):
+                results.append(
+                    self._getObjects(start, start + 16) ==
+                    self._search(start, start + 16))
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8 * len(range(0, 64, 3)))
+        self.assertTrue(all(results))
+        self.assertLessEqual(self._cache.getNumCachedBins(), 5)
+
+    def testMaxCacheSize(self):
+        self._getObjects(0, 64)
+        self.assertEqual(self._cache.getNumCachedBins(), 4)
+        self.assertEqual(
+            self._cache.getCacheSize(),
+            sum(variant.ByteSize() for variant in self._search(0, 16)) +
+            sum(variant.ByteSize() for variant in self._search(16, 32)) +
+            sum(variant.ByteSize() for variant in self._search(32, 48)) +
+            sum(variant.ByteSize() for variant in self._search(48, 64)))
+        # The most recently used bins are retained
+        self._cache.setMaxCacheSize(
+            sum(variant.ByteSize() for variant in self._search(48, 64)))
+        self.assertEqual(self._cache.getNumCachedBins(), 1)
+        self._getObjects(48, 64)
+        self.assertEqual(self._cache.getHitRate(), 0.2)
+        self._cache.setMaxCacheSize(0)
+        self.assertEqual(self._cache.getNumCachedBins(), 0)
+        self.assertEqual(self._getObjects(0, 16), self._search(0, 16))
+        self.assertEqual(self._cache.getNumCachedBins(), 0)
+        self.assertEqual(self._cache.getMaxCacheSize(), 0)
+        with self.assertRaises(ValueError):
+            self._cache.setMaxCacheSize(-1)
+
+    def testVariantSet(self):
+        variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("datasetId"), "variantSetId")
+        variantSet.populateFromDirectory(paths.vcfDirPath)
+        callSetIds = [
+            callSet.getId() for callSet in variantSet.getCallSets()]
+        referenceName = sorted(variantSet.getReferenceToDataUrlIndexMap())[0]
+        records = list(variantSet.getPysamVariants(referenceName, 0, 2**31))
+        start = records[0].start
+        end = records[-1].stop
+        regions = [
+            (start, end), (start - 1, start + 1), (end - 1, end + 100)] + [
+            (record.start, record.stop + 1000) for record in records[:10]]
+        maxCacheSize = variants.regionCache.getMaxCacheSize()
+        try:
+            for regionStart, regionEnd in regions:
+                for callSetIds in [[], callSetIds[:1], callSetIds]:
+                    variants.regionCache.setMaxCacheSize(0)
+                    variantList = list(variantSet.getVariants(
+                        referenceName, regionStart, regionEnd, callSetIds))
+                    variants.regionCache.setMaxCacheSize(2**20)
+                    for _ in range(2):
+                        self.assertEqual(list(variantSet.getVariants(
+                            referenceName, regionStart, regionEnd,
+                            callSetIds)), variantList)
+        finally:
+            variants.regionCache.setMaxCacheSize(maxCacheSize)
+
+
+class TestSampleSubsets(unittest.TestCase):
+    """
+    Tests that variant files are read with only the sample columns of
+    the requested CallSets decoded.
+    """
+    def setUp(self):
+        self._variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("datasetId"), "variantSetId")
+        self._variantSet.populateFromDirectory(paths.vcfDirPath)
+        self._callSetIds = [
+            callSet.getId() for callSet in self._variantSet.getCallSets()]
+        self._dataUrlIndexFilePair = sorted(
+            self._variantSet.getDataUrlIndexPairs())[0]
+
+    def testFileHandles(self):
+        variantSet = self._variantSet
+        pair = self._dataUrlIndexFilePair
+        sampleNames = variantSet.getSampleNames(self._callSetIds)
+        self.assertIs(
+            variantSet.getSampleSubsetFileHandle(pair, None),
+            variantSet.getFileHandle(pair))
+        self.assertIs(
+            variantSet.getSampleSubsetFileHandle(pair, sampleNames),
+            variantSet.getFileHandle(pair))
+        varFile = variantSet.getSampleSubsetFileHandle(pair, [])
+        self.assertEqual(list(varFile.header.samples), [])
+        self.assertIs(variantSet.getSampleSubsetFileHandle(pair, []), varFile)
+        subset = list(reversed(sampleNames[:2]))
+        varFile = variantSet.getSampleSubsetFileHandle(pair, subset)
+        self.assertEqual(sorted(varFile.header.samples), sorted(subset))
+        self.assertIs(
+            variantSet.getSampleSubsetFileHandle(pair, sorted(subset)),
+            varFile)
+
+    def testVariants(self):
+        variantSet = self._variantSet
+        for callSetIds in [
+                [], self._callSetIds[:1], self._callSetIds[-1:0:-2],
+                self._callSetIds]:
+            for referenceName in variantSet.getReferenceToDataUrlIndexMap():
+                variantList = list(variantSet.getVariants(
+                    referenceName, 0, 2**31, callSetIds))
+                self.assertGreater(len(variantList), 0)
+                # Records read with every sample decoded.
+                records = variantSet.getPysamVariants(
+                    referenceName, 0, 2**31)
+                self.assertEqual(variantList, [
+                    variantSet.convertVariant(record, callSetIds)
+                    for record in records])
+                for variant in variantList:
+                    self.assertEqual(
+                        [call.call_set_id for call in variant.calls],
+                        callSetIds)
+
+
+class TestBcfTranscoding(unittest.TestCase):
+    """
+    Tests transcoding bgzipped VCF files to BCF sidecars, and that variant
+    sets read from these are the same as those read from the VCF files.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp(prefix="ga4gh_bcf_test")
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def _getVariantSet(self, vcfDirectory):
+        variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("datasetId"), "variantSetId")
+        variantSet.populateFromDirectory(vcfDirectory)
+        return variantSet
+
+    def _getVariants(self, variantSet):
+        return [
+            list(variantSet.getVariants(referenceName, 0, 2**31, None))
+            for referenceName in sorted(
+                variantSet.getReferenceToDataUrlIndexMap())]
+
+    def testTranscodeVcfToBcf(self):
+        for vcfDirectory in [paths.vcfDirPath, paths.annotatedVcfPath]:
+            for vcfFile in variants.getVariantFilesInDirectory(vcfDirectory):
+                bcfPath = os.path.join(
+                    self._tempDir, os.path.basename(
+                        variants.getBcfSidecarPath(vcfFile)))
+                indexFile = variants.transcodeVcfToBcf(
+                    vcfFile, variants.getDefaultIndexFile(vcfFile), bcfPath)
+                self.assertEqual(indexFile, bcfPath + ".csi")
+                self.assertTrue(os.path.exists(indexFile))
+            vcfVariantSet = self._getVariantSet(vcfDirectory)
+            bcfVariantSet = self._getVariantSet(self._tempDir)
+            for _, indexFile in bcfVariantSet.getDataUrlIndexPairs():
+                self.assertTrue(indexFile.endswith(".bcf.csi"))
+            self.assertEqual(
+                bcfVariantSet.getMetadata(), vcfVariantSet.getMetadata())
+            self.assertEqual(
+                len(bcfVariantSet.getVariantAnnotationSets()),
+                len(vcfVariantSet.getVariantAnnotationSets()))
+            self.assertEqual(
+                self._getVariants(bcfVariantSet),
+                self._getVariants(vcfVariantSet))
+            for bcfFile in glob.glob(os.path.join(self._tempDir, "*")):
+                os.unlink(bcfFile)
+
+    def testSidecars(self):
+        vcfFile = os.path.join(self._tempDir, "chr1.vcf.gz")
+        shutil.copyfile(paths.vcfPath1, vcfFile)
+        shutil.copyfile(paths.vcfIndexPath1, vcfFile + ".tbi")
+        self.assertEqual(
+            variants.getDefaultIndexFile(vcfFile), vcfFile + ".tbi")
+        self.assertIsNone(variants.getBcfSidecar(vcfFile))
+        self.assertEqual(
+            variants.getVariantFilesInDirectory(self._tempDir), [vcfFile])
+        bcfPath = variants.getBcfSidecarPath(vcfFile)
+        self.assertEqual(bcfPath, os.path.join(self._tempDir, "chr1.bcf"))
+        self.assertIsNone(variants.getBcfSidecarPath(bcfPath))
+        indexFile = variants.transcodeVcfToBcf(
+            vcfFile, vcfFile + ".tbi", bcfPath)
+        self.assertEqual(variants.getDefaultIndexFile(bcfPath), indexFile)
+        self.assertEqual(variants.getBcfSidecar(vcfFile), (bcfPath, indexFile))
+        # The sidecar is read in place of the VCF file.
+        self.assertEqual(
+            variants.getVariantFilesInDirectory(self._tempDir), [bcfPath])
+        # A sidecar older than its VCF file is stale.
+        vcfTime = os.path.getmtime(bcfPath) + 10
+        os.utime(vcfFile, (vcfTime, vcfTime))
+        self.assertIsNone(variants.getBcfSidecar(vcfFile))
+        self.assertEqual(
+            variants.getVariantFilesInDirectory(self._tempDir), [vcfFile])
+        # As is a sidecar without an index.
+        os.utime(bcfPath, (vcfTime, vcfTime))
+        self.assertEqual(
+            variants.getVariantFilesInDirectory(self._tempDir), [bcfPath])
+        os.unlink(indexFile)
+        self.assertIsNone(variants.getBcfSidecar(vcfFile))
+        self.assertEqual(
+            variants.getVariantFilesInDirectory(self._tempDir), [vcfFile])
+        # VCF files indexed only with CSI indexes are supported.
+        os.rename(vcfFile + ".tbi", vcfFile + ".csi")
+        self.assertEqual(
+            variants.getDefaultIndexFile(vcfFile), vcfFile + ".csi")
+
+
+class TestVariantIdIndex(unittest.TestCase):
+    """
+    Tests looking up variants by ID through a VariantIdIndex, for
+    bgzipped VCF files spanning many BGZF blocks and for BCF files.
+    """
+    _numVariants = 3000
+
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp(prefix="ga4gh_id_index_test")
+        path = os.path.join(self._tempDir, "chr1.vcf")
+        with open(path, "w") as vcfFile:
+            vcfFile.write("##fileformat=VCFv4.1\n")
+            vcfFile.write("##contig=<ID=chr1>\n")
+            vcfFile.write(
+                '##INFO=<ID=XX,Number=1,Type=String,'
+                'Description="Padding">\n')
+            vcfFile.write("\t".join([
+                "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+                "INFO"]) + "\n")
+            # Pairs of variants share a position.
+            for i in range(self._numVariants):
+                vcfFile.write("\t".join([
+                    "chr1", str(i // 2 + 1), ".", "A", "CG"[i % 2], "50",
+                    "PASS", "XX=" + "N" * 40]) + "\n")
+        self._dataUrl = pysam.tabix_index(path, preset="vcf")
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def _getBcfFile(self):
+        bcfPath = os.path.join(self._tempDir, "chr1.bcf")
+        indexFile = variants.transcodeVcfToBcf(
+            self._dataUrl, self._dataUrl + ".tbi", bcfPath)
+        return bcfPath, indexFile
+
+    def _getVariantSet(self, dataUrl, indexFile):
+        variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("datasetId"), "variantSetId")
+        variantSet.populateFromFile([dataUrl], [indexFile])
+        variantSet.buildIdIndex(os.path.join(self._tempDir, "ids.db"))
+        return variantSet
+
+    def _verifyIdIndex(self, dataUrl, indexFile):
+        variantSet = self._getVariantSet(dataUrl, indexFile)
+        gaVariants = list(variantSet.getVariants("chr1", 0, 2**31, None))
+        self.assertEqual(len(gaVariants), self._numVariants)
+        for gaVariant in gaVariants:
+            compoundId = datamodel.VariantCompoundId.parse(gaVariant.id)
+            self.assertEqual(variantSet.getVariant(compoundId), gaVariant)
+
+    def testVcf(self):
+        self._verifyIdIndex(self._dataUrl, self._dataUrl + ".tbi")
+
+    def testBcf(self):
+        self._verifyIdIndex(*self._getBcfFile())
+
+    def testLookupsDuringFetch(self):
+        variantSet = self._getVariantSet(*self._getBcfFile())
+        gaVariants = list(variantSet.getVariants("chr1", 0, 2**31, None))
+        # Looking up variants by ID must not move the cached file handle
+        # under a query that is iterating over it.
+        starts = []
+        for record, gaVariant in zip(
+                variantSet.getPysamVariants("chr1", 0, 2**31),
+                reversed(gaVariants)):
+            starts.append(record.start)
+            compoundId = datamodel.VariantCompoundId.parse(gaVariant.id)
+            self.assertEqual(variantSet.getVariant(compoundId), gaVariant)
+        self.assertEqual(
+            starts, [gaVariant.start for gaVariant in gaVariants])
+
+    def testRecordOffsets(self):
+        bcfPath, _ = self._getBcfFile()
+        varFile = pysam.VariantFile(str(bcfPath))
+        offsets = []
+        for offset, record in variants.getVariantRecordOffsets(
+                varFile, bcfPath):
+            offsets.append((offset, record.start, record.alts))
+        self.assertEqual(len(offsets), self._numVariants)
+        # The records span several BGZF blocks.
+        blocks = set(offset >> 16 for offset, _, _ in offsets)
+        self.assertGreater(len(blocks), 1)
+        for offset, start, alts in offsets:
+            varFile.seek(offset)
+            record = next(varFile)
+            self.assertEqual((record.start, record.alts), (start, alts))
+        varFile.close()
+        # VCF records cannot be read back by offset.
+        varFile = pysam.VariantFile(str(self._dataUrl))
+        for offset, _ in variants.getVariantRecordOffsets(
+                varFile, self._dataUrl):
+            self.assertIsNone(offset)
+        varFile.close()
+
+
+class TestGenotypeMatrix(unittest.TestCase):
+    """
+    Tests that GenotypeMatrices built from VCF records agree with the
+    corresponding GA Variants.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp(prefix="ga4gh_genotypes_test")
+        manyAlts = ",".join("A" + "C" * i for i in range(1, 131))
+        rows = [
+            ("G", "GT:GL", ["0|1:-1,-2,-3", "1/1:-4,-5,-6", "./.:-7,-8,-9"]),
+            ("G,T", "GT:GL", [
+                "0/2:-1,-2,-3,-4,-5,-6", "1:-1,-2", "1|0:-1,-2,-3,-4,-5,-6"]),
+            (manyAlts, "GT", ["0/130", "0/0", "130/1"]),
+            ("G", "GT:GL", ["0/1:-1,.,-3", "0/0", "1/1:."]),
+        ]
+        path = os.path.join(self._tempDir, "chr1.vcf")
+        with open(path, "w") as vcfFile:
+            vcfFile.write("##fileformat=VCFv4.1\n")
+            vcfFile.write("##contig=<ID=chr1>\n")
+            vcfFile.write(
+                '##FORMAT=<ID=GT,Number=1,Type=String,'
+                'Description="Genotype">\n')
+            vcfFile.write(
+                '##FORMAT=<ID=GL,Number=G,Type=Float,'
+                'Description="Genotype likelihoods">\n')
+            vcfFile.write("\t".join([
+                "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+                "INFO", "FORMAT", "s0", "s1", "s2"]) + "\n")
+            for position, (alts, format_, calls) in enumerate(rows):
+                vcfFile.write("\t".join([
+                    "chr1", str(position + 1), ".", "A", alts, "50", "PASS",
+                    ".", format_] + calls) + "\n")
+        dataUrl = pysam.tabix_index(path, preset="vcf")
+        self._variantSet = variants.HtslibVariantSet(
+            datasets.Dataset("datasetId"), "variantSetId")
+        self._variantSet.populateFromFile([dataUrl], [dataUrl + ".tbi"])
+        self._callSetIds = [
+            callSet.getId() for callSet in self._variantSet.getCallSets()]
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def _getMatrix(self, callSetIds):
+        matrix = variants.GenotypeMatrix(callSetIds, True, True)
+        for record, variantId, callSetLookups in \
+                self._variantSet.getGenotypeRecords(
+                    "chr1", 0, 10, callSetIds):
+            matrix.append(record, variantId, callSetLookups)
+        return matrix
+
+    def _verifyMatrix(self, matrix, callSetIds):
+        gaVariants = list(self._variantSet.getVariants(
+            "chr1", 0, 10, callSetIds))
+        self.assertEqual(len(matrix), len(gaVariants))
+        self.assertEqual(matrix.callSetIds, callSetIds)
+        self.assertEqual(matrix.referenceName, "chr1")
+        for variantIndex, gaVariant in enumerate(gaVariants):
+            self.assertEqual(matrix.variantIds[variantIndex], gaVariant.id)
+            self.assertEqual(matrix.starts[variantIndex], gaVariant.start)
+            self.assertEqual(matrix.ends[variantIndex], gaVariant.end)
+            self.assertEqual(
+                matrix.alleles[variantIndex],
+                [gaVariant.reference_bases] +
+                list(gaVariant.alternate_bases))
+            ploidy = matrix.ploidies[variantIndex]
+            for callSetIndex, call in enumerate(gaVariant.calls):
+                genotype = list(call.genotype)
+                genotype += [-1] * (ploidy - len(genotype))
+                self.assertEqual(
+                    matrix.getGenotype(variantIndex, callSetIndex), genotype)
+                self.assertEqual(
+                    matrix.isPhased(variantIndex, callSetIndex),
+                    call.phaseset != "")
+                likelihoods = matrix.getGenotypeLikelihoods(
+                    variantIndex, callSetIndex)
+                expected = [
+                    value for value in call.genotype_likelihood
+                    if value == value]
+                self.assertEqual(
+                    [value for value in likelihoods if value == value],
+                    expected)
+
+    def testMatchesVariants(self):
+        matrix = self._getMatrix(self._callSetIds)
+        self._verifyMatrix(matrix, self._callSetIds)
+        # Allele indexes larger than a signed byte force promotion.
+        self.assertEqual(matrix.genotypes.itemsize, 2)
+        self.assertEqual(matrix.getGenotype(2, 2), [130, 1])
+        # Missing and haploid calls are padded with -1.
+        self.assertEqual(matrix.getGenotype(0, 2), [-1, -1])
+        self.assertEqual(matrix.getGenotype(1, 1), [1, -1])
+        # Calls with fewer likelihoods than the row are padded with NaN.
+        likelihoods = matrix.getGenotypeLikelihoods(1, 1)
+        self.assertEqual(likelihoods[:2], [-1, -2])
+        self.assertEqual(len(likelihoods), 6)
+        self.assertTrue(all(value != value for value in likelihoods[2:]))
+        self.assertEqual(matrix.getGenotypeLikelihoods(2, 0), [])
+        # Calls with missing likelihoods are filled with NaN.
+        likelihoods = matrix.getGenotypeLikelihoods(3, 0)
+        self.assertEqual(likelihoods[::2], [-1, -3])
+        self.assertNotEqual(likelihoods[1], likelihoods[1])
+        for callSetIndex in [1, 2]:
+            likelihoods = matrix.getGenotypeLikelihoods(3, callSetIndex)
+            self.assertEqual(len(likelihoods), 3)
+            self.assertTrue(all(value != value for value in likelihoods))
+
+    def testPartiallyMissingLikelihoods(self):
+        gaVariant = list(self._variantSet.getVariants(
+            "chr1", 0, 10, self._callSetIds))[3]
+        # A missing likelihood keeps its position so that the others
+        # still line up with their genotypes.
+        likelihoods = list(gaVariant.calls[0].genotype_likelihood)
+        self.assertEqual(len(likelihoods), 3)
+        self.assertEqual(likelihoods[::2], [-1, -3])
+        self.assertNotEqual(likelihoods[1], likelihoods[1])
+        # Likelihoods that are missing entirely are left empty.
+        self.assertEqual(list(gaVariant.calls[2].genotype_likelihood), [])
+
+    def testCallSetSubsets(self):
+        for callSetIds in [self._callSetIds[::-1], self._callSetIds[1:]]:
+            self._verifyMatrix(self._getMatrix(callSetIds), callSetIds)
+
+    def testSerialisation(self):
+        matrix = self._getMatrix(self._callSetIds)
+        matrix.nextPageToken = "1:0"
+        other = variants.GenotypeMatrix.fromBytes(matrix.toBytes())
+        self._verifyMatrix(other, self._callSetIds)
+        self.assertEqual(other.nextPageToken, matrix.nextPageToken)
+        for name, _ in variants.GenotypeMatrix.columnTypes:
+            self.assertEqual(
+                getattr(other, name).tostring(),
+                getattr(matrix, name).tostring())
+        with self.assertRaises(ValueError):
+            variants.GenotypeMatrix.fromBytes(matrix.toBytes()[:-1])
+
+    def testOptionalColumns(self):
+        matrix = variants.GenotypeMatrix(self._callSetIds)
+        for record, variantId, callSetLookups in \
+                self._variantSet.getGenotypeRecords("chr1", 0, 10):
+            matrix.append(record, variantId, callSetLookups)
+        self.assertEqual(len(matrix), 4)
+        self.assertEqual(len(matrix.phased), 0)
+        self.assertEqual(len(matrix.genotypeLikelihoods), 0)
+        self.assertEqual(matrix.getGenotypeLikelihoods(0, 0), [])
@@ -362,6 +362,7 @@ class TestFrontend(unittest.TestCase):
         self.assertEqual(200, response.status_code)
         self.assertEqual("text/html", response.mimetype)
         self.assertGreater(len(response.data), 0)
+        self.assertIn(b"Hit rate", response.data)
 
     def testVariantsSearch(self):
         response = self.sendVariantsSearch()
@@ -406,6 +407,15 @@ class TestFrontend(unittest.TestCase):
         response = self.sendGetVariantSet(str(compoundId))
         self.assertEqual(404, response.status_code)
 
+    def testGetVariantSetStatistics(self):
+        # Statistics are only computed for variant sets added to a
+        # repository, so the simulated variant sets have none.
+        path = "/variantsets/{}/stats".format(self.variantSetId)
+        response = self.sendGetRequest(path)
+        self.assertEqual(404, response.status_code)
+        response = self.app.post(path)
+        self.assertEqual(405, response.status_code)
+
     def testGetReadGroupSet(self):
         response = self.sendGetReadGroupSet()
         self.assertEqual(200, response.status_code)
@@ -488,14 +498,85 @@ class TestFrontend(unittest.TestCase):
     def testSearchUnmappedReads(self):
         response = self.sendReadsSearch(
             readGroupIds=[self.readGroupId], referenceId="")
-        self.assertEqual(501, response.status_code)
+        self.assertEqual(200, response.status_code)
 
-    def testSearchReadsMultipleReadGroupSetsSetMismatch(self):
+    def testSearchReadsMultipleReadGroupSetsBadId(self):
         response = self.sendReadsSearch(
             readGroupIds=[self.readGroupId, "42"],
             referenceId=self.referenceId)
+        self.assertEqual(404, response.status_code)
+
+    def testSearchReadsMultipleReadGroupSetsDuplicateId(self):
+        response = self.sendReadsSearch(
+            readGroupIds=[self.readGroupId, self.readGroupId],
+            referenceId=self.referenceId)
         self.assertEqual(400, response.status_code)
 
+    def testSearchReadsBatchNotSupported(self):
+        # The simulated reads are not backed by alignment files, and so
+        # cannot be returned in the columnar format.
+        request = protocol.SearchReadsRequest()
+        request.read_group_ids.extend([self.readGroupId])
+        request.reference_id = self.referenceId
+        headers = {
+            'Content-type': 'application/json',
+            'Accept': frontend.READ_BATCH_MIMETYPE,
+        }
+        response = self.app.post(
+            '/reads/search', headers=headers, data=protocol.toJson(request))
+        self.assertEqual(501, response.status_code)
+        headers['Accept'] = '*/*'
+        response = self.app.post(
+            '/reads/search', headers=headers, data=protocol.toJson(request))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(frontend.MIMETYPE, response.mimetype)
+
+    def testSearchGenotypeMatrixNotSupported(self):
+        # The simulated variants are not backed by variant files.
+        request = protocol.SearchVariantsRequest()
+        request.variant_set_id = self.variantSetId
+        request.reference_name = "1"
+        headers = {
+            'Content-type': 'application/json',
+            'Accept': frontend.GENOTYPE_MATRIX_MIMETYPE,
+        }
+        response = self.app.post(
+            '/variants/search', headers=headers,
+            data=protocol.toJson(request))
+        self.assertEqual(501, response.status_code)
+        response = self.app.post(
+            '/variants/search?phasing=yes', headers=headers,
+            data=protocol.toJson(request))
+        self.assertEqual(400, response.status_code)
+
+    def testSearchVariantsWithFilter(self):
+        # The simulated variants do not support filters, but invalid
+        # filter expressions are rejected before the search is run.
+        request = protocol.SearchVariantsRequest()
+        request.variant_set_id = self.variantSetId
+        request.reference_name = "1"
+        response = self.sendPostRequest(
+            '/variants/search?filter=QUAL%20%3E%2030', request)
+        self.assertEqual(501, response.status_code)
+        response = self.sendPostRequest(
+            '/variants/search?filter=QUAL%20%3E', request)
+        self.assertEqual(400, response.status_code)
+
+    def testSearchVariantAnnotationsByGene(self):
+        # The simulated annotations have no genes to search on.
+        variantAnnotationSet = self.variantSet.getVariantAnnotationSets()[0]
+        request = protocol.SearchVariantAnnotationsRequest()
+        request.variant_annotation_set_id = variantAnnotationSet.getId()
+        request.reference_name = "1"
+        request.start = 0
+        request.end = 10
+        response = self.sendPostRequest(
+            '/variantannotations/search', request)
+        self.assertEqual(200, response.status_code)
+        response = self.sendPostRequest(
+            '/variantannotations/search?gene=BRCA1', request)
+        self.assertEqual(501, response.status_code)
+
     def testGetExpressionLevel(self):
         response = self.sendGetExpressionLevel()
         self.assertEqual(200, response.status_code)